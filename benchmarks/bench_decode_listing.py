@@ -0,0 +1,111 @@
+"""
+Benchmark: listing decode (slice + struct.unpack vs memoryview + unpack_from)
+リスティングデコードのマイクロベンチマーク
+
+Usage:
+    python benchmarks/bench_decode_listing.py [iterations]
+"""
+import sys
+sys.path.insert(0, '.')
+
+import struct
+import timeit
+from datetime import datetime
+
+from src.packet_decoder.decoder import TradingCenterDecoder
+from src.packet_decoder.packet_types import ItemListing
+
+LISTINGS = 100
+RECORD_SIZE = 64
+
+
+def build_packet(listings: int = LISTINGS) -> bytes:
+    """100件のリスティングを含む合成パケットを生成"""
+    records = []
+    for i in range(listings):
+        name = f"アイテム{i}".encode('utf-8')
+        record = struct.pack('<QIIQH', 10_000 + i, 100 + i, 1 + i % 10, 1_000 * (i + 1), len(name)) + name
+        records.append(record.ljust(RECORD_SIZE, b'\x00'))
+    return (
+        b'\x00' * 16
+        + TradingCenterDecoder.TRADING_CENTER_MAGIC
+        + struct.pack('<I', listings)
+        + b''.join(records)
+    )
+
+
+def legacy_decode_item_listing(data: bytes, offset: int, timestamp: datetime):
+    """変更前の実装（フィールドごとにスライスしてunpack）"""
+    if offset + 8 > len(data):
+        return None
+    listing_id = struct.unpack('<Q', data[offset:offset+8])[0]
+    offset += 8
+    if offset + 4 > len(data):
+        return None
+    item_id = struct.unpack('<I', data[offset:offset+4])[0]
+    offset += 4
+    if offset + 4 > len(data):
+        return None
+    quantity = struct.unpack('<I', data[offset:offset+4])[0]
+    offset += 4
+    if offset + 8 > len(data):
+        return None
+    price = struct.unpack('<Q', data[offset:offset+8])[0]
+    offset += 8
+    if offset + 2 > len(data):
+        return None
+    name_length = struct.unpack('<H', data[offset:offset+2])[0]
+    offset += 2
+    if offset + name_length > len(data):
+        return None
+    item_name = data[offset:offset+name_length].decode('utf-8', errors='ignore')
+    return ItemListing(
+        listing_id=str(listing_id),
+        item_id=item_id,
+        item_name=item_name,
+        quantity=quantity,
+        price=price,
+        timestamp=timestamp
+    )
+
+
+def legacy_decode_packet(packet: bytes, timestamp: datetime) -> list:
+    """変更前のパケットデコード"""
+    magic = TradingCenterDecoder.TRADING_CENTER_MAGIC
+    start = packet.find(magic) + len(magic)
+    count = struct.unpack('<I', packet[start:start+4])[0]
+    offset = start + 4
+    listings = []
+    for _ in range(min(count, 100)):
+        listing = legacy_decode_item_listing(packet, offset, timestamp)
+        if not listing:
+            break
+        listings.append(listing)
+        offset += RECORD_SIZE
+    return listings
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    packet = build_packet()
+    view = memoryview(packet)
+    decoder = TradingCenterDecoder()
+    timestamp = datetime.now()
+
+    assert len(decoder.decode_trading_packet(view, timestamp).listings) == LISTINGS
+
+    before = timeit.timeit(lambda: legacy_decode_packet(packet, timestamp), number=iterations)
+    after = timeit.timeit(lambda: decoder.decode_trading_packet(view, timestamp), number=iterations)
+
+    print(f"Synthetic packet: {LISTINGS} listings, {len(packet)} bytes, {iterations} iterations")
+    print(f"  before (slice + unpack):           {before / iterations * 1e6:8.1f} us/packet")
+    print(f"  after  (memoryview + unpack_from): {after / iterations * 1e6:8.1f} us/packet")
+    print(f"  speedup: {before / after:.2f}x")
+
+    if decoder.decode_listing_batch(view, timestamp) is not None:
+        batch = timeit.timeit(lambda: decoder.decode_listing_batch(view, timestamp), number=iterations)
+        print(f"  batch  (NumPy structured dtype):   {batch / iterations * 1e6:8.1f} us/packet")
+
+
+if __name__ == "__main__":
+    main()
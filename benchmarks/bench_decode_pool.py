@@ -0,0 +1,76 @@
+"""
+Benchmark: decode worker pool under a burst
+デコードワーカープールのバーストベンチマーク
+
+取引所フレームのバーストを ``batch_size`` 件ずつプールに投入し、投入順に結果を待つまでの
+時間をワーカー数（1 / 2 / 4）とワーカーの種類（thread / process）ごとに測ります。
+スレッドモードはGILのためデコード自体は並列にならず、比較用にプールを使わない
+逐次デコードの時間も表示します。
+
+Usage:
+    python benchmarks/bench_decode_pool.py [frames] [listings_per_frame]
+"""
+import sys
+sys.path.insert(0, '.')
+
+import os
+import time
+
+from src.packet_decoder.decode_pool import WORKER_MODES, DecodePool, decode_frames
+from src.packet_decoder.decoder import TradingCenterDecoder
+from tests.helpers import build_trading_payload
+
+BATCH_SIZE = 64
+WORKER_COUNTS = (1, 2, 4)
+
+
+def build_burst(frames: int, listings_per_frame: int):
+    """すべて異なる取引所フレームのバースト（重複排除にかからない）"""
+    return [
+        (build_trading_payload([
+            (i * listings_per_frame + j, 100 + j, 1, 1000 + j) for j in range(listings_per_frame)
+        ]), True)
+        for i in range(frames)
+    ]
+
+
+def run_pool(decoder: TradingCenterDecoder, burst, workers: int, mode: str) -> float:
+    """プールを起動済みの状態から、バーストを投入して全結果を受け取るまでの時間"""
+    pool = DecodePool(decoder, workers, mode)
+    try:
+        # プロセスの起動時間を含めないよう、先に全ワーカーを動かしておく
+        for future in [pool.submit(burst[:1]) for _ in range(workers)]:
+            future.result()
+        started_at = time.perf_counter()
+        futures = [pool.submit(burst[i:i + BATCH_SIZE]) for i in range(0, len(burst), BATCH_SIZE)]
+        decoded = sum(1 for future in futures for packet, _seconds, _error in future.result() if packet)
+        elapsed = time.perf_counter() - started_at
+    finally:
+        pool.shutdown()
+    assert decoded == len(burst)
+    return elapsed
+
+
+def main():
+    frames = int(sys.argv[1]) if len(sys.argv) > 1 else 5_000
+    listings_per_frame = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    decoder = TradingCenterDecoder()
+    burst = build_burst(frames, listings_per_frame)
+
+    started_at = time.perf_counter()
+    decode_frames(decoder, burst)
+    sequential = time.perf_counter() - started_at
+
+    print(f"{frames:,} frames x {listings_per_frame} listings, batches of {BATCH_SIZE}, "
+          f"{os.cpu_count()} CPUs")
+    print(f"  sequential (no pool): {sequential:7.3f}s  {frames / sequential:10,.0f} frames/s")
+    for mode in WORKER_MODES:
+        for workers in WORKER_COUNTS:
+            elapsed = run_pool(decoder, burst, workers, mode)
+            print(f"  {mode:7s} x{workers}:           {elapsed:7.3f}s  {frames / elapsed:10,.0f} frames/s  "
+                  f"speedup {sequential / elapsed:4.2f}x")
+
+
+if __name__ == "__main__":
+    main()
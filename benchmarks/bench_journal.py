@@ -0,0 +1,58 @@
+"""
+Benchmark: write-ahead journal overhead on listing ingestion
+先行書き込みジャーナルが取り込みに加えるCPU時間のベンチマーク
+
+Usage:
+    python benchmarks/bench_journal.py [listings]
+"""
+import sys
+sys.path.insert(0, '.')
+
+import tempfile
+import time
+from pathlib import Path
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from benchmarks.bench_upsert_listings import BATCH, build_stream
+from src.database.ingest import listing_rows, upsert_listings
+from src.database.journal import ListingJournal
+from src.database.models import Base
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+    stream = build_stream(count, 0.8)
+    batches = [listing_rows(stream[start:start + BATCH]) for start in range(0, count, BATCH)]
+
+    with tempfile.TemporaryDirectory() as directory:
+        directory = Path(directory)
+        engine = create_engine(f"sqlite:///{directory / 'market.db'}")
+        Base.metadata.create_all(engine)
+        with Session(engine) as session:
+            started_at = time.process_time()
+            for rows in batches:
+                upsert_listings(session, rows, count_existing=False)
+                session.commit()
+            ingest = time.process_time() - started_at
+        engine.dispose()
+
+        journal = ListingJournal(str(directory / "journal"))
+        started_at = time.process_time()
+        for rows in batches:
+            sequence = journal.append_rows(rows)
+        journal.checkpoint(sequence)
+        journal.close()
+        journaled = time.process_time() - started_at
+        stats = journal.get_stats()
+
+    print(f"{count:,} listings in batches of {BATCH} (CPU time)")
+    print(f"  ingest (upsert + commit): {ingest:7.3f}s")
+    print(f"  journal (append + fsync): {journaled:7.3f}s  "
+          f"({stats['bytes'] / count:.0f} bytes/listing, {stats['fsyncs']} fsyncs)")
+    print(f"  overhead: {journaled / ingest:.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Benchmark: parallel capture decoding (byte-range vs flow sharding)
+並列デコードのベンチマーク（バイト範囲シャードとフローシャード）
+
+フローシャードでは親プロセスがキャプチャを1回だけ解析してレコードをワーカーに送るため、
+1回分の解析時間と振り分けのコストがワーカー数を増やしても短くならない下限になります。
+
+Usage:
+    python benchmarks/bench_parallel_decode.py [packets] [workers]
+"""
+import sys
+sys.path.insert(0, '.')
+
+import tempfile
+import time
+from pathlib import Path
+
+from src.packet_decoder.decoder import TradingCenterDecoder
+from src.packet_decoder.pcap_reader import iter_pcap
+from tests.helpers import build_frame, build_tcp_frame, build_trading_payload, write_pcap
+
+FLOWS = 8
+LISTINGS_PER_PACKET = 20
+
+
+def write_capture(path: Path, packets: int):
+    """FLOWS本のフローに取引所パケットを振り分けたPCAPを生成"""
+    frames = []
+    seqs = [1] * FLOWS
+    for i in range(packets):
+        flow = i % FLOWS
+        listings = [(i * LISTINGS_PER_PACKET + j, 100 + j, 1, 1000 + j) for j in range(LISTINGS_PER_PACKET)]
+        payload = build_frame(build_trading_payload(listings))
+        frames.append((1700000000.0 + i * 0.001, build_tcp_frame(
+            payload, dst=("10.0.0.2", 40000 + flow), seq=seqs[flow]
+        )))
+        seqs[flow] += len(payload)
+    write_pcap(path, frames)
+
+
+def timed(function):
+    started_at = time.perf_counter()
+    result = function()
+    return time.perf_counter() - started_at, result
+
+
+def main():
+    packets = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = str(Path(directory) / "capture.pcap")
+        write_capture(Path(path), packets)
+
+        parse, _count = timed(lambda: sum(1 for _record in iter_pcap(path)))
+        print(f"{packets:,} packets on {FLOWS} flows, {workers} workers")
+        print(f"  one parse pass (iter_pcap):      {parse:7.3f}s")
+
+        for label, reassemble in (("byte-range (no reassembly)", False), ("flow (reassembly)", True)):
+            sequential, _packets = timed(
+                lambda: TradingCenterDecoder(reassemble=reassemble).decode_pcap_file(path)
+            )
+            decoder = TradingCenterDecoder(reassemble=reassemble)
+            parallel, _packets = timed(lambda: decoder.decode_pcap_file(path, workers=workers))
+            passes = decoder.last_run_stats["parse_passes"]
+            print(f"  {label}:")
+            print(f"    sequential {sequential:7.3f}s  parallel {parallel:7.3f}s  "
+                  f"speedup {sequential / parallel:4.2f}x")
+            print(f"    parse passes {passes} ({passes * parse:.3f}s of CPU spent parsing)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Benchmark: protobuf field scanning (per-field parse_field loop vs scan_fields)
+Protobufフィールドスキャンのマイクロベンチマーク
+
+Usage:
+    python benchmarks/bench_protobuf_scan.py [iterations]
+"""
+import sys
+sys.path.insert(0, '.')
+
+import struct
+import timeit
+
+from src.packet_decoder.protobuf import scan_fields
+
+
+def encode_varint(value: int) -> bytes:
+    """Varintをエンコード"""
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def build_message(entries: int = 200) -> bytes:
+    """板情報ページ相当の合成メッセージを生成"""
+    entry = (
+        encode_varint(1 << 3) + encode_varint(5_000_001)
+        + encode_varint(2 << 3) + encode_varint(1234)
+        + encode_varint(3 << 3) + encode_varint(5)
+        + encode_varint(4 << 3) + encode_varint(7_000_000)
+        + encode_varint((5 << 3) | 2) + encode_varint(36) + b"12345678-1234-1234-1234-123456789012"
+        + encode_varint(6 << 3) + encode_varint(1_750_000_000)
+        + encode_varint((7 << 3) | 1) + struct.pack('<Q', 42)
+    )
+    return entry * entries
+
+
+def legacy_parse_varint(data: bytes, offset: int) -> tuple:
+    """変更前の ProtobufParser.parse_varint"""
+    result = 0
+    shift = 0
+    pos = offset
+    while pos < len(data):
+        byte = data[pos]
+        result |= (byte & 0x7F) << shift
+        pos += 1
+        if not (byte & 0x80):
+            break
+        shift += 7
+    return result, pos
+
+
+def legacy_parse_field(data: bytes, offset: int) -> tuple:
+    """変更前の ProtobufParser.parse_field"""
+    if offset >= len(data):
+        return None, offset
+    tag, offset = legacy_parse_varint(data, offset)
+    wire_type = tag & 0x07
+    field_number = tag >> 3
+    value = None
+    if wire_type == 0:
+        value, offset = legacy_parse_varint(data, offset)
+    elif wire_type == 1:
+        if offset + 8 <= len(data):
+            value = struct.unpack('<Q', data[offset:offset+8])[0]
+            offset += 8
+    elif wire_type == 2:
+        length, offset = legacy_parse_varint(data, offset)
+        if offset + length <= len(data):
+            value = data[offset:offset+length]
+            offset += length
+    elif wire_type == 5:
+        if offset + 4 <= len(data):
+            value = struct.unpack('<I', data[offset:offset+4])[0]
+            offset += 4
+    return (field_number, wire_type, value), offset
+
+
+def legacy_scan(data: bytes) -> int:
+    """変更前の方法で全フィールドを読む"""
+    offset = 0
+    count = 0
+    while offset < len(data):
+        field, new_offset = legacy_parse_field(data, offset)
+        if field is None or new_offset == offset:
+            break
+        offset = new_offset
+        count += 1
+    return count
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    data = build_message()
+    fields = len(scan_fields(data))
+    assert legacy_scan(data) == fields
+
+    before = timeit.timeit(lambda: legacy_scan(data), number=iterations)
+    after = timeit.timeit(lambda: scan_fields(data), number=iterations)
+
+    total = fields * iterations
+    print(f"Synthetic message: {len(data)} bytes, {fields} fields, {iterations} iterations")
+    print(f"  before (parse_field loop): {total / before / 1e6:6.2f} M fields/sec")
+    print(f"  after  (scan_fields):      {total / after / 1e6:6.2f} M fields/sec")
+    print(f"  speedup: {before / after:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
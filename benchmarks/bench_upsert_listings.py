@@ -0,0 +1,98 @@
+"""
+Benchmark: listing ingestion (ORM per row vs ON CONFLICT executemany)
+出品情報の取り込みのベンチマーク（重複率80%）
+
+Usage:
+    python benchmarks/bench_upsert_listings.py [listings] [duplicate_rate]
+"""
+import sys
+sys.path.insert(0, '.')
+
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.orm import Session
+
+from src.database.ingest import listing_rows, upsert_listings
+from src.database.models import Base, Item, Listing
+from src.packet_decoder.packet_types import ItemListing
+
+BATCH = 500
+ITEMS = 200
+
+
+def build_stream(count: int, duplicate_rate: float, seed: int = 1):
+    """重複率に従って、既に出た出品を再キャプチャするリスティングの列を生成"""
+    rng = random.Random(seed)
+    seen = []
+    started = datetime(2026, 1, 1)
+    stream = []
+    for i in range(count):
+        if seen and rng.random() < duplicate_rate:
+            listing_id = rng.choice(seen)
+        else:
+            listing_id = 1_000_000 + len(seen)
+            seen.append(listing_id)
+        item_id = 100 + listing_id % ITEMS
+        stream.append(ItemListing(
+            listing_id=str(listing_id), item_id=item_id, item_name=f"アイテム{item_id}",
+            quantity=1 + listing_id % 10, price=rng.randint(1_000, 100_000),
+            timestamp=started + timedelta(seconds=i)
+        ))
+    return stream
+
+
+def legacy_store(session: Session, listings):
+    """変更前に近い実装（アイテムを1件ずつ問い合わせ、ORMのmergeで重複を更新）"""
+    for data in listings:
+        if session.get(Item, data.item_id) is None:
+            session.add(Item(id=data.item_id, name=data.item_name))
+        session.merge(Listing(
+            id=int(data.listing_id), item_id=data.item_id, quantity=data.quantity, price=data.price,
+            unit_price=data.price // data.quantity if data.quantity > 0 else data.price,
+            seller_name=data.seller_name, captured_at=data.timestamp
+        ))
+    session.commit()
+
+
+def upsert_store(session: Session, listings):
+    """ON CONFLICT DO UPDATE をexecutemanyで実行"""
+    upsert_listings(session, listing_rows(listings), count_existing=False)
+    session.commit()
+
+
+def run(store, stream, directory: Path, name: str):
+    engine = create_engine(f"sqlite:///{directory / (name + '.db')}")
+    Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        started_at = time.perf_counter()
+        for start in range(0, len(stream), BATCH):
+            store(session, stream[start:start + BATCH])
+        elapsed = time.perf_counter() - started_at
+        rows = session.scalar(select(func.count()).select_from(Listing))
+    engine.dispose()
+    return elapsed, rows
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+    duplicate_rate = float(sys.argv[2]) if len(sys.argv) > 2 else 0.8
+    stream = build_stream(count, duplicate_rate)
+
+    print(f"{count:,} listings, {duplicate_rate:.0%} re-captures, {BATCH} per commit (SQLite file)")
+    with tempfile.TemporaryDirectory() as directory:
+        directory = Path(directory)
+        results = {}
+        for name, store in (("legacy", legacy_store), ("upsert", upsert_store)):
+            elapsed, rows = run(store, stream, directory, name)
+            results[name] = elapsed
+            print(f"  {name:<7} {elapsed:7.2f}s  {count / elapsed:10,.0f} listings/s  ({rows:,} rows)")
+    print(f"  speedup: {results['legacy'] / results['upsert']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
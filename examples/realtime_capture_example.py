@@ -90,12 +90,9 @@ def example_database_capture():
     print("Data will be saved to database automatically.")
     print("Press Ctrl+C to stop.\n")
     
-    # データベースセッション
-    db = SessionLocal()
-    
-    # コールバックを組み合わせる
+    # コールバックを組み合わせる（DB保存は書き込みスレッドがセッションを開く）
     console_callback = ConsoleCallback()
-    db_callback = DatabaseCallback(db)
+    db_callback = DatabaseCallback(SessionLocal)
     
     # 複合コールバック
     class CombinedCallback(RealtimeCaptureCallback):
@@ -109,6 +106,10 @@ def example_database_capture():
         def on_error(self, error: Exception):
             console_callback.on_error(error)
             db_callback.on_error(error)
+        
+        def close(self):
+            # バッファに残った出品情報を書き込む
+            db_callback.close()
     
     callback = CombinedCallback()
     
@@ -118,7 +119,6 @@ def example_database_capture():
     def signal_handler(sig, frame):
         print("\n\nStopping capture...")
         capture.stop()
-        db.close()
         sys.exit(0)
     
     signal.signal(signal.SIGINT, signal_handler)
@@ -134,7 +134,6 @@ def example_database_capture():
     except KeyboardInterrupt:
         print("\nStopping...")
         capture.stop()
-        db.close()
 
 
 def example_filtered_capture():
@@ -9,19 +9,64 @@ import json
 import logging
 from pathlib import Path
 from datetime import datetime
+from typing import List, Optional, Tuple
 
-from src.database import SessionLocal, Item, Listing
+from sqlalchemy.orm import Session
+
+from src.database import SessionLocal
+from src.database.ingest import listing_rows, upsert_listings
+from src.packet_decoder.packet_types import ItemListing
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-def import_from_json(json_file: str):
+def json_listings(items_data: List[dict], captured_at: datetime) -> Tuple[List[ItemListing], int]:
+    """
+    JSONのアイテムをItemListingに変換
+    
+    Args:
+        items_data: JSONの ``items`` 配列
+        captured_at: キャプチャ日時（listing_id がないアイテムのID生成に使用）
+    
+    Returns:
+        (ItemListingのリスト, スキップした件数)
+    """
+    listings = []
+    skipped_count = 0
+    for item_data in items_data:
+        item_id = item_data.get('item_id')
+        item_name = item_data.get('item_name', 'Unknown')
+        
+        if not item_id:
+            logger.debug(f"Skipping item without ID: {item_name}")
+            skipped_count += 1
+            continue
+        
+        listing_id = item_data.get('listing_id') or 0
+        if listing_id == 0:
+            # IDがない場合はタイムスタンプベースで生成
+            listing_id = int(captured_at.timestamp() * 1000000) + len(listings)
+        
+        listings.append(ItemListing(
+            listing_id=str(listing_id),
+            item_id=item_id,
+            item_name=item_name,
+            quantity=item_data.get('quantity', 1),
+            price=item_data.get('price', 0),
+            seller_name="パース済み",
+            timestamp=captured_at,
+        ))
+    return listings, skipped_count
+
+
+def import_from_json(json_file: str, db: Optional[Session] = None):
     """
     JSONファイルからデータベースにインポート
     
     Args:
         json_file: JSONファイルのパス
+        db: データベースセッション（省略時は SessionLocal で開いて閉じる）
     """
     logger.info(f"Importing from: {json_file}")
     
@@ -36,63 +81,26 @@ def import_from_json(json_file: str):
         logger.warning("No items to import")
         return 0
     
+    captured_at = datetime.now()
+    listings, skipped_count = json_listings(items_data, captured_at)
+    # リアルタイムキャプチャと同じ変換（GUIDや範囲外のIDは listing_key でハッシュ化）
+    rows = listing_rows(listings, captured_at)
+    
     # データベースセッション
-    db = SessionLocal()
+    owns_session = db is None
+    if owns_session:
+        db = SessionLocal()
     
     try:
-        imported_count = 0
-        skipped_count = 0
-        
-        for item_data in items_data:
-            item_id = item_data.get('item_id')
-            item_name = item_data.get('item_name', 'Unknown')
-            
-            if not item_id:
-                logger.debug(f"Skipping item without ID: {item_name}")
-                skipped_count += 1
-                continue
-            
-            # アイテムを取得または作成
-            item = db.query(Item).filter(Item.id == item_id).first()
-            if not item:
-                item = Item(
-                    id=item_id,
-                    name=item_name
-                )
-                db.add(item)
-                logger.info(f"Created new item: {item_name} (ID: {item_id})")
-            
-            # リスティングを作成
-            listing_id = item_data.get('listing_id', 0)
-            if listing_id == 0:
-                # IDがない場合はタイムスタンプベースで生成
-                listing_id = int(datetime.now().timestamp() * 1000000) + imported_count
-            
-            # 既存のリスティングをチェック
-            existing = db.query(Listing).filter(Listing.id == listing_id).first()
-            if existing:
-                logger.debug(f"Listing {listing_id} already exists, skipping")
-                skipped_count += 1
-                continue
-            
-            listing = Listing(
-                id=listing_id,
-                item_id=item_id,
-                quantity=item_data.get('quantity', 1),
-                price=item_data.get('price', 0),
-                unit_price=item_data.get('unit_price', 0),
-                seller_name="パース済み",
-                status="active",
-                captured_at=datetime.now()
-            )
-            db.add(listing)
-            imported_count += 1
-        
-        # コミット
+        # 既存のリスティングは価格とキャプチャ日時を更新する（リアルタイムキャプチャと同じupsert）
+        counts = upsert_listings(db, rows)
         db.commit()
-        logger.info(f"Import complete: {imported_count} items imported, {skipped_count} skipped")
+        logger.info(
+            f"Import complete: {counts['inserted']} imported, {counts['updated']} updated, "
+            f"{counts['items_created']} items created, {skipped_count} skipped"
+        )
         
-        return imported_count
+        return counts['inserted'] + counts['updated']
     
     except Exception as e:
         db.rollback()
@@ -100,7 +108,8 @@ def import_from_json(json_file: str):
         raise
     
     finally:
-        db.close()
+        if owns_session:
+            db.close()
 
 
 def main():
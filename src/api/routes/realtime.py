@@ -3,18 +3,24 @@ Real-time API routes
 リアルタイムデータ配信のAPIルート
 """
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 from typing import List, Dict
 import asyncio
 import json
 import logging
+import time
 
-from ...database import get_db
+from ...config import settings
+from ...database import SessionLocal, get_db
 from ...packet_decoder.realtime_capture import (
+    CompositeCallback,
+    QueuedCallback,
     RealtimePacketCapture,
     RealtimeCaptureCallback
 )
 from ...packet_decoder.packet_types import TradingPacket, ItemListing
+from ...packet_decoder.metrics import STAGE_BROADCAST
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
@@ -22,12 +28,17 @@ router = APIRouter()
 # グローバルキャプチャインスタンス
 capture_instance: RealtimePacketCapture = None
 websocket_clients: List[WebSocket] = []
+# 開始・停止の処理はスレッドプールで待つため、その間に別の開始・停止が割り込まないようにする
+capture_control_lock = asyncio.Lock()
 
 
 class WebSocketCallback(RealtimeCaptureCallback):
     """WebSocketクライアントに通知するコールバック"""
     
-    async def on_listing_found_async(self, listings: List[ItemListing]):
+    # 送信を実行するイベントループ（キャプチャ開始時に設定）
+    loop: asyncio.AbstractEventLoop = None
+    
+    async def on_listing_found_async(self, listings: List[ItemListing], scheduled_at: float = None):
         """新しい出品情報をWebSocketクライアントに送信"""
         if not websocket_clients:
             return
@@ -63,14 +74,19 @@ class WebSocketCallback(RealtimeCaptureCallback):
         for client in disconnected_clients:
             if client in websocket_clients:
                 websocket_clients.remove(client)
+        
+        # 配信件数と、キャプチャ側で呼び出されてから送信し終えるまでの時間を記録
+        if capture_instance is not None and scheduled_at is not None:
+            capture_instance.metrics.count(STAGE_BROADCAST, len(listings))
+            capture_instance.metrics.observe(STAGE_BROADCAST, time.perf_counter() - scheduled_at)
     
     def on_listing_found(self, listings: List[ItemListing]):
         """同期メソッドから非同期メソッドを呼び出し"""
         # イベントループで実行
         try:
-            loop = asyncio.get_event_loop()
+            loop = self.loop or asyncio.get_event_loop()
             asyncio.run_coroutine_threadsafe(
-                self.on_listing_found_async(listings),
+                self.on_listing_found_async(listings, time.perf_counter()),
                 loop
             )
         except Exception as e:
@@ -83,8 +99,7 @@ websocket_callback = WebSocketCallback()
 @router.post("/realtime/start")
 async def start_realtime_capture(
     game_server_ip: str = None,
-    game_server_port: int = None,
-    db: Session = Depends(get_db)
+    game_server_port: int = None
 ):
     """
     リアルタイムキャプチャを開始
@@ -92,34 +107,66 @@ async def start_realtime_capture(
     - **game_server_ip**: ゲームサーバーのIPアドレス（オプション）
     - **game_server_port**: ゲームサーバーのポート（オプション）
     """
+    async with capture_control_lock:
+        if capture_instance and capture_instance.is_running:
+            raise HTTPException(status_code=400, detail="Capture is already running")
+        return await _start_capture(game_server_ip, game_server_port)
+
+
+def _seed_seen_filter(seen_filter) -> int:
+    """保存済みの出品でフィルタを初期化（スレッドプールで実行するため、専用のセッションを開く）"""
+    with SessionLocal() as session:
+        return seen_filter.seed(session)
+
+
+async def _start_capture(game_server_ip: str, game_server_port: int) -> Dict:
+    """キャプチャを作成して開始（DBの読み込みなど時間のかかる処理はスレッドプールで実行）"""
     global capture_instance
     
-    if capture_instance and capture_instance.is_running:
-        raise HTTPException(status_code=400, detail="Capture is already running")
-    
     try:
         # データベースコールバックも追加
-        from ...database import SessionLocal
+        from ...database.journal import ListingJournal
+        from ...database.seen_filter import SeenListingFilter
+        from ...database.writer import ListingWriter
         from ...packet_decoder.realtime_capture import DatabaseCallback
         
-        db_session = SessionLocal()
-        db_callback = DatabaseCallback(db_session)
-        
         # キャプチャインスタンスを作成
         capture_instance = RealtimePacketCapture(
-            callback=websocket_callback,
             game_server_ip=game_server_ip,
             game_server_port=game_server_port
         )
         
-        # データベースコールバックも登録
-        original_on_listing = capture_instance.callback.on_listing_found
+        seen_filter = None
+        if settings.seen_filter_size > 0:
+            # 保存済みの出品を読み込み、変化のない再キャプチャは最終確認時刻の更新だけにする
+            seen_filter = SeenListingFilter(settings.seen_filter_size, settings.seen_filter_bloom)
+            # 最大 seen_filter_size 行を読むため、イベントループを止めないようスレッドプールで実行
+            seeded = await run_in_threadpool(_seed_seen_filter, seen_filter)
+            logger.info(f"Seen-listing filter seeded with {seeded} listings")
         
-        def combined_callback(listings):
-            original_on_listing(listings)
-            db_callback.on_listing_found(listings)
+        # DB保存は専用のエンジンとスレッドを持つライターが行い、APIのセッションと共有しない
+        # （ジャーナルを開くと既存のセグメントを走査するので、これもスレッドプールで実行）
+        journal = (
+            await run_in_threadpool(ListingJournal, settings.journal_directory)
+            if settings.journal_directory else None
+        )
+        writer = ListingWriter.for_url(
+            settings.database_url,
+            seen_filter=seen_filter,
+            metrics=capture_instance.metrics,
+            journal=journal,
+        )
+        # 前回のプロセスがコミットできなかった出品を、新しい出品より先に書き込む
+        # （ジャーナルの読み込みと退避分の書き込み待ちがあるのでスレッドプールで実行）
+        await run_in_threadpool(writer.recover)
+        websocket_callback.loop = asyncio.get_running_loop()
         
-        capture_instance.callback.on_listing_found = combined_callback
+        # WebSocket配信は専用のキューとスレッドで処理し、最新のデータが届けばよいので満杯時は破棄する。
+        # DB保存はライターのキューに入れるだけで戻り、停止時に残りをすべて書き込む
+        capture_instance.callback = CompositeCallback([
+            QueuedCallback(websocket_callback, "websocket", drop_when_full=True),
+            DatabaseCallback(writer=writer),
+        ])
         
         # キャプチャ開始
         capture_instance.start()
@@ -140,27 +187,33 @@ async def stop_realtime_capture():
     """リアルタイムキャプチャを停止"""
     global capture_instance
     
-    if not capture_instance or not capture_instance.is_running:
-        raise HTTPException(status_code=400, detail="Capture is not running")
-    
-    try:
-        stats = capture_instance.get_stats()
-        capture_instance.stop()
-        capture_instance = None
+    async with capture_control_lock:
+        if not capture_instance or not capture_instance.is_running:
+            raise HTTPException(status_code=400, detail="Capture is not running")
         
-        return {
-            "status": "stopped",
-            "stats": stats,
-        }
-    
-    except Exception as e:
-        logger.error(f"Failed to stop capture: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+        try:
+            stats = capture_instance.get_stats()
+            # スレッドの終了待ちとDBへの書き込みの完了待ちはスレッドプールで行う
+            await run_in_threadpool(capture_instance.stop)
+            capture_instance = None
+            
+            return {
+                "status": "stopped",
+                "stats": stats,
+            }
+        
+        except Exception as e:
+            logger.error(f"Failed to stop capture: {e}")
+            raise HTTPException(status_code=500, detail=str(e))
 
 
 @router.get("/realtime/status")
 async def get_realtime_status():
-    """リアルタイムキャプチャの状態を取得"""
+    """
+    リアルタイムキャプチャの状態を取得
+    
+    ステージごとの件数・レート（1秒/60秒）と、レイテンシのパーセンタイル（p50/p90/p99/p99.9）を返します。
+    """
     global capture_instance
     
     if not capture_instance:
@@ -169,9 +222,12 @@ async def get_realtime_status():
             "connected_clients": len(websocket_clients),
         }
     
+    stats = capture_instance.get_stats()
     return {
         "is_running": capture_instance.is_running,
-        "stats": capture_instance.get_stats(),
+        "stages": stats.pop("stages"),
+        "latency": stats.pop("latency"),
+        "stats": stats,
         "connected_clients": len(websocket_clients),
     }
 
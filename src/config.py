@@ -3,7 +3,7 @@ Configuration management
 環境変数と設定の管理
 """
 from pydantic_settings import BaseSettings
-from typing import Optional
+from typing import List, Optional
 
 
 class Settings(BaseSettings):
@@ -22,9 +22,24 @@ class Settings(BaseSettings):
     tshark_path: str = r"C:\Program Files\Wireshark\tshark.exe"
     pcap_directory: str = "./pcaps"
     
+    # Packet Decoder
+    # tools/infer_schema.py が出力したリスティングのスキーマファイル
+    listing_schema_file: Optional[str] = None
+    # 取引所フレームの圧縮アーカイブの保存先（tools/redecode_archive.py で再デコード）
+    archive_directory: Optional[str] = None
+    # 取引所メッセージ（Notify）のメソッドID。空の場合はキャプチャ中に学習する
+    trading_method_ids: List[int] = []
+    # 保存済み出品のフィルタ（LRUの出品数と、追い出した出品を残すBloomフィルタの容量。0で無効）
+    seen_filter_size: int = 200000
+    seen_filter_bloom: int = 0
+    # デコードした出品情報の先行書き込みジャーナルの保存先（起動時にコミットされなかった分を再生）
+    journal_directory: Optional[str] = None
+    
     # Game Server
     game_server_ip: Optional[str] = None
     game_server_port: Optional[int] = None
+    # 固定したゲーム接続にこの秒数パケットがなければ固定を解除する（再接続を拾うため）
+    pinned_flow_idle_timeout: float = 60.0
     
     # Cloudflare Tunnel
     cloudflare_tunnel_token: Optional[str] = None
@@ -0,0 +1,196 @@
+"""
+Bulk listing ingestion
+出品情報の一括取り込み
+
+デコード結果（ItemListing）をまとめてデータベースに書き込みます。
+SQLiteとPostgreSQLでは ``INSERT ... ON CONFLICT DO UPDATE`` をexecutemanyで実行し、
+同じ出品を何度キャプチャしても整合性エラーにならずに価格とキャプチャ日時を更新します。
+それ以外のデータベースでは、チャンク単位で既存IDを1回で調べ、INSERTとUPDATEを分けて実行します。
+"""
+import hashlib
+import logging
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Sequence
+
+from sqlalchemy import insert, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from .models import Item, Listing
+
+logger = logging.getLogger(__name__)
+
+# 1回のIN句・executemanyで扱う行数
+DEFAULT_CHUNK_SIZE = 500
+# ON CONFLICT に対応した方言ごとの insert()
+_UPSERT_INSERTS = {
+    "sqlite": sqlite.insert,
+    "postgresql": postgresql.insert,
+}
+# 主キーの上限（BigIntegerの正の範囲）。数値でない・範囲外の listing_id はこの範囲のハッシュにする
+_KEY_MASK = (1 << 63) - 1
+
+
+def listing_key(listing_id) -> int:
+    """
+    出品IDをテーブルの主キー（整数）に変換
+
+    BigIntegerの正の範囲に収まるASCIIの数値IDはそのまま使い、GUIDなどの文字列や
+    範囲外の数値（u64のID等）はハッシュから安定した整数を作ります。
+
+    Args:
+        listing_id: ItemListing.listing_id
+
+    Returns:
+        主キー（0以上 2**63 未満）
+    """
+    text = str(listing_id)
+    # isdigit() は '²' や '٣' などASCII以外の数字も受け付けるため、ASCIIに限る
+    if text.isascii() and text.isdigit():
+        key = int(text)
+        if key <= _KEY_MASK:
+            return key
+    digest = hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little') & _KEY_MASK
+
+
+def listing_rows(listings: Iterable, captured_at: datetime = None) -> List[Dict]:
+    """
+    ItemListingをlistingsテーブルの行（辞書）に変換
+
+    Args:
+        listings: ItemListingのイテラブル
+        captured_at: キャプチャ日時（省略時は各リスティングのtimestamp）
+
+    Returns:
+        行のリスト（アイテム名は ``item_name`` キーに残す）
+    """
+    rows = []
+    for listing in listings:
+        rows.append({
+            "id": listing_key(listing.listing_id),
+            "item_id": listing.item_id,
+            "item_name": listing.item_name,
+            "quantity": listing.quantity,
+            "price": listing.price,
+            "unit_price": listing.price // listing.quantity if listing.quantity > 0 else listing.price,
+            "seller_id": listing.seller_id,
+            "seller_name": listing.seller_name,
+            "status": "active",
+            "captured_at": captured_at or listing.timestamp or datetime.utcnow(),
+        })
+    return rows
+
+
+def _chunks(rows: Sequence, size: int):
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
+
+
+def _upsert_insert(session: Session):
+    """セッションの方言が ON CONFLICT に対応していれば、その方言の insert() を返す"""
+    return _UPSERT_INSERTS.get(session.get_bind().dialect.name)
+
+
+def listing_upsert_statement(dialect_name: str, keys: Iterable[str]):
+    """
+    出品情報の ``INSERT ... ON CONFLICT (id) DO UPDATE`` 文を作成
+
+    Args:
+        dialect_name: 方言名（"sqlite" / "postgresql"）
+        keys: 書き込む列名（id以外の列を競合時に更新する）
+
+    Returns:
+        executemany で実行できるINSERT文
+    """
+    statement = _UPSERT_INSERTS[dialect_name](Listing)
+    return statement.on_conflict_do_update(
+        index_elements=[Listing.id],
+        set_={key: statement.excluded[key] for key in keys if key != "id"},
+    )
+
+
+def ensure_items(session: Session, rows: Sequence[Dict], chunk_size: int = DEFAULT_CHUNK_SIZE) -> int:
+    """
+    行が参照するアイテムのうち、存在しないものをまとめて作成
+
+    Args:
+        session: SQLAlchemyのセッション
+        rows: listing_rows の結果
+        chunk_size: 1回のIN句で調べるID数
+
+    Returns:
+        作成したアイテム数
+    """
+    names: Dict[int, str] = {}
+    for row in rows:
+        names.setdefault(row["item_id"], row.get("item_name") or f"Item {row['item_id']}")
+
+    # 同時に別の書き込みが作成していても失敗しないよう、対応していれば ON CONFLICT DO NOTHING にする
+    dialect_insert = _upsert_insert(session)
+    statement = dialect_insert(Item).on_conflict_do_nothing(index_elements=[Item.id]) if dialect_insert else insert(Item)
+
+    created = 0
+    item_ids = list(names)
+    for chunk in _chunks(item_ids, chunk_size):
+        existing = set(session.execute(select(Item.id).where(Item.id.in_(chunk))).scalars())
+        missing = [{"id": item_id, "name": names[item_id]} for item_id in chunk if item_id not in existing]
+        if missing:
+            session.execute(statement, missing)
+            created += len(missing)
+    return created
+
+
+def upsert_listings(
+    session: Session,
+    rows: Sequence[Dict],
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    count_existing: bool = True
+) -> Dict[str, Optional[int]]:
+    """
+    出品情報をまとめて挿入または更新（コミットは呼び出し側で行う）
+
+    同じIDが複数ある場合は後の行を採用します。
+
+    Args:
+        session: SQLAlchemyのセッション
+        rows: listing_rows の結果
+        chunk_size: 1チャンクの行数
+        count_existing: 挿入と更新の件数を数えるか（ON CONFLICT を使う場合、数えるには
+            チャンクごとに既存IDのSELECTが1回増える。Falseの場合 inserted / updated はNone）
+
+    Returns:
+        inserted / updated / items_created の件数
+    """
+    # 同じIDは最後の行だけを残す（ON CONFLICT は1文で同じ行を2回更新できない）
+    unique = list({row["id"]: row for row in rows}.values())
+    columns = set(Listing.__table__.columns.keys())
+    dialect_name = session.get_bind().dialect.name
+    upsert = dialect_name in _UPSERT_INSERTS
+    counting = count_existing or not upsert
+    result = {
+        "inserted": 0 if counting else None,
+        "updated": 0 if counting else None,
+        "items_created": ensure_items(session, unique, chunk_size),
+    }
+
+    for chunk in _chunks(unique, chunk_size):
+        values = [{key: value for key, value in row.items() if key in columns} for row in chunk]
+        existing = set()
+        if counting:
+            ids = [row["id"] for row in chunk]
+            existing = set(session.execute(select(Listing.id).where(Listing.id.in_(ids))).scalars())
+            result["updated"] += len(existing)
+            result["inserted"] += len(chunk) - len(existing)
+
+        if upsert:
+            session.execute(listing_upsert_statement(dialect_name, values[0]), values)
+            continue
+
+        new_rows = [row for row in values if row["id"] not in existing]
+        old_rows = [row for row in values if row["id"] in existing]
+        if new_rows:
+            session.execute(insert(Listing), new_rows)
+        if old_rows:
+            session.execute(update(Listing), old_rows)
+    return result
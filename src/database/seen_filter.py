@@ -0,0 +1,197 @@
+"""
+Seen-listing filter
+保存済み出品のフィルタ
+
+キャプチャ中に観測する出品の大半は、同じ価格・数量で保存済みのものです。
+出品ID -> (価格, 数量, 最終確認時刻) の上限付きLRUを書き込みの手前に置き、
+変化のない再観測は行の書き込みではなく最終確認時刻（captured_at）のまとめて更新にします。
+LRUから追い出した出品は、オプションでBloomフィルタに (ID, 価格, 数量) として残します。
+"""
+import hashlib
+import math
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from .models import Listing
+
+
+class BloomFilter:
+    """
+    (出品ID, 価格, 数量) のBloomフィルタ
+
+    偽陽性の場合、価格が変わった出品を「変化なし」と判定して書き込みを省いてしまうため、
+    ``error_rate`` は小さめにしてください。
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 0.001):
+        """
+        Args:
+            capacity: 想定する要素数
+            error_rate: 想定要素数での偽陽性率
+        """
+        if capacity <= 0:
+            raise ValueError("capacity must be positive")
+        self.bits = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hashes = max(1, round(self.bits / capacity * math.log(2)))
+        self._array = bytearray((self.bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key: Tuple) -> Iterable[int]:
+        digest = hashlib.blake2b(repr(key).encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return ((first + i * second) % self.bits for i in range(self.hashes))
+
+    def add(self, key: Tuple):
+        """要素を追加"""
+        for position in self._positions(key):
+            self._array[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key: Tuple) -> bool:
+        return all(self._array[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+    @property
+    def fill_ratio(self) -> float:
+        """立っているビットの割合"""
+        return int.from_bytes(self._array, 'little').bit_count() / self.bits
+
+
+class SeenListingFilter:
+    """
+    保存済み出品の上限付きフィルタ
+
+    ``split`` で書き込む行と最終確認時刻だけを更新する出品に分け、
+    書き込みに成功した行を ``remember`` で登録します。スレッドセーフです。
+    """
+
+    def __init__(self, max_entries: int = 200_000, bloom_capacity: int = 0, bloom_error_rate: float = 0.001):
+        """
+        Args:
+            max_entries: LRUで保持する最大出品数
+            bloom_capacity: LRUから追い出した出品を残すBloomフィルタの容量（0で使わない）
+            bloom_error_rate: Bloomフィルタの偽陽性率
+        """
+        if max_entries <= 0:
+            raise ValueError("max_entries must be positive")
+        self.max_entries = max_entries
+        self.bloom = BloomFilter(bloom_capacity, bloom_error_rate) if bloom_capacity > 0 else None
+        self._entries: "OrderedDict[int, Tuple[int, int, datetime]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {
+            "hits": 0,
+            "bloom_hits": 0,
+            "misses": 0,
+            "changed": 0,
+            "evicted": 0,
+            "seeded": 0,
+        }
+
+    def split(self, rows: Sequence[Dict]) -> Tuple[List[Dict], Dict[int, datetime]]:
+        """
+        行を、書き込む行と最終確認時刻だけを更新する出品に分ける
+
+        Args:
+            rows: listing_rows の結果
+
+        Returns:
+            (書き込む行, 出品ID -> 最終確認時刻)
+        """
+        changed: List[Dict] = []
+        unchanged: Dict[int, datetime] = {}
+        with self._lock:
+            for row in rows:
+                key = row["id"]
+                entry = self._entries.get(key)
+                if entry is not None:
+                    if (entry[0], entry[1]) == (row["price"], row["quantity"]):
+                        self._entries[key] = (entry[0], entry[1], row["captured_at"])
+                        self._entries.move_to_end(key)
+                        unchanged[key] = row["captured_at"]
+                        self.stats["hits"] += 1
+                        continue
+                    self.stats["changed"] += 1
+                elif self.bloom is not None and (key, row["price"], row["quantity"]) in self.bloom:
+                    unchanged[key] = row["captured_at"]
+                    self.stats["bloom_hits"] += 1
+                    continue
+                self.stats["misses"] += 1
+                changed.append(row)
+        return changed, unchanged
+
+    def remember(self, rows: Iterable[Dict]):
+        """
+        書き込みに成功した行を登録
+
+        Args:
+            rows: listing_rows の結果（id / price / quantity / captured_at）
+        """
+        with self._lock:
+            for row in rows:
+                self._put(row["id"], row["price"], row["quantity"], row["captured_at"])
+
+    def _put(self, key: int, price: int, quantity: int, seen_at: datetime):
+        self._entries[key] = (price, quantity, seen_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            old_key, (old_price, old_quantity, _seen) = self._entries.popitem(last=False)
+            self.stats["evicted"] += 1
+            if self.bloom is not None:
+                self.bloom.add((old_key, old_price, old_quantity))
+
+    def seed(self, session: Session, since: Optional[datetime] = None) -> int:
+        """
+        データベースの出品で初期化（最近キャプチャしたものがLRUに残る）
+
+        Args:
+            session: SQLAlchemyのセッション
+            since: この日時以降にキャプチャした出品だけを読み込む
+
+        Returns:
+            読み込んだ出品数
+        """
+        query = select(Listing.id, Listing.price, Listing.quantity, Listing.captured_at)
+        if since is not None:
+            query = query.where(Listing.captured_at >= since)
+
+        if self.bloom is None:
+            # LRUに残る分（最近のもの）だけを読み、古いものから入れる
+            rows = reversed(session.execute(
+                query.order_by(Listing.captured_at.desc()).limit(self.max_entries)
+            ).all())
+        else:
+            # 古いものから順に流し込み、追い出したものはBloomフィルタに残す
+            rows = session.execute(
+                query.order_by(Listing.captured_at).execution_options(yield_per=10_000)
+            )
+
+        count = 0
+        with self._lock:
+            for key, price, quantity, captured_at in rows:
+                self._put(key, price, quantity, captured_at)
+                count += 1
+            self.stats["seeded"] += count
+        return count
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get_stats(self) -> Dict:
+        """
+        統計情報を取得
+
+        Returns:
+            ヒット（LRU・Bloom）・ミス・価格変化・追い出しの件数とヒット率
+        """
+        with self._lock:
+            stats = dict(self.stats, entries=len(self._entries), max_entries=self.max_entries)
+        lookups = stats["hits"] + stats["bloom_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["hits"] + stats["bloom_hits"]) / lookups if lookups else 0.0
+        if self.bloom is not None:
+            stats["bloom"] = {"entries": self.bloom.count, "bits": self.bloom.bits, "fill_ratio": self.bloom.fill_ratio}
+        return stats
@@ -0,0 +1,501 @@
+"""
+Listing ingestion writer
+出品情報の書き込みスレッド
+
+キャプチャの処理スレッドやAPIのイベントループとセッションを共有しないよう、
+専用のスレッドが自分のセッション（``for_url`` の場合はエンジンも）を持ち、
+キューから受け取った出品情報をまとめて書き込みます。
+
+- グループコミット: ``flush_rows`` 行に達するか、最初の行から ``flush_interval`` 秒経つと1回でコミット
+- 再試行: 一時的なエラー（ロック・切断）で失敗したバッチは上限付きの指数バックオフで
+  ``max_retries`` 回まで再試行。データの誤りなど再試行しても成功しないエラーの場合は
+  バッチを二分して書き込み直し、原因の行だけを捨てる
+- 停止時の保証: ``close`` はキューに残った分をすべて書き込んでから戻る
+- ジャーナル: ``journal`` を指定すると、キューに入れる前に追記専用のジャーナルに記録し、
+  コミットした通し番号をチェックポイントにする。再試行の上限を超えて捨てるバッチは退避ファイルに移し、
+  ``recover`` で前回コミットできなかった分と退避した分を再生する
+"""
+import logging
+import queue
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import bindparam, create_engine, update
+from sqlalchemy.exc import DBAPIError, DisconnectionError, OperationalError, TimeoutError as PoolTimeoutError
+from sqlalchemy.orm import Session, sessionmaker
+
+from .ingest import listing_key, listing_rows, upsert_listings
+from .journal import RECORD_ROWS
+from .models import Listing
+from ..packet_decoder.metrics import STAGE_STORED, LatencyHistogram
+
+logger = logging.getLogger(__name__)
+
+# 最終確認時刻の更新が flush_rows のこの倍数だけ溜まったら、タイマーを待たずに書き込む
+SEEN_FLUSH_FACTOR = 10
+
+# キューに入れる要求の種類
+_ROWS = "rows"
+_SEEN = "seen"
+_SYNC = "sync"
+_STOP = "stop"
+
+
+def is_transient_error(error: Exception) -> bool:
+    """
+    再試行すれば成功する見込みのあるエラーか判定
+
+    ロック待ち・切断・接続プールのタイムアウトなどは一時的なエラー、
+    制約違反や値の範囲外（IntegrityError / DataError / OverflowError 等）は
+    何度書き込んでも同じ結果になるエラーとみなします。
+
+    Args:
+        error: 書き込み中に発生した例外
+
+    Returns:
+        一時的なエラーの場合True
+    """
+    if isinstance(error, (OperationalError, DisconnectionError, PoolTimeoutError)):
+        return True
+    return isinstance(error, DBAPIError) and error.connection_invalidated
+
+
+class ListingWriter:
+    """
+    出品情報を専用スレッドで書き込むライター
+
+    ``submit`` / ``submit_seen`` はキューに入れるだけで戻ります（キューが満杯の場合は空くまで待つ）。
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[], Session],
+        flush_rows: int = 500,
+        flush_interval: float = 0.25,
+        seen_filter=None,
+        seen_interval: float = 5.0,
+        max_queue: int = 10_000,
+        max_retries: int = 5,
+        retry_backoff: float = 0.1,
+        max_backoff: float = 5.0,
+        metrics=None,
+        journal=None,
+        on_close: Optional[Callable[[], None]] = None
+    ):
+        """
+        Args:
+            session_factory: 書き込みスレッドで呼び出すセッションの生成関数
+            flush_rows: この行数が溜まったらコミットする
+            flush_interval: 最初の行を溜めてからコミットするまでの最大時間（秒）
+            seen_filter: 保存済み出品のフィルタ（SeenListingFilter）
+            seen_interval: 最終確認時刻の更新だけが溜まっている場合にコミットするまでの最大時間（秒）
+            max_queue: キューの最大件数（要求の数）
+            max_retries: 失敗したバッチの最大再試行回数
+            retry_backoff: 最初の再試行までの待ち時間（秒、以降は倍々）
+            max_backoff: 再試行の待ち時間の上限（秒）
+            metrics: 保存件数と所要時間を記録するPipelineMetrics（省略可）
+            journal: 先行書き込みジャーナル（database.journal.ListingJournal、省略可）
+            on_close: 停止後に呼ぶ後片付け（エンジンの破棄など）
+        """
+        self.session_factory = session_factory
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.seen_filter = seen_filter
+        self.seen_interval = seen_interval
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.max_backoff = max_backoff
+        self.metrics = metrics
+        self.journal = journal
+        self._on_close = on_close
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max_queue)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        # ジャーナルの通し番号とキューの順序を揃える
+        self._submit_lock = threading.Lock()
+        self._closed = False
+        # 以下は書き込みスレッドだけが更新する
+        self._rows: List[Dict] = []
+        self._seen: Dict[int, datetime] = {}
+        self._due: Optional[float] = None
+        # バッファに入っている最後の記録の通し番号（コミット後にチェックポイントにする）
+        self._sequence: Optional[int] = None
+        # 退避できなかったバッチ（rows, seen）。退避し直せるまでチェックポイントを進めない
+        self._held: List[Tuple[List[Dict], Dict[int, datetime]]] = []
+        self._first_write: Optional[float] = None
+        self.commit_latency = LatencyHistogram()
+        self.stats = {
+            "commits": 0,
+            "rows_written": 0,
+            "items_created": 0,
+            "seen_updated": 0,
+            "retries": 0,
+            "errors": 0,
+            "rows_dropped": 0,
+            "rows_rejected": 0,
+            "seen_rejected": 0,
+            "journal_errors": 0,
+            "high_water": 0,
+            "flush_seconds": 0.0,
+        }
+
+    @classmethod
+    def for_url(cls, database_url: str, **kwargs) -> "ListingWriter":
+        """
+        専用のエンジンを持つライターを作成（エンジンは ``close`` で破棄）
+
+        Args:
+            database_url: データベースURL
+            **kwargs: コンストラクタの引数
+
+        Returns:
+            ListingWriter
+        """
+        engine = create_engine(
+            database_url,
+            connect_args={"check_same_thread": False} if "sqlite" in database_url else {},
+        )
+        return cls(sessionmaker(bind=engine, autoflush=False), on_close=engine.dispose, **kwargs)
+
+    def _ensure_thread(self):
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("ListingWriter is closed")
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="listing-writer", daemon=True)
+                self._thread.start()
+
+    def _put(self, item: tuple):
+        self._ensure_thread()
+        self._queue.put(item)
+        self._record_depth()
+
+    def _submit(self, kind: str, payload):
+        """ジャーナルがあれば記録してからキューに入れる"""
+        if self.journal is None:
+            self._put((kind, payload, None))
+            return
+        self._ensure_thread()
+        with self._submit_lock:
+            try:
+                if kind == _ROWS:
+                    sequence = self.journal.append_rows(payload)
+                else:
+                    sequence = self.journal.append_seen(payload)
+            except Exception as e:
+                # 記録できなくてもデータベースへの書き込みは続ける（落ちた場合は再生されない）
+                self.stats["journal_errors"] += 1
+                logger.error(f"Journal append error: {e}")
+                sequence = None
+            self._queue.put((kind, payload, sequence))
+        self._record_depth()
+
+    def _record_depth(self):
+        depth = self._queue.qsize()
+        if depth > self.stats["high_water"]:
+            self.stats["high_water"] = depth
+
+    def submit(self, listings: Iterable):
+        """
+        出品情報を書き込みキューに追加
+
+        Args:
+            listings: ItemListingのイテラブル
+        """
+        self._submit(_ROWS, listing_rows(listings))
+
+    def submit_seen(self, listings: Iterable, seen_at: datetime):
+        """
+        再びキャプチャされた出品の最終確認時刻の更新をキューに追加
+
+        Args:
+            listings: ItemListingのイテラブル
+            seen_at: キャプチャ日時
+        """
+        self._submit(_SEEN, {listing_key(listing.listing_id): seen_at for listing in listings})
+
+    def sync(self, timeout: Optional[float] = None) -> bool:
+        """
+        ここまでに追加した要求をすべて書き込んでコミットするまで待つ
+
+        Args:
+            timeout: 最大待ち時間（秒）
+
+        Returns:
+            書き込みが終わった場合True
+        """
+        done = threading.Event()
+        self._put((_SYNC, done, None))
+        return done.wait(timeout)
+
+    def recover(self) -> int:
+        """
+        ジャーナルのチェックポイントより後の記録（前回コミットできなかった分）と
+        退避したバッチを書き込みキューに戻す
+
+        退避したバッチがある場合は、書き込み終わるまで待ってから退避ファイルを消します。
+
+        Returns:
+            再生した記録数
+        """
+        if self.journal is None:
+            return 0
+        # 退避したバッチはジャーナルの記録より古いので先に書き込む（通し番号なし）
+        set_aside = 0
+        for record in self.journal.replay_set_aside():
+            self._put((_ROWS if record.kind == RECORD_ROWS else _SEEN, record.payload, None))
+            set_aside += 1
+        count = 0
+        for record in self.journal.replay():
+            kind = _ROWS if record.kind == RECORD_ROWS else _SEEN
+            self._put((kind, record.payload, record.sequence))
+            count += 1
+        if count:
+            logger.info(f"Replaying {count} journal records (after checkpoint {self.journal.checkpointed})")
+        if set_aside:
+            logger.info(f"Replaying {set_aside} set-aside journal records")
+            # 書き込めなかった分は改めて退避されるので、再生した退避ファイルは消してよい
+            self.sync()
+            self.journal.discard_set_aside()
+        return count + set_aside
+
+    def close(self):
+        """キューに残った要求をすべて書き込んでからスレッドを停止"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            thread = self._thread
+        if thread is not None:
+            self._queue.put((_STOP, None, None))
+            thread.join()
+        if self.journal is not None:
+            self.journal.close()
+        if self._on_close is not None:
+            self._on_close()
+
+    def _run(self):
+        session = self.session_factory()
+        try:
+            while True:
+                timeout = max(self._due - time.monotonic(), 0.0) if self._due is not None else None
+                try:
+                    kind, payload, sequence = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    self._flush(session)
+                    continue
+
+                if sequence is not None:
+                    self._sequence = sequence
+                if kind == _ROWS:
+                    self._add_rows(payload)
+                elif kind == _SEEN:
+                    self._seen.update(payload)
+                    self._arm(self.seen_interval)
+                elif kind == _SYNC:
+                    self._flush(session)
+                    payload.set()
+                    continue
+                elif kind == _STOP:
+                    self._flush(session)
+                    return
+
+                if len(self._rows) >= self.flush_rows or len(self._seen) >= self.flush_rows * SEEN_FLUSH_FACTOR:
+                    self._flush(session)
+        finally:
+            session.close()
+
+    def _add_rows(self, rows: List[Dict]):
+        if self.seen_filter is not None:
+            rows, unchanged = self.seen_filter.split(rows)
+            self._seen.update(unchanged)
+            self._arm(self.seen_interval)
+        if rows:
+            self._rows.extend(rows)
+            self._arm(self.flush_interval)
+
+    def _arm(self, interval: float):
+        """コミットの期限を設定（既に早い期限があればそのまま）"""
+        due = time.monotonic() + interval
+        if self._due is None or due < self._due:
+            self._due = due
+
+    def _flush(self, session: Session):
+        """溜めた行と最終確認時刻の更新を1回のトランザクションで書き込む（一時的な失敗は再試行）"""
+        rows, self._rows = self._rows, []
+        seen, self._seen = self._seen, {}
+        sequence, self._sequence = self._sequence, None
+        self._due = None
+        if not rows and not seen:
+            self._checkpoint(sequence)
+            return
+
+        for attempt in range(self.max_retries + 1):
+            started_at = time.perf_counter()
+            if self._first_write is None:
+                self._first_write = started_at
+            try:
+                written, items_created, seen_updated = self._write(session, rows, list(seen.items()))
+                break
+            except Exception as e:
+                session.rollback()
+                if attempt == self.max_retries:
+                    self.stats["errors"] += 1
+                    self.stats["rows_dropped"] += len(rows)
+                    logger.error(f"Database save error ({len(rows)} listings dropped): {e}")
+                    self._set_aside(rows, seen, sequence)
+                    return
+                delay = min(self.retry_backoff * (2 ** attempt), self.max_backoff)
+                self.stats["retries"] += 1
+                logger.warning(f"Database save failed, retrying in {delay:.2f}s: {e}")
+                time.sleep(delay)
+
+        elapsed = time.perf_counter() - started_at
+        self.commit_latency.record(elapsed)
+        self.stats["commits"] += 1
+        self.stats["rows_written"] += len(written)
+        self.stats["items_created"] += items_created
+        self.stats["seen_updated"] += seen_updated
+        self.stats["flush_seconds"] += elapsed
+        self._checkpoint(sequence)
+        if self.seen_filter is not None:
+            self.seen_filter.remember(written)
+        if self.metrics is not None and written:
+            self.metrics.count(STAGE_STORED, len(written))
+            self.metrics.observe(STAGE_STORED, elapsed)
+        logger.debug(f"Saved {len(written)} listings to database in {elapsed * 1000:.1f}ms")
+
+    def _checkpoint(self, sequence: Optional[int]):
+        """コミットした通し番号をジャーナルのチェックポイントにする（退避できていないバッチがあれば先に退避）"""
+        if self._held and not self._release_held():
+            return
+        if sequence is not None:
+            self.journal.checkpoint(sequence)
+
+    def _release_held(self) -> bool:
+        """
+        退避できなかったバッチを古い順に退避し直す
+
+        Returns:
+            すべて退避できた場合True（チェックポイントを進めてよい）
+        """
+        while self._held:
+            rows, seen = self._held[0]
+            try:
+                self.journal.set_aside(rows, seen)
+            except Exception as e:
+                logger.error(
+                    f"Could not set aside {len(self._held)} dropped batches, holding journal checkpoint: {e}"
+                )
+                return False
+            self._held.pop(0)
+        logger.info("Set aside held batches, resuming journal checkpoints")
+        return True
+
+    def _set_aside(self, rows: List[Dict], seen: Dict[int, datetime], sequence: Optional[int]):
+        """
+        捨てるバッチをジャーナルの退避ファイルに移す
+
+        退避できなかった場合は、次回の起動時にジャーナルから再生できるよう、
+        以降の書き込みのたびに退避し直し、成功するまでチェックポイントを進めません。
+        """
+        if self.journal is None:
+            return
+        self._held.append((rows, seen))
+        self._checkpoint(sequence)
+
+    def _write(
+        self,
+        session: Session,
+        rows: List[Dict],
+        seen: Sequence[Tuple[int, datetime]]
+    ) -> Tuple[List[Dict], int, int]:
+        """
+        行と最終確認時刻の更新を書き込んでコミット
+
+        再試行しても成功しないエラーの場合はバッチを二分して書き込み直し、原因の行（更新）だけを
+        捨てて数えます。一時的なエラーはそのまま送出します（呼び出し側でバッチごと再試行）。
+
+        Args:
+            session: 書き込みスレッドのセッション
+            rows: listing_rows の行
+            seen: (出品ID, 最終確認時刻) のリスト
+
+        Returns:
+            (書き込んだ行, 作成したアイテム数, 更新した最終確認時刻の数)
+        """
+        try:
+            items_created = self._commit(session, rows, seen)
+            return rows, items_created, len(seen)
+        except Exception as e:
+            session.rollback()
+            if is_transient_error(e):
+                raise
+            if len(rows) + len(seen) <= 1:
+                self.stats["rows_rejected"] += len(rows)
+                self.stats["seen_rejected"] += len(seen)
+                key = rows[0]["id"] if rows else seen[0][0]
+                logger.error(f"Rejected listing {key}: {e}")
+                return [], 0, 0
+
+        if len(rows) > 1:
+            middle = len(rows) // 2
+            parts = ((rows[:middle], []), (rows[middle:], seen))
+        elif len(seen) > 1:
+            middle = len(seen) // 2
+            parts = ((rows, seen[:middle]), ([], seen[middle:]))
+        else:
+            parts = ((rows, []), ([], seen))
+
+        written: List[Dict] = []
+        items_created = seen_updated = 0
+        for part_rows, part_seen in parts:
+            part_written, part_items, part_seen_updated = self._write(session, part_rows, part_seen)
+            written.extend(part_written)
+            items_created += part_items
+            seen_updated += part_seen_updated
+        return written, items_created, seen_updated
+
+    def _commit(self, session: Session, rows: List[Dict], seen: Sequence[Tuple[int, datetime]]) -> int:
+        """1回のトランザクションで書き込み、作成したアイテム数を返す"""
+        items_created = upsert_listings(session, rows, count_existing=False)["items_created"] if rows else 0
+        if seen:
+            table = Listing.__table__
+            session.execute(
+                update(table)
+                .where(table.c.id == bindparam("listing_id"))
+                .values(captured_at=bindparam("seen_at")),
+                [{"listing_id": key, "seen_at": seen_at} for key, seen_at in seen]
+            )
+        session.commit()
+        return items_created
+
+    def get_stats(self) -> Dict:
+        """
+        統計情報を取得
+
+        ``listings_per_second`` は最初の書き込みからの持続スループット、
+        ``write_listings_per_second`` は書き込み処理中だけで計ったスループットです。
+
+        Returns:
+            キューの深さ・コミット数・コミットのレイテンシ・再試行数などを含む辞書
+        """
+        stats = dict(
+            self.stats,
+            depth=self._queue.qsize(),
+            buffered=len(self._rows) + len(self._seen),
+            held_batches=len(self._held),
+        )
+        stats["commit_latency"] = self.commit_latency.to_dict()
+        running = time.perf_counter() - self._first_write if self._first_write is not None else 0.0
+        stats["listings_per_second"] = stats["rows_written"] / running if running > 0 else 0.0
+        stats["write_listings_per_second"] = (
+            stats["rows_written"] / stats["flush_seconds"] if stats["flush_seconds"] > 0 else 0.0
+        )
+        if self.seen_filter is not None:
+            stats["seen_filter"] = self.seen_filter.get_stats()
+        if self.journal is not None:
+            stats["journal"] = self.journal.get_stats()
+        return stats
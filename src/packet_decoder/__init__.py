@@ -3,6 +3,22 @@ Packet decoder module
 パケット解析モジュール
 """
 from .decoder import TradingCenterDecoder
-from .packet_types import TradingPacket, ItemListing
+from .packet_types import TradingPacket, ItemListing, ListingColumns, MarketSnapshot
+from .pcap_reader import Flow, PcapRecord, iter_pcap
+from .protobuf import FieldTable, scan_fields
+from .schema import ListingSchema, SchemaDecoder
 
-__all__ = ["TradingCenterDecoder", "TradingPacket", "ItemListing"]
+__all__ = [
+    "TradingCenterDecoder",
+    "TradingPacket",
+    "ItemListing",
+    "ListingColumns",
+    "MarketSnapshot",
+    "Flow",
+    "PcapRecord",
+    "iter_pcap",
+    "FieldTable",
+    "scan_fields",
+    "ListingSchema",
+    "SchemaDecoder",
+]
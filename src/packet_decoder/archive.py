@@ -0,0 +1,383 @@
+"""
+Compressed payload archive
+圧縮ペイロードアーカイブ
+
+キャプチャした取引所フレームを、時刻とフロー付きでローテーションするセグメントファイルに
+追記します。フレームは一定サイズのブロックにまとめて圧縮し（zstandardがあればzstd、
+なければzlib）、ブロックごとの位置・時刻範囲・件数をインデックスファイルに記録します。
+デコーダーを改良した後、インデックスからブロック単位で過去のトラフィックを並列に再デコードできます。
+
+セグメントファイル (.seg):
+    ファイルヘッダー SEGMENT_MAGIC
+    ブロック: BLOCK_HEADER + 圧縮データ
+        圧縮前: (RECORD_HEADER + フロー文字列 + ペイロード) の並び
+インデックスファイル (.idx):
+    INDEX_ENTRY の並び（ブロック1件につき1エントリ）
+"""
+import os
+import struct
+import threading
+import time
+import zlib
+import logging
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterator, List, NamedTuple, Optional
+
+from .pcap_reader import Flow
+
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# 圧縮方式
+CODEC_NONE = 0
+CODEC_ZLIB = 1
+CODEC_ZSTD = 2
+CODEC_NAMES = {"none": CODEC_NONE, "zlib": CODEC_ZLIB, "zstd": CODEC_ZSTD}
+
+SEGMENT_MAGIC = b'BPSRARC1'
+SEGMENT_SUFFIX = ".seg"
+INDEX_SUFFIX = ".idx"
+
+# magic, codec, compressed_length, raw_length, record_count, first_ts, last_ts
+BLOCK_HEADER = struct.Struct('<4sB3xIIIdd')
+BLOCK_MAGIC = b'BLK0'
+# timestamp, flow文字列の長さ, ペイロード長
+RECORD_HEADER = struct.Struct('<dBI')
+# ブロックの位置, 圧縮後の長さ, 件数, first_ts, last_ts
+INDEX_ENTRY = struct.Struct('<QIIdd')
+
+
+class ArchiveRecord(NamedTuple):
+    """アーカイブの1レコード"""
+    timestamp: float  # UNIX時刻（秒）
+    flow: Flow
+    payload: bytes
+
+
+class ArchiveBlock(NamedTuple):
+    """インデックスの1エントリ（再デコードの作業単位）"""
+    path: str
+    offset: int
+    length: int
+    count: int
+    first_ts: float
+    last_ts: float
+
+
+def _encode_flow(flow: Flow) -> bytes:
+    return f"{flow.src_ip}|{flow.src_port}|{flow.dst_ip}|{flow.dst_port}".encode('ascii')
+
+
+def _decode_flow(data: bytes) -> Flow:
+    src_ip, src_port, dst_ip, dst_port = data.decode('ascii').split('|')
+    return Flow(src_ip, int(src_port), dst_ip, int(dst_port))
+
+
+def _resolve_codec(codec: str) -> int:
+    if codec == "auto":
+        return CODEC_ZSTD if ZSTD_AVAILABLE else CODEC_ZLIB
+    if codec not in CODEC_NAMES:
+        raise ValueError(f"Unknown codec: {codec}")
+    if codec == "zstd" and not ZSTD_AVAILABLE:
+        raise ImportError("zstandard is not installed (pip install zstandard)")
+    return CODEC_NAMES[codec]
+
+
+class PayloadArchive:
+    """
+    取引所フレームのローテーション付き圧縮アーカイブ（書き込み側）
+
+    ``append`` はキャプチャスレッドから呼ばれるため、圧縮はブロックが埋まった時だけ行います。
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        codec: str = "auto",
+        level: int = 3,
+        block_size: int = 1 << 20,
+        segment_bytes: int = 64 << 20,
+        segment_seconds: float = 3600.0,
+        max_segments: Optional[int] = None
+    ):
+        """
+        Args:
+            directory: セグメントファイルの出力先
+            codec: 圧縮方式（"auto" / "zstd" / "zlib" / "none"）
+            level: 圧縮レベル
+            block_size: 1ブロックの圧縮前の目安サイズ（バイト）
+            segment_bytes: セグメントを切り替えるサイズ（バイト）
+            segment_seconds: セグメントを切り替える経過時間（秒）
+            max_segments: 保持するセグメント数の上限（超えたら古いものから削除。Noneで無制限）
+        """
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.codec = _resolve_codec(codec)
+        self.level = level
+        self.block_size = block_size
+        self.segment_bytes = segment_bytes
+        self.segment_seconds = segment_seconds
+        self.max_segments = max_segments
+
+        # 圧縮器はブロックごとに作り直さず使い回す
+        if self.codec == CODEC_ZSTD:
+            self._compress = zstandard.ZstdCompressor(level=level).compress
+        elif self.codec == CODEC_ZLIB:
+            self._compress = lambda data: zlib.compress(data, level)
+        else:
+            self._compress = bytes
+
+        self._lock = threading.Lock()
+        self._buffer = bytearray()
+        self._count = 0
+        self._first_ts = 0.0
+        self._last_ts = 0.0
+        self._segment = None
+        self._index = None
+        self._segment_path: Optional[Path] = None
+        self._segment_opened_at = 0.0
+        self._sequence = 0
+        self.stats = {
+            "records": 0,
+            "raw_bytes": 0,
+            "stored_bytes": 0,
+            "blocks": 0,
+            "segments": 0,
+        }
+
+    def append(self, timestamp: float, flow: Flow, payload: bytes):
+        """
+        フレームを追記
+
+        Args:
+            timestamp: キャプチャ時刻（UNIX秒）
+            flow: フレームのフロー
+            payload: 再構築済みのフレーム
+        """
+        flow_bytes = _encode_flow(flow)
+        with self._lock:
+            if not self._count:
+                self._first_ts = timestamp
+            self._last_ts = timestamp
+            self._buffer += RECORD_HEADER.pack(timestamp, len(flow_bytes), len(payload))
+            self._buffer += flow_bytes
+            self._buffer += payload
+            self._count += 1
+            self.stats["records"] += 1
+            self.stats["raw_bytes"] += len(payload)
+
+            if len(self._buffer) >= self.block_size:
+                self._flush_block()
+
+    def flush(self):
+        """書きかけのブロックを書き出す"""
+        with self._lock:
+            self._flush_block()
+
+    def close(self):
+        """書きかけのブロックを書き出してセグメントを閉じる"""
+        with self._lock:
+            self._flush_block()
+            self._close_segment()
+
+    def _open_segment(self):
+        """新しいセグメントを開く（ロック内で呼ぶ）"""
+        self._sequence += 1
+        name = f"archive-{datetime.now():%Y%m%d-%H%M%S}-{os.getpid()}-{self._sequence:04d}"
+        self._segment_path = self.directory / (name + SEGMENT_SUFFIX)
+        self._segment = open(self._segment_path, 'wb')
+        self._segment.write(SEGMENT_MAGIC)
+        self._index = open(self.directory / (name + INDEX_SUFFIX), 'wb')
+        self._segment_opened_at = time.monotonic()
+        self.stats["segments"] += 1
+        self._enforce_retention()
+
+    def _close_segment(self):
+        """セグメントを閉じる（ロック内で呼ぶ）"""
+        if self._segment is not None:
+            self._segment.close()
+            self._index.close()
+            logger.info(f"Closed archive segment {self._segment_path}")
+            self._segment = self._index = None
+
+    def _flush_block(self):
+        """バッファを1ブロックとして圧縮して書き出す（ロック内で呼ぶ）"""
+        if not self._count:
+            return
+        if self._segment is not None and (
+            self._segment.tell() >= self.segment_bytes
+            or time.monotonic() - self._segment_opened_at >= self.segment_seconds
+        ):
+            self._close_segment()
+        if self._segment is None:
+            self._open_segment()
+
+        compressed = self._compress(bytes(self._buffer))
+        offset = self._segment.tell()
+        self._segment.write(BLOCK_HEADER.pack(
+            BLOCK_MAGIC, self.codec, len(compressed), len(self._buffer),
+            self._count, self._first_ts, self._last_ts
+        ))
+        self._segment.write(compressed)
+        self._segment.flush()
+        # ブロックを書き終えてからインデックスに載せる（途中で落ちても壊れたブロックを指さない）
+        self._index.write(INDEX_ENTRY.pack(
+            offset, len(compressed), self._count, self._first_ts, self._last_ts
+        ))
+        self._index.flush()
+
+        self.stats["blocks"] += 1
+        self.stats["stored_bytes"] += BLOCK_HEADER.size + len(compressed)
+        self._buffer.clear()
+        self._count = 0
+
+    def _enforce_retention(self):
+        """保持数を超えた古いセグメントを削除（ロック内で呼ぶ）"""
+        if self.max_segments is None:
+            return
+        segments = sorted(self.directory.glob(f"*{SEGMENT_SUFFIX}"))
+        for path in segments[:max(0, len(segments) - self.max_segments)]:
+            if path == self._segment_path:
+                continue
+            path.unlink()
+            path.with_suffix(INDEX_SUFFIX).unlink(missing_ok=True)
+            logger.info(f"Removed old archive segment {path}")
+
+    def get_stats(self) -> Dict:
+        """
+        統計情報を取得
+
+        Returns:
+            レコード数、圧縮前後のバイト数と圧縮率、ブロック数、セグメント数
+        """
+        with self._lock:
+            stats = dict(self.stats)
+            stats["pending_records"] = self._count
+        stats["codec"] = {v: k for k, v in CODEC_NAMES.items()}[self.codec]
+        stats["compression_ratio"] = (
+            stats["stored_bytes"] / stats["raw_bytes"] if stats["raw_bytes"] else 0.0
+        )
+        return stats
+
+
+def _scan_blocks(path: Path) -> List[ArchiveBlock]:
+    """インデックスがない（書き込み中に落ちた等）セグメントのブロックをヘッダーから列挙"""
+    blocks = []
+    size = path.stat().st_size
+    with open(path, 'rb') as f:
+        if f.read(len(SEGMENT_MAGIC)) != SEGMENT_MAGIC:
+            raise ValueError(f"Not an archive segment: {path}")
+        offset = len(SEGMENT_MAGIC)
+        while offset + BLOCK_HEADER.size <= size:
+            header = f.read(BLOCK_HEADER.size)
+            magic, _codec, length, _raw, count, first_ts, last_ts = BLOCK_HEADER.unpack(header)
+            if magic != BLOCK_MAGIC or offset + BLOCK_HEADER.size + length > size:
+                break
+            blocks.append(ArchiveBlock(str(path), offset, length, count, first_ts, last_ts))
+            offset += BLOCK_HEADER.size + length
+            f.seek(offset)
+    return blocks
+
+
+def list_blocks(
+    directory: str,
+    start: Optional[float] = None,
+    end: Optional[float] = None
+) -> List[ArchiveBlock]:
+    """
+    アーカイブのブロックを時刻順に列挙
+
+    Args:
+        directory: アーカイブのディレクトリ
+        start: この時刻（UNIX秒）以降のレコードを含むブロックだけを返す
+        end: この時刻（UNIX秒）以前のレコードを含むブロックだけを返す
+
+    Returns:
+        ArchiveBlockのリスト
+    """
+    blocks: List[ArchiveBlock] = []
+    for path in sorted(Path(directory).glob(f"*{SEGMENT_SUFFIX}")):
+        index_path = path.with_suffix(INDEX_SUFFIX)
+        if index_path.exists():
+            data = index_path.read_bytes()
+            usable = len(data) - len(data) % INDEX_ENTRY.size
+            blocks.extend(
+                ArchiveBlock(str(path), *entry) for entry in INDEX_ENTRY.iter_unpack(data[:usable])
+            )
+        else:
+            blocks.extend(_scan_blocks(path))
+
+    blocks = [
+        block for block in blocks
+        if (start is None or block.last_ts >= start) and (end is None or block.first_ts <= end)
+    ]
+    blocks.sort(key=lambda block: block.first_ts)
+    return blocks
+
+
+def read_block(block: ArchiveBlock) -> List[ArchiveRecord]:
+    """
+    ブロックを読み込んで展開
+
+    Args:
+        block: list_blocks が返したブロック
+
+    Returns:
+        ArchiveRecordのリスト
+    """
+    with open(block.path, 'rb') as f:
+        f.seek(block.offset)
+        header = f.read(BLOCK_HEADER.size)
+        magic, codec, length, raw_length, count, _first, _last = BLOCK_HEADER.unpack(header)
+        if magic != BLOCK_MAGIC:
+            raise ValueError(f"Corrupted block at {block.path}:{block.offset}")
+        compressed = f.read(length)
+
+    if codec == CODEC_ZSTD:
+        if not ZSTD_AVAILABLE:
+            raise ImportError("zstandard is required to read this archive (pip install zstandard)")
+        raw = zstandard.ZstdDecompressor().decompress(compressed, max_output_size=raw_length)
+    elif codec == CODEC_ZLIB:
+        raw = zlib.decompress(compressed)
+    else:
+        raw = compressed
+
+    records = []
+    view = memoryview(raw)
+    offset = 0
+    for _ in range(count):
+        timestamp, flow_length, payload_length = RECORD_HEADER.unpack_from(raw, offset)
+        offset += RECORD_HEADER.size
+        flow = _decode_flow(raw[offset:offset + flow_length])
+        offset += flow_length
+        records.append(ArchiveRecord(timestamp, flow, bytes(view[offset:offset + payload_length])))
+        offset += payload_length
+    return records
+
+
+def iter_archive(
+    directory: str,
+    start: Optional[float] = None,
+    end: Optional[float] = None
+) -> Iterator[ArchiveRecord]:
+    """
+    アーカイブのレコードを時刻順に読み出す
+
+    Args:
+        directory: アーカイブのディレクトリ
+        start: 開始時刻（UNIX秒）
+        end: 終了時刻（UNIX秒）
+
+    Yields:
+        ArchiveRecord
+    """
+    for block in list_blocks(directory, start, end):
+        for record in read_block(block):
+            if (start is None or record.timestamp >= start) and (end is None or record.timestamp <= end):
+                yield record
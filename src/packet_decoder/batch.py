@@ -0,0 +1,124 @@
+"""
+Vectorized listing decoder
+NumPy構造化dtypeによるリスティングの一括デコード
+
+リスティング配列の固定長部分（listing_id u64, item_id u32, quantity u32, price u64）を
+NumPyの構造化dtypeとしてビューし、1回の呼び出しで全件をデコードします。
+ItemListingオブジェクトを1件ずつ作らず、列指向の配列のまま一括INSERTや分析に渡せます。
+"""
+import logging
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, List, Optional
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# 1リスティングのレコード長（decoder.decode_trading_packet と同じ仮の固定サイズ）
+LISTING_RECORD_SIZE = 64
+
+if NUMPY_AVAILABLE:
+    LISTING_DTYPE = np.dtype({
+        "names": ["listing_id", "item_id", "quantity", "price", "name_length"],
+        "formats": ["<u8", "<u4", "<u4", "<u8", "<u2"],
+        "offsets": [0, 8, 12, 16, 24],
+        "itemsize": LISTING_RECORD_SIZE,
+    })
+    NAME_OFFSET = 26
+
+
+@dataclass
+class ListingBatch:
+    """列指向のリスティング一括デコード結果"""
+    listing_id: "np.ndarray"
+    item_id: "np.ndarray"
+    quantity: "np.ndarray"
+    price: "np.ndarray"
+    timestamp: datetime
+    records: "np.ndarray"  # 元バッファへの構造化ビュー（名前の遅延デコード用）
+
+    def __len__(self) -> int:
+        return len(self.listing_id)
+
+    @property
+    def unit_price(self) -> "np.ndarray":
+        """単価（数量0の場合は価格そのもの）"""
+        return np.where(self.quantity > 0, self.price // np.maximum(self.quantity, 1), self.price)
+
+    @property
+    def total_value(self) -> int:
+        """価格×数量の合計"""
+        return int((self.price * self.quantity).sum())
+
+    def item_names(self) -> List[str]:
+        """
+        アイテム名をデコード（必要になった時だけ呼ぶ）
+
+        Returns:
+            アイテム名のリスト
+        """
+        raw = self.records.view(np.uint8).reshape(len(self), LISTING_RECORD_SIZE)
+        lengths = np.minimum(self.records["name_length"], LISTING_RECORD_SIZE - NAME_OFFSET)
+        return [
+            raw[i, NAME_OFFSET:NAME_OFFSET + length].tobytes().decode('utf-8', errors='ignore')
+            for i, length in enumerate(lengths.tolist())
+        ]
+
+    def to_columns(self) -> Dict[str, list]:
+        """
+        一括INSERT用の列辞書に変換
+
+        Returns:
+            列名 -> 値のリスト
+        """
+        return {
+            "id": self.listing_id.tolist(),
+            "item_id": self.item_id.tolist(),
+            "quantity": self.quantity.tolist(),
+            "price": self.price.tolist(),
+            "unit_price": self.unit_price.tolist(),
+        }
+
+
+def decode_listing_batch(
+    buffer,
+    offset: int,
+    count: int,
+    timestamp: Optional[datetime] = None
+) -> Optional[ListingBatch]:
+    """
+    固定長リスティング配列を一括デコード
+
+    バッファに完全に含まれるレコードだけを対象にします。
+
+    Args:
+        buffer: パケットデータ（bytes / memoryview / mmap）
+        offset: 最初のリスティングの位置
+        count: パケットが示すリスティング数
+        timestamp: キャプチャ時刻（省略時は現在時刻）
+
+    Returns:
+        ListingBatch。NumPyが利用できない場合はNone
+    """
+    if not NUMPY_AVAILABLE:
+        logger.warning("NumPy is not available. Batch decoding is disabled.")
+        return None
+
+    available = max(0, (len(buffer) - offset) // LISTING_RECORD_SIZE)
+    count = min(count, available)
+
+    records = np.frombuffer(buffer, dtype=LISTING_DTYPE, count=count, offset=offset)
+
+    return ListingBatch(
+        listing_id=records["listing_id"],
+        item_id=records["item_id"],
+        quantity=records["quantity"],
+        price=records["price"],
+        timestamp=timestamp or datetime.now(),
+        records=records,
+    )
@@ -0,0 +1,481 @@
+"""
+Live capture backends
+リアルタイムキャプチャのバックエンド
+
+``RealtimePacketCapture`` はバックエンドから (timestamp, TcpSegment) を受け取るだけで、
+パケットの取得方法には依存しません。
+
+- ``AfPacketBackend``: LinuxのAF_PACKETソケット。BPFフィルタをカーネルに設定し、
+  TPACKET_V3リングを使えばシステムコール1回でブロック単位にフレームを受け取ります。
+  Scapyのオブジェクトを生成しないため、1パケットあたりのコストが小さくなります。
+- ``ScapyBackend``: Scapyの ``AsyncSniffer`` を使うフォールバック（Windows等）
+- ``PcapReplayBackend``: 記録済みのキャプチャファイルを再生（負荷試験用）
+"""
+import ctypes
+import ctypes.util
+import logging
+import mmap
+import select
+import socket
+import struct
+import sys
+import time
+import warnings
+from typing import Callable, Iterator, List, Optional, Tuple
+
+from .pcap_reader import LINKTYPE_RAW, TCP_FIN, TCP_RST, Flow, TcpSegment, iter_frames, parse_frame
+
+logging.getLogger('scapy.runtime').setLevel(logging.ERROR)
+logging.getLogger('scapy').setLevel(logging.ERROR)
+
+# Scapyのインポート時に出る警告だけを抑制（プロセス全体のフィルタは変更しない）
+with warnings.catch_warnings():
+    warnings.filterwarnings('ignore', category=DeprecationWarning)
+    warnings.filterwarnings('ignore', message='.*TripleDES.*')
+    try:
+        from scapy.all import AsyncSniffer, Raw, IP, IPv6, TCP
+        SCAPY_AVAILABLE = True
+    except ImportError:
+        SCAPY_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# バックエンドが1パケットごとに呼び出すハンドラー (timestamp, segment)
+# TCPペイロードもFIN/RSTも含まないパケットの場合 segment は None
+PacketHandler = Callable[[float, Optional[TcpSegment]], None]
+
+# Linuxのソケット定数（socketモジュールにないもの）
+ETH_P_ALL = 0x0003
+SOL_PACKET = 263
+PACKET_RX_RING = 5
+PACKET_VERSION = 10
+TPACKET_V3 = 2
+TP_STATUS_KERNEL = 0
+TP_STATUS_USER = 1
+SO_ATTACH_FILTER = 26
+
+# DLT_RAW（LinuxのlibpcapでのRaw IPの値）
+DLT_RAW_LINUX = 12
+PCAP_NETMASK_UNKNOWN = 0xFFFFFFFF
+
+# TPACKET_V3の構造体
+_TPACKET_REQ3 = struct.Struct('7I')                 # tpacket_req3
+_BLOCK_HEADER = struct.Struct('III')                # block_status, num_pkts, offset_to_first_pkt
+_BLOCK_HEADER_OFFSET = 8                            # version, offset_to_priv の後
+_TPACKET3_HEADER = struct.Struct('IIIIIIHH')        # next_offset, sec, nsec, snaplen, len, status, mac, net
+_BPF_INSN = struct.Struct('HBBI')
+_SOCK_FPROG = struct.Struct('HP')
+
+
+class CaptureBackend:
+    """キャプチャバックエンドのインターフェース"""
+
+    name = "base"
+
+    @classmethod
+    def available(cls) -> bool:
+        """このバックエンドが利用できるか"""
+        return False
+
+    def run(self, capture_filter: str, handler: PacketHandler, should_stop: Callable[[], bool]):
+        """
+        キャプチャを実行（``should_stop`` がTrueになるまでブロック）
+
+        Args:
+            capture_filter: BPFフィルタ式
+            handler: パケットごとに呼び出すハンドラー
+            should_stop: キャプチャを終了するか判定する関数
+        """
+        raise NotImplementedError
+
+    def get_stats(self) -> dict:
+        """バックエンド固有の統計情報"""
+        return {}
+
+
+class ScapyBackend(CaptureBackend):
+    """Scapyの ``AsyncSniffer`` を使うバックエンド（フォールバック）"""
+
+    name = "scapy"
+
+    def __init__(self, interface: Optional[str] = None, poll_interval: float = 0.5):
+        """
+        Args:
+            interface: ネットワークインターフェース名
+            poll_interval: パケットが届かない間に ``should_stop`` を確認する間隔（秒）
+        """
+        self.interface = interface
+        self.poll_interval = poll_interval
+
+    @classmethod
+    def available(cls) -> bool:
+        return SCAPY_AVAILABLE
+
+    def run(self, capture_filter: str, handler: PacketHandler, should_stop: Callable[[], bool]):
+        def on_packet(packet):
+            segment = None
+            if packet.haslayer(TCP):
+                tcp = packet[TCP]
+                flags = int(tcp.flags)
+                payload = bytes(packet[Raw].load) if packet.haslayer(Raw) else b""
+                # ペイロードのないセグメントはFIN/RSTだけ渡す（接続の終了を伝えるため）
+                if payload or flags & (TCP_FIN | TCP_RST):
+                    ip = packet[IP] if packet.haslayer(IP) else packet[IPv6]
+                    segment = TcpSegment(Flow(ip.src, tcp.sport, ip.dst, tcp.dport), tcp.seq, flags, payload)
+            handler(float(packet.time), segment)
+
+        # sniff の stop_filter はパケットが届いた時にしか呼ばれないため、
+        # 受信はScapyのスレッドに任せ、停止の判定はこのスレッドで定期的に行う
+        sniffer = AsyncSniffer(iface=self.interface, filter=capture_filter, prn=on_packet, store=False)
+        sniffer.start()
+        try:
+            while sniffer.running and not should_stop():
+                time.sleep(self.poll_interval)
+        finally:
+            if sniffer.running:
+                sniffer.stop()
+
+
+class AfPacketBackend(CaptureBackend):
+    """
+    LinuxのAF_PACKETソケットを使うバックエンド
+
+    SOCK_DGRAMで受信するため、フレームはリンク層ヘッダーを除いたIPパケットになります。
+    BPFフィルタのコンパイルにはlibpcapを使い、見つからない場合はフィルタなしで
+    受信します（分類はキャプチャスレッドで行われます）。
+    """
+
+    name = "af_packet"
+
+    def __init__(
+        self,
+        interface: Optional[str] = None,
+        use_ring: bool = True,
+        block_size: int = 1 << 20,
+        block_count: int = 16,
+        frame_size: int = 2048,
+        block_timeout_ms: int = 50,
+        poll_interval: float = 0.5
+    ):
+        """
+        Args:
+            interface: ネットワークインターフェース名（省略時は全インターフェース）
+            use_ring: TPACKET_V3リングを使うか
+            block_size: リングのブロックサイズ（ページサイズの倍数）
+            block_count: リングのブロック数
+            frame_size: リングのフレームサイズ
+            block_timeout_ms: ブロックが埋まらなくてもユーザーに渡すまでの時間
+            poll_interval: 停止判定の間隔（秒）
+        """
+        self.interface = interface
+        self.use_ring = use_ring
+        self.block_size = block_size
+        self.block_count = block_count
+        self.frame_size = frame_size
+        self.block_timeout_ms = block_timeout_ms
+        self.poll_interval = poll_interval
+
+    @classmethod
+    def available(cls) -> bool:
+        if not sys.platform.startswith('linux') or not hasattr(socket, 'AF_PACKET'):
+            return False
+        # CAP_NET_RAWがなければソケットを開けない
+        try:
+            socket.socket(socket.AF_PACKET, socket.SOCK_DGRAM, socket.htons(ETH_P_ALL)).close()
+        except OSError:
+            return False
+        return True
+
+    def _open_socket(self, capture_filter: str) -> socket.socket:
+        """ソケットを開いてBPFフィルタを設定"""
+        sock = socket.socket(socket.AF_PACKET, socket.SOCK_DGRAM, socket.htons(ETH_P_ALL))
+        try:
+            if self.interface:
+                sock.bind((self.interface, ETH_P_ALL))
+            program = compile_bpf(capture_filter, DLT_RAW_LINUX) if capture_filter else None
+            if program is not None:
+                attach_bpf(sock, program)
+            elif capture_filter:
+                logger.warning("libpcap is not available. Capturing without a kernel BPF filter.")
+        except Exception:
+            sock.close()
+            raise
+        return sock
+
+    def run(self, capture_filter: str, handler: PacketHandler, should_stop: Callable[[], bool]):
+        sock = self._open_socket(capture_filter)
+        try:
+            if self.use_ring:
+                try:
+                    ring = self._setup_ring(sock)
+                except OSError as e:
+                    logger.warning(f"TPACKET_V3 ring is not available, falling back to recvfrom: {e}")
+                else:
+                    try:
+                        self._run_ring(sock, ring, handler, should_stop)
+                    finally:
+                        ring.close()
+                    return
+            self._run_recv(sock, handler, should_stop)
+        finally:
+            sock.close()
+
+    def _run_recv(self, sock: socket.socket, handler: PacketHandler, should_stop: Callable[[], bool]):
+        """recvfromで1フレームずつ受信"""
+        sock.settimeout(self.poll_interval)
+        while not should_stop():
+            try:
+                frame = sock.recv(65535)
+            except socket.timeout:
+                continue
+            handler(time.time(), parse_frame(LINKTYPE_RAW, frame))
+
+    def _setup_ring(self, sock: socket.socket) -> mmap.mmap:
+        """TPACKET_V3のRXリングを設定してmmapする"""
+        sock.setsockopt(SOL_PACKET, PACKET_VERSION, TPACKET_V3)
+        frame_count = self.block_size // self.frame_size * self.block_count
+        request = _TPACKET_REQ3.pack(
+            self.block_size, self.block_count, self.frame_size, frame_count,
+            self.block_timeout_ms, 0, 0
+        )
+        sock.setsockopt(SOL_PACKET, PACKET_RX_RING, request)
+        return mmap.mmap(sock.fileno(), self.block_size * self.block_count,
+                         mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+
+    def _run_ring(
+        self,
+        sock: socket.socket,
+        ring: mmap.mmap,
+        handler: PacketHandler,
+        should_stop: Callable[[], bool]
+    ):
+        """リングをブロック単位で読み出す"""
+        poller = select.poll()
+        poller.register(sock.fileno(), select.POLLIN | select.POLLERR)
+        timeout_ms = int(self.poll_interval * 1000)
+        block = 0
+
+        while not should_stop():
+            offset = block * self.block_size
+            status = _BLOCK_HEADER.unpack_from(ring, offset + _BLOCK_HEADER_OFFSET)[0]
+            if not status & TP_STATUS_USER:
+                poller.poll(timeout_ms)
+                continue
+
+            for timestamp, frame in iter_tpacket_v3_block(ring, offset):
+                handler(timestamp, parse_frame(LINKTYPE_RAW, frame))
+
+            # ブロックをカーネルに返す
+            struct.pack_into('I', ring, offset + _BLOCK_HEADER_OFFSET, TP_STATUS_KERNEL)
+            block = (block + 1) % self.block_count
+
+
+def iter_tpacket_v3_block(ring, offset: int) -> Iterator[Tuple[float, bytes]]:
+    """
+    TPACKET_V3の1ブロックに含まれるフレームを取り出す
+
+    フレームはブロックをカーネルに返す前にbytesへコピーします。
+
+    Args:
+        ring: mmapしたリング（またはそれと同じレイアウトのバッファ）
+        offset: ブロックの開始位置
+
+    Yields:
+        (timestamp, フレーム)
+    """
+    _status, num_packets, first = _BLOCK_HEADER.unpack_from(ring, offset + _BLOCK_HEADER_OFFSET)
+    position = offset + first
+    for _ in range(num_packets):
+        next_offset, sec, nsec, snaplen, _length, _status, _mac, net = \
+            _TPACKET3_HEADER.unpack_from(ring, position)
+        start = position + net
+        yield sec + nsec * 1e-9, ring[start:start + snaplen]
+        position += next_offset
+
+
+class PcapReplayBackend(CaptureBackend):
+    """
+    キャプチャファイルを再生するバックエンド
+
+    ライブキャプチャと同じ キャプチャ → キュー → デコード → コールバック の経路に
+    パケットを流します。フィルタ変更で ``run`` が再実行された場合は続きから再生し、
+    ファイルの末尾に達すると ``run`` から戻ります。
+    """
+
+    name = "replay"
+
+    def __init__(self, path: str, speed: Optional[float] = 1.0):
+        """
+        Args:
+            path: PCAP/PCAPNGファイルのパス
+            speed: 再生速度（1.0で記録時のタイミング、N でN倍速、
+                None または 0 で待ち時間なし）
+        """
+        self.path = path
+        self.speed = speed
+        self._frames = None
+        self._first_timestamp: Optional[float] = None
+        self._started_at: Optional[float] = None
+        self._finished_at: Optional[float] = None
+        self.packets = 0
+        self.bytes = 0
+
+    @classmethod
+    def available(cls) -> bool:
+        return True
+
+    def run(self, capture_filter: str, handler: PacketHandler, should_stop: Callable[[], bool]):
+        if self._frames is None:
+            self._frames = iter_frames(self.path)
+            self._started_at = time.perf_counter()
+            logger.info(f"Replaying {self.path} at {self._speed_label()}")
+
+        paced = bool(self.speed)
+        for timestamp, linktype, frame in self._frames:
+            if paced:
+                if self._first_timestamp is None:
+                    self._first_timestamp = timestamp
+                delay = (
+                    self._started_at + (timestamp - self._first_timestamp) / self.speed
+                    - time.perf_counter()
+                )
+                if delay > 0:
+                    time.sleep(delay)
+
+            self.packets += 1
+            self.bytes += len(frame)
+            handler(timestamp, parse_frame(linktype, frame))
+
+            if should_stop():
+                return
+
+        if self._finished_at is None:
+            self._finished_at = time.perf_counter()
+            stats = self.get_stats()
+            logger.info(
+                f"Replay finished: {stats['packets']} packets in {stats['seconds']:.2f}s "
+                f"({stats['packets_per_second']:.0f} packets/s)"
+            )
+
+    def _speed_label(self) -> str:
+        return f"{self.speed}x speed" if self.speed else "maximum speed"
+
+    @property
+    def finished(self) -> bool:
+        """ファイルの末尾まで再生したか"""
+        return self._finished_at is not None
+
+    def get_stats(self) -> dict:
+        end = self._finished_at or time.perf_counter()
+        seconds = end - self._started_at if self._started_at is not None else 0.0
+        return {
+            "path": self.path,
+            "speed": self.speed,
+            "packets": self.packets,
+            "bytes": self.bytes,
+            "seconds": seconds,
+            "packets_per_second": self.packets / seconds if seconds > 0 else 0.0,
+            "finished": self.finished,
+        }
+
+
+class _BpfInsn(ctypes.Structure):
+    _fields_ = [
+        ("code", ctypes.c_ushort),
+        ("jt", ctypes.c_ubyte),
+        ("jf", ctypes.c_ubyte),
+        ("k", ctypes.c_uint32),
+    ]
+
+
+class _BpfProgram(ctypes.Structure):
+    _fields_ = [
+        ("bf_len", ctypes.c_uint),
+        ("bf_insns", ctypes.POINTER(_BpfInsn)),
+    ]
+
+
+def compile_bpf(capture_filter: str, linktype: int, snaplen: int = 65535) -> Optional[List[Tuple[int, int, int, int]]]:
+    """
+    libpcapでBPFフィルタ式をコンパイル
+
+    Args:
+        capture_filter: BPFフィルタ式
+        linktype: フィルタを適用するフレームのDLT
+        snaplen: スナップ長
+
+    Returns:
+        (code, jt, jf, k) のリスト。libpcapがない場合はNone
+    """
+    library = ctypes.util.find_library('pcap')
+    if library is None:
+        return None
+    pcap = ctypes.CDLL(library)
+    pcap.pcap_open_dead.restype = ctypes.c_void_p
+    pcap.pcap_open_dead.argtypes = [ctypes.c_int, ctypes.c_int]
+    pcap.pcap_compile.argtypes = [
+        ctypes.c_void_p, ctypes.POINTER(_BpfProgram), ctypes.c_char_p, ctypes.c_int, ctypes.c_uint32
+    ]
+    pcap.pcap_geterr.restype = ctypes.c_char_p
+    pcap.pcap_geterr.argtypes = [ctypes.c_void_p]
+    pcap.pcap_freecode.argtypes = [ctypes.POINTER(_BpfProgram)]
+    pcap.pcap_close.argtypes = [ctypes.c_void_p]
+
+    handle = pcap.pcap_open_dead(linktype, snaplen)
+    program = _BpfProgram()
+    try:
+        if pcap.pcap_compile(handle, ctypes.byref(program), capture_filter.encode(), 1, PCAP_NETMASK_UNKNOWN) != 0:
+            raise ValueError(f"Invalid capture filter '{capture_filter}': {pcap.pcap_geterr(handle).decode()}")
+        instructions = [
+            (insn.code, insn.jt, insn.jf, insn.k)
+            for insn in program.bf_insns[:program.bf_len]
+        ]
+        pcap.pcap_freecode(ctypes.byref(program))
+        return instructions
+    finally:
+        pcap.pcap_close(handle)
+
+
+def attach_bpf(sock: socket.socket, program: List[Tuple[int, int, int, int]]):
+    """
+    コンパイル済みのBPFプログラムをソケットに設定
+
+    Args:
+        sock: AF_PACKETソケット
+        program: compile_bpf の戻り値
+    """
+    buffer = ctypes.create_string_buffer(b''.join(_BPF_INSN.pack(*insn) for insn in program))
+    sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER,
+                    _SOCK_FPROG.pack(len(program), ctypes.addressof(buffer)))
+
+
+# 自動選択時の優先順
+BACKENDS = {
+    AfPacketBackend.name: AfPacketBackend,
+    ScapyBackend.name: ScapyBackend,
+}
+
+
+def create_backend(name: str = "auto", interface: Optional[str] = None) -> Optional[CaptureBackend]:
+    """
+    キャプチャバックエンドを生成
+
+    Args:
+        name: バックエンド名（"auto" の場合は利用できるものを優先順に選ぶ）
+        interface: ネットワークインターフェース名
+
+    Returns:
+        CaptureBackend。利用できるバックエンドがない場合はNone
+    """
+    if name != "auto":
+        if name not in BACKENDS:
+            raise ValueError(f"Unknown capture backend: {name}")
+        candidates = [BACKENDS[name]]
+    else:
+        candidates = list(BACKENDS.values())
+
+    for backend_class in candidates:
+        if backend_class.available():
+            logger.info(f"Using capture backend: {backend_class.name}")
+            return backend_class(interface=interface)
+    return None
@@ -5,57 +5,92 @@ Trading Center Packet Decoder
 参考: https://github.com/JordieB/bpsr_labs/blob/main/src/bpsr_labs/packet_decoder/decoder/trading_center_decode_v2.py
 """
 import struct
-from typing import List, Optional
+import time
+from functools import partial
+from typing import Iterable, Iterator, List, Optional, Tuple, Union
 from datetime import datetime
 import logging
 
-try:
-    from scapy.all import rdpcap, Packet
-    SCAPY_AVAILABLE = True
-except ImportError:
-    SCAPY_AVAILABLE = False
-
-from .packet_types import TradingPacket, ItemListing, MarketSnapshot
+from .packet_types import TradingPacket, ItemListing, ListingColumns, MarketSnapshot
+from .pcap_reader import PcapRecord, iter_pcap
+from .reassembly import TcpReassembler
+from .frames import FrameParser, MessageRouter, iter_trading_payloads
+from .parallel import PcapShard, iter_shard, run_sharded, throughput_stats
+from .batch import ListingBatch, decode_listing_batch
+from .signatures import TRADING_CENTER_MAGIC, SignatureMatch, signatures
+from .schema import ListingSchema, SchemaDecoder
 
 logger = logging.getLogger(__name__)
 
+# デコード対象のバッファ（コピーせずに扱える型）
+Buffer = Union[bytes, bytearray, memoryview]
+
+# リスティングの固定長ヘッダー: listing_id u64, item_id u32, quantity u32, price u64, name_length u16
+_LISTING_HEADER = struct.Struct('<QIIQH')
+_LISTING_COUNT = struct.Struct('<I')
+
 
 class TradingCenterDecoder:
     """取引所パケットのデコーダー"""
     
     # 取引所パケットのマジックバイト
-    TRADING_CENTER_MAGIC = bytes([0x00, 0x63, 0x33, 0x53, 0x42, 0x00])
+    TRADING_CENTER_MAGIC = TRADING_CENTER_MAGIC
+    # このデコーダーが扱うシグネチャ（共有レジストリで1パス検索する）
+    SIGNATURE_NAMES = frozenset({"trading_center"})
     
-    def __init__(self, pcap_file: Optional[str] = None):
+    def __init__(
+        self,
+        pcap_file: Optional[str] = None,
+        reassemble: bool = True,
+        schema: Optional[ListingSchema] = None,
+        raw_retention_bytes: int = 0
+    ):
         """
         Args:
             pcap_file: Pcapファイルのパス
+            reassemble: TCPストリームを再構築してからデコードするか
+            schema: リスティングのProtobufスキーマ（省略時は固定長レイアウトでデコード）
+            raw_retention_bytes: TradingPacket.raw_data として保持する元ペイロードの合計上限
+                （バイト。0で保持しない、Noneで無制限）
         """
         self.pcap_file = pcap_file
+        self.reassemble = reassemble
+        self.schema = schema
+        self.schema_decoder = SchemaDecoder(schema) if schema is not None else None
+        self.raw_retention_bytes = raw_retention_bytes
+        # 元ペイロードを保持できる残りバイト数
+        self._raw_budget = raw_retention_bytes
         self.packets: List[TradingPacket] = []
-        
-        if not SCAPY_AVAILABLE:
-            logger.warning("Scapy is not available. Packet capture functionality is limited.")
+        self.last_run_stats: Optional[dict] = None
     
-    def load_pcap(self, pcap_file: str) -> List[Packet]:
+    def load_pcap(self, pcap_file: str) -> Iterator[PcapRecord]:
         """
         Pcapファイルを読み込む
         
+        ファイル全体をメモリに展開せず、TCPペイロードを1件ずつ返します。
+        
         Args:
-            pcap_file: Pcapファイルのパス
+            pcap_file: Pcap/Pcapngファイルのパス
             
         Returns:
-            パケットのリスト
+            PcapRecord (timestamp, flow, payload) のイテレータ
         """
-        if not SCAPY_AVAILABLE:
-            raise ImportError("Scapy is required for PCAP file reading")
-        
         logger.info(f"Loading PCAP file: {pcap_file}")
-        packets = rdpcap(pcap_file)
-        logger.info(f"Loaded {len(packets)} packets")
-        return packets
+        return iter_pcap(pcap_file)
+    
+    def find_magic(self, data: Buffer) -> Optional[SignatureMatch]:
+        """
+        マジックバイトの位置を探す
+        
+        Args:
+            data: パケットデータ
+            
+        Returns:
+            SignatureMatch。見つからない場合はNone
+        """
+        return signatures.search(data, self.SIGNATURE_NAMES)
     
-    def is_trading_packet(self, data: bytes) -> bool:
+    def is_trading_packet(self, data: Buffer) -> bool:
         """
         取引所パケットかどうかを判定
         
@@ -65,15 +100,23 @@ class TradingCenterDecoder:
         Returns:
             取引所パケットならTrue
         """
-        return self.TRADING_CENTER_MAGIC in data
+        return self.find_magic(data) is not None
     
-    def decode_item_listing(self, data: bytes, offset: int) -> Optional[ItemListing]:
+    def decode_item_listing(
+        self,
+        data: Buffer,
+        offset: int,
+        timestamp: Optional[datetime] = None
+    ) -> Optional[ItemListing]:
         """
         アイテムリスティング情報をデコード
         
+        フィールドごとにスライスを作らず、``unpack_from`` でバッファから直接読み出します。
+        
         Args:
-            data: パケットデータ
+            data: パケットデータ（bytes / memoryview / mmap）
             offset: デコード開始位置
+            timestamp: キャプチャ時刻（省略時は現在時刻）
             
         Returns:
             ItemListingオブジェクト
@@ -81,41 +124,16 @@ class TradingCenterDecoder:
         try:
             # 基本構造の解析（実際のパケット構造に応じて調整が必要）
             # この実装は仮のものです
-            
-            # リスティングID (8 bytes, little endian)
-            if offset + 8 > len(data):
-                return None
-            listing_id = struct.unpack('<Q', data[offset:offset+8])[0]
-            offset += 8
-            
-            # アイテムID (4 bytes, little endian)
-            if offset + 4 > len(data):
-                return None
-            item_id = struct.unpack('<I', data[offset:offset+4])[0]
-            offset += 4
-            
-            # 数量 (4 bytes, little endian)
-            if offset + 4 > len(data):
+            # リスティングID (u64) / アイテムID (u32) / 数量 (u32) / 価格 (u64) / 名前の長さ (u16)
+            if offset + _LISTING_HEADER.size > len(data):
                 return None
-            quantity = struct.unpack('<I', data[offset:offset+4])[0]
-            offset += 4
+            listing_id, item_id, quantity, price, name_length = _LISTING_HEADER.unpack_from(data, offset)
+            offset += _LISTING_HEADER.size
             
-            # 価格 (8 bytes, little endian)
-            if offset + 8 > len(data):
-                return None
-            price = struct.unpack('<Q', data[offset:offset+8])[0]
-            offset += 8
-            
-            # アイテム名の長さ (2 bytes)
-            if offset + 2 > len(data):
-                return None
-            name_length = struct.unpack('<H', data[offset:offset+2])[0]
-            offset += 2
-            
-            # アイテム名 (UTF-8)
+            # アイテム名 (UTF-8) — 保持する名前の部分だけをデコードする
             if offset + name_length > len(data):
                 return None
-            item_name = data[offset:offset+name_length].decode('utf-8', errors='ignore')
+            item_name = str(data[offset:offset+name_length], 'utf-8', 'ignore')
             
             return ItemListing(
                 listing_id=str(listing_id),
@@ -123,41 +141,73 @@ class TradingCenterDecoder:
                 item_name=item_name,
                 quantity=quantity,
                 price=price,
-                timestamp=datetime.now()
+                timestamp=timestamp or datetime.now()
             )
             
         except Exception as e:
             logger.error(f"Error decoding item listing: {e}")
             return None
     
-    def decode_trading_packet(self, packet_data: bytes) -> TradingPacket:
+    def _retain_raw(self, packet_data: Buffer) -> Optional[bytes]:
+        """
+        上限の範囲内で元ペイロードを保持する
+        
+        Returns:
+            保持する場合はbytes（mmap等の寿命に依存しないようコピーする）、しない場合はNone
+        """
+        if self._raw_budget is not None:
+            if len(packet_data) > self._raw_budget:
+                return None
+            self._raw_budget -= len(packet_data)
+        return packet_data if isinstance(packet_data, bytes) else bytes(packet_data)
+    
+    def decode_trading_packet(
+        self,
+        packet_data: Buffer,
+        timestamp: Optional[datetime] = None
+    ) -> TradingPacket:
         """
         取引所パケットをデコード
         
         Args:
-            packet_data: パケットデータ
+            packet_data: パケットデータ（bytes / memoryview / mmap）
+            timestamp: キャプチャ時刻（省略時は現在時刻）
             
         Returns:
             TradingPacketオブジェクト
         """
+        if timestamp is None:
+            timestamp = datetime.now()
+        
         trading_packet = TradingPacket(
             packet_type="trading_center",
-            raw_data=packet_data,
-            timestamp=datetime.now()
+            raw_data=self._retain_raw(packet_data),
+            timestamp=timestamp
         )
         
         # マジックバイトの位置を探す
-        magic_pos = packet_data.find(self.TRADING_CENTER_MAGIC)
-        if magic_pos == -1:
+        match = self.find_magic(packet_data)
+        if match is None:
             logger.warning("Trading center magic bytes not found")
             return trading_packet
         
         # マジックバイトの後からデータを解析
-        data_start = magic_pos + len(self.TRADING_CENTER_MAGIC)
+        data_start = match.end
+        
+        # スキーマが指定されている場合はProtobufメッセージとしてデコード
+        if self.schema_decoder is not None:
+            listings = self.schema_decoder.decode_listings(packet_data, data_start, timestamp)
+            trading_packet.listings = listings
+            trading_packet.decoded_data = {
+                "num_listings": len(listings),
+                "total_value": sum(l.price * l.quantity for l in listings),
+                "schema": self.schema.name,
+            }
+            return trading_packet
         
         # リスティング数を取得（仮定: 4バイト）
         if data_start + 4 <= len(packet_data):
-            num_listings = struct.unpack('<I', packet_data[data_start:data_start+4])[0]
+            num_listings = _LISTING_COUNT.unpack_from(packet_data, data_start)[0]
             data_start += 4
             
             listings = []
@@ -165,7 +215,7 @@ class TradingCenterDecoder:
             
             # 各リスティングをデコード
             for i in range(min(num_listings, 100)):  # 最大100件まで
-                listing = self.decode_item_listing(packet_data, offset)
+                listing = self.decode_item_listing(packet_data, offset, timestamp)
                 if listing:
                     listings.append(listing)
                     # 次のリスティングへ（サイズは推定）
@@ -181,12 +231,104 @@ class TradingCenterDecoder:
         
         return trading_packet
     
-    def decode_pcap_file(self, pcap_file: Optional[str] = None) -> List[TradingPacket]:
+    def decode_listing_batch(
+        self,
+        packet_data: Buffer,
+        timestamp: Optional[datetime] = None
+    ) -> Optional[ListingBatch]:
+        """
+        取引所パケットのリスティングを列指向で一括デコード
+        
+        ItemListingを1件ずつ生成せず、NumPy配列のまま返します。
+        市場オープン時のバーストなど、件数が多い場合に使用します。
+        
+        Args:
+            packet_data: パケットデータ
+            timestamp: キャプチャ時刻（省略時は現在時刻）
+            
+        Returns:
+            ListingBatch。マジックバイトがない場合やNumPyがない場合はNone
+        """
+        match = self.find_magic(packet_data)
+        if match is None:
+            return None
+        
+        data_start = match.end
+        if data_start + 4 > len(packet_data):
+            return None
+        
+        num_listings = _LISTING_COUNT.unpack_from(packet_data, data_start)[0]
+        return decode_listing_batch(packet_data, data_start + 4, num_listings, timestamp)
+    
+    def iter_pcap_file(self, pcap_file: Optional[str] = None) -> Iterator[TradingPacket]:
+        """
+        Pcapファイルから取引所パケットを順次デコード
+        
+        パケットを1件ずつ読み込んでデコードするため、
+        ファイルサイズに関係なくメモリ使用量は一定です。
+        
+        Args:
+            pcap_file: Pcapファイルのパス（省略時はコンストラクタで指定したものを使用）
+            
+        Yields:
+            デコードされたTradingPacket
+        """
+        if pcap_file is None:
+            pcap_file = self.pcap_file
+        
+        if pcap_file is None:
+            raise ValueError("PCAP file path not specified")
+        
+        return self.decode_records(self.load_pcap(pcap_file))
+    
+    def decode_records(self, records: Iterable[PcapRecord]) -> Iterator[TradingPacket]:
+        """
+        PcapRecordの列から取引所パケットを順次デコード
+        
+        Args:
+            records: PcapRecordのイテラブル
+            
+        Yields:
+            デコードされたTradingPacket
+        """
+        reassembler = TcpReassembler() if self.reassemble else None
+        # 取引所のメッセージだけをデコードする（圧縮されたメッセージは展開してから判定）
+        parser = FrameParser()
+        router = MessageRouter(signature_names=self.SIGNATURE_NAMES)
+        timestamp = None
+        
+        for record in records:
+            timestamp = datetime.fromtimestamp(record.timestamp)
+            
+            if reassembler is None:
+                # FIN/RSTだけのセグメントは再構築しない場合は不要
+                frames = [record.payload] if record.payload else []
+            else:
+                frames = reassembler.feed(
+                    record.flow, record.seq, record.payload,
+                    record.timestamp, record.flags
+                )
+            
+            for data in iter_trading_payloads(frames, parser, router):
+                yield self.decode_trading_packet(data, timestamp=timestamp)
+        
+        # ファイル末尾で未完成のまま残ったデータも確認する（時刻はそのフローの最後のレコード）
+        if reassembler is not None:
+            for _flow, frame, last_seen in reassembler.flush():
+                for data in iter_trading_payloads([frame], parser, router):
+                    yield self.decode_trading_packet(data, timestamp=datetime.fromtimestamp(last_seen))
+    
+    def decode_pcap_file(
+        self,
+        pcap_file: Optional[str] = None,
+        workers: int = 1
+    ) -> List[TradingPacket]:
         """
         Pcapファイルから取引所パケットをデコード
         
         Args:
             pcap_file: Pcapファイルのパス（省略時はコンストラクタで指定したものを使用）
+            workers: 並列デコードのプロセス数（2以上でマルチプロセス）
             
         Returns:
             デコードされたパケットのリスト
@@ -197,38 +339,55 @@ class TradingCenterDecoder:
         if pcap_file is None:
             raise ValueError("PCAP file path not specified")
         
-        packets = self.load_pcap(pcap_file)
-        trading_packets = []
-        
-        for packet in packets:
-            # TCPペイロードを取得
-            if packet.haslayer('Raw'):
-                payload = bytes(packet['Raw'].load)
-                
-                if self.is_trading_packet(payload):
-                    trading_packet = self.decode_trading_packet(payload)
-                    trading_packets.append(trading_packet)
+        if workers > 1:
+            trading_packets, self.last_run_stats = run_sharded(
+                pcap_file,
+                partial(
+                    _decode_shard,
+                    reassemble=self.reassemble,
+                    schema=self.schema,
+                    raw_retention_bytes=self.raw_retention_bytes
+                ),
+                workers,
+                by_flow=self.reassemble
+            )
+            # 各シャードは上限いっぱいまで保持するので、マージ後にキャプチャ順で上限を適用し直す
+            if self.raw_retention_bytes:
+                for packet in trading_packets:
+                    if packet.raw_data is not None:
+                        packet.raw_data = self._retain_raw(packet.raw_data)
+        else:
+            start_time = time.perf_counter()
+            trading_packets = list(self.iter_pcap_file(pcap_file))
+            self.last_run_stats = throughput_stats(
+                pcap_file, time.perf_counter() - start_time, workers
+            )
         
         self.packets = trading_packets
         logger.info(f"Decoded {len(trading_packets)} trading packets")
         return trading_packets
     
-    def create_market_snapshot(self) -> MarketSnapshot:
+    def create_market_snapshot(self, packets: Optional[Iterable[TradingPacket]] = None) -> MarketSnapshot:
         """
-        現在のパケットから市場スナップショットを作成
+        パケットから列指向の市場スナップショットを作成
         
+        ``iter_pcap_file()`` を直接渡せば、パケットを保持せずにスナップショットを作れます。
+        
+        Args:
+            packets: TradingPacketのイテラブル（省略時は decode_pcap_file の結果）
+            
         Returns:
-            MarketSnapshotオブジェクト
+            MarketSnapshotオブジェクト（listings は ListingColumns）
         """
-        all_listings = []
-        for packet in self.packets:
+        columns = ListingColumns()
+        for packet in self.packets if packets is None else packets:
             if packet.listings:
-                all_listings.extend(packet.listings)
+                columns.extend(packet.listings)
         
         return MarketSnapshot(
             timestamp=datetime.now(),
-            listings=all_listings,
-            total_items=len(all_listings)
+            listings=columns,
+            total_items=len(columns)
         )
     
     def decode_from_bytes(self, data: bytes) -> Optional[TradingPacket]:
@@ -244,3 +403,20 @@ class TradingCenterDecoder:
         if self.is_trading_packet(data):
             return self.decode_trading_packet(data)
         return None
+
+
+def _decode_shard(
+    pcap_file: str,
+    shard: PcapShard,
+    reassemble: bool = True,
+    schema: Optional[ListingSchema] = None,
+    raw_retention_bytes: int = 0
+) -> List[Tuple[datetime, TradingPacket]]:
+    """並列デコード用ワーカー（子プロセスで実行）"""
+    decoder = TradingCenterDecoder(
+        reassemble=reassemble, schema=schema, raw_retention_bytes=raw_retention_bytes
+    )
+    return [
+        (packet.timestamp, packet)
+        for packet in decoder.decode_records(iter_shard(pcap_file, shard))
+    ]
@@ -0,0 +1,140 @@
+"""
+Payload dedupe cache
+ペイロードの重複排除キャッシュ
+
+プレイヤーは取引所の同じページを何度も更新するため、まったく同じペイロードが
+繰り返しキャプチャされます。マジックバイト以降の領域のハッシュをキーにデコード結果を
+保持し、完全に一致する再送はデコードと保存をスキップします。
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from .packet_types import ItemListing
+
+# キーのダイジェスト長（バイト）
+DIGEST_SIZE = 16
+
+
+class _CacheEntry:
+    """キャッシュのエントリ"""
+    __slots__ = ("listings", "stored_at", "last_seen", "hits")
+
+    def __init__(self, listings: List[ItemListing], now: float):
+        self.listings = listings
+        self.stored_at = now
+        self.last_seen = now
+        self.hits = 0
+
+
+class PayloadCache:
+    """
+    ペイロードのハッシュ -> デコード結果 のLRUキャッシュ（TTL付き）
+
+    TTLはデコードした時点から数えます。期限が切れたエントリは次の参照でミスになり、
+    同じページでも一定間隔で再デコード・再保存されます。
+    """
+
+    def __init__(self, max_entries: int = 4096, ttl: float = 60.0, clock=time.monotonic):
+        """
+        Args:
+            max_entries: 保持する最大エントリ数
+            ttl: エントリの有効期間（秒）
+            clock: 時刻関数（テスト用）
+        """
+        if max_entries <= 0:
+            raise ValueError("max_entries must be positive")
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._clock = clock
+        self._entries: "OrderedDict[bytes, _CacheEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "expired": 0,
+            "evicted": 0,
+        }
+
+    @staticmethod
+    def key(data, offset: int = 0) -> bytes:
+        """
+        ペイロードのキーを求める
+
+        Args:
+            data: フレーム（bytes / memoryview）
+            offset: マジックバイト直後の位置（ここから末尾までをハッシュする）
+
+        Returns:
+            ダイジェスト
+        """
+        return hashlib.blake2b(memoryview(data)[offset:], digest_size=DIGEST_SIZE).digest()
+
+    def get(self, key: bytes) -> Optional[List[ItemListing]]:
+        """
+        キャッシュを参照し、ヒットした場合は最終確認時刻を更新
+
+        Args:
+            key: ``key`` で求めたダイジェスト
+
+        Returns:
+            キャッシュしたリスティング。ミスまたは期限切れの場合はNone
+        """
+        now = self._clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+            if now - entry.stored_at > self.ttl:
+                del self._entries[key]
+                self.stats["expired"] += 1
+                self.stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            entry.last_seen = now
+            entry.hits += 1
+            self.stats["hits"] += 1
+            return entry.listings
+
+    def put(self, key: bytes, listings: List[ItemListing]):
+        """
+        デコード結果を登録
+
+        Args:
+            key: ダイジェスト
+            listings: デコードしたリスティング（空でもよい）
+        """
+        now = self._clock()
+        with self._lock:
+            self._entries[key] = _CacheEntry(listings, now)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats["evicted"] += 1
+
+    def clear(self):
+        """すべてのエントリを削除"""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get_stats(self) -> Dict:
+        """
+        統計情報を取得
+
+        Returns:
+            ヒット・ミス・期限切れ・追い出しの件数とヒット率
+        """
+        with self._lock:
+            stats = dict(self.stats)
+            stats["entries"] = len(self._entries)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        stats["max_entries"] = self.max_entries
+        stats["ttl"] = self.ttl
+        return stats
@@ -0,0 +1,349 @@
+"""
+Game protocol frame parser
+ゲームプロトコルのフレームパーサー
+
+再構築したストリームは ``split_length_prefixed`` で長さヘッダーごとのフレームに分かれています。
+このモジュールはフレームヘッダー（長さ u32 + パケット種別 u16、0x8000はzstd圧縮）を解析し、
+FrameDown に入れ子になったフレームを展開して、メソッドIDごとのメッセージに振り分けます。
+取引所のメッセージだけをデコーダーに渡すことで、全バイトに対するマジックバイト検索を省きます。
+
+フレームの構造:
+    u32 BE  フレーム長（ヘッダーを含む）
+    u16 BE  パケット種別（下位15ビット: メッセージ種別、0x8000: ペイロードがzstd圧縮）
+    Notify:    u64 service_uuid, u32 stub_id, u32 method_id, ペイロード
+    Return:    u32 stub_id, ペイロード
+    FrameDown: u32 server_sequence, 入れ子のフレーム列
+"""
+import struct
+import logging
+from typing import Dict, Iterable, Iterator, NamedTuple, Optional
+
+from .reassembly import FRAME_MIN_SIZE, split_length_prefixed
+from .signatures import signatures
+
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# メッセージ種別
+MSG_NOTIFY = 2
+MSG_RETURN = 3
+MSG_FRAME_DOWN = 6
+MSG_RAW = None  # フレームとして解析できなかったデータ（非同期のチャンク）
+
+COMPRESSED_FLAG = 0x8000
+MSG_TYPE_MASK = 0x7FFF
+
+FRAME_HEADER = struct.Struct('>IH')
+NOTIFY_HEADER = struct.Struct('>QII')
+RETURN_HEADER = struct.Struct('>I')
+FRAME_DOWN_HEADER = struct.Struct('>I')
+
+# FrameDownの入れ子の最大深さ
+MAX_NESTING = 4
+# 展開後の最大サイズ
+DEFAULT_MAX_DECOMPRESSED = 8 << 20
+
+
+class GameMessage(NamedTuple):
+    """フレームから取り出したメッセージ"""
+    msg_type: Optional[int]      # MSG_NOTIFY / MSG_RETURN / ... （MSG_RAW は未解析のデータ）
+    method_id: Optional[int]     # Notify のメソッドID
+    stub_id: Optional[int]
+    payload: bytes               # 展開済みのペイロード
+    frame: bytes                 # メッセージを含む（入れ子の場合は内側の）フレーム
+    compressed: bool = False
+
+    @property
+    def data(self) -> bytes:
+        """デコーダーに渡すデータ（非圧縮ならフレームそのまま、圧縮なら展開したペイロード）"""
+        return self.payload if self.compressed else self.frame
+
+
+class FrameParser:
+    """
+    フレームを解析してメッセージに分解
+
+    zstdの展開コンテキストはインスタンスごとに1つ作って使い回します
+    （スレッドごとに別のインスタンスを使ってください）。
+    """
+
+    def __init__(self, max_decompressed: int = DEFAULT_MAX_DECOMPRESSED):
+        """
+        Args:
+            max_decompressed: 1メッセージの展開後の最大サイズ（バイト）
+        """
+        self.max_decompressed = max_decompressed
+        self._dctx = zstandard.ZstdDecompressor() if ZSTD_AVAILABLE else None
+        self.stats = {
+            "frames": 0,
+            "messages": 0,
+            "raw_chunks": 0,
+            "compressed": 0,
+            "undecompressable": 0,
+            "oversized": 0,
+            "malformed": 0,
+        }
+
+    def _decompress(self, data) -> Optional[bytes]:
+        """zstdペイロードを展開（展開できない場合はNone）"""
+        self.stats["compressed"] += 1
+        if self._dctx is None:
+            self.stats["undecompressable"] += 1
+            return None
+        data = bytes(data)
+        try:
+            content_size = zstandard.frame_content_size(data)
+            if content_size > self.max_decompressed:
+                return self._oversized()
+            if content_size >= 0:
+                return self._dctx.decompress(data)
+            # フレームヘッダーに展開後サイズがない場合はストリームとして展開する。
+            # 上限+1バイトまでしか読まないので、展開爆弾でもメモリを使い切らない
+            chunks = []
+            remaining = self.max_decompressed + 1
+            with self._dctx.stream_reader(data) as reader:
+                while remaining > 0:
+                    chunk = reader.read(remaining)
+                    if not chunk:
+                        break
+                    chunks.append(chunk)
+                    remaining -= len(chunk)
+        except zstandard.ZstdError:
+            self.stats["undecompressable"] += 1
+            return None
+        if remaining <= 0:
+            return self._oversized()
+        return b"".join(chunks)
+
+    def _oversized(self) -> None:
+        self.stats["oversized"] += 1
+        logger.warning(f"Dropped zstd payload larger than {self.max_decompressed} bytes")
+        return None
+
+    def parse(self, frame: bytes) -> Iterator[GameMessage]:
+        """
+        フレーム（またはsplit_length_prefixedが返した非同期のチャンク）をメッセージに分解
+
+        Args:
+            frame: 再構築済みのフレーム
+
+        Yields:
+            GameMessage
+        """
+        self.stats["frames"] += 1
+        yield from self._parse(frame, 0)
+
+    def _parse(self, frame, depth: int) -> Iterator[GameMessage]:
+        if len(frame) < FRAME_MIN_SIZE or FRAME_HEADER.unpack_from(frame, 0)[0] != len(frame):
+            # フレームとして解析できない（途中から参加したストリーム等）
+            self.stats["raw_chunks"] += 1
+            frame = bytes(frame)
+            yield GameMessage(MSG_RAW, None, None, frame, frame)
+            return
+
+        packet_type = FRAME_HEADER.unpack_from(frame, 0)[1]
+        compressed = bool(packet_type & COMPRESSED_FLAG)
+        msg_type = packet_type & MSG_TYPE_MASK
+        offset = FRAME_HEADER.size
+
+        try:
+            if msg_type == MSG_NOTIFY:
+                _service_uuid, stub_id, method_id = NOTIFY_HEADER.unpack_from(frame, offset)
+                body = frame[offset + NOTIFY_HEADER.size:]
+            elif msg_type == MSG_RETURN:
+                stub_id, = RETURN_HEADER.unpack_from(frame, offset)
+                method_id = None
+                body = frame[offset + RETURN_HEADER.size:]
+            elif msg_type == MSG_FRAME_DOWN:
+                body = frame[offset + FRAME_DOWN_HEADER.size:]
+                if compressed:
+                    body = self._decompress(body)
+                    if body is None:
+                        return
+                if depth >= MAX_NESTING:
+                    self.stats["malformed"] += 1
+                    return
+                nested, _consumed = split_length_prefixed(bytearray(body), self.max_decompressed)
+                for inner in nested:
+                    yield from self._parse(inner, depth + 1)
+                return
+            else:
+                stub_id = method_id = None
+                body = frame[offset:]
+        except struct.error:
+            self.stats["malformed"] += 1
+            return
+
+        if compressed:
+            body = self._decompress(body)
+            if body is None:
+                return
+        self.stats["messages"] += 1
+        yield GameMessage(msg_type, method_id, stub_id, bytes(body), bytes(frame), compressed)
+
+    def get_stats(self) -> Dict:
+        """統計情報を取得"""
+        return dict(self.stats, zstd_available=ZSTD_AVAILABLE)
+
+
+class MessageRouter:
+    """
+    メッセージを取引所のものとそれ以外に振り分け
+
+    取引所のメソッドIDが分かっていれば、そのIDのNotifyだけを通し、それ以外は検索せずに捨てます。
+    分かっていない場合は各メッセージ（圧縮されていたものは展開後）をシグネチャで判定し、
+    同じメソッドIDのNotifyが ``learn_after`` 回続けて取引所と判定された時点でそのIDを学習します。
+    メソッドIDを持たない Return と、フレームとして解析できなかったチャンクは常にシグネチャで判定します。
+
+    学習したIDが誤っていた場合（ゲームの更新でIDが変わった等）に備え、IDで振り分けている間も
+    Notifyの ``probe_every`` 件に1件はシグネチャで判定します。他のIDの取引所メッセージが
+    続けて見つかればそのIDを学習し、学習したIDのメッセージが ``unlearn_after`` 回続けて
+    取引所でなければそのIDを忘れます（設定で指定したIDは忘れません）。
+    """
+
+    def __init__(
+        self,
+        method_ids: Iterable[int] = (),
+        signature_names: Iterable[str] = ("trading_center",),
+        learn_after: int = 8,
+        probe_every: int = 64,
+        unlearn_after: int = 4
+    ):
+        """
+        Args:
+            method_ids: 取引所メッセージのメソッドID
+            signature_names: シグネチャで判定する場合に使う名前
+            learn_after: メソッドIDを学習するまでの連続一致回数（0で学習しない）
+            probe_every: IDで振り分けている間にシグネチャで判定するNotifyの間隔（0で判定しない）
+            unlearn_after: 学習したIDを忘れるまでの、判定で取引所でなかった連続回数
+        """
+        self.method_ids = set(method_ids)
+        self.signature_names = frozenset(signature_names)
+        self.learn_after = learn_after
+        self.probe_every = probe_every
+        self.unlearn_after = unlearn_after
+        # 設定で指定したID（学習したIDと違って忘れない）
+        self._configured = frozenset(self.method_ids)
+        self._candidate: Optional[int] = None
+        self._candidate_hits = 0
+        self._until_probe = probe_every
+        # 学習したIDごとの、判定で取引所でなかった連続回数
+        self._misses: Dict[int, int] = {}
+        self.stats = {
+            "routed": 0,
+            "skipped_by_method": 0,
+            "searched": 0,
+            "probes": 0,
+            "unlearned": 0,
+        }
+
+    def is_trading(self, message: GameMessage) -> bool:
+        """
+        取引所のメッセージか判定
+
+        Args:
+            message: FrameParserが返したメッセージ
+
+        Returns:
+            デコーダーに渡すべき場合True
+        """
+        if message.msg_type == MSG_NOTIFY and self.method_ids:
+            listed = message.method_id in self.method_ids
+            if not self._probe_due(message.method_id):
+                if listed:
+                    self.stats["routed"] += 1
+                    return True
+                # 設定済み・学習済みのIDがある場合、他のNotifyは検索しない
+                self.stats["skipped_by_method"] += 1
+                return False
+            self.stats["probes"] += 1
+            if self._search(message):
+                return True
+            if listed:
+                # 学習したIDの確認だけで、振り分けは変えない
+                self.stats["routed"] += 1
+                return True
+            return False
+
+        return self._search(message)
+
+    def _probe_due(self, method_id: int) -> bool:
+        """IDで振り分けている間に、このNotifyをシグネチャで判定するか"""
+        if self.probe_every <= 0 or self.learn_after <= 0 or method_id in self._configured:
+            return False
+        self._until_probe -= 1
+        if self._until_probe > 0:
+            return False
+        self._until_probe = self.probe_every
+        return True
+
+    def _search(self, message: GameMessage) -> bool:
+        """シグネチャで判定し、Notifyの場合は結果をメソッドIDの学習に使う"""
+        self.stats["searched"] += 1
+        if signatures.search(message.data, self.signature_names) is None:
+            if message.msg_type == MSG_NOTIFY:
+                self._miss(message.method_id)
+            return False
+
+        if message.msg_type == MSG_NOTIFY and self.learn_after > 0:
+            self._observe(message.method_id)
+        self.stats["routed"] += 1
+        return True
+
+    def _observe(self, method_id: int):
+        """取引所と判定したNotifyのメソッドIDを記録し、連続して一致したら学習"""
+        self._misses.pop(method_id, None)
+        if method_id in self.method_ids:
+            return
+        if method_id == self._candidate:
+            self._candidate_hits += 1
+        else:
+            self._candidate = method_id
+            self._candidate_hits = 1
+        if self._candidate_hits >= self.learn_after:
+            self.method_ids.add(method_id)
+            self._candidate = None
+            self._candidate_hits = 0
+            logger.info(f"Learned trading method id: 0x{method_id:08x}")
+
+    def _miss(self, method_id: int):
+        """学習したIDのメッセージが取引所でなければ数え、連続したら忘れる"""
+        if method_id not in self.method_ids or method_id in self._configured:
+            return
+        misses = self._misses[method_id] = self._misses.get(method_id, 0) + 1
+        if misses >= self.unlearn_after:
+            self.method_ids.discard(method_id)
+            del self._misses[method_id]
+            self.stats["unlearned"] += 1
+            logger.info(f"Unlearned trading method id: 0x{method_id:08x}")
+
+    def get_stats(self) -> Dict:
+        """統計情報を取得"""
+        return dict(self.stats, method_ids=sorted(self.method_ids))
+
+
+def iter_trading_payloads(
+    frames: Iterable[bytes],
+    parser: FrameParser,
+    router: MessageRouter
+) -> Iterator[bytes]:
+    """
+    フレームの列から取引所メッセージのペイロードだけを取り出す
+
+    Args:
+        frames: 再構築済みのフレーム
+        parser: フレームパーサー
+        router: メッセージの振り分け
+
+    Yields:
+        デコーダーに渡すデータ（GameMessage.data）
+    """
+    for frame in frames:
+        for message in parser.parse(frame):
+            if router.is_trading(message):
+                yield message.data
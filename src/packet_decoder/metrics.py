@@ -0,0 +1,246 @@
+"""
+Capture pipeline metrics
+キャプチャパイプラインの計測
+
+キャプチャスレッドと処理スレッド（およびコールバック）から同時に更新されるため、
+各メトリクスは自身のロックで保護します。1パケットごとに呼ばれる経路でも使えるよう、
+サンプルは保持せずカウンタとバケットの更新だけを行います。
+"""
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+# パイプラインのステージ
+STAGE_CAPTURED = "captured"
+STAGE_FILTERED = "filtered"
+STAGE_QUEUED = "queued"
+STAGE_DECODED = "decoded"
+STAGE_STORED = "stored"
+STAGE_BROADCAST = "broadcast"
+STAGES = (STAGE_CAPTURED, STAGE_FILTERED, STAGE_QUEUED, STAGE_DECODED, STAGE_STORED, STAGE_BROADCAST)
+# 所要時間を計測するステージ
+TIMED_STAGES = (STAGE_QUEUED, STAGE_DECODED, STAGE_STORED, STAGE_BROADCAST)
+
+# HDR形式ヒストグラムの精度（2のべき乗区間あたりのサブバケット数 = 2 ** SUB_BUCKET_BITS）
+SUB_BUCKET_BITS = 5
+_SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+# 記録できる最大値（マイクロ秒、これを超える値は最大値として記録）
+MAX_TRACKABLE_US = 3600 * 1_000_000
+
+# to_dict で出力するパーセンタイル
+DEFAULT_PERCENTILES = (50, 90, 99, 99.9)
+
+
+def _bucket_index(value: int) -> int:
+    """値（マイクロ秒）をバケット番号に変換"""
+    if value < _SUB_BUCKETS:
+        return value
+    shift = value.bit_length() - SUB_BUCKET_BITS - 1
+    return _SUB_BUCKETS + shift * _SUB_BUCKETS + ((value >> shift) - _SUB_BUCKETS)
+
+
+def _bucket_upper(index: int) -> int:
+    """バケットに含まれる最大値（マイクロ秒）"""
+    if index < _SUB_BUCKETS:
+        return index
+    shift, sub = divmod(index - _SUB_BUCKETS, _SUB_BUCKETS)
+    return ((sub + _SUB_BUCKETS + 1) << shift) - 1
+
+
+class LatencyHistogram:
+    """
+    HDR形式（対数-線形バケット）のレイテンシヒストグラム
+
+    値の大きさに関係なく相対誤差が約 1/2**SUB_BUCKET_BITS に収まり、
+    1マイクロ秒から1時間までを固定サイズの配列で記録します。
+    """
+
+    def __init__(self):
+        self._counts: List[int] = [0] * (_bucket_index(MAX_TRACKABLE_US) + 1)
+        self._lock = threading.Lock()
+        self.count = 0
+        self.total_us = 0
+        self.max_us = 0
+
+    def record(self, seconds: float):
+        """
+        レイテンシを記録
+
+        Args:
+            seconds: レイテンシ（秒）
+        """
+        value = min(max(int(seconds * 1_000_000), 0), MAX_TRACKABLE_US)
+        index = _bucket_index(value)
+        with self._lock:
+            self._counts[index] += 1
+            self.count += 1
+            self.total_us += value
+            if value > self.max_us:
+                self.max_us = value
+
+    def percentile(self, q: float) -> Optional[float]:
+        """
+        パーセンタイルを求める
+
+        Args:
+            q: パーセンタイル（0-100）
+
+        Returns:
+            推定値（ミリ秒）。記録がない場合はNone
+        """
+        return self.percentiles([q]).get(q)
+
+    def percentiles(self, qs: Iterable[float]) -> Dict[float, Optional[float]]:
+        """
+        複数のパーセンタイルを1回の走査で求める
+
+        Args:
+            qs: パーセンタイルのリスト（0-100）
+
+        Returns:
+            パーセンタイル -> 推定値（ミリ秒）
+        """
+        with self._lock:
+            counts = list(self._counts)
+            count = self.count
+            max_us = self.max_us
+
+        qs = sorted(qs)
+        result: Dict[float, Optional[float]] = {q: None for q in qs}
+        if count == 0:
+            return result
+
+        pending = iter(qs)
+        q = next(pending, None)
+        cumulative = 0
+        for index, bucket_count in enumerate(counts):
+            if not bucket_count:
+                continue
+            cumulative += bucket_count
+            while q is not None and cumulative >= count * q / 100.0:
+                result[q] = min(_bucket_upper(index), max_us) / 1000.0
+                q = next(pending, None)
+            if q is None:
+                break
+        return result
+
+    def to_dict(self, percentiles: Iterable[float] = DEFAULT_PERCENTILES) -> Dict:
+        """統計情報を辞書に変換"""
+        values = self.percentiles(percentiles)
+        with self._lock:
+            count = self.count
+            mean_ms = self.total_us / count / 1000.0 if count else None
+            max_ms = self.max_us / 1000.0
+        stats = {"count": count, "mean_ms": mean_ms, "max_ms": max_ms}
+        for q, value in values.items():
+            stats[f"p{q:g}_ms".replace(".", "")] = value
+        return stats
+
+
+class RateCounter:
+    """
+    合計値と直近のレート（1秒・60秒）を持つカウンタ
+
+    1秒単位のバケットをリングで保持します（集計中の秒 + 直前60秒）。
+    """
+
+    WINDOW = 61
+
+    def __init__(self, clock=time.monotonic):
+        """
+        Args:
+            clock: 時刻関数（テスト用）
+        """
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._buckets = [0] * self.WINDOW
+        self._current = int(clock())
+        self.total = 0
+
+    def _advance(self, now: int):
+        """現在の秒まで進め、経過したバケットをクリア（ロック内で呼ぶ）"""
+        elapsed = now - self._current
+        if elapsed <= 0:
+            return
+        for second in range(self._current + 1, self._current + 1 + min(elapsed, self.WINDOW)):
+            self._buckets[second % self.WINDOW] = 0
+        self._current = now
+
+    def add(self, n: int = 1):
+        """
+        カウントを加算
+
+        Args:
+            n: 加算する値
+        """
+        now = int(self._clock())
+        with self._lock:
+            if now != self._current:
+                self._advance(now)
+            self._buckets[now % self.WINDOW] += n
+            self.total += n
+
+    def rates(self) -> Dict[str, float]:
+        """
+        直近のレートを求める（集計中の現在の秒は含めない）
+
+        Returns:
+            rate_1s: 直前の1秒間の件数 / rate_60s: 直前60秒間の平均件数（毎秒）
+        """
+        now = int(self._clock())
+        with self._lock:
+            self._advance(now)
+            last_second = self._buckets[(now - 1) % self.WINDOW]
+            last_minute = sum(self._buckets) - self._buckets[now % self.WINDOW]
+        return {"rate_1s": float(last_second), "rate_60s": last_minute / (self.WINDOW - 1)}
+
+    def to_dict(self) -> Dict:
+        """統計情報を辞書に変換"""
+        return dict(self.rates(), total=self.total)
+
+
+class PipelineMetrics:
+    """
+    パイプライン全体のメトリクス
+
+    名前付きのカウンタとレイテンシヒストグラムを持ちます。
+    生成時にすべて作成しておくため、更新時に辞書を変更しません。
+    """
+
+    def __init__(
+        self,
+        counters: Iterable[str] = STAGES,
+        histograms: Iterable[str] = TIMED_STAGES
+    ):
+        """
+        Args:
+            counters: カウンタ名
+            histograms: ヒストグラム名
+        """
+        self.counters: Dict[str, RateCounter] = {name: RateCounter() for name in counters}
+        self.histograms: Dict[str, LatencyHistogram] = {name: LatencyHistogram() for name in histograms}
+
+    def count(self, name: str, n: int = 1):
+        """カウンタを加算"""
+        self.counters[name].add(n)
+
+    def observe(self, name: str, seconds: float):
+        """レイテンシを記録"""
+        self.histograms[name].record(seconds)
+
+    def total(self, name: str) -> int:
+        """カウンタの合計値"""
+        return self.counters[name].total
+
+    def snapshot(self) -> Dict:
+        """
+        全メトリクスのスナップショット
+
+        Returns:
+            counters: 名前 -> {total, rate_1s, rate_60s}
+            latency: 名前 -> {count, mean_ms, max_ms, p50_ms, p90_ms, p99_ms, p999_ms}
+        """
+        return {
+            "counters": {name: counter.to_dict() for name, counter in self.counters.items()},
+            "latency": {name: histogram.to_dict() for name, histogram in self.histograms.items()},
+        }
@@ -0,0 +1,269 @@
+"""
+Bounded packet queue
+キャプチャスレッドと処理スレッドの間の有界リングバッファ
+
+件数とバイト数の両方に上限を持ち、満杯時の破棄ポリシーを選べます。
+破棄は理由・分類ごとに集計し、ログは一定間隔のサマリーだけを出力します
+（破棄のたびにログを出すと、過負荷をさらに悪化させるため）。
+"""
+import logging
+import threading
+import time
+from typing import List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 満杯時の破棄ポリシー
+DROP_NEWEST = "drop_newest"                        # 新しく届いたフレームを捨てる
+DROP_OLDEST = "drop_oldest"                        # 最も古いフレームを捨てる
+DROP_NON_TRADING_FIRST = "drop_non_trading_first"  # 取引所以外の古いフレームから捨てる
+POLICIES = (DROP_NEWEST, DROP_OLDEST, DROP_NON_TRADING_FIRST)
+
+# 破棄の理由
+REASON_NEWEST = "newest"
+REASON_OLDEST = "oldest"
+REASON_NON_TRADING = "non_trading"
+
+# キューの要素 (フレーム, 取引所パケットか, 到着時刻)
+QueueItem = Tuple[bytes, bool, float]
+
+
+class _Ring:
+    """
+    固定長のリングによるFIFO
+
+    スロットの配列を最初に確保するだけで、フレーム本体は確保しません。
+    各スロットはキャプチャ側の ``bytes`` への参照を持つだけなので、
+    投入・取り出しでペイロードのコピーは発生しません。
+    """
+
+    __slots__ = ("slots", "capacity", "head", "count")
+
+    def __init__(self, capacity: int):
+        self.slots: List[Optional[tuple]] = [None] * capacity
+        self.capacity = capacity
+        self.head = 0
+        self.count = 0
+
+    def push(self, entry: tuple):
+        self.slots[(self.head + self.count) % self.capacity] = entry
+        self.count += 1
+
+    def peek(self) -> Optional[tuple]:
+        return self.slots[self.head] if self.count else None
+
+    def pop(self) -> tuple:
+        entry = self.slots[self.head]
+        self.slots[self.head] = None
+        self.head = (self.head + 1) % self.capacity
+        self.count -= 1
+        return entry
+
+
+class PacketRingBuffer:
+    """
+    破棄ポリシー付きの有界パケットキュー
+
+    取引所パケットとそれ以外を別々のリングに保持し、到着順の通し番号で
+    取り出し順を保ちます。これにより ``drop_non_trading_first`` でも
+    破棄はO(1)で済みます。
+    """
+
+    def __init__(
+        self,
+        max_items: int = 1000,
+        max_bytes: int = 16 * 1024 * 1024,
+        policy: str = DROP_NEWEST,
+        summary_interval: float = 10.0
+    ):
+        """
+        Args:
+            max_items: 保持する最大フレーム数
+            max_bytes: 保持する最大バイト数
+            policy: 満杯時の破棄ポリシー
+            summary_interval: 過負荷サマリーをログ出力する間隔（秒）
+        """
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown drop policy: {policy}")
+
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.summary_interval = summary_interval
+
+        self._trading = _Ring(max_items)
+        self._other = _Ring(max_items)
+        self._bytes = 0
+        self._sequence = 0
+        self._closed = False
+        self._not_empty = threading.Condition(threading.Lock())
+
+        self._last_summary = time.monotonic()
+        self._drops_since_summary = 0
+
+        self.stats = {
+            "enqueued": 0,
+            "high_water_items": 0,
+            "high_water_bytes": 0,
+            "dropped": {
+                reason: {"packets": 0, "bytes": 0}
+                for reason in (REASON_NEWEST, REASON_OLDEST, REASON_NON_TRADING)
+            },
+            "dropped_by_category": {"trading": 0, "game": 0},
+        }
+
+    def __len__(self) -> int:
+        return self._trading.count + self._other.count
+
+    def qsize(self) -> int:
+        """保持しているフレーム数"""
+        return len(self)
+
+    @property
+    def bytes(self) -> int:
+        """保持しているバイト数"""
+        return self._bytes
+
+    def put(self, payload: bytes, is_trading: bool, arrived_at: float) -> bool:
+        """
+        フレームを追加（ブロックしない）
+
+        Args:
+            payload: フレーム
+            is_trading: 取引所パケットか
+            arrived_at: 到着時刻（time.perf_counter）
+
+        Returns:
+            追加できた場合True
+        """
+        size = len(payload)
+        with self._not_empty:
+            if self._closed:
+                return False
+
+            if not self._make_room(size, is_trading):
+                self._record_drop(REASON_NEWEST, size, is_trading)
+                return False
+
+            self._sequence += 1
+            entry = (self._sequence, payload, is_trading, arrived_at)
+            (self._trading if is_trading else self._other).push(entry)
+            self._bytes += size
+
+            stats = self.stats
+            stats["enqueued"] += 1
+            depth = len(self)
+            if depth > stats["high_water_items"]:
+                stats["high_water_items"] = depth
+            if self._bytes > stats["high_water_bytes"]:
+                stats["high_water_bytes"] = self._bytes
+
+            self._not_empty.notify()
+            return True
+
+    def _fits(self, size: int) -> bool:
+        return len(self) < self.max_items and self._bytes + size <= self.max_bytes
+
+    def _make_room(self, size: int, is_trading: bool) -> bool:
+        """ポリシーに従って空きを作る（ロック内で呼ぶ）"""
+        if self._fits(size):
+            return True
+        if size > self.max_bytes or self.policy == DROP_NEWEST:
+            return False
+
+        while not self._fits(size):
+            if self.policy == DROP_NON_TRADING_FIRST:
+                if self._other.count:
+                    self._evict(self._other, REASON_NON_TRADING)
+                    continue
+                # 取引所パケットしか残っていない場合、取引所以外の新着は捨てる
+                if not is_trading:
+                    return False
+            self._evict(self._oldest_ring(), REASON_OLDEST)
+        return True
+
+    def _oldest_ring(self) -> _Ring:
+        trading = self._trading.peek()
+        other = self._other.peek()
+        if other is None or (trading is not None and trading[0] < other[0]):
+            return self._trading
+        return self._other
+
+    def _evict(self, ring: _Ring, reason: str):
+        _sequence, payload, is_trading, _arrived_at = ring.pop()
+        self._bytes -= len(payload)
+        self._record_drop(reason, len(payload), is_trading)
+
+    def _record_drop(self, reason: str, size: int, is_trading: bool):
+        """破棄を集計し、一定間隔でサマリーをログ出力（ロック内で呼ぶ）"""
+        dropped = self.stats["dropped"][reason]
+        dropped["packets"] += 1
+        dropped["bytes"] += size
+        self.stats["dropped_by_category"]["trading" if is_trading else "game"] += 1
+        self._drops_since_summary += 1
+
+        now = time.monotonic()
+        if now - self._last_summary >= self.summary_interval:
+            logger.warning(
+                f"Packet queue overloaded: dropped {self._drops_since_summary} frames "
+                f"in the last {now - self._last_summary:.0f}s (policy={self.policy}, "
+                f"total={self.stats['dropped']})"
+            )
+            self._last_summary = now
+            self._drops_since_summary = 0
+
+    def get_batch(self, max_items: int, timeout: Optional[float] = None) -> List[QueueItem]:
+        """
+        フレームを到着順に最大 ``max_items`` 件取り出す
+
+        1件以上届くまでブロックします。
+
+        Args:
+            max_items: 取り出す最大件数
+            timeout: 最大待ち時間（秒、省略時は無制限）
+
+        Returns:
+            (フレーム, 取引所パケットか, 到着時刻) のリスト。
+            クローズ済みで空の場合、またはタイムアウトした場合は空リスト
+        """
+        with self._not_empty:
+            if not len(self) and not self._closed:
+                self._not_empty.wait_for(lambda: len(self) or self._closed, timeout)
+
+            batch = []
+            while len(batch) < max_items and len(self):
+                _sequence, payload, is_trading, arrived_at = self._oldest_ring().pop()
+                self._bytes -= len(payload)
+                batch.append((payload, is_trading, arrived_at))
+            return batch
+
+    def close(self):
+        """
+        キューを閉じる（処理スレッドへの停止の合図）
+
+        閉じた後も残っているフレームは取り出せ、空になると ``get_batch`` は空リストを返します。
+        """
+        with self._not_empty:
+            self._closed = True
+            self._not_empty.notify_all()
+
+    def reopen(self):
+        """閉じたキューを再び使えるようにする"""
+        with self._not_empty:
+            self._closed = False
+
+    def get_stats(self) -> dict:
+        """統計情報を取得"""
+        with self._not_empty:
+            return {
+                "policy": self.policy,
+                "items": len(self),
+                "bytes": self._bytes,
+                "max_items": self.max_items,
+                "max_bytes": self.max_bytes,
+                "enqueued": self.stats["enqueued"],
+                "high_water_items": self.stats["high_water_items"],
+                "high_water_bytes": self.stats["high_water_bytes"],
+                "dropped": {reason: dict(counts) for reason, counts in self.stats["dropped"].items()},
+                "dropped_by_category": dict(self.stats["dropped_by_category"]),
+            }
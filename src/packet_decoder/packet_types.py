@@ -2,12 +2,15 @@
 Packet data structures
 パケットのデータ構造定義
 """
+import json
+import math
+from array import array
 from dataclasses import dataclass
 from datetime import datetime
-from typing import Optional, List
+from typing import Dict, Iterable, Iterator, List, Optional, Union
 
 
-@dataclass
+@dataclass(slots=True)
 class ItemListing:
     """取引所の出品情報"""
     listing_id: str
@@ -17,8 +20,11 @@ class ItemListing:
     price: int
     seller_id: Optional[str] = None
     seller_name: Optional[str] = None
+    # キャプチャ時刻
     timestamp: Optional[datetime] = None
-    
+    # ゲーム内の出品時刻（メッセージに含まれる場合）
+    notice_time: Optional[datetime] = None
+
     def to_dict(self) -> dict:
         """辞書形式に変換"""
         return {
@@ -30,34 +36,166 @@ class ItemListing:
             "seller_id": self.seller_id,
             "seller_name": self.seller_name,
             "timestamp": self.timestamp.isoformat() if self.timestamp else None,
+            "notice_time": self.notice_time.isoformat() if self.notice_time else None,
         }
 
 
-@dataclass
+@dataclass(slots=True)
 class TradingPacket:
     """取引所パケットの情報"""
     packet_type: str  # "listing", "purchase", "search", etc.
-    raw_data: bytes
+    # 元のペイロード（デコーダーの raw_retention_bytes が0の場合は保持しない）
+    raw_data: Optional[bytes] = None
     decoded_data: Optional[dict] = None
     listings: Optional[List[ItemListing]] = None
     timestamp: Optional[datetime] = None
-    
+
     def __post_init__(self):
         if self.timestamp is None:
             self.timestamp = datetime.now()
 
 
-@dataclass
+class ListingColumns:
+    """
+    リスティングの列指向コンテナ
+
+    数値列は ``array`` に、アイテム名は重複を除いた名前表への番号として保持し、
+    ItemListingを1件ずつ持つ場合よりメモリ使用量を抑えます。
+    """
+    __slots__ = (
+        "listing_id", "item_id", "quantity", "price", "timestamp", "notice_time",
+        "name_index", "names", "_name_lookup", "seller_id", "seller_name",
+    )
+
+    def __init__(self):
+        self.listing_id: List[str] = []
+        self.item_id = array('Q')
+        self.quantity = array('Q')
+        self.price = array('Q')
+        self.timestamp = array('d')  # UNIX時刻（ない場合はNaN）
+        self.notice_time = array('d')  # 同上
+        self.name_index = array('I')
+        self.names: List[str] = []
+        self._name_lookup: Dict[str, int] = {}
+        self.seller_id: List[Optional[str]] = []
+        self.seller_name: List[Optional[str]] = []
+
+    @classmethod
+    def from_listings(cls, listings: Iterable[ItemListing]) -> "ListingColumns":
+        """ItemListingの列から生成"""
+        columns = cls()
+        columns.extend(listings)
+        return columns
+
+    def append(self, listing: ItemListing):
+        """
+        リスティングを1件追加
+
+        Args:
+            listing: 追加するItemListing
+        """
+        index = self._name_lookup.get(listing.item_name)
+        if index is None:
+            index = self._name_lookup[listing.item_name] = len(self.names)
+            self.names.append(listing.item_name)
+
+        self.listing_id.append(listing.listing_id)
+        self.item_id.append(listing.item_id)
+        self.quantity.append(listing.quantity)
+        self.price.append(listing.price)
+        self.timestamp.append(listing.timestamp.timestamp() if listing.timestamp else math.nan)
+        self.notice_time.append(listing.notice_time.timestamp() if listing.notice_time else math.nan)
+        self.name_index.append(index)
+        self.seller_id.append(listing.seller_id)
+        self.seller_name.append(listing.seller_name)
+
+    def extend(self, listings: Iterable[ItemListing]):
+        """リスティングをまとめて追加"""
+        for listing in listings:
+            self.append(listing)
+
+    def __len__(self) -> int:
+        return len(self.listing_id)
+
+    def __getitem__(self, i: Union[int, slice]) -> Union[ItemListing, List[ItemListing]]:
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        timestamp = self.timestamp[i]
+        notice_time = self.notice_time[i]
+        return ItemListing(
+            listing_id=self.listing_id[i],
+            item_id=self.item_id[i],
+            item_name=self.names[self.name_index[i]],
+            quantity=self.quantity[i],
+            price=self.price[i],
+            seller_id=self.seller_id[i],
+            seller_name=self.seller_name[i],
+            timestamp=None if math.isnan(timestamp) else datetime.fromtimestamp(timestamp),
+            notice_time=None if math.isnan(notice_time) else datetime.fromtimestamp(notice_time),
+        )
+
+    def __iter__(self) -> Iterator[ItemListing]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def iter_dicts(self) -> Iterator[dict]:
+        """
+        1件ずつ辞書形式に変換（ItemListingを経由しない）
+
+        Yields:
+            ItemListing.to_dict と同じ形式の辞書
+        """
+        names = self.names
+        for i in range(len(self)):
+            timestamp = self.timestamp[i]
+            notice_time = self.notice_time[i]
+            yield {
+                "listing_id": self.listing_id[i],
+                "item_id": self.item_id[i],
+                "item_name": names[self.name_index[i]],
+                "quantity": self.quantity[i],
+                "price": self.price[i],
+                "seller_id": self.seller_id[i],
+                "seller_name": self.seller_name[i],
+                "timestamp": None if math.isnan(timestamp) else datetime.fromtimestamp(timestamp).isoformat(),
+                "notice_time": None if math.isnan(notice_time) else datetime.fromtimestamp(notice_time).isoformat(),
+            }
+
+
+@dataclass(slots=True)
 class MarketSnapshot:
     """市場のスナップショット"""
     timestamp: datetime
-    listings: List[ItemListing]
+    listings: Union[List[ItemListing], ListingColumns]
     total_items: int
-    
+
+    def iter_listing_dicts(self) -> Iterator[dict]:
+        """リスティングを1件ずつ辞書形式で返す"""
+        if isinstance(self.listings, ListingColumns):
+            return self.listings.iter_dicts()
+        return (listing.to_dict() for listing in self.listings)
+
     def to_dict(self) -> dict:
-        """辞書形式に変換"""
+        """
+        辞書形式に変換
+
+        ``listings`` は全件の辞書をまとめて作らず、1件ずつ生成するイテレータです。
+        リストが必要な場合は ``list()`` で展開してください。
+        """
         return {
             "timestamp": self.timestamp.isoformat(),
-            "listings": [listing.to_dict() for listing in self.listings],
+            "listings": self.iter_listing_dicts(),
             "total_items": self.total_items,
         }
+
+    def iter_json(self) -> Iterator[str]:
+        """
+        JSONを分割して出力（ファイルやHTTPレスポンスへの逐次書き込み用）
+
+        Yields:
+            JSON文字列の断片
+        """
+        yield f'{{"timestamp": {json.dumps(self.timestamp.isoformat())}, "total_items": {self.total_items}, "listings": ['
+        for i, listing in enumerate(self.iter_listing_dicts()):
+            yield (', ' if i else '') + json.dumps(listing, ensure_ascii=False)
+        yield ']}'
@@ -0,0 +1,248 @@
+"""
+Parallel capture decoding
+キャプチャファイルのマルチプロセス並列デコード
+
+キャプチャファイルをシャードに分割し、ProcessPoolExecutorで並列にデコードします。
+
+- バイト範囲シャード: クラシックPCAPをレコード境界で分割（再構築なし）
+- フローシャード: フローのハッシュで振り分け（TCP再構築あり、またはPCAPNG）
+
+各シャードの結果はタイムスタンプ順にマージされます。
+
+``run_sharded`` のフローシャードでは、親プロセスがキャプチャを1回だけ読んで解析し、
+レコードを ``ROUTE_CHUNK_RECORDS`` 件ずつ担当ワーカーのキューに送ります
+（``iter_shard`` をワーカーから直接呼ぶ場合は、各ワーカーがファイル全体を読んで
+担当外のフローを捨てます）。解析の回数は統計の ``parse_passes`` と
+benchmarks/bench_parallel_decode.py で確認できます。
+"""
+import os
+import time
+import heapq
+import zlib
+import queue
+import logging
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Any, Callable, Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+from .pcap_reader import Flow, PcapRecord, capture_format, iter_pcap, split_pcap_ranges
+
+logger = logging.getLogger(__name__)
+
+# 親プロセスからワーカーに1回で送るレコード数
+ROUTE_CHUNK_RECORDS = 512
+# ワーカーごとのキューに溜められるチャンク数（読み込みが先行しすぎないように）
+ROUTE_QUEUE_CHUNKS = 8
+
+# ワーカープロセスに渡されたシャードごとのキュー（_init_routed_worker で設定）
+_route_queues: Sequence["multiprocessing.Queue"] = ()
+
+
+class PcapShard(NamedTuple):
+    """キャプチャファイルのシャード"""
+    index: int
+    count: int
+    start: Optional[int] = None  # バイト範囲（フローシャードの場合はNone）
+    end: Optional[int] = None
+    # フローシャードのレコードをファイルではなく親プロセスから受け取るか
+    routed: bool = False
+
+    @property
+    def by_flow(self) -> bool:
+        """フロー単位のシャードかどうか"""
+        return self.start is None
+
+
+def flow_shard(flow: Flow, count: int) -> int:
+    """
+    フローの担当シャード番号を求める
+
+    プロセス間で一致させるため、組み込みのhash()ではなくCRC32を使用します。
+    """
+    return zlib.crc32(f"{flow.src_ip}:{flow.src_port}>{flow.dst_ip}:{flow.dst_port}".encode()) % count
+
+
+def plan_shards(pcap_file: str, count: int, by_flow: bool = False) -> List[PcapShard]:
+    """
+    キャプチャファイルのシャード分割を決める
+
+    Args:
+        pcap_file: キャプチャファイルのパス
+        count: シャード数
+        by_flow: フロー単位で分割するか（TCP再構築を行う場合はTrue）
+
+    Returns:
+        PcapShardのリスト
+    """
+    if not by_flow and capture_format(pcap_file) != "pcap":
+        # PCAPNGはバイト範囲で分割できないのでフロー単位にする
+        by_flow = True
+
+    if by_flow:
+        return [PcapShard(i, count) for i in range(count)]
+
+    ranges = split_pcap_ranges(pcap_file, count)
+    return [PcapShard(i, len(ranges), start, end) for i, (start, end) in enumerate(ranges)]
+
+
+def iter_shard(pcap_file: str, shard: PcapShard) -> Iterator[PcapRecord]:
+    """
+    シャードに属するレコードを読み出す
+
+    フローシャードの場合はファイル全体を読み、担当のフローのレコードだけを返します。
+
+    Args:
+        pcap_file: キャプチャファイルのパス
+        shard: 対象シャード
+
+    Yields:
+        PcapRecord
+    """
+    if not shard.by_flow:
+        yield from iter_pcap(pcap_file, shard.start, shard.end)
+        return
+
+    if shard.routed:
+        # 親プロセスが振り分けたレコードを受け取る（Noneで終了）
+        records = _route_queues[shard.index]
+        while True:
+            chunk = records.get()
+            if chunk is None:
+                return
+            yield from chunk
+
+    # フローごとの担当を記憶して、CRC計算をフローあたり1回にする
+    owners = {}
+    for record in iter_pcap(pcap_file):
+        owner = owners.get(record.flow)
+        if owner is None:
+            owner = owners[record.flow] = flow_shard(record.flow, shard.count)
+        if owner == shard.index:
+            yield record
+
+
+ShardWorker = Callable[[str, PcapShard], List[Tuple[Any, Any]]]
+
+
+def run_sharded(
+    pcap_file: str,
+    worker: ShardWorker,
+    workers: int,
+    by_flow: bool = False
+) -> Tuple[List[Any], dict]:
+    """
+    シャードごとにworkerを並列実行し、結果をタイムスタンプ順にマージ
+
+    Args:
+        pcap_file: キャプチャファイルのパス
+        worker: (pcap_file, shard) を受け取り、(sort_key, result) の
+            ソート済みリストを返すトップレベル関数（pickle可能であること）
+        workers: プロセス数
+        by_flow: フロー単位で分割するか
+
+    Returns:
+        (マージされた結果のリスト, スループット統計)
+        統計の ``parse_passes`` はキャプチャ全体を解析した回数（フローシャードではシャード数）
+    """
+    start_time = time.perf_counter()
+    shards = plan_shards(pcap_file, workers, by_flow=by_flow)
+
+    if shards and shards[0].by_flow:
+        shard_results = _run_routed(pcap_file, worker, len(shards))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(worker, pcap_file, shard) for shard in shards]
+            shard_results = [future.result() for future in futures]
+
+    merged = [
+        result for _key, result in heapq.merge(*shard_results, key=lambda pair: pair[0])
+    ]
+
+    stats = throughput_stats(pcap_file, time.perf_counter() - start_time, workers)
+    stats["shards"] = len(shards)
+    stats["sharding"] = "flow" if shards and shards[0].by_flow else "byte_range"
+    # キャプチャ全体を読んで解析した回数（フローシャードも親プロセスが1回だけ読む）
+    stats["parse_passes"] = 1
+    return merged, stats
+
+
+def _init_routed_worker(queues: Sequence["multiprocessing.Queue"]):
+    """フローシャードのワーカーの初期化（子プロセスで実行）"""
+    global _route_queues
+    _route_queues = queues
+
+
+def _run_routed(pcap_file: str, worker: ShardWorker, count: int) -> List[List[Tuple[Any, Any]]]:
+    """
+    キャプチャを1回だけ読み、レコードをフローの担当ワーカーに振り分けて実行
+
+    Args:
+        pcap_file: キャプチャファイルのパス
+        worker: run_sharded と同じワーカー（``iter_shard`` でレコードを受け取る）
+        count: シャード数（＝ワーカー数。全シャードを同時に実行する）
+
+    Returns:
+        シャードごとのワーカーの結果
+    """
+    queues = [multiprocessing.Queue(maxsize=ROUTE_QUEUE_CHUNKS) for _ in range(count)]
+    with ProcessPoolExecutor(
+        max_workers=count, initializer=_init_routed_worker, initargs=(queues,)
+    ) as executor:
+        futures = [
+            executor.submit(worker, pcap_file, PcapShard(i, count, routed=True)) for i in range(count)
+        ]
+        # フローごとの担当を記憶して、CRC計算をフローあたり1回にする
+        owners: Dict[Flow, int] = {}
+        chunks: List[List[PcapRecord]] = [[] for _ in range(count)]
+        for record in iter_pcap(pcap_file):
+            owner = owners.get(record.flow)
+            if owner is None:
+                owner = owners[record.flow] = flow_shard(record.flow, count)
+            chunk = chunks[owner]
+            chunk.append(record)
+            if len(chunk) >= ROUTE_CHUNK_RECORDS:
+                _route(queues[owner], chunk, futures[owner])
+                chunks[owner] = []
+        for owner, chunk in enumerate(chunks):
+            if chunk:
+                _route(queues[owner], chunk, futures[owner])
+            _route(queues[owner], None, futures[owner])
+        return [future.result() for future in futures]
+
+
+def _route(records: "multiprocessing.Queue", chunk: Optional[List[PcapRecord]], future: Future):
+    """ワーカーのキューにチャンクを送る（ワーカーが先に失敗した場合はその例外を送出）"""
+    while True:
+        try:
+            records.put(chunk, timeout=0.5)
+            return
+        except queue.Full:
+            if future.done():
+                future.result()
+                raise RuntimeError("Shard worker exited before reading all records")
+
+
+def throughput_stats(pcap_file: str, seconds: float, workers: int) -> dict:
+    """
+    スループット統計を作成してログ出力
+
+    Args:
+        pcap_file: キャプチャファイルのパス
+        seconds: 処理時間
+        workers: プロセス数
+
+    Returns:
+        統計情報の辞書
+    """
+    size = os.path.getsize(pcap_file)
+    mb_per_sec = size / (1024 * 1024) / seconds if seconds > 0 else 0.0
+    logger.info(
+        f"Decoded {size / (1024 * 1024):.1f} MB in {seconds:.2f}s "
+        f"({mb_per_sec:.1f} MB/s, workers={workers})"
+    )
+    return {
+        "workers": workers,
+        "bytes": size,
+        "seconds": seconds,
+        "mb_per_sec": mb_per_sec,
+    }
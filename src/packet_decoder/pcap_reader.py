@@ -0,0 +1,431 @@
+"""
+Streaming PCAP/PCAPNG reader
+Scapyを使わないストリーミングPCAP/PCAPNGリーダー
+
+Scapyの ``rdpcap`` は全パケットを完全にディセクトしたオブジェクトとして
+メモリに展開するため、数GBのキャプチャでは読み込みだけで数分かかります。
+このモジュールはレコードを1件ずつ読み進め、ペイロードに到達するのに必要な
+Ethernet/IP/TCPヘッダーだけを解析して ``(timestamp, flow, payload)`` を返します。
+"""
+import os
+import socket
+import struct
+import logging
+from typing import Iterator, List, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# PCAP マジックナンバー
+PCAP_MAGIC_USEC = 0xA1B2C3D4
+PCAP_MAGIC_NSEC = 0xA1B23C4D
+
+# PCAPNG ブロックタイプ
+PCAPNG_SECTION_HEADER = 0x0A0D0D0A
+PCAPNG_INTERFACE_DESCRIPTION = 0x00000001
+PCAPNG_SIMPLE_PACKET = 0x00000003
+PCAPNG_ENHANCED_PACKET = 0x00000006
+PCAPNG_BYTE_ORDER_MAGIC = 0x1A2B3C4D
+
+# リンクタイプ
+LINKTYPE_NULL = 0
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+DLT_RAW = (12, 14)  # OSによって値が異なる
+LINKTYPE_LOOP = 108
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_IPV4 = 228
+LINKTYPE_IPV6 = 229
+
+ETHERTYPE_IPV4 = 0x0800
+ETHERTYPE_IPV6 = 0x86DD
+ETHERTYPE_VLAN = (0x8100, 0x88A8)
+
+IPPROTO_TCP = 6
+
+# TCPフラグ
+TCP_FIN = 0x01
+TCP_SYN = 0x02
+TCP_RST = 0x04
+
+PCAP_GLOBAL_HEADER_SIZE = 24
+PCAP_RECORD_HEADER_SIZE = 16
+
+_U16_BE = struct.Struct('!H')
+_TCP_PORTS_SEQ = struct.Struct('!HHI')
+_U32 = {'<': struct.Struct('<I'), '>': struct.Struct('>I')}
+
+
+class Flow(NamedTuple):
+    """TCPフローの4タプル"""
+    src_ip: str
+    src_port: int
+    dst_ip: str
+    dst_port: int
+
+    def reversed(self) -> "Flow":
+        """逆方向のフローを返す"""
+        return Flow(self.dst_ip, self.dst_port, self.src_ip, self.src_port)
+
+
+class TcpSegment(NamedTuple):
+    """TCPセグメントの解析結果"""
+    flow: Flow
+    seq: int
+    flags: int
+    payload: bytes
+
+
+class PcapRecord(NamedTuple):
+    """キャプチャファイルから取り出したTCPペイロード"""
+    timestamp: float  # UNIX時刻（秒）
+    flow: Flow
+    payload: bytes
+    seq: int = 0
+    flags: int = 0
+
+
+def parse_ip_packet(packet: bytes) -> Optional[TcpSegment]:
+    """
+    IPパケットからTCPセグメントを取り出す
+
+    Args:
+        packet: IPv4/IPv6パケット
+
+    Returns:
+        TcpSegment。TCP以外の場合や、ペイロードが空でFIN/RSTも立っていない場合はNone
+        （FIN/RSTだけのセグメントはフローの終了を伝えるため空のペイロードで返す）
+    """
+    if not packet:
+        return None
+
+    version = packet[0] >> 4
+    if version == 4:
+        ihl = (packet[0] & 0x0F) * 4
+        if ihl < 20 or len(packet) < ihl:
+            return None
+        if packet[9] != IPPROTO_TCP:
+            return None
+        # フラグメント（オフセット非ゼロ）は再構築できないのでスキップ
+        if _U16_BE.unpack_from(packet, 6)[0] & 0x1FFF:
+            return None
+        total_length = _U16_BE.unpack_from(packet, 2)[0]
+        end = min(total_length, len(packet)) if total_length else len(packet)
+        src_ip = socket.inet_ntoa(packet[12:16])
+        dst_ip = socket.inet_ntoa(packet[16:20])
+        tcp_start = ihl
+    elif version == 6:
+        if len(packet) < 40 or packet[6] != IPPROTO_TCP:
+            return None
+        end = min(40 + _U16_BE.unpack_from(packet, 4)[0], len(packet))
+        src_ip = socket.inet_ntop(socket.AF_INET6, packet[8:24])
+        dst_ip = socket.inet_ntop(socket.AF_INET6, packet[24:40])
+        tcp_start = 40
+    else:
+        return None
+
+    if tcp_start + 20 > end:
+        return None
+
+    src_port, dst_port, seq = _TCP_PORTS_SEQ.unpack_from(packet, tcp_start)
+    tcp_header_length = (packet[tcp_start + 12] >> 4) * 4
+    payload_start = tcp_start + tcp_header_length
+    if tcp_header_length < 20 or payload_start > end:
+        return None
+    flags = packet[tcp_start + 13]
+    if payload_start == end and not flags & (TCP_FIN | TCP_RST):
+        return None
+
+    return TcpSegment(
+        Flow(src_ip, src_port, dst_ip, dst_port),
+        seq,
+        flags,
+        packet[payload_start:end],
+    )
+
+
+def parse_frame(linktype: int, frame: bytes) -> Optional[TcpSegment]:
+    """
+    リンク層フレームからTCPセグメントを取り出す
+
+    Args:
+        linktype: PCAPのリンクタイプ
+        frame: フレームデータ
+
+    Returns:
+        TcpSegment。対象外のフレームの場合はNone
+    """
+    if linktype == LINKTYPE_ETHERNET:
+        if len(frame) < 14:
+            return None
+        offset = 12
+        ethertype = _U16_BE.unpack_from(frame, offset)[0]
+        while ethertype in ETHERTYPE_VLAN and len(frame) >= offset + 6:
+            offset += 4
+            ethertype = _U16_BE.unpack_from(frame, offset)[0]
+        if ethertype not in (ETHERTYPE_IPV4, ETHERTYPE_IPV6):
+            return None
+        return parse_ip_packet(frame[offset + 2:])
+
+    if linktype in (LINKTYPE_RAW, LINKTYPE_IPV4, LINKTYPE_IPV6) or linktype in DLT_RAW:
+        return parse_ip_packet(frame)
+
+    if linktype in (LINKTYPE_NULL, LINKTYPE_LOOP):
+        # 4バイトのアドレスファミリーヘッダー（Windowsのループバック等）
+        return parse_ip_packet(frame[4:])
+
+    if linktype == LINKTYPE_LINUX_SLL:
+        if len(frame) < 16:
+            return None
+        if _U16_BE.unpack_from(frame, 14)[0] not in (ETHERTYPE_IPV4, ETHERTYPE_IPV6):
+            return None
+        return parse_ip_packet(frame[16:])
+
+    return None
+
+
+def _read_pcap_header(f, header: bytes) -> Tuple[str, float, int]:
+    """クラシックPCAPのグローバルヘッダーを読む (endian, 端数の単位, linktype)"""
+    magic_le = _U32['<'].unpack_from(header)[0]
+    if magic_le in (PCAP_MAGIC_USEC, PCAP_MAGIC_NSEC):
+        endian = '<'
+    else:
+        endian = '>'
+    magic = _U32[endian].unpack_from(header)[0]
+    frac_scale = 1e-9 if magic == PCAP_MAGIC_NSEC else 1e-6
+
+    rest = f.read(20)
+    if len(rest) < 20:
+        raise ValueError("Truncated PCAP global header")
+    linktype = struct.unpack(endian + 'HHiIII', rest)[5] & 0x0FFFFFFF
+    return endian, frac_scale, linktype
+
+
+def _iter_pcap_frames(
+    f,
+    header: bytes,
+    start: Optional[int] = None,
+    end: Optional[int] = None
+) -> Iterator[Tuple[float, int, bytes]]:
+    """クラシックPCAP形式のフレームを読み出す"""
+    endian, frac_scale, linktype = _read_pcap_header(f, header)
+
+    position = PCAP_GLOBAL_HEADER_SIZE
+    if start is not None and start > position:
+        f.seek(start)
+        position = start
+
+    record_header = struct.Struct(endian + 'IIII')
+    while end is None or position < end:
+        raw = f.read(record_header.size)
+        if len(raw) < record_header.size:
+            return
+        ts_sec, ts_frac, incl_len, _orig_len = record_header.unpack(raw)
+        frame = f.read(incl_len)
+        if len(frame) < incl_len:
+            logger.warning("Truncated PCAP record at end of file")
+            return
+        position += record_header.size + incl_len
+        yield ts_sec + ts_frac * frac_scale, linktype, frame
+
+
+def _iter_pcapng_frames(f, header: bytes) -> Iterator[Tuple[float, int, bytes]]:
+    """PCAPNG形式のフレームを読み出す"""
+    endian = '<'
+    interfaces = []  # (linktype, 秒あたりのtick数, snaplen)
+    block_type_raw = header
+
+    while True:
+        if len(block_type_raw) < 4:
+            return
+        length_raw = f.read(4)
+        if len(length_raw) < 4:
+            return
+
+        if _U32['<'].unpack(block_type_raw)[0] == PCAPNG_SECTION_HEADER:
+            # セクションごとにバイトオーダーとインターフェースをリセット
+            bom = f.read(4)
+            if len(bom) < 4:
+                return
+            endian = '<' if _U32['<'].unpack(bom)[0] == PCAPNG_BYTE_ORDER_MAGIC else '>'
+            interfaces = []
+            block_length = _U32[endian].unpack(length_raw)[0]
+            f.read(block_length - 12)
+            block_type_raw = f.read(4)
+            continue
+
+        block_type = _U32[endian].unpack(block_type_raw)[0]
+        block_length = _U32[endian].unpack(length_raw)[0]
+        if block_length < 12:
+            raise ValueError(f"Invalid PCAPNG block length: {block_length}")
+        body = f.read(block_length - 8)
+        if len(body) < block_length - 8:
+            logger.warning("Truncated PCAPNG block at end of file")
+            return
+
+        if block_type == PCAPNG_INTERFACE_DESCRIPTION:
+            linktype, _reserved, snaplen = struct.unpack_from(endian + 'HHI', body)
+            interfaces.append((linktype, _parse_if_tsresol(body, endian), snaplen))
+
+        elif block_type == PCAPNG_ENHANCED_PACKET:
+            if_id, ts_high, ts_low, cap_len = struct.unpack_from(endian + 'IIII', body)
+            if if_id < len(interfaces):
+                linktype, ticks, _snaplen = interfaces[if_id]
+                timestamp = ((ts_high << 32) | ts_low) / ticks
+                yield timestamp, linktype, body[20:20 + cap_len]
+
+        elif block_type == PCAPNG_SIMPLE_PACKET:
+            if interfaces:
+                linktype, _ticks, snaplen = interfaces[0]
+                orig_len = _U32[endian].unpack_from(body)[0]
+                cap_len = min(orig_len, snaplen) if snaplen else orig_len
+                # SPBにはタイムスタンプがない
+                yield 0.0, linktype, body[4:4 + cap_len]
+
+        block_type_raw = f.read(4)
+
+
+def _parse_if_tsresol(body: bytes, endian: str) -> int:
+    """IDBのif_tsresolオプションから秒あたりのtick数を求める"""
+    offset = 8
+    while offset + 4 <= len(body) - 4:
+        code, length = struct.unpack_from(endian + 'HH', body, offset)
+        if code == 0:
+            break
+        if code == 9 and length >= 1:
+            resol = body[offset + 4]
+            if resol & 0x80:
+                return 2 ** (resol & 0x7F)
+            return 10 ** resol
+        offset += 4 + ((length + 3) & ~3)
+    return 1_000_000
+
+
+def _detect_format(header: bytes) -> Optional[str]:
+    """ファイル先頭4バイトから形式を判定"""
+    if len(header) < 4:
+        return None
+    if _U32['<'].unpack(header)[0] == PCAPNG_SECTION_HEADER:
+        return "pcapng"
+    if (_U32['<'].unpack(header)[0] in (PCAP_MAGIC_USEC, PCAP_MAGIC_NSEC)
+            or _U32['>'].unpack(header)[0] in (PCAP_MAGIC_USEC, PCAP_MAGIC_NSEC)):
+        return "pcap"
+    return None
+
+
+def capture_format(pcap_file: str) -> Optional[str]:
+    """
+    キャプチャファイルの形式を判定
+
+    Returns:
+        "pcap", "pcapng"、または不明な場合はNone
+    """
+    with open(pcap_file, 'rb') as f:
+        return _detect_format(f.read(4))
+
+
+def split_pcap_ranges(pcap_file: str, parts: int) -> List[Tuple[int, int]]:
+    """
+    クラシックPCAPをレコード境界でほぼ均等なバイト範囲に分割
+
+    レコードヘッダーだけを読み飛ばしながら走査するため、
+    パケット本体は読み込みません。
+
+    Args:
+        pcap_file: PCAPファイルのパス
+        parts: 分割数
+
+    Returns:
+        (開始オフセット, 終了オフセット) のリスト
+    """
+    size = os.path.getsize(pcap_file)
+    with open(pcap_file, 'rb') as f:
+        header = f.read(4)
+        if _detect_format(header) != "pcap":
+            raise ValueError("Byte range splitting requires a classic PCAP file")
+        endian, _frac_scale, _linktype = _read_pcap_header(f, header)
+        record_header = struct.Struct(endian + 'IIII')
+
+        data_size = size - PCAP_GLOBAL_HEADER_SIZE
+        boundaries = [PCAP_GLOBAL_HEADER_SIZE]
+        position = PCAP_GLOBAL_HEADER_SIZE
+        next_target = PCAP_GLOBAL_HEADER_SIZE + data_size * len(boundaries) // parts
+
+        while len(boundaries) < parts:
+            raw = f.read(PCAP_RECORD_HEADER_SIZE)
+            if len(raw) < PCAP_RECORD_HEADER_SIZE:
+                break
+            incl_len = record_header.unpack(raw)[2]
+            position += PCAP_RECORD_HEADER_SIZE + incl_len
+            f.seek(incl_len, os.SEEK_CUR)
+            if position >= next_target and position < size:
+                boundaries.append(position)
+                next_target = PCAP_GLOBAL_HEADER_SIZE + data_size * len(boundaries) // parts
+
+    boundaries.append(size)
+    return [
+        (boundaries[i], boundaries[i + 1])
+        for i in range(len(boundaries) - 1)
+        if boundaries[i] < boundaries[i + 1]
+    ]
+
+
+def iter_frames(
+    pcap_file: str,
+    start: Optional[int] = None,
+    end: Optional[int] = None
+) -> Iterator[Tuple[float, int, bytes]]:
+    """
+    キャプチャファイルのフレームを順に読み出す
+
+    Args:
+        pcap_file: PCAP/PCAPNGファイルのパス
+        start: 読み込み開始オフセット（レコード境界、クラシックPCAPのみ）
+        end: 読み込み終了オフセット（クラシックPCAPのみ）
+
+    Yields:
+        (timestamp, linktype, frame)
+    """
+    with open(pcap_file, 'rb') as f:
+        header = f.read(4)
+        file_format = _detect_format(header)
+
+        if file_format == "pcapng":
+            if start is not None or end is not None:
+                raise ValueError("Byte ranges are not supported for PCAPNG files")
+            yield from _iter_pcapng_frames(f, header)
+            return
+
+        if file_format == "pcap":
+            yield from _iter_pcap_frames(f, header, start, end)
+            return
+
+        if len(header) < 4:
+            return
+
+        raise ValueError(f"Unsupported capture file format: {pcap_file}")
+
+
+def iter_pcap(
+    pcap_file: str,
+    start: Optional[int] = None,
+    end: Optional[int] = None
+) -> Iterator[PcapRecord]:
+    """
+    キャプチャファイルからTCPペイロードをストリーミングで読み出す
+
+    ファイル全体をメモリに読み込まないため、ファイルサイズに関係なく
+    メモリ使用量は一定です。ペイロードのないFIN/RSTセグメントも
+    （再構築でフローを閉じられるよう）空のペイロードで返します。
+
+    Args:
+        pcap_file: PCAP/PCAPNGファイルのパス
+        start: 読み込み開始オフセット（split_pcap_rangesの結果を使用）
+        end: 読み込み終了オフセット
+
+    Yields:
+        PcapRecord (timestamp, flow, payload, seq, flags)
+    """
+    for timestamp, linktype, frame in iter_frames(pcap_file, start, end):
+        segment = parse_frame(linktype, frame)
+        if segment is not None:
+            yield PcapRecord(timestamp, segment.flow, segment.payload, segment.seq, segment.flags)
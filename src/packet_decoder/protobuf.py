@@ -0,0 +1,175 @@
+"""
+Protobuf wire-format scanner
+Protobufワイヤーフォーマットの高速スキャナー
+
+バッファ全体を1パスでトークン化し、フィールドごとに
+(field_number, wire_type, offset, length, value) を配列として返します。
+フィールド単位でタプルやbytesを生成しないため、ヒューリスティックや
+スキーマによる解析はこの配列の上で行います。
+"""
+import struct
+from array import array
+from typing import Iterator, NamedTuple, Tuple
+
+# ワイヤータイプ
+WIRE_VARINT = 0
+WIRE_FIXED64 = 1
+WIRE_LENGTH_DELIMITED = 2
+WIRE_START_GROUP = 3
+WIRE_END_GROUP = 4
+WIRE_FIXED32 = 5
+
+_U64 = struct.Struct('<Q')
+_U32 = struct.Struct('<I')
+_MASK64 = (1 << 64) - 1
+
+
+class FieldTable(NamedTuple):
+    """スキャン結果（フィールドごとの並列配列）"""
+    field_numbers: array  # フィールド番号
+    wire_types: array     # ワイヤータイプ
+    offsets: array        # 値の開始位置（バッファ内の絶対位置）
+    lengths: array        # 値のバイト長
+    values: array         # varint/fixedの値（length-delimitedは0）
+    end: int              # スキャンを終えた位置
+
+    def __len__(self) -> int:
+        return len(self.field_numbers)
+
+    def iter_fields(self) -> Iterator[Tuple[int, int, int, int, int]]:
+        """(field_number, wire_type, offset, length, value) を順に返す"""
+        return zip(self.field_numbers, self.wire_types, self.offsets, self.lengths, self.values)
+
+
+def read_varint(data, pos: int, end: int) -> Tuple[int, int]:
+    """
+    Varintを読む
+
+    Args:
+        data: バッファ
+        pos: 開始位置
+        end: 読み込み上限
+
+    Returns:
+        (値, 次の位置)。途中で切れている場合は次の位置が -1
+    """
+    result = 0
+    shift = 0
+    while pos < end:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result & _MASK64, pos
+        shift += 7
+        if shift > 63:
+            return 0, -1
+    return 0, -1
+
+
+def scan_fields(data, offset: int = 0, end: int = None) -> FieldTable:
+    """
+    バッファ内のProtobufフィールドを1パスでトークン化
+
+    不正なタグや途中で切れたフィールドに到達した時点でスキャンを終了し、
+    それまでに読めたフィールドを返します。
+
+    Args:
+        data: バッファ（bytes / memoryview）
+        offset: スキャン開始位置
+        end: スキャン終了位置（省略時はバッファ末尾）
+
+    Returns:
+        FieldTable
+    """
+    if end is None:
+        end = len(data)
+
+    field_numbers = array('I')
+    wire_types = array('B')
+    offsets = array('I')
+    lengths = array('I')
+    values = array('Q')
+
+    add_number = field_numbers.append
+    add_type = wire_types.append
+    add_offset = offsets.append
+    add_length = lengths.append
+    add_value = values.append
+    unpack_u64 = _U64.unpack_from
+    unpack_u32 = _U32.unpack_from
+
+    pos = offset
+    while pos < end:
+        # タグ（1バイトのケースを高速化）
+        tag = data[pos]
+        if tag < 0x80:
+            next_pos = pos + 1
+        else:
+            tag, next_pos = read_varint(data, pos, end)
+            if next_pos < 0:
+                break
+
+        field_number = tag >> 3
+        wire_type = tag & 0x07
+        if field_number == 0:
+            break
+        value_start = next_pos
+
+        if wire_type == WIRE_VARINT:
+            if next_pos >= end:
+                break
+            value = data[next_pos]
+            if value < 0x80:
+                next_pos += 1
+            else:
+                value, next_pos = read_varint(data, next_pos, end)
+                if next_pos < 0:
+                    break
+            length = next_pos - value_start
+
+        elif wire_type == WIRE_LENGTH_DELIMITED:
+            if next_pos >= end:
+                break
+            length = data[next_pos]
+            if length < 0x80:
+                next_pos += 1
+            else:
+                length, next_pos = read_varint(data, next_pos, end)
+                if next_pos < 0:
+                    break
+            value_start = next_pos
+            next_pos += length
+            if next_pos > end:
+                break
+            value = 0
+
+        elif wire_type == WIRE_FIXED64:
+            if next_pos + 8 > end:
+                break
+            value = unpack_u64(data, next_pos)[0]
+            length = 8
+            next_pos += 8
+
+        elif wire_type == WIRE_FIXED32:
+            if next_pos + 4 > end:
+                break
+            value = unpack_u32(data, next_pos)[0]
+            length = 4
+            next_pos += 4
+
+        elif wire_type == WIRE_START_GROUP or wire_type == WIRE_END_GROUP:
+            value = 0
+            length = 0
+
+        else:
+            break
+
+        add_number(field_number)
+        add_type(wire_type)
+        add_offset(value_start)
+        add_length(length)
+        add_value(value)
+        pos = next_pos
+
+    return FieldTable(field_numbers, wire_types, offsets, lengths, values, pos)
@@ -6,31 +6,43 @@ WinDivertを使用してリアルタイムでゲームパケットをキャプ
 参考: https://github.com/winjwinj/bpsr-logs
 """
 import logging
+import queue
 import threading
 import time
-import warnings
-from typing import Optional, Callable, List
+from typing import Callable, Optional, List, Tuple, Union
 from datetime import datetime
-from queue import Queue
-
-# 警告を抑制
-warnings.filterwarnings('ignore', category=DeprecationWarning)
-warnings.filterwarnings('ignore', message='.*TripleDES.*')
-logging.getLogger('scapy.runtime').setLevel(logging.ERROR)
-logging.getLogger('scapy').setLevel(logging.ERROR)
-
-try:
-    from scapy.all import sniff, Packet, Raw
-    SCAPY_AVAILABLE = True
-except ImportError:
-    SCAPY_AVAILABLE = False
 
+from .capture_backends import CaptureBackend, create_backend
 from .decoder import TradingCenterDecoder
+from .decode_pool import WORKER_THREAD, DecodePool, DecodeResult, decode_frames
 from .packet_types import TradingPacket, ItemListing
+from .pcap_reader import Flow, TcpSegment, TCP_FIN, TCP_RST
+from .reassembly import TcpReassembler
+from .metrics import (
+    STAGES, TIMED_STAGES, STAGE_CAPTURED, STAGE_FILTERED, STAGE_QUEUED, STAGE_DECODED,
+    PipelineMetrics,
+)
+from .packet_queue import DROP_NEWEST, PacketRingBuffer
+from .dedupe import PayloadCache
+from .archive import PayloadArchive
+from .frames import FrameParser, MessageRouter
+from .schema import ListingSchema
 from ..config import settings
 
 logger = logging.getLogger(__name__)
 
+# フローの分類
+FLOW_GAME = "game"          # 固定済み、または設定されたゲームサーバーとの通信
+FLOW_UNKNOWN = "unknown"    # まだ判定できない通信（取引所パケットだけを通す）
+FLOW_NON_GAME = "non_game"  # ゲーム以外の通信（再構築前に破棄）
+
+# ステージ以外のカウンタ・ヒストグラム
+COUNTER_LISTINGS = "listings"
+COUNTER_ERRORS = "errors"
+COUNTER_DEDUPED = "deduplicated"  # 重複排除キャッシュでデコードを省いたフレーム
+FILTERED_COUNTERS = {category: f"filtered_{category}" for category in (FLOW_NON_GAME, FLOW_UNKNOWN)}
+HISTOGRAM_LISTING = "listing"  # パケット到着から on_listing_found 呼び出しまで
+
 
 class RealtimeCaptureCallback:
     """リアルタイムキャプチャのコールバックインターフェース"""
@@ -43,9 +55,169 @@ class RealtimeCaptureCallback:
         """新しい出品情報が見つかった時に呼ばれる"""
         pass
     
+    def on_listings_seen(self, listings: List[ItemListing], seen_at: datetime):
+        """処理済みのページが再びキャプチャされた時に呼ばれる（最終確認時刻の更新用）"""
+        pass
+    
     def on_error(self, error: Exception):
         """エラーが発生した時に呼ばれる"""
         pass
+    
+    def close(self):
+        """キャプチャの停止時に呼ばれる（保留中の処理を終える）"""
+        pass
+    
+    def get_stats(self) -> dict:
+        """コールバック側の統計情報（キューの深さ等）"""
+        return {}
+
+
+class CompositeCallback(RealtimeCaptureCallback):
+    """複数のコールバックに順に通知するコールバック"""
+    
+    def __init__(self, callbacks: List[RealtimeCaptureCallback]):
+        """
+        Args:
+            callbacks: 通知先のコールバック
+        """
+        self.callbacks = list(callbacks)
+    
+    def _each(self, method: str, *args):
+        for callback in self.callbacks:
+            try:
+                getattr(callback, method)(*args)
+            except Exception as e:
+                logger.error(f"{type(callback).__name__}.{method} error: {e}")
+    
+    def on_packet_captured(self, packet: TradingPacket):
+        self._each("on_packet_captured", packet)
+    
+    def on_listing_found(self, listings: List[ItemListing]):
+        self._each("on_listing_found", listings)
+    
+    def on_listings_seen(self, listings: List[ItemListing], seen_at: datetime):
+        self._each("on_listings_seen", listings, seen_at)
+    
+    def on_error(self, error: Exception):
+        self._each("on_error", error)
+    
+    def close(self):
+        self._each("close")
+    
+    def get_stats(self) -> dict:
+        stats = {}
+        for callback in self.callbacks:
+            stats.update(callback.get_stats())
+        return stats
+
+
+class QueuedCallback(RealtimeCaptureCallback):
+    """
+    専用スレッドとキューで遅いシンク（DB保存・WebSocket配信）を切り離すコールバック
+    
+    処理スレッド（シーケンサー）は通知をキューに入れるだけで戻るため、
+    DBのコミット待ちがデコードを止めません。通知の順序はキューで保たれます。
+    """
+    
+    def __init__(
+        self,
+        callback: RealtimeCaptureCallback,
+        name: str,
+        max_items: int = 1000,
+        drop_when_full: bool = False
+    ):
+        """
+        Args:
+            callback: 実際に処理するコールバック
+            name: シンク名（統計情報のキー）
+            max_items: キューの最大件数
+            drop_when_full: 満杯の時に通知を破棄するか（Falseの場合は空くまで待つ）
+        """
+        self.callback = callback
+        self.name = name
+        self.drop_when_full = drop_when_full
+        self._queue: "queue.Queue[Optional[tuple]]" = queue.Queue(maxsize=max_items)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        # 基底クラスのまま（何もしない）のメソッドはキューに入れない
+        self._handled = {
+            method for method in ("on_packet_captured", "on_listing_found", "on_listings_seen")
+            if getattr(type(callback), method, None) is not getattr(RealtimeCaptureCallback, method)
+        }
+        self.stats = {
+            "delivered": 0,
+            "dropped": 0,
+            "errors": 0,
+            "high_water": 0,
+        }
+    
+    def _ensure_thread(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name=f"sink-{self.name}", daemon=True)
+                self._thread.start()
+    
+    def _enqueue(self, method: str, *args):
+        if method not in self._handled:
+            return
+        self._ensure_thread()
+        try:
+            if self.drop_when_full:
+                self._queue.put_nowait((method, args))
+            else:
+                self._queue.put((method, args))
+        except queue.Full:
+            self.stats["dropped"] += 1
+            return
+        depth = self._queue.qsize()
+        if depth > self.stats["high_water"]:
+            self.stats["high_water"] = depth
+    
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            method, args = item
+            try:
+                getattr(self.callback, method)(*args)
+                self.stats["delivered"] += 1
+            except Exception as e:
+                self.stats["errors"] += 1
+                logger.error(f"Sink {self.name} error: {e}")
+    
+    def on_packet_captured(self, packet: TradingPacket):
+        self._enqueue("on_packet_captured", packet)
+    
+    def on_listing_found(self, listings: List[ItemListing]):
+        self._enqueue("on_listing_found", listings)
+    
+    def on_listings_seen(self, listings: List[ItemListing], seen_at: datetime):
+        self._enqueue("on_listings_seen", listings, seen_at)
+    
+    def on_error(self, error: Exception):
+        """エラー通知はキューを経由せずにそのまま渡す"""
+        self.callback.on_error(error)
+    
+    def close(self, timeout: Optional[float] = 10.0):
+        """
+        キューに残った通知を処理し終えてからスレッドを停止
+        
+        Args:
+            timeout: 最大待ち時間（秒）
+        """
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+        if thread is not None and thread.is_alive():
+            self._queue.put(None)
+            thread.join(timeout)
+        self.callback.close()
+    
+    def get_stats(self) -> dict:
+        stats = {self.name: dict(self.stats, depth=self._queue.qsize())}
+        stats.update(self.callback.get_stats())
+        return stats
 
 
 class RealtimePacketCapture:
@@ -61,7 +233,19 @@ class RealtimePacketCapture:
         callback: Optional[RealtimeCaptureCallback] = None,
         interface: Optional[str] = None,
         game_server_ip: Optional[str] = None,
-        game_server_port: Optional[int] = None
+        game_server_port: Optional[int] = None,
+        batch_size: int = 64,
+        backend: Union[str, CaptureBackend] = "auto",
+        queue_size: int = 1000,
+        queue_max_bytes: int = 16 * 1024 * 1024,
+        queue_policy: str = DROP_NEWEST,
+        schema: Optional[ListingSchema] = None,
+        dedupe_size: int = 4096,
+        dedupe_ttl: float = 60.0,
+        decode_workers: int = 1,
+        worker_mode: str = WORKER_THREAD,
+        archive: Optional[PayloadArchive] = None,
+        pin_idle_timeout: Optional[float] = None
     ):
         """
         Args:
@@ -69,23 +253,76 @@ class RealtimePacketCapture:
             interface: ネットワークインターフェース名
             game_server_ip: ゲームサーバーのIPアドレス
             game_server_port: ゲームサーバーのポート
+            batch_size: 処理スレッドが1回の起床で取り出す最大フレーム数
+            backend: キャプチャバックエンド（名前またはインスタンス。"auto" の場合は
+                AF_PACKETを優先し、使えなければScapy）
+            queue_size: パケットキューの最大フレーム数
+            queue_max_bytes: パケットキューの最大バイト数
+            queue_policy: キューが満杯の時の破棄ポリシー
+                （drop_newest / drop_oldest / drop_non_trading_first）
+            schema: リスティングのスキーマ（省略時は設定の listing_schema_file を読み込む）
+            dedupe_size: 重複排除キャッシュの最大エントリ数（0で無効）
+            dedupe_ttl: 重複排除キャッシュの有効期間（秒）
+            decode_workers: デコードのワーカー数（1の場合は処理スレッドでデコード）
+            worker_mode: ワーカーの種類（"thread" / "process"。スレッドはデコードを速くせず、
+                シンクと切り離すだけ。decode_pool を参照）
+            archive: 取引所フレームを保存するアーカイブ（省略時は設定の archive_directory があれば作成）
+            pin_idle_timeout: 固定したゲーム接続にこの秒数パケットがなければ固定を解除する
+                （省略時は設定の pinned_flow_idle_timeout）
         """
         self.callback = callback or RealtimeCaptureCallback()
         self.interface = interface
         self.game_server_ip = game_server_ip or settings.game_server_ip
         self.game_server_port = game_server_port or settings.game_server_port
+        self.backend = backend
         
-        self.decoder = TradingCenterDecoder()
+        if schema is None and settings.listing_schema_file:
+            schema = ListingSchema.load(settings.listing_schema_file)
+        self.decoder = TradingCenterDecoder(schema=schema)
+        self.reassembler = TcpReassembler()
+        # フレームをメッセージに分解し、取引所のメッセージだけをキューに入れる（キャプチャスレッド専用）
+        self.frame_parser = FrameParser()
+        self.message_router = MessageRouter(settings.trading_method_ids, self.decoder.SIGNATURE_NAMES)
         self.is_running = False
         self.capture_thread: Optional[threading.Thread] = None
-        self.packet_queue = Queue(maxsize=1000)
+        self.process_thread: Optional[threading.Thread] = None
+        # バックエンドが終了した（再生が終わった等）ことを示すイベント
+        self.capture_finished = threading.Event()
+        self.packet_queue = PacketRingBuffer(queue_size, queue_max_bytes, queue_policy)
+        self.batch_size = batch_size
+        self.decode_workers = decode_workers
+        self.worker_mode = worker_mode
+        # 同じページの再送はデコードせず、キャッシュした結果で最終確認時刻だけを更新する
+        self.payload_cache = PayloadCache(dedupe_size, dedupe_ttl) if dedupe_size > 0 else None
+        # デコード中（結果をキャッシュに入れる前）のフレームのキャッシュキー。
+        # 並列デコードで別のバッチに入った再送も、先のバッチの結果をキャッシュから引く
+        self._inflight_keys = set()
+        # 後でデコーダーを改良した時に再デコードできるよう、取引所フレームを圧縮して保存する
+        if archive is None and settings.archive_directory:
+            archive = PayloadArchive(settings.archive_directory)
+        self.archive = archive
+        # キャプチャスレッド・処理スレッド・コールバックから更新されるメトリクス
+        self.metrics = PipelineMetrics(
+            counters=(
+                *STAGES, *FILTERED_COUNTERS.values(), COUNTER_LISTINGS, COUNTER_ERRORS, COUNTER_DEDUPED
+            ),
+            histograms=(*TIMED_STAGES, HISTOGRAM_LISTING),
+        )
+        
+        # 取引所パケットを出したフロー（双方向）。固定後はBPFフィルタも絞り込む
+        self.pinned_flow: Optional[Flow] = None
+        self._pinned_flows = frozenset()
+        self._filter_changed = False
+        # 接続が閉じたことを見逃した場合（FIN/RSTの取りこぼし等）に備えたアイドル判定
+        self.pin_idle_timeout = (
+            pin_idle_timeout if pin_idle_timeout is not None else settings.pinned_flow_idle_timeout
+        )
+        self._pinned_seen_at = 0.0
         
+        # カウンタ以外の状態（更新はキャプチャスレッドのみ）
         self.stats = {
-            "total_packets": 0,
-            "trading_packets": 0,
-            "listings_found": 0,
-            "errors": 0,
             "start_time": None,
+            "pinned_flow": None,
         }
     
     def start(self):
@@ -94,13 +331,21 @@ class RealtimePacketCapture:
             logger.warning("Capture is already running")
             return
         
-        if not SCAPY_AVAILABLE:
-            error = ImportError("Scapy is not available. Install with: pip install scapy")
-            logger.error(str(error))
-            self.callback.on_error(error)
-            return
+        if not isinstance(self.backend, CaptureBackend):
+            backend = create_backend(self.backend, self.interface)
+            if backend is None:
+                error = ImportError(
+                    "No capture backend is available. Install Scapy (pip install scapy) "
+                    "or run with CAP_NET_RAW on Linux"
+                )
+                logger.error(str(error))
+                self.callback.on_error(error)
+                return
+            self.backend = backend
         
         self.is_running = True
+        self.capture_finished.clear()
+        self.packet_queue.reopen()
         self.stats["start_time"] = datetime.now()
         
         # パケットキャプチャスレッド
@@ -123,99 +368,454 @@ class RealtimePacketCapture:
         if self.capture_thread:
             self.capture_thread.join(timeout=5)
         
+        # 再構築の途中で残ったデータも、キューを閉じる前に処理スレッドに渡す
+        if self.capture_thread is None or not self.capture_thread.is_alive():
+            self._flush_reassembler()
+        
         if self.process_thread:
+            # キューを閉じ、残ったフレームを処理し終えたら処理スレッドが終了する
+            self.packet_queue.close()
             self.process_thread.join(timeout=5)
         
+        # シンクのキューに残った通知を処理し終える
+        self.callback.close()
+        
+        if self.archive is not None:
+            self.archive.close()
+        
         logger.info("Real-time packet capture stopped")
         self._log_stats()
     
     def _capture_loop(self):
         """パケットキャプチャループ"""
         try:
-            # フィルタを構築
-            capture_filter = self._build_capture_filter()
-            
-            logger.info(f"Starting packet capture with filter: {capture_filter}")
-            
-            # Scapyでパケットをキャプチャ
-            sniff(
-                iface=self.interface,
-                filter=capture_filter,
-                prn=self._packet_handler,
-                store=False,
-                stop_filter=lambda p: not self.is_running
-            )
+            # フローの固定・解除でフィルタが変わったらsniffを張り直す
+            while self.is_running:
+                capture_filter = self._build_capture_filter()
+                self._filter_changed = False
+                
+                logger.info(f"Starting packet capture with filter: {capture_filter}")
+                
+                self.backend.run(capture_filter, self._packet_handler, self._should_restart_capture)
+                
+                # フィルタ変更以外で戻った場合はソースが尽きた（再生の終了等）
+                if not self._filter_changed:
+                    break
             
         except Exception as e:
             logger.error(f"Capture loop error: {e}")
-            self.stats["errors"] += 1
+            self.metrics.count(COUNTER_ERRORS)
             self.callback.on_error(e)
             self.is_running = False
+        
+        finally:
+            self.capture_finished.set()
+    
+    def _should_restart_capture(self) -> bool:
+        """
+        バックエンドを止めるか判定（キャプチャスレッドでバックエンドから呼ばれる）
+        
+        固定したゲーム接続がアイドルになっていれば固定を解除し、フィルタを戻すために止めます。
+        絞り込んだフィルタでは他の通信が届かないため、パケットを待たずにここで判定します。
+        
+        Returns:
+            停止する場合True
+        """
+        if not self.is_running or self._filter_changed:
+            return True
+        if (self.pinned_flow is not None and self.pin_idle_timeout > 0
+                and time.monotonic() - self._pinned_seen_at > self.pin_idle_timeout):
+            logger.info(f"Pinned game connection idle for {self.pin_idle_timeout:.0f}s")
+            self.unpin_flow()
+            return True
+        return False
+    
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """
+        バックエンドが終了するまで待つ（再生バックエンド向け）
+        
+        Args:
+            timeout: 最大待ち時間（秒）
+            
+        Returns:
+            終了した場合True
+        """
+        return self.capture_finished.wait(timeout)
     
     def _process_loop(self):
-        """パケット処理ループ"""
-        while self.is_running:
+        """
+        パケット処理ループ
+        
+        フレームが届くまでブロックし、起床ごとに最大 ``batch_size`` 件をまとめて処理します。
+        キューが閉じられ、空になったら終了します。
+        ``decode_workers`` が2以上の場合、デコードはワーカープールで並列に行い、
+        シーケンサースレッドが投入順（キャプチャ順）にコールバックを呼びます。
+        """
+        if self.decode_workers > 1:
+            self._parallel_process_loop()
+            return
+        
+        while True:
+            batch = self.packet_queue.get_batch(self.batch_size)
+            if not batch:
+                break
+            
             try:
-                if not self.packet_queue.empty():
-                    packet_data = self.packet_queue.get(timeout=1)
-                    self._process_packet(packet_data)
-                else:
-                    time.sleep(0.1)
+                self._process_batch(batch)
             except Exception as e:
                 logger.error(f"Process loop error: {e}")
-                self.stats["errors"] += 1
+                self.metrics.count(COUNTER_ERRORS)
     
-    def _packet_handler(self, packet: Packet):
-        """Scapyパケットハンドラー"""
+    def _parallel_process_loop(self):
+        """ワーカープールにデコードを投入し、結果をシーケンサーに投入順で渡す"""
+        pool = DecodePool(self.decoder, self.decode_workers, self.worker_mode)
+        # 投入順のFIFO。上限を設けて、シーケンサーが遅れたら投入側を待たせる
+        ordered: "queue.Queue[Optional[tuple]]" = queue.Queue(maxsize=self.decode_workers * 2)
+        sequencer = threading.Thread(target=self._sequence_loop, args=(ordered,), daemon=True)
+        sequencer.start()
+        
         try:
-            self.stats["total_packets"] += 1
-            
-            if packet.haslayer(Raw):
-                payload = bytes(packet[Raw].load)
+            while True:
+                batch = self.packet_queue.get_batch(self.batch_size)
+                if not batch:
+                    break
                 
-                # キューに追加（キューが満杯の場合はスキップ）
-                if not self.packet_queue.full():
-                    self.packet_queue.put(payload)
-                else:
-                    logger.warning("Packet queue is full, dropping packet")
+                work = []
+                try:
+                    work, seen, repeats = self._prepare_batch(batch)
+                    future = pool.submit([(data, is_trading) for data, is_trading, _, _ in work]) if work else None
+                    ordered.put((work, seen, repeats, future))
+                except Exception as e:
+                    logger.error(f"Process loop error: {e}")
+                    self.metrics.count(COUNTER_ERRORS)
+                    self._release_keys(work)
+        finally:
+            ordered.put(None)
+            sequencer.join()
+            pool.shutdown()
+    
+    def _sequence_loop(self, ordered: "queue.Queue[Optional[tuple]]"):
+        """
+        シーケンサー：投入順にデコード結果を待ち、キャプチャ順でコールバックを呼ぶ
+        
+        Args:
+            ordered: (デコード対象, キャッシュにヒットした出品情報, バッチ内の再送, Future) のFIFO。Noneで終了
+        """
+        while True:
+            item = ordered.get()
+            if item is None:
+                break
+            
+            work, seen, repeats, future = item
+            try:
+                results = future.result() if future is not None else []
+                self._emit_batch(work, results, seen, repeats)
+            except Exception as e:
+                logger.error(f"Sequencer error: {e}")
+                self.metrics.count(COUNTER_ERRORS)
+                self._release_keys(work)
+    
+    def _packet_handler(self, timestamp: float, segment: Optional[TcpSegment]):
+        """
+        バックエンドから受け取ったパケットのハンドラー
+        
+        Args:
+            timestamp: キャプチャ時刻（UNIX秒）
+            segment: TCPセグメント（ペイロードもFIN/RSTもない場合はNone）
+        """
+        try:
+            self.metrics.count(STAGE_CAPTURED)
+            
+            if segment is not None:
+                self._handle_segment(
+                    segment.flow, segment.seq, segment.payload, timestamp, segment.flags
+                )
         
         except Exception as e:
             logger.error(f"Packet handler error: {e}")
-            self.stats["errors"] += 1
+            self.metrics.count(COUNTER_ERRORS)
+    
+    def _handle_segment(
+        self,
+        flow: Flow,
+        seq: int,
+        payload: bytes,
+        timestamp: float,
+        flags: int = 0
+    ):
+        """
+        TCPセグメントを分類し、必要なフレームだけをキューに追加
+        
+        キャプチャスレッドで実行されるため、ゲーム以外のフローは再構築前に破棄し、
+        未判定のフローからは取引所パケットだけを通します。再構築したフレームは
+        メッセージに分解し（圧縮されたものは展開）、メッセージ単位でキューに追加します。
+        
+        Args:
+            flow: セグメントのフロー
+            seq: TCPシーケンス番号
+            payload: TCPペイロード
+            timestamp: キャプチャ時刻（UNIX秒）
+            flags: TCPフラグ
+        """
+        category = self._classify_flow(flow)
+        if category == FLOW_NON_GAME:
+            self.metrics.count(STAGE_FILTERED)
+            self.metrics.count(FILTERED_COUNTERS[FLOW_NON_GAME])
+            return
+        if self._pinned_flows:
+            self._pinned_seen_at = time.monotonic()
+        
+        # セグメントを再構築し、完成したフレームだけを扱う
+        frames = self.reassembler.feed(flow, seq, payload, timestamp, flags)
+        self._queue_frames(flow, category, frames, timestamp)
+        
+        # 固定したゲーム接続が閉じたら、再接続を拾えるようにフィルタを戻す
+        if flags & (TCP_FIN | TCP_RST) and flow in self._pinned_flows:
+            self.unpin_flow()
+    
+    def _queue_frames(self, flow: Flow, category: str, frames: List[bytes], timestamp: float):
+        """
+        再構築したフレームをメッセージに分解し、取引所のメッセージ（と判定済みのゲーム接続の
+        メッセージ）をキューに追加
+        
+        Args:
+            flow: フレームのフロー
+            category: フローの分類
+            frames: 再構築したフレーム
+            timestamp: キャプチャ時刻（UNIX秒）
+        """
+        for frame in frames:
+            for message in self.frame_parser.parse(frame):
+                data = message.data
+                is_trading = self.message_router.is_trading(message)
+                
+                if is_trading:
+                    if flow not in self._pinned_flows:
+                        self.pin_flow(flow)
+                    if self.archive is not None:
+                        self.archive.append(timestamp, flow, data)
+                elif category == FLOW_UNKNOWN:
+                    self.metrics.count(STAGE_FILTERED)
+                    self.metrics.count(FILTERED_COUNTERS[FLOW_UNKNOWN])
+                    continue
+                
+                # キューに追加（満杯時の破棄と集計はキューのポリシーに従う）
+                if self.packet_queue.put(data, is_trading, time.perf_counter()):
+                    self.metrics.count(STAGE_QUEUED)
     
-    def _process_packet(self, packet_data: bytes):
-        """パケットを処理"""
+    def _flush_reassembler(self):
+        """停止時に、再構築の途中で残ったデータをそのフローの最後のキャプチャ時刻でキューに追加"""
         try:
-            # 取引所パケットかチェック
-            if not self.decoder.is_trading_packet(packet_data):
-                return
+            for flow, frame, last_seen in self.reassembler.flush():
+                category = self._classify_flow(flow)
+                if category != FLOW_NON_GAME:
+                    self._queue_frames(flow, category, [frame], last_seen)
+        except Exception as e:
+            logger.error(f"Reassembler flush error: {e}")
+            self.metrics.count(COUNTER_ERRORS)
+    
+    def _classify_flow(self, flow: Flow) -> str:
+        """
+        フローを分類
+        
+        Args:
+            flow: 分類するフロー
+            
+        Returns:
+            FLOW_GAME / FLOW_UNKNOWN / FLOW_NON_GAME
+        """
+        if self._pinned_flows:
+            return FLOW_GAME if flow in self._pinned_flows else FLOW_NON_GAME
+        
+        if self.game_server_ip and self.game_server_ip not in (flow.src_ip, flow.dst_ip):
+            return FLOW_NON_GAME
+        if self.game_server_port and self.game_server_port not in (flow.src_port, flow.dst_port):
+            return FLOW_NON_GAME
+        
+        if self.game_server_ip or self.game_server_port:
+            return FLOW_GAME
+        return FLOW_UNKNOWN
+    
+    def pin_flow(self, flow: Flow):
+        """
+        フローをゲーム接続として固定し、キャプチャフィルタを絞り込む
+        
+        Args:
+            flow: 取引所パケットを送ってきたフロー（サーバー -> クライアント）
+        """
+        self.pinned_flow = flow
+        self._pinned_flows = frozenset((flow, flow.reversed()))
+        self._pinned_seen_at = time.monotonic()
+        self._filter_changed = True
+        self.stats["pinned_flow"] = f"{flow.src_ip}:{flow.src_port} -> {flow.dst_ip}:{flow.dst_port}"
+        logger.info(f"Pinned game connection: {self.stats['pinned_flow']}")
+    
+    def unpin_flow(self):
+        """固定したゲーム接続を解除し、キャプチャフィルタを元に戻す"""
+        if self.pinned_flow is None:
+            return
+        logger.info(f"Unpinned game connection: {self.stats['pinned_flow']}")
+        self.pinned_flow = None
+        self._pinned_flows = frozenset()
+        self._filter_changed = True
+        self.stats["pinned_flow"] = None
+    
+    def _prepare_batch(self, batch: List[tuple]) -> Tuple[List[tuple], List[ItemListing], List[bytes]]:
+        """
+        取り出したフレームからデコードが必要なものを選ぶ
+        
+        キューでの待ち時間を記録し、重複排除キャッシュにヒットしたフレームは
+        デコード対象から外してキャッシュした出品情報を返します。
+        同じバッチ内や、デコード中の先のバッチに入っている再送は最初の1件だけをデコードし、
+        残りは結果の登録後にキャッシュから引きます（シーケンサーは投入順に出力するため、
+        後のバッチを出力する時点で先のバッチの結果は登録済み）。
+        
+        Args:
+            batch: (フレーム, 取引所パケットか, 到着時刻) のリスト
             
-            self.stats["trading_packets"] += 1
+        Returns:
+            (デコード対象の (フレーム, 取引所パケットか, 到着時刻, キャッシュキー) のリスト,
+             キャッシュにヒットした出品情報, デコード中のフレームの再送のキャッシュキー)
+        """
+        work: List[tuple] = []
+        seen: List[ItemListing] = []
+        repeats: List[bytes] = []
+        inflight = self._inflight_keys
+        
+        # キューでの待ち時間
+        dequeued_at = time.perf_counter()
+        for _packet_data, _is_trading, arrived_at in batch:
+            self.metrics.observe(STAGE_QUEUED, dequeued_at - arrived_at)
+        
+        for packet_data, is_trading, arrived_at in batch:
+            key = None
+            if self.payload_cache is not None and is_trading is not False:
+                match = self.decoder.find_magic(packet_data)
+                if match is not None:
+                    key = self.payload_cache.key(packet_data, match.end)
+                    if key in inflight:
+                        repeats.append(key)
+                        continue
+                    cached = self.payload_cache.get(key)
+                    if cached is not None:
+                        self.metrics.count(COUNTER_DEDUPED)
+                        seen.extend(cached)
+                        continue
+                    inflight.add(key)
+            work.append((packet_data, is_trading, arrived_at, key))
+        
+        return work, seen, repeats
+    
+    def _process_batch(self, batch: List[tuple]):
+        """
+        取り出したフレームを処理スレッドでまとめて処理（ワーカーを使わない場合）
+        
+        Args:
+            batch: (フレーム, 取引所パケットか, 到着時刻) のリスト
+        """
+        work, seen, repeats = self._prepare_batch(batch)
+        try:
+            results = decode_frames(self.decoder, [(data, is_trading) for data, is_trading, _, _ in work])
+            self._emit_batch(work, results, seen, repeats)
+        finally:
+            self._release_keys(work)
+    
+    def _emit_batch(
+        self,
+        work: List[tuple],
+        results: List[DecodeResult],
+        seen: List[ItemListing],
+        repeats: List[bytes] = ()
+    ):
+        """
+        デコード結果をコールバックに渡す
+        
+        見つかった出品情報を1回の ``on_listing_found`` にまとめて渡します。
+        重複排除キャッシュにヒットしたフレームの出品情報は ``on_listings_seen`` にまとめて渡します。
+        
+        Args:
+            work: _prepare_batch が返したデコード対象
+            results: work と同じ順序のデコード結果
+            seen: キャッシュにヒットした出品情報
+            repeats: デコード中のフレームの再送のキャッシュキー
+        """
+        listings: List[ItemListing] = []
+        arrivals: List[float] = []
+        
+        for (_packet_data, _is_trading, arrived_at, key), (trading_packet, seconds, error) in zip(work, results):
+            if error is not None:
+                logger.error(f"Packet processing error: {error}")
+                self.metrics.count(COUNTER_ERRORS)
+                self.callback.on_error(error)
+                continue
+            if trading_packet is None:
+                continue
             
-            # デコード
-            trading_packet = self.decoder.decode_trading_packet(packet_data)
+            self.metrics.observe(STAGE_DECODED, seconds)
+            self.metrics.count(STAGE_DECODED)
+            if key is not None:
+                self.payload_cache.put(key, trading_packet.listings or [])
             
-            # コールバック呼び出し
-            self.callback.on_packet_captured(trading_packet)
+            try:
+                self.callback.on_packet_captured(trading_packet)
+            except Exception as e:
+                logger.error(f"Packet callback error: {e}")
+                self.metrics.count(COUNTER_ERRORS)
+                self.callback.on_error(e)
             
-            # 出品情報が見つかった場合
             if trading_packet.listings:
-                self.stats["listings_found"] += len(trading_packet.listings)
-                self.callback.on_listing_found(trading_packet.listings)
-                
-                logger.info(
-                    f"Found {len(trading_packet.listings)} listings in packet"
-                )
+                listings.extend(trading_packet.listings)
+                arrivals.append(arrived_at)
+        # 結果をキャッシュに入れてから外す（外した後に届いた再送はキャッシュにヒットする）
+        self._release_keys(work)
+        
+        for key in repeats:
+            cached = self.payload_cache.get(key)
+            if cached is not None:
+                self.metrics.count(COUNTER_DEDUPED)
+                seen.extend(cached)
+        
+        if seen:
+            try:
+                self.callback.on_listings_seen(seen, datetime.now())
+            except Exception as e:
+                logger.error(f"Listing seen callback error: {e}")
+                self.metrics.count(COUNTER_ERRORS)
+        
+        if not listings:
+            return
         
+        self.metrics.count(COUNTER_LISTINGS, len(listings))
+        now = time.perf_counter()
+        for arrived_at in arrivals:
+            self.metrics.observe(HISTOGRAM_LISTING, now - arrived_at)
+        
+        try:
+            self.callback.on_listing_found(listings)
         except Exception as e:
-            logger.error(f"Packet processing error: {e}")
-            self.stats["errors"] += 1
+            logger.error(f"Listing callback error: {e}")
+            self.metrics.count(COUNTER_ERRORS)
             self.callback.on_error(e)
+        
+        logger.info(f"Found {len(listings)} listings in {len(arrivals)} packets")
+    
+    def _release_keys(self, work: List[tuple]):
+        """デコードを終えた（または投入できなかった）フレームのキャッシュキーをデコード中から外す"""
+        for _packet_data, _is_trading, _arrived_at, key in work:
+            if key is not None:
+                self._inflight_keys.discard(key)
     
     def _build_capture_filter(self) -> str:
         """キャプチャフィルタを構築"""
         filters = ["tcp"]
         
+        # 固定したゲーム接続だけに絞り込む
+        if self.pinned_flow is not None:
+            flow = self.pinned_flow
+            filters.append(f"host {flow.src_ip} and port {flow.src_port}")
+            filters.append(f"host {flow.dst_ip} and port {flow.dst_port}")
+            return " and ".join(filters)
+        
         if self.game_server_ip:
             filters.append(f"host {self.game_server_ip}")
         
@@ -227,21 +827,65 @@ class RealtimePacketCapture:
     def _log_stats(self):
         """統計情報をログ出力"""
         if self.stats["start_time"]:
-            duration = (datetime.now() - self.stats["start_time"]).total_seconds()
+            stats = self.get_stats()
             
             logger.info("=== Capture Statistics ===")
-            logger.info(f"Duration: {duration:.2f}s")
-            logger.info(f"Total packets: {self.stats['total_packets']}")
-            logger.info(f"Trading packets: {self.stats['trading_packets']}")
-            logger.info(f"Listings found: {self.stats['listings_found']}")
-            logger.info(f"Errors: {self.stats['errors']}")
+            logger.info(f"Duration: {stats['duration']:.2f}s")
+            logger.info(f"Total packets: {stats['total_packets']}")
+            logger.info(f"Trading packets: {stats['trading_packets']}")
+            logger.info(f"Listings found: {stats['listings_found']}")
+            logger.info(f"Errors: {stats['errors']}")
+            logger.info(f"Filtered: {stats['filtered']}")
+            if "dedupe" in stats:
+                logger.info(f"Dedupe hit rate: {stats['dedupe']['hit_rate']:.1%} "
+                            f"({stats['dedupe']['hits']} hits)")
+            
+            queue_stats = stats["queue"]
+            logger.info(f"Queue high-water mark: {queue_stats['high_water_items']} frames, "
+                        f"{queue_stats['high_water_bytes']} bytes")
+            logger.info(f"Queue dropped ({queue_stats['policy']}): {queue_stats['dropped']}")
+            
+            for name, latency in stats["latency"].items():
+                if latency["count"]:
+                    logger.info(f"Latency {name}: p50={latency['p50_ms']:.3f}ms "
+                                f"p99={latency['p99_ms']:.3f}ms max={latency['max_ms']:.3f}ms")
             
-            if duration > 0:
-                logger.info(f"Packets/sec: {self.stats['total_packets'] / duration:.2f}")
+            if stats["duration"] > 0:
+                logger.info(f"Packets/sec: {stats['packets_per_second']:.2f}")
     
     def get_stats(self) -> dict:
-        """統計情報を取得"""
+        """
+        統計情報を取得
+        
+        Returns:
+            合計値に加え、ステージごとのカウンタ（合計・1秒/60秒レート）と
+            レイテンシのパーセンタイルを含む辞書
+        """
+        metrics = self.metrics.snapshot()
+        counters = metrics["counters"]
+        
         stats = self.stats.copy()
+        stats["total_packets"] = counters[STAGE_CAPTURED]["total"]
+        stats["trading_packets"] = counters[STAGE_DECODED]["total"]
+        stats["listings_found"] = counters[COUNTER_LISTINGS]["total"]
+        stats["errors"] = counters[COUNTER_ERRORS]["total"]
+        stats["filtered"] = {
+            category: counters[name]["total"] for category, name in FILTERED_COUNTERS.items()
+        }
+        stats["stages"] = {stage: counters[stage] for stage in STAGES}
+        stats["latency"] = metrics["latency"]
+        stats["queue"] = self.packet_queue.get_stats()
+        if self.payload_cache is not None:
+            stats["dedupe"] = self.payload_cache.get_stats()
+        if self.archive is not None:
+            stats["archive"] = self.archive.get_stats()
+        sinks = self.callback.get_stats()
+        if sinks:
+            stats["sinks"] = sinks
+        if isinstance(self.backend, CaptureBackend):
+            stats["backend"] = dict(self.backend.get_stats(), name=self.backend.name)
+        stats["reassembly"] = dict(self.reassembler.stats, active_flows=self.reassembler.active_flows)
+        stats["frames"] = dict(self.frame_parser.get_stats(), routing=self.message_router.get_stats())
         
         if stats["start_time"]:
             stats["duration"] = (datetime.now() - stats["start_time"]).total_seconds()
@@ -254,52 +898,82 @@ class RealtimePacketCapture:
 
 
 class DatabaseCallback(RealtimeCaptureCallback):
-    """データベースに自動保存するコールバック"""
+    """
+    データベースに自動保存するコールバック
+    
+    書き込みは専用スレッドの ListingWriter（database.writer）が行います。
+    通知はキューに入れるだけで戻るため、コミット待ちがデコードを止めません。
+    出品情報は ``flush_rows`` 行に達するか最初の行から ``flush_interval`` 秒経つとまとめてコミットされ、
+    ``seen_filter`` を指定すると同じ価格・数量で保存済みの出品は最終確認時刻の更新だけになります。
+    """
     
-    def __init__(self, db_session):
+    def __init__(
+        self,
+        database: Union[str, Callable, None] = None,
+        metrics: Optional[PipelineMetrics] = None,
+        flush_rows: int = 500,
+        flush_interval: float = 0.25,
+        seen_filter=None,
+        seen_interval: float = 5.0,
+        writer=None
+    ):
         """
         Args:
-            db_session: SQLAlchemyのセッション
+            database: データベースURL、または書き込みスレッドで呼び出すセッションの生成関数
+                （sessionmaker 等。呼び出し側とセッションを共有しないよう、セッション自体は受け付けない。
+                writer を指定する場合は不要）
+            metrics: 保存件数と所要時間を記録するメトリクス（省略可）
+            flush_rows: この行数が溜まったら書き込む
+            flush_interval: 最初の行を溜めてから書き込むまでの最大時間（秒）
+            seen_filter: 保存済み出品のフィルタ（database.seen_filter.SeenListingFilter）
+            seen_interval: 最終確認時刻の更新だけが溜まっている場合に書き込むまでの最大時間（秒）
+            writer: 書き込みに使うListingWriter（省略時は database からライターを作成）
+            
+        Raises:
+            ValueError: database も writer も指定されていない場合
+            TypeError: database がURLでもセッションの生成関数でもない場合（セッション等）
         """
-        self.db = db_session
+        if writer is None:
+            from ..database.writer import ListingWriter
+            
+            if database is None:
+                raise ValueError("database or writer is required")
+            options = dict(
+                flush_rows=flush_rows,
+                flush_interval=flush_interval,
+                seen_filter=seen_filter,
+                seen_interval=seen_interval,
+                metrics=metrics,
+            )
+            if isinstance(database, str):
+                writer = ListingWriter.for_url(database, **options)
+            elif callable(database):
+                writer = ListingWriter(database, **options)
+            else:
+                raise TypeError(
+                    f"database must be a URL or a session factory, not {type(database).__name__}"
+                )
+        self.writer = writer
     
     def on_listing_found(self, listings: List[ItemListing]):
-        """出品情報をデータベースに保存"""
-        from ..database.models import Item, Listing
-        
-        try:
-            for listing_data in listings:
-                # アイテムを取得または作成
-                item = self.db.query(Item).filter(
-                    Item.id == listing_data.item_id
-                ).first()
-                
-                if not item:
-                    item = Item(
-                        id=listing_data.item_id,
-                        name=listing_data.item_name
-                    )
-                    self.db.add(item)
-                
-                # リスティングを作成
-                listing = Listing(
-                    id=int(listing_data.listing_id),
-                    item_id=listing_data.item_id,
-                    quantity=listing_data.quantity,
-                    price=listing_data.price,
-                    unit_price=listing_data.price // listing_data.quantity 
-                        if listing_data.quantity > 0 else listing_data.price,
-                    seller_name=listing_data.seller_name,
-                    captured_at=listing_data.timestamp
-                )
-                self.db.add(listing)
-            
-            self.db.commit()
-            logger.info(f"Saved {len(listings)} listings to database")
-            
-        except Exception as e:
-            self.db.rollback()
-            logger.error(f"Database save error: {e}")
+        """出品情報を書き込みキューに追加"""
+        self.writer.submit(listings)
+    
+    def on_listings_seen(self, listings: List[ItemListing], seen_at: datetime):
+        """再びキャプチャされた出品情報のキャプチャ日時の更新を書き込みキューに追加"""
+        self.writer.submit_seen(listings, seen_at)
+    
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """ここまでの出品情報を書き込み終えるまで待つ"""
+        return self.writer.sync(timeout)
+    
+    def close(self):
+        """キューに残った出品情報をすべて書き込んでから停止"""
+        self.writer.close()
+    
+    def get_stats(self) -> dict:
+        """書き込みの統計情報（キューの深さ・コミットのレイテンシ等）"""
+        return {"database_writer": self.writer.get_stats()}
     
     def on_error(self, error: Exception):
         """エラーをログ出力"""
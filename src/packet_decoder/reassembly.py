@@ -0,0 +1,301 @@
+"""
+TCP stream reassembly
+TCPストリームの再構築
+
+大きな板情報ページは複数のTCPセグメントに分割されて届くため、
+セグメント単位でデコードするとマジックバイトを見逃したり途中で切れたりします。
+このモジュールはフロー（4タプル）ごとにシーケンス番号順でデータを並べ直し、
+再送・欠落を処理したうえで、アプリケーションフレーム単位でデコーダーに渡します。
+"""
+import struct
+import logging
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+from .pcap_reader import Flow, TCP_FIN, TCP_RST
+
+logger = logging.getLogger(__name__)
+
+SEQ_MODULO = 1 << 32
+
+# ゲームプロトコルのフレーム長の上限（これを超える長さヘッダーは非同期とみなす）
+DEFAULT_MAX_FRAME_SIZE = 1 << 20
+
+# フレームヘッダー: 4バイトのビッグエンディアン長（ヘッダー自身を含む）
+FRAME_LENGTH_HEADER = struct.Struct('>I')
+FRAME_MIN_SIZE = 6
+
+FrameSplitter = Callable[[bytearray], Tuple[List[bytes], int]]
+
+
+def split_length_prefixed(
+    buffer: bytearray,
+    max_frame_size: int = DEFAULT_MAX_FRAME_SIZE
+) -> Tuple[List[bytes], int]:
+    """
+    長さプレフィックス付きフレームを切り出す
+
+    長さヘッダーが妥当でない場合（キャプチャ途中からの参加や非フレーム化の
+    トラフィック）は、バッファ全体を1つのチャンクとしてそのまま返し、
+    次のセグメント境界で再同期します。
+
+    Args:
+        buffer: 順序が整ったストリームデータ
+        max_frame_size: 1フレームの最大サイズ
+
+    Returns:
+        (完成したフレームのリスト, 消費したバイト数)
+    """
+    frames = []
+    offset = 0
+    length = len(buffer)
+
+    while offset + FRAME_LENGTH_HEADER.size <= length:
+        frame_size = FRAME_LENGTH_HEADER.unpack_from(buffer, offset)[0]
+        if frame_size < FRAME_MIN_SIZE or frame_size > max_frame_size:
+            # 非同期: 残りをそのまま渡す
+            frames.append(bytes(buffer[offset:]))
+            return frames, length
+        if offset + frame_size > length:
+            break
+        frames.append(bytes(buffer[offset:offset + frame_size]))
+        offset += frame_size
+
+    return frames, offset
+
+
+class _FlowState:
+    """フローごとの再構築状態"""
+
+    __slots__ = ("next_seq", "buffer", "pending", "pending_bytes", "last_seen")
+
+    def __init__(self, seq: int, timestamp: float):
+        self.next_seq = seq
+        self.buffer = bytearray()
+        self.pending: Dict[int, bytes] = {}
+        self.pending_bytes = 0
+        self.last_seen = timestamp
+
+
+class TcpReassembler:
+    """
+    フローごとのTCPストリーム再構築
+
+    - シーケンス番号順に並べ直し、順序外セグメントは保留
+    - 再送（重複・部分重複）は切り詰めて破棄
+    - 保留データが上限を超えた場合は欠落とみなして先へ進める
+    - フローごとのメモリ上限とアイドルフローの追い出し
+    """
+
+    def __init__(
+        self,
+        frame_splitter: Optional[FrameSplitter] = None,
+        max_buffer_bytes: int = 4 * 1024 * 1024,
+        max_pending_bytes: int = 1024 * 1024,
+        idle_timeout: float = 120.0,
+        max_flows: int = 1024
+    ):
+        """
+        Args:
+            frame_splitter: フレーム分割関数（省略時は長さプレフィックス形式）
+            max_buffer_bytes: フローごとの未完成フレームの最大サイズ
+            max_pending_bytes: フローごとの順序外セグメントの最大保留量
+            idle_timeout: この秒数データがないフローを追い出す
+            max_flows: 同時に追跡するフローの最大数
+        """
+        self.frame_splitter = frame_splitter or split_length_prefixed
+        self.max_buffer_bytes = max_buffer_bytes
+        self.max_pending_bytes = max_pending_bytes
+        self.idle_timeout = idle_timeout
+        self.max_flows = max_flows
+
+        self._flows: "OrderedDict[Flow, _FlowState]" = OrderedDict()
+        self._last_eviction = 0.0
+
+        self.stats = {
+            "segments": 0,
+            "frames": 0,
+            "retransmissions": 0,
+            "out_of_order": 0,
+            "gaps": 0,
+            "overflows": 0,
+            "evicted_flows": 0,
+            "dropped_bytes": 0,
+        }
+
+    @property
+    def active_flows(self) -> int:
+        """追跡中のフロー数"""
+        return len(self._flows)
+
+    def feed(
+        self,
+        flow: Flow,
+        seq: int,
+        payload: bytes,
+        timestamp: float = 0.0,
+        flags: int = 0
+    ) -> List[bytes]:
+        """
+        セグメントを投入し、完成したフレームを返す
+
+        Args:
+            flow: TCPフロー
+            seq: シーケンス番号
+            payload: TCPペイロード
+            timestamp: キャプチャ時刻（アイドル判定用）
+            flags: TCPフラグ
+
+        Returns:
+            完成したアプリケーションフレームのリスト
+        """
+        self.stats["segments"] += 1
+
+        if timestamp - self._last_eviction >= self.idle_timeout / 2:
+            self.evict_idle(timestamp)
+            self._last_eviction = timestamp
+
+        state = self._flows.get(flow)
+        if state is None:
+            if len(self._flows) >= self.max_flows:
+                self._evict(next(iter(self._flows)))
+            state = _FlowState(seq, timestamp)
+            self._flows[flow] = state
+        else:
+            self._flows.move_to_end(flow)
+            state.last_seen = timestamp
+
+        if payload:
+            self._insert(state, seq, payload)
+
+        frames = self._split(state)
+
+        if flags & (TCP_FIN | TCP_RST):
+            frames.extend(self._close(flow))
+
+        return frames
+
+    def _insert(self, state: _FlowState, seq: int, payload: bytes):
+        """セグメントを順序どおりにバッファへ追加"""
+        delta = (seq - state.next_seq) % SEQ_MODULO
+        if delta >= SEQ_MODULO // 2:
+            delta -= SEQ_MODULO
+
+        if delta < 0:
+            # 再送または部分重複
+            if -delta >= len(payload):
+                self.stats["retransmissions"] += 1
+                return
+            payload = payload[-delta:]
+            delta = 0
+
+        if delta > 0:
+            # 順序外: 保留する
+            self.stats["out_of_order"] += 1
+            if seq not in state.pending:
+                state.pending[seq] = payload
+                state.pending_bytes += len(payload)
+            if state.pending_bytes > self.max_pending_bytes:
+                self._skip_gap(state)
+            return
+
+        state.buffer += payload
+        state.next_seq = (state.next_seq + len(payload)) % SEQ_MODULO
+        self._drain_pending(state)
+
+    def _drain_pending(self, state: _FlowState):
+        """保留中のセグメントのうち連続したものをバッファへ移す"""
+        while state.pending:
+            progressed = False
+            for seq in list(state.pending):
+                delta = (seq - state.next_seq) % SEQ_MODULO
+                if delta >= SEQ_MODULO // 2:
+                    delta -= SEQ_MODULO
+                if delta > 0:
+                    continue
+                payload = state.pending.pop(seq)
+                state.pending_bytes -= len(payload)
+                if -delta < len(payload):
+                    state.buffer += payload[-delta:]
+                    state.next_seq = (seq + len(payload)) % SEQ_MODULO
+                    progressed = True
+                else:
+                    self.stats["retransmissions"] += 1
+            if not progressed:
+                return
+
+    def _skip_gap(self, state: _FlowState):
+        """欠落したデータを諦めて、保留中の最小シーケンスまで進める"""
+        self.stats["gaps"] += 1
+        self.stats["dropped_bytes"] += len(state.buffer)
+        # 途中までのフレームは完成しないので破棄し、次の境界で再同期する
+        state.buffer.clear()
+        state.next_seq = min(
+            state.pending,
+            key=lambda s: (s - state.next_seq) % SEQ_MODULO
+        )
+        self._drain_pending(state)
+
+    def _split(self, state: _FlowState) -> List[bytes]:
+        """バッファから完成したフレームを切り出す"""
+        if not state.buffer:
+            return []
+
+        frames, consumed = self.frame_splitter(state.buffer)
+        if consumed:
+            del state.buffer[:consumed]
+
+        if len(state.buffer) > self.max_buffer_bytes:
+            self.stats["overflows"] += 1
+            self.stats["dropped_bytes"] += len(state.buffer)
+            state.buffer.clear()
+
+        self.stats["frames"] += len(frames)
+        return frames
+
+    def _close(self, flow: Flow) -> List[bytes]:
+        """フローを閉じ、残りのデータを返す"""
+        state = self._flows.pop(flow, None)
+        if state is None or not state.buffer:
+            return []
+        self.stats["frames"] += 1
+        return [bytes(state.buffer)]
+
+    def _evict(self, flow: Flow):
+        """フローを追い出す（未完成のデータは破棄）"""
+        state = self._flows.pop(flow)
+        self.stats["evicted_flows"] += 1
+        self.stats["dropped_bytes"] += len(state.buffer) + state.pending_bytes
+
+    def evict_idle(self, now: float) -> int:
+        """
+        アイドル状態のフローを追い出す
+
+        Args:
+            now: 現在時刻（キャプチャ時刻）
+
+        Returns:
+            追い出したフロー数
+        """
+        idle = [
+            flow for flow, state in self._flows.items()
+            if now - state.last_seen > self.idle_timeout
+        ]
+        for flow in idle:
+            self._evict(flow)
+        if idle:
+            logger.debug(f"Evicted {len(idle)} idle flows")
+        return len(idle)
+
+    def flush(self) -> List[Tuple[Flow, bytes, float]]:
+        """
+        全フローの残りデータを吐き出す（キャプチャ終了時用）
+
+        Returns:
+            (フロー, 残っていたデータ, そのフローの最後のキャプチャ時刻) のリスト
+        """
+        remaining = []
+        for flow in list(self._flows):
+            last_seen = self._flows[flow].last_seen
+            remaining.extend((flow, data, last_seen) for data in self._close(flow))
+        return remaining
@@ -0,0 +1,343 @@
+"""
+Schema-driven trading message decoder
+スキーマ駆動の取引所メッセージデコーダー
+
+宣言したメッセージスキーマ（フィールド番号 -> ItemListingの属性）に従って
+Protobufのリスティングをデコードします。値の範囲からフィールドを推測する
+ヒューリスティックと違い、フィールド番号の辞書引き1回で値を割り当て、
+未知のフィールドは ``scan_fields`` が長さだけ見て読み飛ばします。
+"""
+import hashlib
+import json
+import logging
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from .packet_types import ItemListing
+from .protobuf import WIRE_LENGTH_DELIMITED, scan_fields
+
+logger = logging.getLogger(__name__)
+
+# フィールドの型
+TYPE_UINT = "uint"            # varint / fixed32 / fixed64
+TYPE_BOOL = "bool"
+TYPE_STRING = "string"
+TYPE_TIMESTAMP = "timestamp"  # UNIX時刻（秒またはミリ秒。変換は to_item_listing で行う）
+FIELD_TYPES = (TYPE_UINT, TYPE_BOOL, TYPE_STRING, TYPE_TIMESTAMP)
+
+# ミリ秒のUNIX時刻とみなす境界
+_MILLISECONDS_THRESHOLD = 10 ** 12
+
+# リスティングの識別子になる属性（先にあるものを優先）
+KEY_ATTRIBUTES = ("listing_id", "guid")
+# 識別子がないエントリにメッセージのバイト列から作るキーの接頭辞
+DERIVED_KEY_PREFIX = "entry:"
+
+
+class FieldPath(NamedTuple):
+    """属性の位置（ネストしたメッセージのフィールド番号の列）と型"""
+    path: Tuple[int, ...]
+    type: str = TYPE_UINT
+
+
+@dataclass
+class ListingSchema:
+    """
+    リスティングメッセージのスキーマ
+
+    ``entry_field`` はマジックバイトの後に続くトップレベルメッセージのうち、
+    リスティング（1件分のサブメッセージ）を運ぶフィールドの番号です。
+    Noneの場合はすべてのlength-delimitedフィールドを候補にします。
+    """
+    name: str
+    fields: Dict[str, FieldPath]
+    entry_field: Optional[int] = None
+    required: Tuple[str, ...] = ("item_id", "quantity", "price")
+    version: int = 1
+    metadata: Dict = field(default_factory=dict)
+
+    def __post_init__(self):
+        for attribute, spec in self.fields.items():
+            if not spec.path:
+                raise ValueError(f"Empty field path for {attribute}")
+            if spec.type not in FIELD_TYPES:
+                raise ValueError(f"Unknown field type for {attribute}: {spec.type}")
+        missing = [attribute for attribute in self.required if attribute not in self.fields]
+        if missing:
+            raise ValueError(f"Required attributes are not mapped: {missing}")
+
+    def to_dict(self) -> Dict:
+        """辞書（JSON）形式に変換"""
+        return {
+            "name": self.name,
+            "version": self.version,
+            "entry_field": self.entry_field,
+            "required": list(self.required),
+            "fields": {
+                attribute: {"path": list(spec.path), "type": spec.type}
+                for attribute, spec in self.fields.items()
+            },
+            "metadata": self.metadata,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "ListingSchema":
+        """辞書（JSON）形式から生成"""
+        return cls(
+            name=data["name"],
+            version=data.get("version", 1),
+            entry_field=data.get("entry_field"),
+            required=tuple(data.get("required", ("item_id", "quantity", "price"))),
+            fields={
+                attribute: FieldPath(tuple(spec["path"]), spec.get("type", TYPE_UINT))
+                for attribute, spec in data["fields"].items()
+            },
+            metadata=data.get("metadata", {}),
+        )
+
+    def save(self, path: str):
+        """
+        スキーマファイル（JSON）に書き出す
+
+        Args:
+            path: 出力先のパス
+        """
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=2)
+
+    @classmethod
+    def load(cls, path: str) -> "ListingSchema":
+        """
+        スキーマファイル（JSON）を読み込む
+
+        Args:
+            path: スキーマファイルのパス
+
+        Returns:
+            ListingSchema
+        """
+        with open(path, 'r', encoding='utf-8') as f:
+            schema = cls.from_dict(json.load(f))
+        logger.info(f"Loaded listing schema '{schema.name}' (v{schema.version}) from {path}")
+        return schema
+
+
+# 取引所リスティングの既定スキーマ
+# ExchangeItem { price=1, num=2, itemInfo=3 { configId=1, count=2, bindFlag=3 }, guid=4, noticeTime=5 }
+# ゲームのアップデートで構造が変わった場合はスキーマファイルで差し替える
+DEFAULT_LISTING_SCHEMA = ListingSchema(
+    name="exchange_item",
+    fields={
+        "price": FieldPath((1,)),
+        "quantity": FieldPath((2,)),
+        "item_id": FieldPath((3, 1)),
+        "bind_flag": FieldPath((3, 3), TYPE_BOOL),
+        "guid": FieldPath((4,), TYPE_STRING),
+        "notice_time": FieldPath((5,), TYPE_TIMESTAMP),
+    },
+)
+
+
+class SchemaDecoder:
+    """
+    ListingSchemaに従ってリスティングをデコード
+
+    スキーマはフィールド番号をキーにした木に変換しておき、フィールドごとの処理を
+    辞書引き1回にします。
+    """
+
+    def __init__(self, schema: ListingSchema = DEFAULT_LISTING_SCHEMA):
+        """
+        Args:
+            schema: リスティングのスキーマ
+        """
+        self.schema = schema
+        self._tree: Dict[int, object] = {}
+        for attribute, spec in schema.fields.items():
+            node = self._tree
+            for number in spec.path[:-1]:
+                child = node.setdefault(number, {})
+                if not isinstance(child, dict):
+                    raise ValueError(f"Field {number} is mapped both as a value and as a message")
+                node = child
+            if spec.path[-1] in node:
+                raise ValueError(f"Field path {spec.path} is mapped more than once")
+            node[spec.path[-1]] = (attribute, spec.type)
+        self._required = schema.required
+        self.stats = {
+            "derived_keys": 0,
+        }
+
+    def decode_entry(self, data, offset: int = 0, end: Optional[int] = None) -> Optional[Dict]:
+        """
+        リスティング1件分のメッセージをデコード
+
+        Args:
+            data: バッファ（bytes / memoryview）
+            offset: メッセージの開始位置
+            end: メッセージの終了位置（省略時はバッファ末尾）
+
+        Returns:
+            属性名 -> 値 の辞書。必須属性が欠けている場合はNone
+        """
+        values: Dict = {}
+        self._decode_message(data, offset, len(data) if end is None else end, self._tree, values)
+        for attribute in self._required:
+            if not values.get(attribute):
+                return None
+        return values
+
+    def _decode_message(self, data, offset: int, end: int, tree: Dict, values: Dict):
+        fields = scan_fields(data, offset, end)
+        lookup = tree.get
+        for number, wire_type, value_offset, length, value in fields.iter_fields():
+            target = lookup(number)
+            if target is None:
+                continue
+            if type(target) is dict:
+                if wire_type == WIRE_LENGTH_DELIMITED:
+                    self._decode_message(data, value_offset, value_offset + length, target, values)
+                continue
+            attribute, field_type = target
+            if attribute in values:
+                continue
+            if field_type == TYPE_STRING:
+                if wire_type == WIRE_LENGTH_DELIMITED:
+                    values[attribute] = str(data[value_offset:value_offset + length], 'utf-8', 'ignore')
+            elif wire_type != WIRE_LENGTH_DELIMITED:
+                values[attribute] = bool(value) if field_type == TYPE_BOOL else value
+
+    def iter_entries(self, data, offset: int = 0, end: Optional[int] = None) -> Iterator[Tuple[int, int]]:
+        """
+        トップレベルメッセージからリスティングのサブメッセージの範囲を取り出す
+
+        Args:
+            data: バッファ
+            offset: トップレベルメッセージの開始位置（マジックバイトの直後）
+            end: 終了位置
+
+        Yields:
+            (開始位置, 終了位置)
+        """
+        fields = scan_fields(data, offset, end)
+        entry_field = self.schema.entry_field
+        for number, wire_type, value_offset, length, _value in fields.iter_fields():
+            if wire_type != WIRE_LENGTH_DELIMITED:
+                continue
+            if entry_field is not None and number != entry_field:
+                continue
+            yield value_offset, value_offset + length
+
+    def decode_entries(self, data, offset: int = 0, end: Optional[int] = None) -> List[Dict]:
+        """
+        トップレベルメッセージに含まれるリスティングをすべてデコード
+
+        Returns:
+            decode_entry の結果のリスト（デコードできなかったものは含まない）
+        """
+        entries = []
+        for start, stop in self.iter_entries(data, offset, end):
+            values = self.decode_entry(data, start, stop)
+            if values is not None:
+                entries.append(values)
+        return entries
+
+    def decode_listings(
+        self,
+        data,
+        offset: int = 0,
+        timestamp: Optional[datetime] = None
+    ) -> List[ItemListing]:
+        """
+        トップレベルメッセージに含まれるリスティングをItemListingとしてデコード
+
+        識別子（listing_id / guid）がないエントリには、メッセージのバイト列から
+        決まるキーを付けます（同じ出品の再キャプチャは同じキーになる）。
+
+        Args:
+            data: バッファ
+            offset: トップレベルメッセージの開始位置
+            timestamp: キャプチャ時刻
+
+        Returns:
+            ItemListingのリスト
+        """
+        listings = []
+        for start, stop in self.iter_entries(data, offset):
+            values = self.decode_entry(data, start, stop)
+            if values is None:
+                continue
+            if listing_key_of(values) is None:
+                values["listing_id"] = entry_key(data[start:stop])
+                self.stats["derived_keys"] += 1
+            listings.append(to_item_listing(values, timestamp))
+        return listings
+
+
+def listing_key_of(values: Dict) -> Optional[str]:
+    """
+    decode_entry の結果からリスティングの識別子を取り出す
+
+    Returns:
+        識別子。どの属性もない（空の）場合はNone
+    """
+    for attribute in KEY_ATTRIBUTES:
+        value = values.get(attribute)
+        if value:
+            return str(value)
+    return None
+
+
+def entry_key(entry) -> str:
+    """
+    識別子のないエントリのキーをメッセージのバイト列から作る
+
+    Args:
+        entry: リスティング1件分のメッセージ
+
+    Returns:
+        キー（DERIVED_KEY_PREFIX + BLAKE2bの16進）
+    """
+    return DERIVED_KEY_PREFIX + hashlib.blake2b(bytes(entry), digest_size=8).hexdigest()
+
+
+def to_item_listing(values: Dict, timestamp: Optional[datetime] = None) -> ItemListing:
+    """
+    decode_entry の結果をItemListingに変換
+
+    Args:
+        values: 属性名 -> 値（listing_id または guid が必要）
+        timestamp: キャプチャ時刻（省略時は現在時刻）。notice_time は別の属性に入れる
+
+    Returns:
+        ItemListingオブジェクト
+
+    Raises:
+        ValueError: 識別子がない場合（空のIDで保存すると別の出品同士が上書きし合うため）
+    """
+    listing_id = listing_key_of(values)
+    if listing_id is None:
+        raise ValueError("Listing has no listing_id or guid")
+    notice_time = values.get("notice_time")
+    return ItemListing(
+        listing_id=listing_id,
+        item_id=values["item_id"],
+        item_name=values.get("item_name", ""),
+        quantity=values["quantity"],
+        price=values["price"],
+        seller_id=values.get("seller_id"),
+        seller_name=values.get("seller_name"),
+        timestamp=timestamp or datetime.now(),
+        notice_time=_to_datetime(notice_time) if notice_time else None,
+    )
+
+
+def _to_datetime(value: int) -> Optional[datetime]:
+    """UNIX時刻（秒またはミリ秒）をキャプチャ時刻と同じローカル時刻のdatetimeに変換"""
+    if value >= _MILLISECONDS_THRESHOLD:
+        value /= 1000.0
+    try:
+        return datetime.fromtimestamp(value)
+    except (OverflowError, OSError, ValueError):
+        return None
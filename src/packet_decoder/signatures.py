@@ -0,0 +1,150 @@
+"""
+Message signature registry
+メッセージシグネチャ（マジックバイト）のレジストリ
+
+既知のマーカーを1つのバイト列正規表現にまとめ、ペイロードを1パスで走査して
+全マーカーの出現位置を求めます。各デコーダーはここから位置を受け取るため、
+シグネチャを追加してもペイロードの走査回数は増えません。
+"""
+import re
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence
+
+
+class SignatureMatch(NamedTuple):
+    """シグネチャの一致位置"""
+    name: str
+    start: int
+    end: int
+
+
+class SignatureRegistry:
+    """
+    マジックバイトのレジストリ
+
+    マーカーは長いものから順に照合するため、長いマーカーに含まれる短いマーカー
+    （例: ``00 63 33 53 42 00`` に含まれる ``c3SB``）は長い方として報告されます。
+    """
+
+    def __init__(self, signatures: Optional[Dict[str, bytes]] = None):
+        """
+        Args:
+            signatures: シグネチャ名 -> マーカーのバイト列
+        """
+        self._signatures: Dict[str, bytes] = {}
+        self._pattern: Optional[re.Pattern] = None
+        for name, marker in (signatures or {}).items():
+            self.register(name, marker)
+
+    def register(self, name: str, marker: bytes):
+        """
+        シグネチャを登録（同名の場合は置き換え）
+
+        Args:
+            name: シグネチャ名（Pythonの識別子として有効な名前）
+            marker: マーカーのバイト列
+        """
+        if not name.isidentifier():
+            raise ValueError(f"Invalid signature name: {name}")
+        if not marker:
+            raise ValueError("Signature marker must not be empty")
+        self._signatures[name] = bytes(marker)
+        self._compile()
+
+    def _compile(self):
+        """全シグネチャを1つの正規表現にまとめる"""
+        ordered = sorted(self._signatures.items(), key=lambda item: -len(item[1]))
+        self._pattern = re.compile(b"|".join(
+            b"(?P<" + name.encode() + b">" + re.escape(marker) + b")"
+            for name, marker in ordered
+        ))
+
+    @property
+    def names(self) -> List[str]:
+        """登録されているシグネチャ名"""
+        return list(self._signatures)
+
+    def marker(self, name: str) -> bytes:
+        """シグネチャのマーカーを取得"""
+        return self._signatures[name]
+
+    def find_all(self, data, names: Optional[Iterable[str]] = None) -> List[SignatureMatch]:
+        """
+        全シグネチャの出現位置を1パスで求める
+
+        Args:
+            data: ペイロード（bytes / memoryview / mmap）
+            names: 対象のシグネチャ名（省略時は全て）
+
+        Returns:
+            SignatureMatchのリスト（出現順）
+        """
+        if self._pattern is None:
+            return []
+        wanted = _as_set(names) if names is not None else None
+        return [
+            SignatureMatch(m.lastgroup, m.start(), m.end())
+            for m in self._pattern.finditer(data)
+            if wanted is None or m.lastgroup in wanted
+        ]
+
+    def search(self, data, names: Optional[Iterable[str]] = None) -> Optional[SignatureMatch]:
+        """
+        最初に出現するシグネチャを求める
+
+        Args:
+            data: ペイロード
+            names: 対象のシグネチャ名（省略時は全て）
+
+        Returns:
+            SignatureMatch。見つからない場合はNone
+        """
+        if self._pattern is None:
+            return None
+        if names is None:
+            m = self._pattern.search(data)
+            return SignatureMatch(m.lastgroup, m.start(), m.end()) if m else None
+        wanted = _as_set(names)
+        for m in self._pattern.finditer(data):
+            if m.lastgroup in wanted:
+                return SignatureMatch(m.lastgroup, m.start(), m.end())
+        return None
+
+    def search_preferred(self, data, preference: Sequence[str]) -> Optional[SignatureMatch]:
+        """
+        優先順位に従ってシグネチャを選ぶ（走査は1パス）
+
+        優先度の高いシグネチャがどこかに出現すればその最初の位置を、
+        なければ次の優先度のシグネチャの最初の位置を返します。
+
+        Args:
+            data: ペイロード
+            preference: 優先度の高い順のシグネチャ名
+
+        Returns:
+            SignatureMatch。見つからない場合はNone
+        """
+        first: Dict[str, SignatureMatch] = {}
+        for match in self.find_all(data, preference):
+            if match.name == preference[0]:
+                return match
+            first.setdefault(match.name, match)
+        for name in preference:
+            if name in first:
+                return first[name]
+        return None
+
+
+def _as_set(names: Iterable[str]):
+    """呼び出しごとにsetを作らないよう、既にsetならそのまま使う"""
+    return names if isinstance(names, (set, frozenset)) else set(names)
+
+
+# 取引所パケットのマジックバイト
+TRADING_CENTER_MAGIC = bytes([0x00, 0x63, 0x33, 0x53, 0x42, 0x00])
+TRADING_CENTER_MAGIC_SHORT = b'c3SB'
+
+# 全パーサーで共有するデフォルトのレジストリ
+signatures = SignatureRegistry({
+    "trading_center": TRADING_CENTER_MAGIC,
+    "trading_center_short": TRADING_CENTER_MAGIC_SHORT,
+})
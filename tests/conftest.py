@@ -0,0 +1,19 @@
+"""
+Shared pytest fixtures
+テスト共通のフィクスチャ
+"""
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from src.database.models import Base
+
+
+@pytest.fixture
+def session():
+    """テーブルを作成したインメモリSQLiteのセッション"""
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        yield session
+    engine.dispose()
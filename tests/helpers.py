@@ -0,0 +1,138 @@
+"""
+Test helpers for building synthetic captures
+テスト用の合成キャプチャと共通のテスト部品を生成するヘルパー
+"""
+import socket
+import struct
+
+from src.packet_decoder.decoder import TradingCenterDecoder
+from src.packet_decoder.packet_types import ItemListing
+
+LISTING_RECORD_SIZE = 64
+
+
+def build_listing_record(listing_id, item_id, quantity, price, name="テストアイテム"):
+    """固定長64バイトのリスティングレコードを生成"""
+    name_bytes = name.encode('utf-8')
+    record = struct.pack('<QIIQH', listing_id, item_id, quantity, price, len(name_bytes)) + name_bytes
+    return record.ljust(LISTING_RECORD_SIZE, b'\x00')
+
+
+def build_trading_payload(listings, prefix=b'\x01\x02'):
+    """取引所パケットのペイロードを生成"""
+    body = b''.join(build_listing_record(*listing) for listing in listings)
+    return prefix + TradingCenterDecoder.TRADING_CENTER_MAGIC + struct.pack('<I', len(listings)) + body
+
+
+def build_tcp_frame(payload, src=("10.0.0.1", 5000), dst=("10.0.0.2", 40000), seq=1, flags=0x18):
+    """Ethernet/IPv4/TCPフレームを生成"""
+    tcp = struct.pack('!HHIIBBHHH', src[1], dst[1], seq, 0, 5 << 4, flags, 65535, 0, 0)
+    total_length = 20 + len(tcp) + len(payload)
+    ip = struct.pack(
+        '!BBHHHBBH4s4s', 0x45, 0, total_length, 0, 0, 64, 6, 0,
+        socket.inet_aton(src[0]), socket.inet_aton(dst[0])
+    )
+    ethernet = b'\x00' * 12 + struct.pack('!H', 0x0800)
+    return ethernet + ip + tcp + payload
+
+
+def write_pcap(path, frames):
+    """(timestamp, frame) のリストをクラシックPCAPとして書き出す"""
+    with open(path, 'wb') as f:
+        f.write(struct.pack('<IHHiIII', 0xA1B2C3D4, 2, 4, 0, 0, 65535, 1))
+        for timestamp, frame in frames:
+            sec = int(timestamp)
+            usec = int(round((timestamp - sec) * 1_000_000))
+            f.write(struct.pack('<IIII', sec, usec, len(frame), len(frame)))
+            f.write(frame)
+
+
+def write_pcapng(path, frames):
+    """(timestamp, frame) のリストをPCAPNGとして書き出す"""
+    def block(block_type, body):
+        body += b'\x00' * (-len(body) % 4)
+        length = len(body) + 12
+        return struct.pack('<II', block_type, length) + body + struct.pack('<I', length)
+
+    with open(path, 'wb') as f:
+        f.write(block(0x0A0D0D0A, struct.pack('<IHHq', 0x1A2B3C4D, 1, 0, -1)))
+        f.write(block(0x00000001, struct.pack('<HHI', 1, 0, 65535)))
+        for timestamp, frame in frames:
+            ticks = int(round(timestamp * 1_000_000))
+            f.write(block(
+                0x00000006,
+                struct.pack('<IIIII', 0, ticks >> 32, ticks & 0xFFFFFFFF, len(frame), len(frame)) + frame
+            ))
+
+
+def build_frame(body, packet_type=2):
+    """長さプレフィックス付きのゲームフレームを生成"""
+    return struct.pack('>IH', len(body) + 6, packet_type) + body
+
+
+def encode_varint(value):
+    """Varintをエンコード"""
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def pb_varint(field_number, value):
+    """Varintフィールドをエンコード"""
+    return encode_varint(field_number << 3) + encode_varint(value)
+
+
+def pb_bytes(field_number, value):
+    """Length-delimitedフィールドをエンコード"""
+    return encode_varint((field_number << 3) | 2) + encode_varint(len(value)) + value
+
+
+def pb_fixed64(field_number, value):
+    """64-bitフィールドをエンコード"""
+    return encode_varint((field_number << 3) | 1) + struct.pack('<Q', value)
+
+
+def build_exchange_item(price, quantity, item_id, guid="", notice_time=0, extra=b""):
+    """既定スキーマ (ExchangeItem) のリスティング1件をエンコード"""
+    item_info = pb_varint(1, item_id) + pb_varint(2, quantity)
+    body = pb_varint(1, price) + pb_varint(2, quantity) + pb_bytes(3, item_info) + extra
+    if guid:
+        body += pb_bytes(4, guid.encode())
+    if notice_time:
+        body += pb_varint(5, notice_time)
+    return body
+
+
+def build_exchange_payload(entries, entry_field=1):
+    """マジックバイト + ExchangeItemを並べたトップレベルメッセージ"""
+    body = b''.join(pb_bytes(entry_field, build_exchange_item(*entry)) for entry in entries)
+    return b'\x01\x02' + TradingCenterDecoder.TRADING_CENTER_MAGIC + body
+
+
+class FakeClock:
+    """手動で進める時刻"""
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def make_listing(listing_id, item_id=100, price=1000, quantity=1, timestamp=None):
+    """テスト用のItemListing（アイテム名は「品<item_id>」）"""
+    return ItemListing(
+        listing_id=str(listing_id), item_id=item_id, item_name=f"品{item_id}",
+        quantity=quantity, price=price, timestamp=timestamp
+    )
+
+
+def make_listings(ids, item_id=100, quantity=1, timestamp=None):
+    """IDごとに価格が 1000 + ID のItemListingを生成"""
+    return [make_listing(i, item_id, 1000 + i, quantity, timestamp) for i in ids]
@@ -0,0 +1,94 @@
+"""
+Tests for the compressed payload archive
+"""
+import os
+
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import Session
+
+from src.database.models import Base, Listing
+from src.packet_decoder.archive import (
+    INDEX_SUFFIX,
+    PayloadArchive,
+    iter_archive,
+    list_blocks,
+)
+from src.packet_decoder.pcap_reader import Flow
+from tests.helpers import build_trading_payload
+from tools.redecode_archive import redecode
+
+FLOW = Flow("10.0.0.1", 5000, "10.0.0.2", 40000)
+
+
+def write_archive(directory, count=100, **kwargs):
+    archive = PayloadArchive(str(directory), codec="zlib", **kwargs)
+    payloads = []
+    for i in range(count):
+        payload = build_trading_payload([(i, 100 + i % 5, 1, 500 + i)])
+        archive.append(1_700_000_000.0 + i, FLOW, payload)
+        payloads.append(payload)
+    archive.close()
+    return archive, payloads
+
+
+class TestPayloadArchive:
+    """PayloadArchiveのテスト"""
+
+    def test_round_trip(self, tmp_path):
+        """書き込んだフレームを時刻・フロー付きで読み出せ、元より小さく保存される"""
+        archive, payloads = write_archive(tmp_path, block_size=4096)
+
+        records = list(iter_archive(str(tmp_path)))
+
+        assert [record.payload for record in records] == payloads
+        assert records[3].flow == FLOW
+        assert records[3].timestamp == 1_700_000_003.0
+        stats = archive.get_stats()
+        assert stats["blocks"] > 1
+        assert stats["compression_ratio"] < 0.5
+
+    def test_time_range(self, tmp_path):
+        """インデックスの時刻範囲でブロックを絞り込める"""
+        write_archive(tmp_path, block_size=1024)
+        start, end = 1_700_000_040.0, 1_700_000_049.0
+
+        records = list(iter_archive(str(tmp_path), start, end))
+
+        assert [record.timestamp for record in records] == [1_700_000_040.0 + i for i in range(10)]
+        assert len(list_blocks(str(tmp_path), start, end)) < len(list_blocks(str(tmp_path)))
+
+    def test_rotation_and_retention(self, tmp_path):
+        """サイズでセグメントを切り替え、上限を超えた古いセグメントを削除する"""
+        write_archive(tmp_path, block_size=512, segment_bytes=256, max_segments=3)
+
+        segments = sorted(p for p in os.listdir(tmp_path) if p.endswith(".seg"))
+        assert len(segments) == 3
+
+    def test_missing_index_scans_blocks(self, tmp_path):
+        """インデックスがなくてもブロックヘッダーから読み出せる"""
+        _archive, payloads = write_archive(tmp_path, block_size=4096)
+        for name in os.listdir(tmp_path):
+            if name.endswith(INDEX_SUFFIX):
+                os.remove(tmp_path / name)
+
+        assert [record.payload for record in iter_archive(str(tmp_path))] == payloads
+
+
+class TestRedecode:
+    """アーカイブの再デコードのテスト"""
+
+    def test_redecode_upserts(self, tmp_path):
+        """再デコードの結果をupsertし、再実行しても重複しない"""
+        write_archive(tmp_path, count=30, block_size=1024)
+        engine = create_engine("sqlite://")
+        Base.metadata.create_all(engine)
+
+        with Session(engine) as session:
+            first = redecode(str(tmp_path), session=session)
+            second = redecode(str(tmp_path), workers=2, session=session)
+            count = len(session.execute(select(Listing.id)).all())
+
+        assert first["listings"] == 30
+        assert first["inserted"] == 30
+        assert second["updated"] == 30
+        assert count == 30
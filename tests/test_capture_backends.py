@@ -0,0 +1,171 @@
+"""
+Tests for live capture backends
+"""
+import struct
+
+import pytest
+
+from src.packet_decoder.capture_backends import (
+    CaptureBackend,
+    PcapReplayBackend,
+    create_backend,
+    iter_tpacket_v3_block,
+)
+from src.packet_decoder.pcap_reader import LINKTYPE_RAW, TCP_FIN, Flow, parse_frame
+from src.packet_decoder.realtime_capture import RealtimePacketCapture
+from tests.helpers import build_frame, build_tcp_frame, build_trading_payload, write_pcap
+
+
+def build_tpacket_v3_block(frames, first=48):
+    """TPACKET_V3ブロックと同じレイアウトのバッファを生成"""
+    body = b""
+    for i, (timestamp, frame) in enumerate(frames):
+        header_size = 32
+        entry_size = (header_size + len(frame) + 15) & ~15
+        next_offset = entry_size if i < len(frames) - 1 else 0
+        sec = int(timestamp)
+        nsec = int(round((timestamp - sec) * 1e9))
+        header = struct.pack('IIIIIIHH', next_offset, sec, nsec, len(frame), len(frame), 1,
+                             header_size, header_size).ljust(header_size, b'\x00')
+        body += (header + frame).ljust(entry_size, b'\x00')
+    block_header = struct.pack('IIIII', 3, 0, 1, len(frames), first)
+    return block_header.ljust(first, b'\x00') + body
+
+
+class FakeBackend(CaptureBackend):
+    """決まったセグメントを流すバックエンド"""
+
+    name = "fake"
+
+    def __init__(self, packets):
+        self.packets = packets
+        self.filters = []
+
+    def run(self, capture_filter, handler, should_stop):
+        self.filters.append(capture_filter)
+        while self.packets and not should_stop():
+            handler(*self.packets.pop(0))
+
+
+class TestCaptureBackends:
+    """キャプチャバックエンドのテスト"""
+
+    def test_iter_tpacket_v3_block(self):
+        """リングのブロックからIPパケットとタイムスタンプを取り出す"""
+        ip_packets = [build_tcp_frame(b"abc")[14:], build_tcp_frame(b"defg", seq=4)[14:]]
+        block = build_tpacket_v3_block([(10.5, ip_packets[0]), (11.25, ip_packets[1])])
+
+        frames = list(iter_tpacket_v3_block(block, 0))
+
+        assert [round(ts, 3) for ts, _ in frames] == [10.5, 11.25]
+        assert [parse_frame(LINKTYPE_RAW, frame).payload for _, frame in frames] == [b"abc", b"defg"]
+
+    def test_unknown_backend(self):
+        """未知のバックエンド名はエラー"""
+        with pytest.raises(ValueError):
+            create_backend("unknown")
+
+    def test_capture_loop_restarts_backend_on_pin(self):
+        """フローが固定されるとバックエンドを絞り込んだフィルタで再実行する"""
+        frame = build_tcp_frame(build_trading_payload([(1, 100, 1, 500)]))
+        segment = parse_frame(1, frame)
+        backend = FakeBackend([(1.0, None), (1.0, segment)])
+        capture = RealtimePacketCapture(backend=backend)
+        capture.game_server_ip = capture.game_server_port = None
+
+        capture.is_running = True
+        original_run = backend.run
+
+        def run_once(capture_filter, handler, should_stop):
+            original_run(capture_filter, handler, should_stop)
+            if len(backend.filters) == 2:
+                capture.is_running = False
+
+        backend.run = run_once
+        capture._capture_loop()
+
+        assert backend.filters[0] == "tcp"
+        assert "port 5000" in backend.filters[1]
+        assert capture.get_stats()["total_packets"] == 2
+        assert capture.packet_queue.qsize() == 1
+
+
+class TestPcapReplayBackend:
+    """再生バックエンドのテスト"""
+
+    def write_capture(self, path, count=5, interval=0.05):
+        trading = build_trading_payload([(1, 100, 1, 500)])
+        frames = []
+        seq = 1
+        for i in range(count):
+            frames.append((1000.0 + i * interval, build_tcp_frame(trading, seq=seq)))
+            seq += len(trading)
+        write_pcap(str(path), frames)
+
+    def test_replay_through_pipeline(self, tmp_path):
+        """再生したパケットがキャプチャからコールバックまで流れる"""
+        path = tmp_path / "replay.pcap"
+        self.write_capture(path)
+        # 同じペイロードを繰り返し再生するため、重複排除は無効にする
+        capture = RealtimePacketCapture(backend=PcapReplayBackend(str(path), speed=None), dedupe_size=0)
+        capture.game_server_ip = capture.game_server_port = None
+
+        capture.start()
+        assert capture.wait(timeout=5)
+        capture.stop()
+
+        stats = capture.get_stats()
+        assert stats["total_packets"] == 5
+        assert stats["listings_found"] == 5
+        assert stats["queue"]["high_water_items"] >= 1
+        assert stats["backend"]["name"] == "replay"
+        assert stats["backend"]["finished"]
+
+    def test_reconnect_after_fin_is_pinned(self, tmp_path):
+        """ペイロードのないFINで固定が解除され、新しいポートの再接続を拾う"""
+        server, old_client, new_client = ("10.0.0.1", 5000), ("10.0.0.2", 40000), ("10.0.0.2", 40001)
+        trading = build_trading_payload([(1, 100, 1, 500)])
+        path = tmp_path / "reconnect.pcap"
+        write_pcap(str(path), [
+            (1000.0, build_tcp_frame(trading, src=server, dst=old_client)),
+            (1000.1, build_tcp_frame(b"", src=old_client, dst=server, seq=1, flags=TCP_FIN | 0x10)),
+            (1001.0, build_tcp_frame(build_trading_payload([(2, 100, 1, 600)]), src=server, dst=new_client)),
+        ])
+        capture = RealtimePacketCapture(backend=PcapReplayBackend(str(path), speed=None), dedupe_size=0)
+        capture.game_server_ip = capture.game_server_port = None
+
+        capture.start()
+        assert capture.wait(timeout=5)
+        capture.stop()
+
+        assert capture.pinned_flow == Flow(*server, *new_client)
+        assert capture.get_stats()["listings_found"] == 2
+
+    def test_stop_flushes_reassembler(self, tmp_path):
+        """停止時に再構築の途中で残ったデータも処理してからキューを閉じる"""
+        payload = build_trading_payload([(1, 100, 1, 500)])
+        path = tmp_path / "truncated.pcap"
+        # 長さヘッダーより短いまま終わるフレーム
+        write_pcap(str(path), [(1000.0, build_tcp_frame(build_frame(payload + b"\x00" * 16)[:-16]))])
+        capture = RealtimePacketCapture(backend=PcapReplayBackend(str(path), speed=None), dedupe_size=0)
+        capture.game_server_ip = capture.game_server_port = None
+
+        capture.start()
+        assert capture.wait(timeout=5)
+        assert capture.get_stats()["listings_found"] == 0
+        capture.stop()
+
+        assert capture.get_stats()["listings_found"] == 1
+        assert capture.reassembler.active_flows == 0
+
+    def test_original_timing(self, tmp_path):
+        """speed指定時は記録時の間隔に合わせて再生する"""
+        path = tmp_path / "timed.pcap"
+        self.write_capture(path, count=3, interval=0.1)
+        backend = PcapReplayBackend(str(path), speed=2.0)
+
+        backend.run("tcp", lambda ts, segment: None, lambda: False)
+
+        # 0.2秒分の記録を2倍速で再生
+        assert backend.get_stats()["seconds"] >= 0.09
+        assert backend.finished
@@ -0,0 +1,92 @@
+"""
+Tests for TradingCenterDecoder
+"""
+import json
+import mmap
+import pytest
+from datetime import datetime
+
+from src.packet_decoder.decoder import TradingCenterDecoder
+from tests.helpers import build_trading_payload
+
+
+class TestTradingCenterDecoder:
+    """TradingCenterDecoderのテスト"""
+    
+    LISTINGS = [(1, 10, 2, 300, "剣"), (2, 11, 5, 1500, "盾")]
+    
+    def test_decode_from_memoryview(self):
+        """memoryviewからコピーせずにデコードできる"""
+        payload = build_trading_payload(self.LISTINGS)
+        decoder = TradingCenterDecoder(raw_retention_bytes=None)
+        timestamp = datetime(2026, 1, 1)
+        
+        packet = decoder.decode_trading_packet(memoryview(payload), timestamp)
+        
+        assert [l.item_name for l in packet.listings] == ["剣", "盾"]
+        assert packet.listings[1].price == 1500
+        assert packet.raw_data == payload
+        assert packet.decoded_data["total_value"] == 2 * 300 + 5 * 1500
+    
+    def test_decode_from_mmap(self, tmp_path):
+        """mmapしたファイルから直接デコードできる"""
+        path = tmp_path / "payload.bin"
+        path.write_bytes(build_trading_payload(self.LISTINGS))
+        decoder = TradingCenterDecoder()
+        
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            assert decoder.is_trading_packet(mapped)
+            packet = decoder.decode_trading_packet(mapped)
+        
+        assert len(packet.listings) == 2
+    
+    def test_truncated_listing_stops_decoding(self):
+        """途中で切れたリスティングはデコードされない"""
+        payload = build_trading_payload(self.LISTINGS)[:-80]
+        packet = TradingCenterDecoder().decode_trading_packet(payload)
+        
+        assert len(packet.listings) == 1
+    
+    def test_decode_listing_batch(self):
+        """一括デコードの結果が1件ずつのデコードと一致する"""
+        pytest.importorskip("numpy")
+        listings = [(100 + i, 10 + i, 1 + i % 3, 1000 * (i + 1), f"品{i}") for i in range(150)]
+        payload = build_trading_payload(listings)
+        decoder = TradingCenterDecoder()
+        
+        batch = decoder.decode_listing_batch(payload)
+        
+        assert len(batch) == 150
+        assert batch.listing_id.tolist() == [100 + i for i in range(150)]
+        assert batch.item_names()[:2] == ["品0", "品1"]
+        assert batch.unit_price.tolist()[2] == 3000 // 3
+        assert batch.total_value == sum(q * p for _, _, q, p, _ in listings)
+    
+    def test_raw_retention(self):
+        """元ペイロードは既定で保持せず、上限を指定した場合はその範囲内で保持する"""
+        payload = build_trading_payload(self.LISTINGS)
+        
+        assert TradingCenterDecoder().decode_trading_packet(payload).raw_data is None
+        
+        decoder = TradingCenterDecoder(raw_retention_bytes=len(payload) + 10)
+        first = decoder.decode_trading_packet(payload)
+        second = decoder.decode_trading_packet(payload)
+        assert first.raw_data == payload
+        assert second.raw_data is None
+        assert second.listings[0].item_name == "剣"
+    
+    def test_columnar_snapshot(self):
+        """スナップショットは列指向で保持し、辞書を1件ずつ生成する"""
+        decoder = TradingCenterDecoder()
+        timestamp = datetime(2026, 1, 1, 12, 0, 0)
+        packets = [decoder.decode_trading_packet(build_trading_payload(self.LISTINGS), timestamp) for _ in range(3)]
+        
+        snapshot = decoder.create_market_snapshot(iter(packets))
+        
+        assert snapshot.total_items == 6
+        assert snapshot.listings.names == ["剣", "盾"]
+        assert snapshot.listings[1] == packets[0].listings[1]
+        data = snapshot.to_dict()
+        assert not isinstance(data["listings"], list)
+        assert list(data["listings"]) == [l.to_dict() for p in packets for l in p.listings]
+        assert json.loads("".join(snapshot.iter_json()))["listings"][0]["item_name"] == "剣"
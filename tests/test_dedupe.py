@@ -0,0 +1,61 @@
+"""
+Tests for the payload dedupe cache
+"""
+import pytest
+
+from src.packet_decoder.dedupe import PayloadCache
+from tests.helpers import FakeClock, make_listing
+
+
+class TestPayloadCache:
+    """PayloadCacheのテスト"""
+
+    def test_key_covers_region_after_offset(self):
+        """オフセットより前のバイトはキーに影響しない"""
+        assert PayloadCache.key(b"AAmagic-body", 2) == PayloadCache.key(b"BBmagic-body", 2)
+        assert PayloadCache.key(b"AAmagic-body", 2) != PayloadCache.key(b"AAmagic-bodz", 2)
+
+    def test_hit_updates_last_seen(self):
+        """ヒットすると結果を返し、最終確認時刻とヒット率を更新する"""
+        clock = FakeClock()
+        cache = PayloadCache(ttl=60.0, clock=clock)
+        key = PayloadCache.key(b"page")
+        listings = [make_listing(1)]
+
+        assert cache.get(key) is None
+        cache.put(key, listings)
+        clock.now += 5
+        assert cache.get(key) is listings
+
+        assert cache._entries[key].last_seen == clock.now
+        stats = cache.get_stats()
+        assert stats["hits"] == 1
+        assert stats["misses"] == 1
+        assert stats["hit_rate"] == 0.5
+
+    def test_ttl_expires(self):
+        """TTLを過ぎたエントリはミスになる"""
+        clock = FakeClock()
+        cache = PayloadCache(ttl=10.0, clock=clock)
+        cache.put(b"k", [])
+        clock.now += 11
+
+        assert cache.get(b"k") is None
+        assert cache.get_stats()["expired"] == 1
+        assert len(cache) == 0
+
+    def test_lru_eviction(self):
+        """最大件数を超えると最も古く参照されたエントリを追い出す"""
+        cache = PayloadCache(max_entries=2)
+        cache.put(b"a", [])
+        cache.put(b"b", [])
+        cache.get(b"a")
+        cache.put(b"c", [])
+
+        assert cache.get(b"b") is None
+        assert cache.get(b"a") is not None
+        assert cache.get_stats()["evicted"] == 1
+
+    def test_invalid_size(self):
+        with pytest.raises(ValueError):
+            PayloadCache(max_entries=0)
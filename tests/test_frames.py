@@ -0,0 +1,182 @@
+"""
+Tests for the game protocol frame parser
+"""
+import struct
+
+import pytest
+
+from src.packet_decoder.decoder import TradingCenterDecoder
+from src.packet_decoder.frames import (
+    COMPRESSED_FLAG,
+    MSG_FRAME_DOWN,
+    MSG_NOTIFY,
+    MSG_RAW,
+    MSG_RETURN,
+    FrameParser,
+    MessageRouter,
+    iter_trading_payloads,
+)
+from tests.helpers import build_frame, build_trading_payload
+
+TRADING_METHOD = 0x2E
+
+
+def notify(payload, method_id=TRADING_METHOD, compressed=False):
+    """Notifyフレームを生成"""
+    body = struct.pack('>QII', 0x1234567890, 1, method_id) + payload
+    return build_frame(body, MSG_NOTIFY | (COMPRESSED_FLAG if compressed else 0))
+
+
+def frame_down(frames):
+    """FrameDownフレームを生成"""
+    return build_frame(struct.pack('>I', 7) + b"".join(frames), MSG_FRAME_DOWN)
+
+
+class TestFrameParser:
+    """FrameParserのテスト"""
+
+    def test_notify_header(self):
+        """Notifyのメソッドとペイロードを取り出す"""
+        [message] = FrameParser().parse(notify(b"payload", method_id=0x1234))
+
+        assert message.msg_type == MSG_NOTIFY
+        assert message.method_id == 0x1234
+        assert message.payload == b"payload"
+        assert message.data == notify(b"payload", method_id=0x1234)
+
+    def test_return_has_no_method(self):
+        """Returnはメソッドを持たない"""
+        [message] = FrameParser().parse(build_frame(struct.pack('>I', 9) + b"result", MSG_RETURN))
+
+        assert (message.msg_type, message.method_id, message.stub_id) == (MSG_RETURN, None, 9)
+        assert message.payload == b"result"
+
+    def test_frame_down_is_flattened(self):
+        """FrameDownの入れ子のフレームを展開する"""
+        parser = FrameParser()
+        messages = list(parser.parse(frame_down([notify(b"a", 1), notify(b"b", 2)])))
+
+        assert [(m.method_id, m.payload) for m in messages] == [(1, b"a"), (2, b"b")]
+        assert parser.stats["messages"] == 2
+
+    def test_unframed_chunk_is_raw(self):
+        """長さヘッダーが合わないデータは未解析のまま返す"""
+        [message] = FrameParser().parse(b"\x00\x00\x10\x00garbage")
+
+        assert message.msg_type is MSG_RAW
+        assert message.data == b"\x00\x00\x10\x00garbage"
+
+    def test_compressed_without_zstd_is_counted(self, monkeypatch):
+        """zstdがない場合、圧縮メッセージは数えて捨てる"""
+        parser = FrameParser()
+        monkeypatch.setattr(parser, "_dctx", None)
+
+        assert list(parser.parse(notify(b"\x28\xb5\x2f\xfd", compressed=True))) == []
+        assert parser.stats["undecompressable"] == 1
+
+    def test_compressed_frame_down(self):
+        """圧縮されたFrameDownを展開して中の取引所メッセージを取り出す"""
+        zstandard = pytest.importorskip("zstandard")
+        payload = build_trading_payload([(1, 100, 2, 5000)])
+        inner = zstandard.ZstdCompressor().compress(notify(payload))
+        outer = build_frame(struct.pack('>I', 7) + inner, MSG_FRAME_DOWN | COMPRESSED_FLAG)
+
+        parser = FrameParser()
+        [message] = parser.parse(outer)
+
+        assert message.payload == payload
+        assert parser.stats["compressed"] == 1
+
+    @pytest.mark.parametrize("streamed", [False, True])
+    def test_oversized_payload_is_dropped(self, streamed):
+        """展開後サイズが上限を超えるペイロードは（展開後サイズがないストリームでも）捨てる"""
+        zstandard = pytest.importorskip("zstandard")
+        body = b"\x00" * 4096
+        if streamed:
+            compressor = zstandard.ZstdCompressor().compressobj()
+            compressed = compressor.compress(body) + compressor.flush()
+        else:
+            compressed = zstandard.ZstdCompressor().compress(body)
+
+        parser = FrameParser(max_decompressed=1024)
+
+        assert list(parser.parse(notify(compressed, compressed=True))) == []
+        assert parser.stats["oversized"] == 1
+
+
+class TestMessageRouter:
+    """MessageRouterのテスト"""
+
+    def test_configured_method_skips_search(self):
+        """設定済みのメソッド以外のNotifyは検索せずに捨てる"""
+        router = MessageRouter([TRADING_METHOD])
+        parser = FrameParser()
+        trading = build_trading_payload([(1, 100, 1, 1000)])
+
+        assert router.is_trading(next(parser.parse(notify(b"no magic"))))
+        assert not router.is_trading(next(parser.parse(notify(trading, method_id=0x99))))
+        assert router.stats["searched"] == 0
+        assert router.stats["skipped_by_method"] == 1
+
+    def test_learns_method_after_consistent_hits(self):
+        """同じメソッドで連続して取引所と判定したら学習する"""
+        router = MessageRouter(learn_after=3)
+        parser = FrameParser()
+        trading = notify(build_trading_payload([(1, 100, 1, 1000)]))
+
+        for _ in range(3):
+            assert router.is_trading(next(parser.parse(trading)))
+        assert router.method_ids == {TRADING_METHOD}
+
+        # 学習後は他のメソッドを検索しない
+        assert not router.is_trading(next(parser.parse(notify(b"chat", method_id=0x10))))
+        assert router.stats["searched"] == 3
+
+    def test_wrong_learned_method_is_replaced(self):
+        """誤って学習したIDは、他のIDの取引所メッセージを見つけたら学習し直し、外れ続けたら忘れる"""
+        router = MessageRouter(learn_after=2, probe_every=2, unlearn_after=2)
+        parser = FrameParser()
+        wrong = 0x10
+        trading = build_trading_payload([(1, 100, 1, 1000)])
+
+        # 取引所のデータを一時的に別のメソッドで受け取り、誤ったIDを学習する
+        for _ in range(2):
+            assert router.is_trading(next(parser.parse(notify(trading, method_id=wrong))))
+        assert router.method_ids == {wrong}
+
+        # 本当のIDのメッセージは、定期的な判定で見つかって学習される
+        routed = [
+            router.is_trading(next(parser.parse(notify(trading))))
+            for _ in range(4)
+        ]
+        assert routed == [False, True, False, True]
+        assert router.method_ids == {wrong, TRADING_METHOD}
+
+        # 誤ったIDのメッセージが続けて取引所でなければ忘れる
+        for _ in range(4):
+            router.is_trading(next(parser.parse(notify(b"position", method_id=wrong))))
+        assert router.method_ids == {TRADING_METHOD}
+        assert router.stats["unlearned"] == 1
+
+    def test_return_is_searched(self):
+        """Returnはペイロードのシグネチャで判定する"""
+        router = MessageRouter([TRADING_METHOD])
+        trading = build_trading_payload([(1, 100, 1, 1000)])
+        [message] = FrameParser().parse(build_frame(struct.pack('>I', 1) + trading, MSG_RETURN))
+
+        assert router.is_trading(message)
+
+
+class TestFrameDecoding:
+    """フレーム単位のデコードのテスト"""
+
+    def test_only_trading_messages_reach_decoder(self):
+        """FrameDownの中の取引所メッセージだけをデコードする"""
+        trading = build_trading_payload([(1, 100, 2, 5000), (2, 101, 1, 700)])
+        stream = [frame_down([notify(b"position", method_id=0x10), notify(trading)])]
+
+        payloads = list(iter_trading_payloads(stream, FrameParser(), MessageRouter()))
+        packet = TradingCenterDecoder().decode_trading_packet(payloads[0])
+
+        assert len(payloads) == 1
+        assert [l.price for l in packet.listings] == [5000, 700]
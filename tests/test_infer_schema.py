@@ -0,0 +1,91 @@
+"""
+Tests for the listing schema inference tool
+"""
+import json
+
+import pytest
+
+from src.packet_decoder.decoder import TradingCenterDecoder
+from src.packet_decoder.schema import TYPE_STRING, TYPE_TIMESTAMP, ListingSchema, SchemaDecoder
+from tests.helpers import build_exchange_payload, build_tcp_frame, pb_bytes, pb_varint, write_pcap
+from tools.infer_schema import SchemaInferrer, infer_schema, load_known_listings
+
+LISTINGS = [
+    (120000 + i * 7, 1 + i % 5, 1050 + i, f"guid-{i:04d}-0000-0000-000000000000", 1_760_000_000 + i)
+    for i in range(20)
+]
+
+
+def build_changed_entry(price, quantity, item_id, guid, notice_time):
+    """アップデート後を想定してフィールド番号を入れ替えたリスティング"""
+    item_info = pb_varint(4, item_id)
+    return (
+        pb_varint(6, quantity) + pb_bytes(2, item_info) + pb_varint(7, price)
+        + pb_bytes(9, guid.encode()) + pb_varint(11, notice_time)
+    )
+
+
+def write_capture(path, payloads):
+    frames = []
+    seq = 1
+    for i, payload in enumerate(payloads):
+        frames.append((1_700_000_000.0 + i, build_tcp_frame(payload, seq=seq)))
+        seq += len(payload)
+    write_pcap(path, frames)
+
+
+class TestSchemaInferrer:
+    """SchemaInferrerのテスト"""
+
+    def test_infer_default_layout(self):
+        """既定の構造からフィールド番号を推定できる"""
+        known = [{"item_id": i, "quantity": q, "price": p} for p, q, i, _, _ in LISTINGS]
+        inferrer = SchemaInferrer(known)
+        payload = build_exchange_payload(LISTINGS)
+        inferrer.feed(payload, 2 + len(TradingCenterDecoder.TRADING_CENTER_MAGIC))
+
+        schema = inferrer.infer()
+
+        assert schema.fields["price"].path == (1,)
+        assert schema.fields["quantity"].path == (2,)
+        assert schema.fields["item_id"].path == (3, 1)
+        # 既知の値がない属性は値の範囲・形から推定する
+        assert schema.fields["notice_time"] == ((5,), TYPE_TIMESTAMP)
+        assert schema.fields["guid"] == ((4,), TYPE_STRING)
+        assert schema.entry_field == 1
+        assert schema.metadata["confidence"]["price"] == 1.0
+
+    def test_no_match_raises(self):
+        """既知の出品情報と一致しなければエラー"""
+        inferrer = SchemaInferrer([{"item_id": 1, "quantity": 1, "price": 1}])
+        inferrer.feed(pb_bytes(1, pb_varint(1, 999)), 0)
+
+        with pytest.raises(ValueError):
+            inferrer.infer()
+
+
+class TestInferSchema:
+    """キャプチャからの推定のテスト"""
+
+    def test_changed_layout_round_trip(self, tmp_path):
+        """変更後の構造を推定し、保存したスキーマでデコードできる"""
+        body = b''.join(pb_bytes(3, build_changed_entry(*listing)) for listing in LISTINGS)
+        payload = b'\x01\x02' + TradingCenterDecoder.TRADING_CENTER_MAGIC + body
+        pcap_path = tmp_path / "sample.pcap"
+        write_capture(pcap_path, [payload])
+
+        known_path = tmp_path / "known.json"
+        known_path.write_text(json.dumps([
+            {"item_id": i, "quantity": q, "price": p, "guid": g} for p, q, i, g, _ in LISTINGS[:5]
+        ]))
+
+        schema = infer_schema(str(pcap_path), load_known_listings(str(known_path)))
+        schema_path = tmp_path / "schema.json"
+        schema.save(str(schema_path))
+        loaded = ListingSchema.load(str(schema_path))
+
+        assert loaded.fields["item_id"].path == (2, 4)
+        assert loaded.fields["guid"].path == (9,)
+        assert loaded.entry_field == 3
+        entries = SchemaDecoder(loaded).decode_entries(payload, 2 + len(TradingCenterDecoder.TRADING_CENTER_MAGIC))
+        assert [(e["price"], e["quantity"], e["item_id"]) for e in entries] == [l[:3] for l in LISTINGS]
@@ -0,0 +1,105 @@
+"""
+Tests for bulk listing ingestion
+"""
+import json
+from datetime import datetime
+from functools import partial
+
+import pytest
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql
+
+from scripts.import_from_json import import_from_json
+from src.database.ingest import listing_key, listing_rows, listing_upsert_statement, upsert_listings
+from src.database.models import Item, Listing
+from tests import helpers
+
+# 取り込みのテストでは2個ずつの出品を同じ日時にキャプチャしたものとする
+make_listing = partial(helpers.make_listing, quantity=2, timestamp=datetime(2026, 1, 1))
+
+
+class TestIngest:
+    """一括取り込みのテスト"""
+
+    def test_listing_key(self):
+        """数値IDはそのまま、GUIDは安定した正の整数になる"""
+        assert listing_key("12345") == 12345
+        key = listing_key("abc-def")
+        assert key == listing_key("abc-def")
+        assert 0 <= key < 1 << 63
+
+    def test_listing_key_out_of_range_id_is_hashed(self, session):
+        """BigIntegerに収まらないu64のIDはハッシュにして保存できる"""
+        assert listing_key(str((1 << 63) - 1)) == (1 << 63) - 1
+        key = listing_key(str((1 << 64) - 5))
+        assert 0 <= key < 1 << 63
+
+        upsert_listings(session, listing_rows([make_listing(str((1 << 64) - 5))]))
+        session.commit()
+
+        assert session.get(Listing, key) is not None
+
+    @pytest.mark.parametrize("listing_id", ["²", "٣", "12³"])
+    def test_listing_key_non_ascii_digits_are_hashed(self, listing_id):
+        """ASCII以外の数字はint()に渡さずハッシュにする"""
+        key = listing_key(listing_id)
+        assert key == listing_key(listing_id)
+        assert 0 <= key < 1 << 63
+
+    def test_upsert_inserts_then_updates(self, session):
+        """新規は挿入、既存は更新し、不足しているアイテムを作成する"""
+        rows = listing_rows([make_listing("1"), make_listing("2", item_id=200)])
+        result = upsert_listings(session, rows)
+        session.commit()
+
+        assert result == {"inserted": 2, "updated": 0, "items_created": 2}
+        assert session.get(Item, 200).name == "品200"
+
+        result = upsert_listings(session, listing_rows([make_listing("1", price=900), make_listing("3")]))
+        session.commit()
+
+        assert result == {"inserted": 1, "updated": 1, "items_created": 0}
+        assert session.get(Listing, 1).price == 900
+        assert session.get(Listing, 1).unit_price == 450
+        assert len(session.execute(select(Listing.id)).all()) == 3
+
+    def test_recapture_refreshes_in_place(self, session):
+        """重複を含むバッチも失敗せず、再キャプチャで価格とキャプチャ日時を更新する"""
+        first = make_listing("1")
+        upsert_listings(session, listing_rows([first, make_listing("2")]), count_existing=False)
+        session.commit()
+
+        recaptured = make_listing("1", price=800)
+        recaptured.timestamp = datetime(2026, 1, 2)
+        result = upsert_listings(
+            session, listing_rows([recaptured, make_listing("2"), make_listing("2")]), count_existing=False
+        )
+        session.commit()
+
+        assert result == {"inserted": None, "updated": None, "items_created": 0}
+        listing = session.get(Listing, 1)
+        session.refresh(listing)
+        assert (listing.price, listing.captured_at) == (800, datetime(2026, 1, 2))
+        assert len(session.execute(select(Listing.id)).all()) == 2
+
+    def test_postgresql_statement(self):
+        """PostgreSQLでも ON CONFLICT (id) DO UPDATE になる"""
+        statement = listing_upsert_statement("postgresql", ["id", "price", "captured_at"])
+        sql = str(statement.compile(dialect=postgresql.dialect()))
+
+        assert "ON CONFLICT (id) DO UPDATE SET price = excluded.price" in sql
+        assert "captured_at = excluded.captured_at" in sql
+
+    def test_import_from_json_keys(self, session, tmp_path):
+        """JSONインポートもu64やGUIDのIDを listing_key で主キーにする"""
+        u64_id = 2**64 - 5
+        guid = "5f0c2a1e-9b7d-4c3e-8a6f-123456789abc"
+        path = tmp_path / "parsed.json"
+        path.write_text(json.dumps({"items": [
+            {"listing_id": u64_id, "item_id": 100, "item_name": "品100", "quantity": 2, "price": 1000},
+            {"listing_id": guid, "item_id": 101, "item_name": "品101", "quantity": 1, "price": 500},
+        ]}), encoding="utf-8")
+
+        assert import_from_json(str(path), db=session) == 2
+        assert session.get(Listing, listing_key(str(u64_id))).price == 1000
+        assert session.get(Listing, listing_key(guid)).item_id == 101
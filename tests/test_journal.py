@@ -0,0 +1,234 @@
+"""
+Tests for the listing write-ahead journal
+"""
+import os
+import stat
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from src.database.ingest import listing_rows
+from src.database.journal import (
+    RECORD_ROWS,
+    RECORD_SEEN,
+    SET_ASIDE_FILE,
+    ListingJournal,
+    decode_rows,
+    encode_rows,
+)
+from src.database.models import Base, Listing
+from src.database.writer import ListingWriter
+from tests.helpers import make_listing, make_listings
+
+
+def make_rows(start, count):
+    return listing_rows(make_listings(range(start, start + count), quantity=2,
+                                      timestamp=datetime(2026, 1, 1, 12, 0, 0, 123456)))
+
+
+class TestListingJournal:
+    """ListingJournalのテスト"""
+
+    def test_rows_round_trip(self):
+        """行をバイナリにして元に戻せる"""
+        rows = make_rows(1, 3)
+        rows[0]["seller_name"] = None
+
+        decoded = decode_rows(encode_rows(rows))
+
+        assert [{k: row[k] for k in decoded[0]} for row in rows] == decoded
+
+    def test_rows_round_trip_u64_values(self):
+        """u64の出品IDや価格、負の値も範囲に合った型で記録して戻せる"""
+        rows = make_rows(1, 2)
+        rows[0].update(id=(1 << 64) - 5, price=(1 << 63) + 1)
+        rows[1]["quantity"] = -1
+
+        decoded = decode_rows(encode_rows(rows))
+
+        assert [(r["id"], r["price"], r["quantity"]) for r in decoded] == \
+            [(r["id"], r["price"], r["quantity"]) for r in rows]
+
+    def test_replay_after_checkpoint(self, tmp_path):
+        """チェックポイントより後の記録だけを再生する"""
+        journal = ListingJournal(str(tmp_path))
+        first = journal.append_rows(make_rows(1, 2))
+        journal.append_seen({1: datetime(2026, 2, 1)})
+        journal.append_rows(make_rows(3, 1))
+        journal.checkpoint(first)
+        journal.close()
+
+        records = list(ListingJournal(str(tmp_path)).replay())
+
+        assert [(r.sequence, r.kind) for r in records] == [(2, RECORD_SEEN), (3, RECORD_ROWS)]
+        assert records[0].payload == {1: datetime(2026, 2, 1)}
+        assert records[1].payload[0]["id"] == 3
+
+    def test_torn_tail_is_truncated(self, tmp_path):
+        """書き込み途中で切れた末尾の記録は捨て、続きから追記する"""
+        journal = ListingJournal(str(tmp_path))
+        journal.append_rows(make_rows(1, 1))
+        journal.append_rows(make_rows(2, 1))
+        journal.close()
+        [segment] = tmp_path.glob("*.wal")
+        segment.write_bytes(segment.read_bytes()[:-5])
+
+        journal = ListingJournal(str(tmp_path))
+        journal.append_rows(make_rows(3, 1))
+
+        assert [r.sequence for r in journal.replay()] == [1, 2]
+        assert journal.sequence == 2
+
+    def test_checkpointed_segments_are_removed(self, tmp_path):
+        """チェックポイントより前の記録だけのセグメントを削除する"""
+        journal = ListingJournal(str(tmp_path), segment_bytes=200)
+        sequences = [journal.append_rows(make_rows(i, 2)) for i in range(10)]
+        segments = len(list(tmp_path.glob("*.wal")))
+
+        journal.checkpoint(sequences[-2])
+
+        assert segments > 2
+        assert len(list(tmp_path.glob("*.wal"))) <= 2
+        assert [r.sequence for r in journal.replay()] == [sequences[-1]]
+
+    def test_tail_fsynced_off_append_thread(self, tmp_path, monkeypatch):
+        """最後の追記も、後続の追記を待たずに別スレッドで fsync される"""
+        fsync_threads = []
+        fsync = os.fsync
+
+        def recording_fsync(fd):
+            # セグメントを作成したときのディレクトリの fsync は除く
+            if stat.S_ISREG(os.fstat(fd).st_mode):
+                fsync_threads.append(threading.current_thread())
+            fsync(fd)
+
+        monkeypatch.setattr(os, "fsync", recording_fsync)
+        journal = ListingJournal(str(tmp_path), fsync_interval=0.01)
+        journal.append_rows(make_rows(1, 1))
+        journal.append_rows(make_rows(2, 1))
+
+        deadline = time.monotonic() + 2.0
+        while journal.get_stats()["fsyncs"] == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        fsyncs = journal.get_stats()["fsyncs"]
+        journal.close()
+
+        assert fsyncs >= 1
+        assert fsync_threads[0] is not threading.current_thread()
+
+
+class TestWriterJournal:
+    """ライターとジャーナルの組み合わせのテスト"""
+
+    def test_uncommitted_rows_replayed_after_crash(self, tmp_path):
+        """コミット前に落ちた分を次の起動で書き込む"""
+        url = f"sqlite:///{tmp_path / 'market.db'}"
+        engine = create_engine(url)
+        Base.metadata.create_all(engine)
+        listings = make_listings(range(5))
+
+        # コミットされる前にプロセスが落ちた状態（close を呼ばない）
+        crashed = ListingWriter.for_url(url, flush_rows=1000, flush_interval=60,
+                                        journal=ListingJournal(str(tmp_path / "journal")))
+        crashed.submit(listings)
+
+        journal = ListingJournal(str(tmp_path / "journal"))
+        writer = ListingWriter.for_url(url, journal=journal)
+        assert writer.recover() == 1
+        writer.close()
+
+        with Session(engine) as session:
+            assert session.scalar(select(func.count()).select_from(Listing)) == 5
+        assert journal.get_stats()["pending"] == 0
+        assert list(ListingJournal(str(tmp_path / "journal")).replay()) == []
+
+    def test_journal_error_does_not_lose_write(self, tmp_path, monkeypatch):
+        """ジャーナルに記録できなくてもデータベースには書き込む"""
+        url = f"sqlite:///{tmp_path / 'market.db'}"
+        Base.metadata.create_all(create_engine(url))
+        journal = ListingJournal(str(tmp_path / "journal"))
+
+        def broken(rows):
+            raise OSError("No space left on device")
+
+        monkeypatch.setattr(journal, "append_rows", broken)
+        writer = ListingWriter.for_url(url, journal=journal)
+        writer.submit([make_listing(1)])
+        writer.close()
+
+        stats = writer.get_stats()
+        assert (stats["rows_written"], stats["journal_errors"]) == (1, 1)
+
+    def test_dropped_batch_set_aside_and_replayed(self, tmp_path):
+        """再試行の上限を超えたバッチは退避し、後のチェックポイントで失われず次の起動で書き込む"""
+        url = f"sqlite:///{tmp_path / 'market.db'}"
+        engine = create_engine(url)
+        Base.metadata.create_all(engine)
+        failures = {"left": 1}
+
+        class FailingOnceSession(Session):
+            def commit(self):
+                if failures["left"]:
+                    failures["left"] -= 1
+                    raise OperationalError("COMMIT", {}, Exception("database is locked"))
+                super().commit()
+
+        listings = make_listings(range(4))
+        journal = ListingJournal(str(tmp_path / "journal"))
+        writer = ListingWriter(lambda: FailingOnceSession(engine), max_retries=0, journal=journal)
+        writer.submit(listings[:2])
+        writer.sync()
+        writer.submit(listings[2:])
+        writer.close()
+
+        assert writer.get_stats()["rows_dropped"] == 2
+        assert journal.get_stats()["pending"] == 0
+        assert (tmp_path / "journal" / SET_ASIDE_FILE).exists()
+
+        writer = ListingWriter.for_url(url, journal=ListingJournal(str(tmp_path / "journal")))
+        assert writer.recover() == 1
+        writer.close()
+
+        with Session(engine) as session:
+            assert session.scalar(select(func.count()).select_from(Listing)) == 4
+        assert list((tmp_path / "journal").glob("set-aside*")) == []
+
+    def test_held_batch_set_aside_on_later_write(self, tmp_path, monkeypatch):
+        """退避に失敗したバッチは次の書き込みで退避し直し、チェックポイントを再開する"""
+        engine = create_engine(f"sqlite:///{tmp_path / 'market.db'}")
+        Base.metadata.create_all(engine)
+        failures = {"commit": 1, "set_aside": 1}
+
+        class FailingOnceSession(Session):
+            def commit(self):
+                if failures["commit"]:
+                    failures["commit"] -= 1
+                    raise OperationalError("COMMIT", {}, Exception("database is locked"))
+                super().commit()
+
+        journal = ListingJournal(str(tmp_path / "journal"))
+        set_aside = journal.set_aside
+
+        def failing_set_aside(rows=(), seen=None):
+            if failures["set_aside"]:
+                failures["set_aside"] -= 1
+                raise OSError("disk full")
+            set_aside(rows, seen)
+
+        monkeypatch.setattr(journal, "set_aside", failing_set_aside)
+        listings = make_listings(range(4))
+        writer = ListingWriter(lambda: FailingOnceSession(engine), max_retries=0, journal=journal)
+        writer.submit(listings[:2])
+        writer.sync()
+        held = (writer.get_stats()["held_batches"], journal.get_stats()["pending"])
+        writer.submit(listings[2:])
+        writer.close()
+
+        assert held == (1, 1)
+        assert writer.get_stats()["held_batches"] == 0
+        assert journal.get_stats()["pending"] == 0
+        assert len(list(ListingJournal(str(tmp_path / "journal")).replay_set_aside())) == 1
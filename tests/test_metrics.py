@@ -0,0 +1,86 @@
+"""
+Tests for capture pipeline metrics
+"""
+import threading
+
+from src.packet_decoder.metrics import LatencyHistogram, PipelineMetrics, RateCounter
+from tests.helpers import FakeClock
+
+
+class TestLatencyHistogram:
+    """LatencyHistogramのテスト"""
+
+    def test_percentiles_within_precision(self):
+        """パーセンタイルがバケットの精度内で求まる"""
+        histogram = LatencyHistogram()
+        for ms in range(1, 1001):
+            histogram.record(ms / 1000.0)
+
+        stats = histogram.to_dict()
+        assert stats["count"] == 1000
+        assert abs(stats["p50_ms"] - 500) / 500 < 0.05
+        assert abs(stats["p99_ms"] - 990) / 990 < 0.05
+        assert stats["p999_ms"] <= stats["max_ms"] == 1000.0
+
+    def test_empty(self):
+        """記録がない場合はNone"""
+        assert LatencyHistogram().percentile(50) is None
+
+    def test_concurrent_record(self):
+        """複数スレッドから記録しても件数が失われない"""
+        histogram = LatencyHistogram()
+
+        def worker():
+            for _ in range(5000):
+                histogram.record(0.001)
+
+        threads = [threading.Thread(target=worker) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert histogram.count == 20000
+
+
+class TestRateCounter:
+    """RateCounterのテスト"""
+
+    def test_rolling_rates(self):
+        """直前1秒と直前60秒のレートを求める"""
+        clock = FakeClock()
+        counter = RateCounter(clock=clock)
+        for second in range(60):
+            clock.now = 1000.0 + second
+            counter.add(10 if second < 59 else 30)
+        clock.now = 1060.0
+
+        stats = counter.to_dict()
+        assert stats["total"] == 59 * 10 + 30
+        assert stats["rate_1s"] == 30
+        assert stats["rate_60s"] == (59 * 10 + 30) / 60
+
+    def test_old_buckets_expire(self):
+        """60秒以上前のカウントはレートに含まれない"""
+        clock = FakeClock()
+        counter = RateCounter(clock=clock)
+        counter.add(100)
+        clock.now += 120
+
+        assert counter.rates() == {"rate_1s": 0.0, "rate_60s": 0.0}
+        assert counter.total == 100
+
+
+class TestPipelineMetrics:
+    """PipelineMetricsのテスト"""
+
+    def test_snapshot(self):
+        """カウンタとヒストグラムがスナップショットに含まれる"""
+        metrics = PipelineMetrics()
+        metrics.count("captured", 3)
+        metrics.observe("decoded", 0.002)
+
+        snapshot = metrics.snapshot()
+        assert snapshot["counters"]["captured"]["total"] == 3
+        assert snapshot["latency"]["decoded"]["count"] == 1
+        assert "captured" not in snapshot["latency"]
@@ -0,0 +1,93 @@
+"""
+Tests for the bounded packet queue
+"""
+import threading
+
+import pytest
+
+from src.packet_decoder.packet_queue import (
+    DROP_NEWEST,
+    DROP_NON_TRADING_FIRST,
+    DROP_OLDEST,
+    PacketRingBuffer,
+)
+
+
+def payloads(batch):
+    return [payload for payload, _is_trading, _arrived_at in batch]
+
+
+class TestPacketRingBuffer:
+    """PacketRingBufferのテスト"""
+
+    def test_fifo_across_categories(self):
+        """取引所パケットとそれ以外が到着順に取り出される"""
+        queue = PacketRingBuffer(max_items=10)
+        queue.put(b"a", False, 0.0)
+        queue.put(b"b", True, 0.0)
+        queue.put(b"c", False, 0.0)
+
+        assert payloads(queue.get_batch(2)) == [b"a", b"b"]
+        assert payloads(queue.get_batch(10)) == [b"c"]
+
+    def test_drop_newest(self):
+        """drop_newestでは新着を捨てる"""
+        queue = PacketRingBuffer(max_items=2, policy=DROP_NEWEST)
+        for payload in (b"1", b"2", b"3"):
+            queue.put(payload, True, 0.0)
+
+        assert payloads(queue.get_batch(10)) == [b"1", b"2"]
+        assert queue.get_stats()["dropped"]["newest"] == {"packets": 1, "bytes": 1}
+
+    def test_drop_oldest(self):
+        """drop_oldestでは最も古いフレームを捨てる"""
+        queue = PacketRingBuffer(max_items=2, policy=DROP_OLDEST)
+        for payload in (b"1", b"2", b"3"):
+            queue.put(payload, True, 0.0)
+
+        assert payloads(queue.get_batch(10)) == [b"2", b"3"]
+        assert queue.get_stats()["dropped"]["oldest"]["packets"] == 1
+
+    def test_drop_non_trading_first(self):
+        """取引所以外のフレームから先に捨てる"""
+        queue = PacketRingBuffer(max_items=3, policy=DROP_NON_TRADING_FIRST)
+        queue.put(b"t1", True, 0.0)
+        queue.put(b"o1", False, 0.0)
+        queue.put(b"t2", True, 0.0)
+        queue.put(b"t3", True, 0.0)
+        # 取引所パケットしか残っていなければ、取引所以外の新着は捨てる
+        assert not queue.put(b"o2", False, 0.0)
+
+        assert payloads(queue.get_batch(10)) == [b"t1", b"t2", b"t3"]
+        stats = queue.get_stats()
+        assert stats["dropped"]["non_trading"]["packets"] == 1
+        assert stats["dropped"]["newest"]["packets"] == 1
+        assert stats["dropped_by_category"] == {"trading": 0, "game": 2}
+
+    def test_byte_limit_and_high_water(self):
+        """バイト数の上限を超えるフレームは入らず、最高水位が記録される"""
+        queue = PacketRingBuffer(max_items=100, max_bytes=10)
+        assert queue.put(b"x" * 6, True, 0.0)
+        assert not queue.put(b"y" * 6, True, 0.0)
+        assert queue.put(b"z" * 4, True, 0.0)
+
+        stats = queue.get_stats()
+        assert stats["bytes"] == 10
+        assert stats["high_water_bytes"] == 10
+        assert stats["high_water_items"] == 2
+
+    def test_close_wakes_consumer(self):
+        """closeで待機中の処理スレッドが起き、空リストを受け取る"""
+        queue = PacketRingBuffer()
+        results = []
+        thread = threading.Thread(target=lambda: results.append(queue.get_batch(10)))
+        thread.start()
+        queue.close()
+        thread.join(timeout=5)
+
+        assert results == [[]]
+
+    def test_unknown_policy(self):
+        """未知のポリシーはエラー"""
+        with pytest.raises(ValueError):
+            PacketRingBuffer(policy="drop_everything")
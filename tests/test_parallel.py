@@ -0,0 +1,84 @@
+"""
+Tests for parallel capture decoding
+"""
+from src.packet_decoder.decoder import TradingCenterDecoder
+from src.packet_decoder.parallel import iter_shard, plan_shards
+from src.packet_decoder.pcap_reader import iter_pcap, split_pcap_ranges
+from tests.helpers import (
+    build_frame,
+    build_tcp_frame,
+    build_trading_payload,
+    write_pcap,
+)
+
+
+def write_multi_flow_capture(path, packets=40):
+    """複数フローにまたがる取引所パケットを含むPCAPを生成"""
+    frames = []
+    for i in range(packets):
+        port = 40000 + i % 4
+        payload = build_frame(build_trading_payload([(i + 1, 100 + i, 1, 1000 + i)]))
+        frames.append((1700000000.0 + i, build_tcp_frame(
+            payload, dst=("10.0.0.2", port), seq=1 + (i // 4) * len(payload)
+        )))
+    write_pcap(path, frames)
+
+
+class TestParallelDecoding:
+    """並列デコードのテスト"""
+    
+    def test_byte_ranges_cover_all_records(self, tmp_path):
+        """バイト範囲シャードで全レコードが1回ずつ読まれる"""
+        path = tmp_path / "capture.pcap"
+        write_multi_flow_capture(path)
+        
+        ranges = split_pcap_ranges(str(path), 3)
+        records = [r for start, end in ranges for r in iter_pcap(str(path), start, end)]
+        
+        assert len(ranges) == 3
+        assert [r.payload for r in records] == [r.payload for r in iter_pcap(str(path))]
+    
+    def test_flow_shards_partition_records(self, tmp_path):
+        """フローシャードでは各フローが1つのシャードにだけ属する"""
+        path = tmp_path / "capture.pcap"
+        write_multi_flow_capture(path)
+        
+        shards = plan_shards(str(path), 3, by_flow=True)
+        owners = {}
+        total = 0
+        for shard in shards:
+            for record in iter_shard(str(path), shard):
+                assert owners.setdefault(record.flow, shard.index) == shard.index
+                total += 1
+        
+        assert total == 40
+    
+    def test_parallel_matches_sequential(self, tmp_path):
+        """並列デコードの結果が逐次デコードと一致する"""
+        path = tmp_path / "capture.pcap"
+        write_multi_flow_capture(path)
+        
+        sequential = TradingCenterDecoder().decode_pcap_file(str(path))
+        decoder = TradingCenterDecoder()
+        parallel = decoder.decode_pcap_file(str(path), workers=2)
+        
+        assert [p.listings[0].listing_id for p in parallel] == \
+            [p.listings[0].listing_id for p in sequential]
+        assert decoder.last_run_stats["workers"] == 2
+        # フローシャードでも親プロセスが1回だけ解析してワーカーに振り分ける
+        assert decoder.last_run_stats["parse_passes"] == 1
+        assert decoder.last_run_stats["sharding"] == "flow"
+        assert decoder.last_run_stats["mb_per_sec"] >= 0
+    
+    def test_parallel_raw_retention_is_global(self, tmp_path):
+        """元ペイロードの保持上限はシャードごとではなくキャプチャ全体に適用する"""
+        path = tmp_path / "capture.pcap"
+        write_multi_flow_capture(path)
+        budget = 3 * len(build_trading_payload([(1, 100, 1, 1000)]))
+        
+        sequential = TradingCenterDecoder(raw_retention_bytes=budget).decode_pcap_file(str(path))
+        parallel = TradingCenterDecoder(raw_retention_bytes=budget).decode_pcap_file(str(path), workers=2)
+        
+        retained = [p.raw_data is not None for p in parallel]
+        assert retained == [p.raw_data is not None for p in sequential]
+        assert 0 < sum(retained) <= 3
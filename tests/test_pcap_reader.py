@@ -0,0 +1,54 @@
+"""
+Tests for the streaming PCAP reader
+"""
+import pytest
+from datetime import datetime
+
+from src.packet_decoder.decoder import TradingCenterDecoder
+from src.packet_decoder.pcap_reader import Flow, iter_pcap, parse_frame
+from tests.helpers import (
+    build_tcp_frame,
+    build_trading_payload,
+    write_pcap,
+    write_pcapng,
+)
+
+
+class TestPcapReader:
+    """pcap_readerのテスト"""
+    
+    @pytest.mark.parametrize("writer", [write_pcap, write_pcapng])
+    def test_iter_pcap_yields_tcp_payloads(self, tmp_path, writer):
+        """PCAP/PCAPNGの両方からペイロードを読み出せる"""
+        path = tmp_path / "capture.pcap"
+        writer(path, [
+            (1700000000.5, build_tcp_frame(b"hello")),
+            (1700000001.25, build_tcp_frame(b"", seq=6)),  # ペイロードなしは除外
+            (1700000002.0, build_tcp_frame(b"world", seq=6)),
+        ])
+        
+        records = list(iter_pcap(str(path)))
+        
+        assert [r.payload for r in records] == [b"hello", b"world"]
+        assert records[0].timestamp == pytest.approx(1700000000.5)
+        assert records[0].flow == Flow("10.0.0.1", 5000, "10.0.0.2", 40000)
+    
+    def test_parse_frame_ignores_non_ip(self):
+        """IP以外のフレームは無視される"""
+        frame = b'\x00' * 12 + b'\x08\x06' + b'\x00' * 28  # ARP
+        assert parse_frame(1, frame) is None
+    
+    def test_decode_pcap_file_uses_capture_timestamp(self, tmp_path):
+        """リスティングにはPCAPのタイムスタンプが付与される"""
+        path = tmp_path / "trading.pcap"
+        payload = build_trading_payload([(1001, 42, 3, 900, "ポーション")])
+        write_pcap(path, [(1700000000.0, build_tcp_frame(payload))])
+        
+        decoder = TradingCenterDecoder()
+        packets = decoder.decode_pcap_file(str(path))
+        
+        assert len(packets) == 1
+        listing = packets[0].listings[0]
+        assert listing.item_id == 42
+        assert listing.item_name == "ポーション"
+        assert listing.timestamp == datetime.fromtimestamp(1700000000.0)
@@ -0,0 +1,47 @@
+"""
+Tests for the protobuf wire-format scanner
+"""
+from src.packet_decoder.protobuf import (
+    WIRE_FIXED64,
+    WIRE_LENGTH_DELIMITED,
+    WIRE_VARINT,
+    scan_fields,
+)
+from tests.helpers import pb_bytes, pb_fixed64, pb_varint
+
+
+class TestScanFields:
+    """scan_fieldsのテスト"""
+    
+    def test_tokenizes_all_wire_types(self):
+        """各ワイヤータイプを配列にトークン化する"""
+        data = pb_varint(1, 150) + pb_bytes(2, b"guid-value") + pb_fixed64(3, 123456789) + pb_varint(20, 1 << 40)
+        
+        fields = scan_fields(data)
+        
+        assert list(fields.field_numbers) == [1, 2, 3, 20]
+        assert list(fields.wire_types) == [WIRE_VARINT, WIRE_LENGTH_DELIMITED, WIRE_FIXED64, WIRE_VARINT]
+        assert fields.values[0] == 150
+        assert fields.values[2] == 123456789
+        assert fields.values[3] == 1 << 40
+        start, length = fields.offsets[1], fields.lengths[1]
+        assert data[start:start + length] == b"guid-value"
+        assert fields.end == len(data)
+    
+    def test_stops_at_truncated_field(self):
+        """途中で切れたフィールドの手前で止まる"""
+        data = pb_varint(1, 5) + pb_bytes(2, b"x" * 30)[:-5]
+        
+        fields = scan_fields(data)
+        
+        assert len(fields) == 1
+        assert fields.end == 2
+    
+    def test_scan_with_offset_on_memoryview(self):
+        """memoryviewの途中から絶対位置でスキャンできる"""
+        prefix = b"\xff\xff\xff"
+        data = memoryview(prefix + pb_varint(4, 7))
+        
+        fields = scan_fields(data, len(prefix))
+        
+        assert list(fields.iter_fields()) == [(4, WIRE_VARINT, 4, 1, 7)]
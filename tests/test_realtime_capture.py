@@ -0,0 +1,362 @@
+"""
+Tests for real-time capture filtering
+"""
+import threading
+import time
+from datetime import datetime
+
+import pytest
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.orm import Session
+
+from src.packet_decoder.decode_pool import WORKER_PROCESS, WORKER_THREAD
+from src.packet_decoder.pcap_reader import Flow, TCP_FIN
+from src.packet_decoder.realtime_capture import (
+    FLOW_GAME,
+    FLOW_NON_GAME,
+    FLOW_UNKNOWN,
+    CompositeCallback,
+    DatabaseCallback,
+    QueuedCallback,
+    RealtimeCaptureCallback,
+    RealtimePacketCapture,
+)
+from src.database.models import Base, Item, Listing
+from src.database.seen_filter import SeenListingFilter
+from src.database.writer import ListingWriter
+from tests.helpers import build_frame, build_trading_payload, make_listings
+
+GAME = Flow("10.0.0.1", 5000, "10.0.0.2", 40000)
+OTHER = Flow("10.0.0.9", 443, "10.0.0.2", 40001)
+
+
+def make_capture(**kwargs):
+    """設定ファイルのゲームサーバー設定に依存しないキャプチャを生成"""
+    capture = RealtimePacketCapture(**kwargs)
+    capture.game_server_ip = kwargs.get("game_server_ip")
+    capture.game_server_port = kwargs.get("game_server_port")
+    return capture
+
+
+class TestPreQueueFiltering:
+    """キュー投入前のフロー分類と固定のテスト"""
+
+    def test_unknown_flow_passes_only_trading(self):
+        """未判定のフローからは取引所パケットだけがキューに入る"""
+        capture = make_capture()
+        capture._handle_segment(OTHER, 1, build_frame(b"noise" * 10), 1.0)
+
+        trading = build_trading_payload([(1, 100, 1, 500)])
+        capture._handle_segment(GAME, 1, trading, 1.0)
+
+        assert capture.packet_queue.qsize() == 1
+        assert capture.packet_queue.get_batch(10)[0][:2] == (trading, True)
+        assert capture.get_stats()["filtered"][FLOW_UNKNOWN] == 1
+
+    def test_trading_packet_pins_flow(self):
+        """取引所パケットを出したフローが固定され、他のフローは破棄される"""
+        capture = make_capture()
+        trading = build_trading_payload([])
+        capture._handle_segment(GAME, 1, trading, 1.0)
+
+        assert capture.pinned_flow == GAME
+        assert capture._classify_flow(GAME.reversed()) == FLOW_GAME
+        assert capture._classify_flow(OTHER) == FLOW_NON_GAME
+        assert "port 5000" in capture._build_capture_filter()
+        assert "port 40000" in capture._build_capture_filter()
+
+        capture._handle_segment(OTHER, 1, build_trading_payload([]), 1.0)
+        assert capture.get_stats()["filtered"][FLOW_NON_GAME] == 1
+
+        # 固定後はゲーム接続の取引所以外のフレームもキューに入る
+        capture._handle_segment(GAME, 1 + len(trading), build_frame(b"x" * 20), 1.0)
+        assert capture.packet_queue.qsize() == 2
+
+    def test_closed_connection_unpins(self):
+        """固定した接続が閉じると固定が解除される"""
+        capture = make_capture()
+        capture._handle_segment(GAME, 1, build_trading_payload([]), 1.0)
+        capture._handle_segment(GAME.reversed(), 1, b"", 2.0, TCP_FIN)
+
+        assert capture.pinned_flow is None
+        assert capture._classify_flow(OTHER) == FLOW_UNKNOWN
+
+    def test_idle_pinned_flow_unpins(self):
+        """固定した接続にパケットが届かなくなったら、バックエンドを止めて固定を解除する"""
+        capture = make_capture(pin_idle_timeout=5)
+        capture.is_running = True
+        capture._handle_segment(GAME, 1, build_trading_payload([]), 1.0)
+        capture._filter_changed = False
+
+        assert not capture._should_restart_capture()
+        capture._pinned_seen_at -= 6
+
+        assert capture._should_restart_capture()
+        assert capture.pinned_flow is None
+
+    def test_configured_server(self):
+        """設定されたゲームサーバー以外のフローは分類時点で破棄される"""
+        capture = make_capture(game_server_ip="10.0.0.1", game_server_port=5000)
+
+        assert capture._classify_flow(GAME) == FLOW_GAME
+        assert capture._classify_flow(OTHER) == FLOW_NON_GAME
+
+    def test_queue_drops_counted_per_category(self):
+        """キュー満杯時の破棄は分類別に集計される"""
+        capture = make_capture(queue_size=1)
+        trading = build_trading_payload([])
+        other = build_frame(b"y" * 20)
+        capture._handle_segment(GAME, 1, trading, 1.0)
+        capture._handle_segment(GAME, 1 + len(trading), other, 1.0)
+        capture._handle_segment(GAME, 1 + len(trading) + len(other), trading, 1.0)
+
+        stats = capture.get_stats()
+        assert stats["queue"]["dropped_by_category"] == {"trading": 1, FLOW_GAME: 1}
+
+
+class RecordingCallback(RealtimeCaptureCallback):
+    """on_listing_found の呼び出しを記録するコールバック"""
+
+    def __init__(self):
+        self.calls = []
+        self.seen = []
+
+    def on_listing_found(self, listings):
+        self.calls.append(listings)
+
+    def on_listings_seen(self, listings, seen_at):
+        self.seen.append(listings)
+
+
+class TestProcessLoop:
+    """バッチ処理ループのテスト"""
+
+    def test_batches_listings_and_stops_on_close(self):
+        """起床ごとにまとめて処理し、キューが閉じられたら終了する"""
+        callback = RecordingCallback()
+        capture = make_capture(callback=callback, batch_size=8)
+        for i in range(3):
+            payload = build_trading_payload([(i, 100, 1, 500)])
+            capture.packet_queue.put(payload, True, time.perf_counter())
+        capture.packet_queue.close()
+
+        capture._process_loop()
+
+        assert [len(listings) for listings in callback.calls] == [3]
+        stats = capture.get_stats()
+        assert stats["listings_found"] == 3
+        assert stats["latency"]["listing"]["count"] == 3
+        assert stats["latency"]["queued"]["count"] == 3
+        assert stats["stages"]["decoded"]["total"] == 3
+
+    def test_repeated_page_skips_decode(self):
+        """同じページの再送はデコードせず on_listings_seen に渡す"""
+        callback = RecordingCallback()
+        capture = make_capture(callback=callback)
+        payload = build_trading_payload([(1, 100, 1, 500)])
+        for prefix in (b'\x01\x02', b'\x01\x02', b'\x09\x09'):
+            capture.packet_queue.put(prefix + payload[2:], True, time.perf_counter())
+        capture.packet_queue.close()
+
+        capture._process_loop()
+
+        assert [len(listings) for listings in callback.calls] == [1]
+        assert [len(listings) for listings in callback.seen] == [2]
+        stats = capture.get_stats()
+        assert stats["stages"]["decoded"]["total"] == 1
+        assert stats["dedupe"]["hits"] == 2
+        assert stats["dedupe"]["hit_rate"] == 2 / 3
+
+    def test_consumer_wakes_on_arrival(self):
+        """処理スレッドはポーリングせず、到着したフレームをすぐに処理する"""
+        callback = RecordingCallback()
+        capture = make_capture(callback=callback)
+        thread = threading.Thread(target=capture._process_loop)
+        thread.start()
+
+        capture._handle_segment(GAME, 1, build_trading_payload([(1, 100, 1, 500)]), 1.0)
+        capture.packet_queue.close()
+        thread.join(timeout=5)
+
+        assert not thread.is_alive()
+        assert len(callback.calls) == 1
+
+
+class TestParallelDecode:
+    """デコードワーカープールとシーケンサーのテスト"""
+
+    @pytest.mark.parametrize("mode", [WORKER_THREAD, WORKER_PROCESS])
+    def test_callbacks_in_capture_order(self, mode):
+        """並列にデコードしても、コールバックはキャプチャ順に呼ばれる"""
+        callback = RecordingCallback()
+        capture = make_capture(callback=callback, batch_size=2, decode_workers=3, worker_mode=mode)
+        for i in range(20):
+            payload = build_trading_payload([(i, 100 + i, 1, 500)])
+            capture.packet_queue.put(payload, True, time.perf_counter())
+        capture.packet_queue.close()
+
+        capture._process_loop()
+
+        assert [l.listing_id for listings in callback.calls for l in listings] == [str(i) for i in range(20)]
+        assert capture.get_stats()["stages"]["decoded"]["total"] == 20
+
+    def test_repeats_across_batches_decoded_once(self):
+        """別々のバッチに入った同じページの再送も、デコード中の結果を待って1回だけデコードする"""
+        callback = RecordingCallback()
+        capture = make_capture(callback=callback, batch_size=1, decode_workers=3)
+        payload = build_trading_payload([(1, 100, 1, 500)])
+        for _ in range(6):
+            capture.packet_queue.put(payload, True, time.perf_counter())
+        capture.packet_queue.close()
+
+        capture._process_loop()
+
+        assert capture.get_stats()["stages"]["decoded"]["total"] == 1
+        assert [len(listings) for listings in callback.calls] == [1]
+        assert sum(len(listings) for listings in callback.seen) == 5
+        assert capture._inflight_keys == set()
+
+
+class SlowCallback(RecordingCallback):
+    """保存に時間がかかるシンク"""
+
+    def __init__(self):
+        super().__init__()
+        self.release = threading.Event()
+
+    def on_listing_found(self, listings):
+        self.release.wait(5)
+        super().on_listing_found(listings)
+
+
+class TestQueuedCallback:
+    """シンクのキュー分離のテスト"""
+
+    def test_slow_sink_does_not_block(self):
+        """遅いシンクがあっても通知はすぐに戻り、停止時に残りを処理する"""
+        slow = SlowCallback()
+        fast = RecordingCallback()
+        callback = CompositeCallback([QueuedCallback(slow, "database"), QueuedCallback(fast, "websocket")])
+
+        started_at = time.perf_counter()
+        for i in range(3):
+            callback.on_listing_found([i])
+        assert time.perf_counter() - started_at < 1.0
+
+        slow.release.set()
+        callback.close()
+
+        assert slow.calls == [[0], [1], [2]]
+        assert fast.calls == [[0], [1], [2]]
+        assert callback.get_stats()["database"]["delivered"] == 3
+
+    def test_drop_when_full(self):
+        """drop_when_full の場合は満杯の時に破棄して数える"""
+        slow = SlowCallback()
+        callback = QueuedCallback(slow, "websocket", max_items=1, drop_when_full=True)
+        for i in range(5):
+            callback.on_listing_found([i])
+        slow.release.set()
+        callback.close()
+
+        stats = callback.get_stats()["websocket"]
+        assert stats["dropped"] >= 3
+        assert stats["delivered"] + stats["dropped"] == 5
+
+    def test_unhandled_methods_not_queued(self):
+        """コールバックが実装していない通知はキューに入れない"""
+        callback = QueuedCallback(RecordingCallback(), "database")
+        callback.on_packet_captured(object())
+
+        assert callback.get_stats()["database"]["high_water"] == 0
+        assert callback._thread is None
+
+
+@pytest.fixture
+def database_url(tmp_path):
+    # 書き込みスレッドとテストのセッションで同じデータベースを使えるようにファイルにする
+    url = f"sqlite:///{tmp_path / 'market.db'}"
+    engine = create_engine(url)
+    Base.metadata.create_all(engine)
+    engine.dispose()
+    return url
+
+
+@pytest.fixture
+def db_session(database_url):
+    engine = create_engine(database_url)
+    with Session(engine) as session:
+        yield session
+    engine.dispose()
+
+
+class TestDatabaseCallback:
+    """書き込みスレッド経由のDB保存のテスト"""
+
+    def count(self, session, model):
+        session.rollback()
+        return session.scalar(select(func.count()).select_from(model))
+
+    def test_flushes_at_row_count(self, database_url, db_session):
+        """行数に達したらまとめて書き込み、アイテムも作成する"""
+        callback = DatabaseCallback(writer=ListingWriter.for_url(database_url, flush_rows=4, flush_interval=60))
+        callback.on_listing_found(make_listings([1, 2]))
+        callback.on_listing_found(make_listings([3, 4], item_id=200))
+        # 4行目でコミットされるため、同期要求は空のバッファを確認するだけになる
+        callback.flush()
+        stats = callback.get_stats()["database_writer"]
+
+        assert self.count(db_session, Listing) == 4
+        assert self.count(db_session, Item) == 2
+        assert (stats["commits"], stats["rows_written"], stats["buffered"]) == (1, 4, 0)
+        assert stats["commit_latency"]["count"] == 1
+        callback.close()
+
+    def test_flushes_after_interval(self, database_url, db_session):
+        """行数に達しなくても一定時間で書き込む"""
+        callback = DatabaseCallback(writer=ListingWriter.for_url(database_url, flush_rows=1000, flush_interval=0.05))
+        callback.on_listing_found(make_listings([1]))
+
+        deadline = time.time() + 5
+        while callback.get_stats()["database_writer"]["commits"] == 0 and time.time() < deadline:
+            time.sleep(0.01)
+
+        assert self.count(db_session, Listing) == 1
+        callback.close()
+
+    def test_close_flushes_seen_updates(self, database_url, db_session):
+        """停止時に残りの行と最終確認時刻の更新を書き込む"""
+        callback = DatabaseCallback(writer=ListingWriter.for_url(database_url, flush_rows=1000, flush_interval=60))
+        callback.on_listing_found(make_listings([1, 2]))
+        seen_at = datetime(2026, 3, 1, 12, 0)
+        callback.on_listings_seen(make_listings([1]), seen_at)
+        callback.close()
+
+        self.count(db_session, Listing)
+        assert db_session.get(Listing, 1).captured_at == seen_at
+        assert callback.get_stats()["database_writer"]["seen_updated"] == 1
+
+    def test_seen_filter_skips_unchanged_rows(self, database_url):
+        """保存済みで変化のない出品は行を書き込まず、最終確認時刻だけを更新する"""
+        writer = ListingWriter.for_url(database_url, flush_rows=2, flush_interval=60, seen_filter=SeenListingFilter())
+        callback = DatabaseCallback(writer=writer)
+        callback.on_listing_found(make_listings([1, 2]))
+        callback.on_listing_found(make_listings([1, 2]))
+        callback.close()
+
+        stats = callback.get_stats()["database_writer"]
+        assert (stats["rows_written"], stats["seen_updated"]) == (2, 2)
+        assert stats["seen_filter"]["hit_rate"] == pytest.approx(0.5)
+
+    def test_url_opens_writer_engine(self, database_url, db_session):
+        """URLを渡すと専用のエンジンを持つライターを作り、停止時に書き終える"""
+        callback = DatabaseCallback(database_url, flush_rows=1000, flush_interval=60)
+        callback.on_listing_found(make_listings([1, 2, 3]))
+        callback.close()
+
+        assert self.count(db_session, Listing) == 3
+
+    def test_shared_session_rejected(self, db_session):
+        """呼び出し側のセッションは書き込みスレッドと共有しないよう受け付けない"""
+        with pytest.raises(TypeError):
+            DatabaseCallback(db_session)
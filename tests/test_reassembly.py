@@ -0,0 +1,140 @@
+"""
+Tests for TCP stream reassembly
+"""
+import pytest
+
+from src.packet_decoder.decoder import TradingCenterDecoder
+from src.packet_decoder.pcap_reader import Flow, TCP_FIN, TCP_RST, iter_pcap
+from src.packet_decoder.reassembly import TcpReassembler
+from tests.helpers import (
+    build_frame,
+    build_tcp_frame,
+    build_trading_payload,
+    write_pcap,
+)
+
+FLOW = Flow("10.0.0.1", 5000, "10.0.0.2", 40000)
+
+
+class TestTcpReassembler:
+    """TcpReassemblerのテスト"""
+    
+    def test_frame_split_across_segments(self):
+        """複数セグメントに分割されたフレームが1つにまとまる"""
+        frame = build_frame(b"x" * 100)
+        reassembler = TcpReassembler()
+        
+        assert reassembler.feed(FLOW, 1000, frame[:40]) == []
+        assert reassembler.feed(FLOW, 1040, frame[40:]) == [frame]
+    
+    def test_reorder_then_duplicate(self):
+        """順序外で届いたセグメントを並べ直し、重複は捨てる"""
+        first = build_frame(b"a" * 20)
+        second = build_frame(b"b" * 30)
+        stream = first + second
+        reassembler = TcpReassembler()
+        
+        # 先頭のセグメントでフローの基準シーケンスを確立
+        assert reassembler.feed(FLOW, 100, stream[:10]) == []
+        # 後半が先に届く
+        assert reassembler.feed(FLOW, 120, stream[20:]) == []
+        # 欠けていた部分が届くと両方のフレームが完成する
+        assert reassembler.feed(FLOW, 110, stream[10:20]) == [first, second]
+        # 再送は無視される
+        assert reassembler.feed(FLOW, 110, stream[10:20]) == []
+        assert reassembler.stats["retransmissions"] == 1
+    
+    def test_gap_skips_lost_data(self):
+        """保留量の上限を超えた欠落は諦めて先へ進む"""
+        reassembler = TcpReassembler(max_pending_bytes=64)
+        frame = build_frame(b"c" * 100)
+        
+        reassembler.feed(FLOW, 0, b"\x00")
+        # seq=1 のデータが失われたまま後続が届く
+        frames = reassembler.feed(FLOW, 50, frame)
+        
+        assert frames == [frame]
+        assert reassembler.stats["gaps"] == 1
+    
+    def test_idle_flow_eviction(self):
+        """アイドル状態のフローは追い出される"""
+        reassembler = TcpReassembler(idle_timeout=10)
+        reassembler.feed(FLOW, 0, build_frame(b"d" * 10)[:5], timestamp=1000.0)
+        
+        assert reassembler.active_flows == 1
+        assert reassembler.evict_idle(1011.0) == 1
+        assert reassembler.active_flows == 0
+    
+    def test_fin_flushes_remaining(self):
+        """FINで残りのデータが吐き出される"""
+        reassembler = TcpReassembler()
+        partial = build_frame(b"e" * 10)[:8]
+        
+        assert reassembler.feed(FLOW, 0, partial, flags=TCP_FIN) == [partial]
+        assert reassembler.active_flows == 0
+    
+    def test_flush_returns_last_timestamp_per_flow(self):
+        """flushは各フローの残りデータをそのフローの最後のキャプチャ時刻と一緒に返す"""
+        other = Flow("10.0.0.1", 5000, "10.0.0.2", 40001)
+        reassembler = TcpReassembler()
+        first = build_frame(b"g" * 10)[:8]
+        second = build_frame(b"h" * 10)[:9]
+        reassembler.feed(FLOW, 0, first[:4], timestamp=1000.0)
+        reassembler.feed(FLOW, 4, first[4:], timestamp=1001.0)
+        reassembler.feed(other, 0, second, timestamp=1050.0)
+
+        assert reassembler.flush() == [(FLOW, first, 1001.0), (other, second, 1050.0)]
+        assert reassembler.active_flows == 0
+
+    @pytest.mark.parametrize("flags", [TCP_FIN | 0x10, TCP_RST])
+    def test_pcap_flag_only_segment_closes_flow(self, tmp_path, flags):
+        """PCAPのペイロードなしのFIN/RSTセグメントでフローが閉じ、残りのデータが吐き出される"""
+        partial = build_frame(b"f" * 10)[:8]
+        path = tmp_path / "close.pcap"
+        write_pcap(path, [
+            (1700000000.0, build_tcp_frame(partial, seq=1)),
+            (1700000000.1, build_tcp_frame(b"", seq=9, flags=0x10)),  # ACKだけは除外
+            (1700000000.2, build_tcp_frame(b"", seq=9, flags=flags)),
+        ])
+        reassembler = TcpReassembler()
+
+        records = list(iter_pcap(str(path)))
+        frames = [
+            frame for record in records
+            for frame in reassembler.feed(record.flow, record.seq, record.payload, record.timestamp, record.flags)
+        ]
+
+        assert [(r.payload, r.flags) for r in records] == [(partial, 0x18), (b"", flags)]
+        assert frames == [partial]
+        assert reassembler.active_flows == 0
+
+    def test_decoder_reassembles_split_trading_packet(self, tmp_path):
+        """分割された取引所パケットをPCAPからデコードできる"""
+        listings = [(2000 + i, 10 + i, 1, 500) for i in range(30)]
+        frame = build_frame(build_trading_payload(listings))
+        path = tmp_path / "split.pcap"
+        write_pcap(path, [
+            (1700000000.0, build_tcp_frame(frame[:700], seq=1)),
+            (1700000000.1, build_tcp_frame(frame[700:], seq=701)),
+        ])
+        
+        packets = TradingCenterDecoder().decode_pcap_file(str(path))
+        
+        assert len(packets) == 1
+        assert len(packets[0].listings) == 30
+
+    def test_decoder_flush_uses_flow_timestamp(self, tmp_path):
+        """ファイル末尾で吐き出したデータは、最後のレコードではなくそのフローの時刻でデコードする"""
+        payload = build_trading_payload([(3000, 10, 1, 500)])
+        # 長さヘッダーより短いまま終わるフレーム（末尾の16バイトが届かない）
+        truncated = build_frame(payload + b"\x00" * 16)[:-16]
+        path = tmp_path / "truncated.pcap"
+        write_pcap(path, [
+            (1700000000.0, build_tcp_frame(truncated, seq=1)),
+            (1700000060.0, build_tcp_frame(b"\x00\x01", dst=("10.0.0.2", 40001), seq=1)),
+        ])
+
+        packets = TradingCenterDecoder().decode_pcap_file(str(path))
+
+        assert [p.listings[0].listing_id for p in packets] == ["3000"]
+        assert packets[0].timestamp.timestamp() == 1700000000.0
@@ -0,0 +1,102 @@
+"""
+Tests for the schema-driven listing decoder
+"""
+from datetime import datetime
+
+import pytest
+
+from src.packet_decoder.decoder import TradingCenterDecoder
+from src.database.ingest import listing_key
+from src.packet_decoder.schema import (
+    DEFAULT_LISTING_SCHEMA,
+    DERIVED_KEY_PREFIX,
+    TYPE_STRING,
+    FieldPath,
+    ListingSchema,
+    SchemaDecoder,
+    to_item_listing,
+)
+from tests.helpers import build_exchange_item, build_exchange_payload, pb_bytes, pb_varint
+
+
+class TestSchemaDecoder:
+    """SchemaDecoderのテスト"""
+
+    def test_decode_entry_by_field_number(self):
+        """フィールド番号で値を割り当て、未知のフィールドは読み飛ばす"""
+        extra = pb_bytes(9, b"x" * 300) + pb_varint(15, 1_800_000_000)
+        data = build_exchange_item(120000, 3, 1050, guid="abc-def", notice_time=1_760_000_000, extra=extra)
+
+        values = SchemaDecoder().decode_entry(data)
+
+        assert values == {
+            "price": 120000,
+            "quantity": 3,
+            "item_id": 1050,
+            "guid": "abc-def",
+            "notice_time": 1_760_000_000,
+        }
+
+    def test_missing_required_returns_none(self):
+        """必須属性が欠けていればNone"""
+        assert SchemaDecoder().decode_entry(pb_varint(1, 100) + pb_varint(2, 1)) is None
+
+    def test_decode_listings(self):
+        """トップレベルメッセージからItemListingを生成する"""
+        payload = build_exchange_payload([(500, 2, 10, "g-1", 1_760_000_000), (900, 1, 11)])
+        offset = payload.index(TradingCenterDecoder.TRADING_CENTER_MAGIC) + 6
+
+        captured_at = datetime(2026, 3, 1, 12, 0)
+        listings = SchemaDecoder().decode_listings(memoryview(payload), offset, captured_at)
+
+        assert [(l.item_id, l.quantity, l.price) for l in listings] == [(10, 2, 500), (11, 1, 900)]
+        assert listings[0].listing_id == "g-1"
+        # 出品時刻はキャプチャ時刻を置き換えず、別の属性に入る
+        assert [l.timestamp for l in listings] == [captured_at, captured_at]
+        assert listings[0].notice_time.timestamp() == 1_760_000_000
+        assert listings[1].notice_time is None
+
+    def test_entries_without_key_get_distinct_keys(self):
+        """識別子のないエントリはバイト列から決まる別々のキーになり、同じ行に上書きされない"""
+        payload = build_exchange_payload([(500, 2, 10), (900, 1, 11), (500, 2, 10, "g-1")])
+        offset = payload.index(TradingCenterDecoder.TRADING_CENTER_MAGIC) + 6
+        decoder = SchemaDecoder()
+
+        listings = decoder.decode_listings(payload, offset)
+        again = decoder.decode_listings(payload, offset)
+
+        ids = [l.listing_id for l in listings]
+        assert ids[0].startswith(DERIVED_KEY_PREFIX) and ids[2] == "g-1"
+        assert len({listing_key(listing_id) for listing_id in ids}) == 3
+        assert [l.listing_id for l in again] == ids
+        assert decoder.stats["derived_keys"] == 4
+
+    def test_to_item_listing_requires_key(self):
+        """識別子のない値からはItemListingを作らない"""
+        with pytest.raises(ValueError):
+            to_item_listing({"item_id": 1, "quantity": 1, "price": 100, "guid": ""})
+
+    def test_schema_round_trip(self):
+        """スキーマを辞書に変換して戻せる"""
+        restored = ListingSchema.from_dict(DEFAULT_LISTING_SCHEMA.to_dict())
+        assert restored == DEFAULT_LISTING_SCHEMA
+
+    def test_invalid_schema(self):
+        """必須属性の欠落や矛盾するパスはエラー"""
+        with pytest.raises(ValueError):
+            ListingSchema(name="broken", fields={"price": FieldPath((1,))})
+        with pytest.raises(ValueError):
+            SchemaDecoder(ListingSchema(name="conflict", fields={
+                "price": FieldPath((1,)),
+                "quantity": FieldPath((1, 2)),
+                "item_id": FieldPath((3,)),
+                "guid": FieldPath((4,), TYPE_STRING),
+            }))
+
+    def test_trading_center_decoder_with_schema(self):
+        """TradingCenterDecoderにスキーマを渡すとProtobufとしてデコードする"""
+        decoder = TradingCenterDecoder(schema=DEFAULT_LISTING_SCHEMA)
+        packet = decoder.decode_trading_packet(build_exchange_payload([(500, 2, 10), (700, 7, 12)]))
+
+        assert [l.item_id for l in packet.listings] == [10, 12]
+        assert packet.decoded_data["total_value"] == 500 * 2 + 700 * 7
@@ -0,0 +1,72 @@
+"""
+Tests for the seen-listing filter
+"""
+from datetime import datetime
+
+import pytest
+
+from src.database.ingest import listing_rows, upsert_listings
+from src.database.seen_filter import BloomFilter, SeenListingFilter
+from tests.helpers import make_listing
+
+
+def make_rows(*listings, day=1):
+    return listing_rows([
+        make_listing(i, price=price, quantity=quantity, timestamp=datetime(2026, 1, day))
+        for i, price, quantity in listings
+    ])
+
+
+class TestSeenListingFilter:
+    """SeenListingFilterのテスト"""
+
+    def test_unchanged_listings_become_seen_updates(self):
+        """同じ価格・数量の再観測は書き込まず、最終確認時刻の更新にする"""
+        seen = SeenListingFilter()
+        changed, unchanged = seen.split(make_rows((1, 100, 1), (2, 200, 1)))
+        assert len(changed) == 2 and unchanged == {}
+        seen.remember(changed)
+
+        changed, unchanged = seen.split(make_rows((1, 100, 1), (2, 250, 1), day=2))
+
+        assert [row["id"] for row in changed] == [2]
+        assert unchanged == {1: datetime(2026, 1, 2)}
+        stats = seen.get_stats()
+        assert (stats["hits"], stats["changed"], stats["misses"]) == (1, 1, 3)
+        assert stats["hit_rate"] == pytest.approx(0.25)
+
+    def test_evicted_listings_kept_in_bloom(self):
+        """LRUから追い出した出品もBloomフィルタで判定する"""
+        seen = SeenListingFilter(max_entries=2, bloom_capacity=100)
+        seen.remember(make_rows((1, 100, 1), (2, 200, 1), (3, 300, 1)))
+
+        changed, unchanged = seen.split(make_rows((1, 100, 1), (1, 999, 1)))
+
+        assert len(seen) == 2
+        assert list(unchanged) == [1]
+        assert [row["price"] for row in changed] == [999]
+        assert seen.get_stats()["bloom_hits"] == 1
+
+    def test_seed_keeps_most_recent(self, session):
+        """データベースから最近キャプチャした出品を読み込む"""
+        upsert_listings(session, make_rows((1, 100, 1), day=1) + make_rows((2, 200, 1), day=2))
+        session.commit()
+
+        seen = SeenListingFilter(max_entries=1)
+
+        assert seen.seed(session) == 1
+        assert seen.split(make_rows((2, 200, 1)))[1] == {2: datetime(2026, 1, 1)}
+
+
+class TestBloomFilter:
+    """BloomFilterのテスト"""
+
+    def test_false_positive_rate(self):
+        """想定要素数で偽陽性率がおおよそ指定値に収まる"""
+        bloom = BloomFilter(2000, error_rate=0.01)
+        for i in range(2000):
+            bloom.add((i, i * 10, 1))
+
+        assert all((i, i * 10, 1) in bloom for i in range(2000))
+        false_positives = sum((i, i * 10, 1) in bloom for i in range(10_000, 20_000))
+        assert false_positives < 300
@@ -0,0 +1,43 @@
+"""
+Tests for the signature registry
+"""
+import pytest
+
+from src.packet_decoder.signatures import SignatureRegistry, TRADING_CENTER_MAGIC, signatures
+
+
+class TestSignatureRegistry:
+    """SignatureRegistryのテスト"""
+    
+    def test_find_all_in_single_pass(self):
+        """全マーカーの位置を出現順に返す"""
+        data = b"xx" + TRADING_CENTER_MAGIC + b"yy" + b"c3SB" + b"zz"
+        
+        matches = signatures.find_all(data)
+        
+        assert [(m.name, m.start) for m in matches] == [
+            ("trading_center", 2),
+            ("trading_center_short", 10),
+        ]
+    
+    def test_search_preferred(self):
+        """優先度の高いシグネチャを後方にあっても選ぶ"""
+        data = b"c3SB" + b"...." + TRADING_CENTER_MAGIC
+        preference = ("trading_center", "trading_center_short")
+        
+        match = signatures.search_preferred(data, preference)
+        
+        assert match.name == "trading_center"
+        assert match.end == len(data)
+        assert signatures.search_preferred(b"..c3SB", preference).start == 2
+        assert signatures.search_preferred(b"nothing", preference) is None
+    
+    def test_register_new_signature(self):
+        """シグネチャを追加しても同じ1パスで見つかる"""
+        registry = SignatureRegistry({"a": b"AAA"})
+        registry.register("b", b"BB")
+        
+        assert [m.name for m in registry.find_all(memoryview(b"BB-AAA"))] == ["b", "a"]
+        assert registry.search(b"AAA", names={"b"}) is None
+        with pytest.raises(ValueError):
+            registry.register("not valid", b"x")
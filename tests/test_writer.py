@@ -0,0 +1,97 @@
+"""
+Tests for the listing ingestion writer
+"""
+import pytest
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from src.database.models import Base, Listing
+from src.database.writer import ListingWriter
+from tests.helpers import make_listing, make_listings
+
+
+class FlakySession(Session):
+    """最初の何回かのコミットが失敗するセッション"""
+
+    failures = 0
+
+    def commit(self):
+        if FlakySession.failures > 0:
+            FlakySession.failures -= 1
+            raise OperationalError("COMMIT", {}, Exception("database is locked"))
+        super().commit()
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'market.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(engine)
+    yield engine
+    engine.dispose()
+
+
+def count_listings(engine):
+    with Session(engine) as session:
+        return session.scalar(select(func.count()).select_from(Listing))
+
+
+class TestListingWriter:
+    """ListingWriterのテスト"""
+
+    def test_close_writes_everything(self, engine):
+        """停止時にキューとバッファに残った出品をすべて書き込む"""
+        writer = ListingWriter(lambda: Session(engine), flush_rows=50, flush_interval=60)
+        for start in range(0, 1000, 10):
+            writer.submit(make_listings(range(start, start + 10)))
+        writer.close()
+
+        stats = writer.get_stats()
+        assert count_listings(engine) == 1000
+        assert stats["rows_written"] == 1000
+        assert stats["commits"] == 20
+        assert stats["depth"] == 0
+
+    def test_retries_with_backoff(self, engine):
+        """コミットに失敗したバッチは再試行して書き込む"""
+        FlakySession.failures = 2
+        writer = ListingWriter(lambda: FlakySession(engine), retry_backoff=0.001)
+        writer.submit(make_listings(range(5)))
+        writer.close()
+
+        stats = writer.get_stats()
+        assert count_listings(engine) == 5
+        assert (stats["retries"], stats["errors"], stats["rows_dropped"]) == (2, 0, 0)
+
+    def test_gives_up_after_max_retries(self, engine):
+        """再試行の上限を超えたバッチは破棄して数える"""
+        FlakySession.failures = 10
+        writer = ListingWriter(lambda: FlakySession(engine), max_retries=2, retry_backoff=0.001)
+        writer.submit(make_listings(range(5)))
+        writer.close()
+        FlakySession.failures = 0
+
+        stats = writer.get_stats()
+        assert (stats["retries"], stats["errors"], stats["rows_dropped"]) == (2, 1, 5)
+        assert count_listings(engine) == 0
+
+    def test_bad_row_rejected_without_retry(self, engine):
+        """再試行しても成功しないエラーは再試行せず、原因の行だけを捨てる"""
+        listings = make_listings(range(50))
+        listings[17] = make_listing("17", price=1 << 64)
+        writer = ListingWriter(lambda: Session(engine), flush_rows=50, retry_backoff=10)
+        writer.submit(listings)
+        writer.close()
+
+        stats = writer.get_stats()
+        assert count_listings(engine) == 49
+        assert (stats["rows_written"], stats["rows_rejected"], stats["rows_dropped"]) == (49, 1, 0)
+        assert stats["retries"] == 0
+
+    def test_submit_after_close_fails(self, engine):
+        """停止後の追加はエラーにする"""
+        writer = ListingWriter(lambda: Session(engine))
+        writer.close()
+
+        with pytest.raises(RuntimeError):
+            writer.submit(make_listings(range(1)))
@@ -0,0 +1,409 @@
+"""
+Listing Schema Inference
+リスティングスキーマの自動推定
+
+サンプルのキャプチャと、既知の出品情報（ゲーム画面で確認したアイテムID・数量・価格など）から、
+取引所メッセージのどのフィールド番号がどの属性を運んでいるかを統計的に推定し、
+ライブデコーダーが読み込むスキーマファイル（JSON）を出力します。
+
+ゲームのアップデートでメッセージ構造が変わった場合も、コードを編集せずに
+スキーマファイルを作り直すだけで正確なデコードに戻せます。
+"""
+import sys
+import re
+import json
+import struct
+import time
+import logging
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+# src パッケージを参照できるようにする
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.packet_decoder.decoder import TradingCenterDecoder
+from src.packet_decoder.pcap_reader import iter_pcap
+from src.packet_decoder.protobuf import WIRE_LENGTH_DELIMITED, scan_fields
+from src.packet_decoder.reassembly import TcpReassembler
+from src.packet_decoder.schema import (
+    TYPE_STRING,
+    TYPE_TIMESTAMP,
+    TYPE_UINT,
+    FieldPath,
+    ListingSchema,
+)
+from src.packet_decoder.signatures import signatures
+
+# ロギング設定
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# 推定対象の数値属性（既知の値と一致するフィールドを探す）
+NUMERIC_ATTRIBUTES = ("item_id", "quantity", "price", "listing_id", "notice_time")
+REQUIRED_ATTRIBUTES = ("item_id", "quantity", "price")
+# ネストしたメッセージを展開する深さ
+MAX_DEPTH = 3
+# UNIX時刻（秒・ミリ秒）とみなす範囲
+TIMESTAMP_RANGES = ((1_500_000_000, 2_500_000_000), (1_500_000_000_000, 2_500_000_000_000))
+# 既知の値がない属性を範囲で推定する際に必要な割合
+RANGE_MATCH_RATIO = 0.9
+
+# 十分な根拠が集まったとみなす一致件数（これ以上は走査を打ち切る）
+DEFAULT_MAX_MATCHES = 5000
+
+# 展開したフィールド (path, wire_type, offset, length, value)
+FlatField = Tuple[Tuple[int, ...], int, int, int, int]
+
+
+def _encode_varint(value: int) -> bytes:
+    """Varintをエンコード"""
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _price_pattern(prices: Iterable[int]):
+    """
+    既知の価格のエンコード表現（varint / fixed32 / fixed64）のいずれかに一致する正規表現
+
+    価格を含まないエントリを展開せずに読み飛ばすための事前フィルタです。
+    """
+    encodings = set()
+    for price in prices:
+        encodings.add(_encode_varint(price))
+        encodings.add(struct.pack('<Q', price))
+        if price < 1 << 32:
+            encodings.add(struct.pack('<I', price))
+    return re.compile(b'|'.join(re.escape(encoding) for encoding in sorted(encodings, key=len, reverse=True)))
+
+
+def load_known_listings(path: str) -> List[Dict]:
+    """
+    既知の出品情報を読み込む
+
+    平坦な形式 ``{"item_id", "quantity", "price", "guid", "notice_time"}`` のほか、
+    packet_parser_v2.py の出力形式（metadata.raw_entry）も受け付けます。
+
+    Args:
+        path: JSONファイルのパス
+
+    Returns:
+        属性名 -> 値 の辞書のリスト
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+
+    listings = []
+    for entry in data:
+        raw = entry.get("metadata", {}).get("raw_entry", {})
+        known = {
+            "item_id": entry.get("item_id"),
+            "quantity": entry.get("quantity"),
+            "price": entry.get("price"),
+            "listing_id": entry.get("listing_id") or None,
+            "guid": entry.get("guid") or raw.get("guid"),
+            "notice_time": entry.get("notice_time") or raw.get("noticeTime"),
+        }
+        listings.append({key: value for key, value in known.items() if value})
+    return listings
+
+
+def iter_trading_frames(pcap_file: str) -> Iterator[Tuple[bytes, int]]:
+    """
+    キャプチャから取引所メッセージを取り出す
+
+    Yields:
+        (フレーム, マジックバイト直後の位置)
+    """
+    reassembler = TcpReassembler()
+
+    def frames():
+        for record in iter_pcap(pcap_file):
+            yield from reassembler.feed(record.flow, record.seq, record.payload, record.timestamp, record.flags)
+        yield from (frame for _flow, frame, _last_seen in reassembler.flush())
+
+    for frame in frames():
+        match = signatures.search(frame, TradingCenterDecoder.SIGNATURE_NAMES)
+        if match is not None:
+            yield frame, match.end
+
+
+def flatten_entry(data, start: int, end: int, prefix=(), depth: int = 1, out=None) -> List[FlatField]:
+    """
+    メッセージのフィールドをネストも含めて平坦化
+
+    length-delimitedフィールドは、範囲をちょうど読み切れる場合だけサブメッセージとして展開します
+    （文字列として扱う可能性も残すため、フィールド自体も結果に含めます）。
+    """
+    if out is None:
+        out = []
+    fields = scan_fields(data, start, end)
+    for number, wire_type, offset, length, value in fields.iter_fields():
+        path = prefix + (number,)
+        out.append((path, wire_type, offset, length, value))
+        if wire_type == WIRE_LENGTH_DELIMITED and depth < MAX_DEPTH and length:
+            nested = scan_fields(data, offset, offset + length)
+            if len(nested) and nested.end == offset + length:
+                flatten_entry(data, offset, offset + length, path, depth + 1, out)
+    return out
+
+
+class SchemaInferrer:
+    """既知の出品情報との一致からフィールド番号を推定"""
+
+    def __init__(self, known_listings: Iterable[Dict], max_matches: int = DEFAULT_MAX_MATCHES):
+        """
+        Args:
+            known_listings: 既知の出品情報（属性名 -> 値）
+            max_matches: この件数のエントリが一致したら集計を終える（0で無制限）
+        """
+        self.known = list(known_listings)
+        self.max_matches = max_matches
+        # 価格で索引を作り、エントリごとの照合を辞書引きにする
+        self._by_price: Dict[int, List[Dict]] = defaultdict(list)
+        for listing in self.known:
+            self._by_price[listing["price"]].append(listing)
+        self._price_search = _price_pattern(self._by_price).search if self._by_price else None
+
+        self.votes: Dict[str, Counter] = defaultdict(Counter)
+        self.entry_fields: Counter = Counter()
+        self.range_hits: Counter = Counter()
+        self.guid_hits: Counter = Counter()
+        self.path_counts: Counter = Counter()
+        self.stats = {"frames": 0, "entries": 0, "matched_entries": 0}
+
+    @property
+    def done(self) -> bool:
+        """十分な根拠が集まったか"""
+        return bool(self.max_matches) and self.stats["matched_entries"] >= self.max_matches
+
+    def feed(self, data: bytes, offset: int):
+        """
+        取引所メッセージ1件を集計
+
+        Args:
+            data: フレーム
+            offset: マジックバイト直後の位置
+        """
+        self.stats["frames"] += 1
+        top = scan_fields(data, offset)
+        for number, wire_type, start, length, _value in top.iter_fields():
+            if wire_type != WIRE_LENGTH_DELIMITED or not length:
+                continue
+            self.stats["entries"] += 1
+            if self._price_search is None or not self._price_search(data, start, start + length):
+                continue
+            flat = flatten_entry(data, start, start + length)
+            if self._match(data, flat):
+                self.entry_fields[number] += 1
+
+    def _match(self, data: bytes, flat: List[FlatField]) -> bool:
+        """エントリを既知の出品情報と照合して票を入れる"""
+        numeric: Dict[int, List[Tuple[int, ...]]] = defaultdict(list)
+        for path, wire_type, _offset, _length, value in flat:
+            if wire_type != WIRE_LENGTH_DELIMITED:
+                numeric[value].append(path)
+
+        candidates = [
+            listing
+            for price in numeric.keys() & self._by_price.keys()
+            for listing in self._by_price[price]
+            if listing["item_id"] in numeric and listing["quantity"] in numeric
+        ]
+        if not candidates:
+            return False
+
+        self.stats["matched_entries"] += 1
+        known = candidates[0]
+        for attribute in NUMERIC_ATTRIBUTES:
+            if attribute in known:
+                for path in numeric.get(known[attribute], ()):
+                    self.votes[attribute][path] += 1
+
+        guid = known.get("guid")
+        for path, wire_type, offset, length, value in flat:
+            self.path_counts[path] += 1
+            if wire_type == WIRE_LENGTH_DELIMITED:
+                if guid and bytes(data[offset:offset + length]) == guid.encode():
+                    self.votes["guid"][path] += 1
+                elif 16 <= length <= 40 and b'-' in data[offset:offset + length]:
+                    self.guid_hits[path] += 1
+            elif any(low <= value <= high for low, high in TIMESTAMP_RANGES):
+                self.range_hits[path] += 1
+        return True
+
+    def _best(self, counter: Counter, minimum: int) -> Optional[Tuple[Tuple[int, ...], int]]:
+        """最多票のパス（同数なら浅いパス）"""
+        if not counter:
+            return None
+        path, votes = min(counter.items(), key=lambda item: (-item[1], len(item[0]), item[0]))
+        return (path, votes) if votes >= minimum else None
+
+    def infer(self, name: str = "inferred_listing") -> ListingSchema:
+        """
+        集計結果からスキーマを生成
+
+        Args:
+            name: スキーマ名
+
+        Returns:
+            ListingSchema
+
+        Raises:
+            ValueError: 必須属性のフィールドを推定できない場合
+        """
+        matched = self.stats["matched_entries"]
+        if matched == 0:
+            raise ValueError("No entries matched the known listings")
+
+        fields: Dict[str, FieldPath] = {}
+        confidence: Dict[str, float] = {}
+        used = set()
+
+        # 一致数の多い属性から順に、同じパスを二重に割り当てないよう決める
+        attributes = sorted(self.votes, key=lambda attribute: -max(self.votes[attribute].values()))
+        for attribute in attributes:
+            counter = Counter({path: votes for path, votes in self.votes[attribute].items() if path not in used})
+            best = self._best(counter, minimum=1)
+            if best is None:
+                continue
+            path, votes = best
+            field_type = TYPE_STRING if attribute == "guid" else (
+                TYPE_TIMESTAMP if attribute == "notice_time" else TYPE_UINT
+            )
+            fields[attribute] = FieldPath(path, field_type)
+            confidence[attribute] = votes / matched
+            used.add(path)
+
+        # 既知の値がない属性は値の範囲・形から推定
+        minimum = int(matched * RANGE_MATCH_RATIO) or 1
+        if "notice_time" not in fields:
+            best = self._best(Counter({p: v for p, v in self.range_hits.items() if p not in used}), minimum)
+            if best is not None:
+                fields["notice_time"] = FieldPath(best[0], TYPE_TIMESTAMP)
+                confidence["notice_time"] = best[1] / matched
+                used.add(best[0])
+        if "guid" not in fields:
+            best = self._best(Counter({p: v for p, v in self.guid_hits.items() if p not in used}), minimum)
+            if best is not None:
+                fields["guid"] = FieldPath(best[0], TYPE_STRING)
+                confidence["guid"] = best[1] / matched
+
+        missing = [attribute for attribute in REQUIRED_ATTRIBUTES if attribute not in fields]
+        if missing:
+            raise ValueError(f"Could not infer fields for: {missing}")
+
+        # サブメッセージの途中とトップレベルの値が衝突しないよう、親パスに値が割り当てられていれば除外
+        value_paths = {spec.path for spec in fields.values()}
+        for attribute, spec in list(fields.items()):
+            if any(spec.path[:i] in value_paths for i in range(1, len(spec.path))):
+                logger.warning(f"Dropping {attribute}: its parent field is mapped as a value")
+                del fields[attribute]
+                confidence.pop(attribute, None)
+
+        entry_field = None
+        if self.entry_fields:
+            number, count = self.entry_fields.most_common(1)[0]
+            if count == sum(self.entry_fields.values()):
+                entry_field = number
+
+        return ListingSchema(
+            name=name,
+            fields=fields,
+            entry_field=entry_field,
+            metadata={
+                "inferred_at": time.strftime('%Y-%m-%dT%H:%M:%S'),
+                "confidence": confidence,
+                **self.stats,
+            },
+        )
+
+
+def infer_schema(
+    pcap_file: str,
+    known_listings: List[Dict],
+    name: str = "inferred_listing",
+    max_matches: int = DEFAULT_MAX_MATCHES
+) -> ListingSchema:
+    """
+    キャプチャと既知の出品情報からスキーマを推定
+
+    Args:
+        pcap_file: サンプルのキャプチャ
+        known_listings: 既知の出品情報
+        name: スキーマ名
+        max_matches: この件数のエントリが一致したら走査を打ち切る（0で全件）
+
+    Returns:
+        ListingSchema
+    """
+    inferrer = SchemaInferrer(known_listings, max_matches)
+    start_time = time.perf_counter()
+    for frame, offset in iter_trading_frames(pcap_file):
+        inferrer.feed(frame, offset)
+        if inferrer.done:
+            break
+    elapsed = time.perf_counter() - start_time
+
+    stats = inferrer.stats
+    logger.info(
+        f"Scanned {stats['frames']} trading frames / {stats['entries']} entries in {elapsed:.2f}s, "
+        f"{stats['matched_entries']} matched known listings"
+    )
+    return inferrer.infer(name)
+
+
+def main():
+    if len(sys.argv) < 3:
+        print("Usage: python infer_schema.py <pcap_file> <known_listings.json> [--output FILE] [--name NAME]")
+        print("\nknown_listings.json:")
+        print('  [{"item_id": 1050, "quantity": 3, "price": 120000, "guid": "...", "notice_time": 1760000000}, ...]')
+        print("\nOptions:")
+        print("  --output FILE  Schema file to write (default: data/listing_schema.json)")
+        print("  --name NAME    Schema name")
+        print(f"  --max-matches N  Stop after N matched entries, 0 scans everything (default: {DEFAULT_MAX_MATCHES})")
+        sys.exit(1)
+
+    pcap_file = sys.argv[1]
+    known_listings = load_known_listings(sys.argv[2])
+    output_file = 'data/listing_schema.json'
+    if '--output' in sys.argv:
+        output_file = sys.argv[sys.argv.index('--output') + 1]
+    name = "inferred_listing"
+    if '--name' in sys.argv:
+        name = sys.argv[sys.argv.index('--name') + 1]
+    max_matches = DEFAULT_MAX_MATCHES
+    if '--max-matches' in sys.argv:
+        max_matches = int(sys.argv[sys.argv.index('--max-matches') + 1])
+
+    try:
+        schema = infer_schema(pcap_file, known_listings, name, max_matches)
+    except ValueError as e:
+        print(f"\n✗ {e}")
+        sys.exit(1)
+
+    schema.save(output_file)
+
+    print(f"\n{'='*60}")
+    print(f"Inferred schema: {schema.name}")
+    print(f"{'='*60}")
+    print(f"Entry field: {schema.entry_field if schema.entry_field is not None else 'any'}")
+    for attribute, spec in schema.fields.items():
+        confidence = schema.metadata["confidence"].get(attribute, 0.0)
+        print(f"  {attribute:12s} <- field {'.'.join(map(str, spec.path)):8s} ({spec.type}, {confidence:.0%})")
+    print(f"\nSchema saved to: {output_file}")
+    print("Set LISTING_SCHEMA_FILE in .env or pass --schema to packet_parser_v2.py to use it.")
+
+
+if __name__ == '__main__':
+    main()
@@ -21,6 +21,11 @@ warnings.filterwarnings('ignore', message='.*TripleDES.*')
 logging.getLogger('scapy.runtime').setLevel(logging.ERROR)
 logging.getLogger('scapy').setLevel(logging.ERROR)
 
+# src パッケージを参照できるようにする
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.packet_decoder.signatures import signatures
+
 # ロギング設定
 logging.basicConfig(
     level=logging.INFO,
@@ -32,12 +37,8 @@ logger = logging.getLogger(__name__)
 class GamePacketParser:
     """ゲームパケット専用パーサー"""
     
-    # 取引所パケットのマジックバイト候補
-    MAGIC_BYTES_CANDIDATES = [
-        bytes([0x00, 0x63, 0x33, 0x53, 0x42, 0x00]),  # 既知のパターン
-        bytes([0x63, 0x33, 0x53, 0x42]),              # 短縮版
-        b'c3SB',                                       # ASCII版
-    ]
+    # 取引所パケットのマジックバイト候補（優先度順、共有レジストリで1パス検索）
+    SIGNATURE_PREFERENCE = ("trading_center", "trading_center_short")
     
     def __init__(self, pcap_file: str):
         """
@@ -101,10 +102,9 @@ class GamePacketParser:
     
     def _is_trading_packet(self, data: bytes) -> bool:
         """取引所パケットかどうかを判定"""
-        # 複数のマジックバイトパターンをチェック
-        for magic in self.MAGIC_BYTES_CANDIDATES:
-            if magic in data:
-                return True
+        # 全マジックバイトパターンを1パスでチェック
+        if signatures.search(data, self.SIGNATURE_PREFERENCE) is not None:
+            return True
         
         # サイズチェック（取引所パケットは通常100バイト以上）
         if len(data) > 100:
@@ -124,19 +124,14 @@ class GamePacketParser:
         
         try:
             # マジックバイトの位置を探す
-            magic_pos = -1
-            for magic in self.MAGIC_BYTES_CANDIDATES:
-                pos = data.find(magic)
-                if pos != -1:
-                    magic_pos = pos
-                    break
+            match = signatures.search_preferred(data, self.SIGNATURE_PREFERENCE)
             
-            if magic_pos == -1:
+            if match is None:
                 # マジックバイトなしで日本語文字列を探す
                 return self._extract_items_by_string(data)
             
             # マジックバイトの後からデータを解析
-            offset = magic_pos + 6
+            offset = match.end
             
             # リスティング数を取得（推定）
             if offset + 4 <= len(data):
@@ -310,21 +305,14 @@ class GamePacketParser:
         with open(self.pcap_file, 'rb') as f:
             data = f.read()
             
-            # 取引所パケットのパターンを探す
-            for magic in self.MAGIC_BYTES_CANDIDATES:
-                pos = 0
-                while True:
-                    pos = data.find(magic, pos)
-                    if pos == -1:
-                        break
-                    
-                    logger.info(f"Found magic bytes at position {pos}")
-                    
-                    # この位置からデータを抽出
-                    extracted = self._extract_items(data[pos:pos+10000])
-                    items.extend(extracted)
-                    
-                    pos += 1
+            # 取引所パケットのパターンを1パスで探す
+            for match in signatures.find_all(data, self.SIGNATURE_PREFERENCE):
+                pos = match.start
+                logger.info(f"Found magic bytes at position {pos}")
+                
+                # この位置からデータを抽出
+                extracted = self._extract_items(data[pos:pos+10000])
+                items.extend(extracted)
         
         return items
     
@@ -23,6 +23,11 @@ except ImportError:
     SCAPY_AVAILABLE = False
     print("Warning: scapy not available")
 
+# src パッケージを参照できるようにする
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.packet_decoder.signatures import signatures
+
 # ロギング設定
 logging.basicConfig(
     level=logging.DEBUG,
@@ -121,22 +126,15 @@ def analyze_packet(data: bytes, packet_num: int):
     print(f"Packet #{packet_num} - Size: {len(data)} bytes")
     print(f"{'='*80}")
     
-    # マジックバイト検索
-    magic_bytes = [
-        (b'\x00\x63\x33\x53\x42\x00', '00 63 33 53 42 00'),
-        (b'\x63\x33\x53\x42', '63 33 53 42'),
-        (b'c3SB', 'c3SB (ASCII)'),
-    ]
-    
+    # マジックバイト検索（全シグネチャを1パスで走査）
     print("\n[1] Magic Bytes Search:")
     found_magic = False
-    for magic, name in magic_bytes:
-        pos = data.find(magic)
-        if pos != -1:
-            print(f"  ✓ Found {name} at offset 0x{pos:04x} ({pos})")
-            print(f"    Context (32 bytes):")
-            print(hex_dump(data, max(0, pos-8), 32))
-            found_magic = True
+    for match in signatures.find_all(data):
+        pos = match.start
+        print(f"  ✓ Found {match.name} ({signatures.marker(match.name).hex(' ')}) at offset 0x{pos:04x} ({pos})")
+        print(f"    Context (32 bytes):")
+        print(hex_dump(data, max(0, pos-8), 32))
+        found_magic = True
     
     if not found_magic:
         print("  ✗ No magic bytes found")
@@ -214,11 +212,7 @@ def main():
                 # 取引所パケットの候補をフィルタ
                 if len(data) > 100:  # 最低サイズ
                     # マジックバイトまたは日本語文字列を含む
-                    has_magic = any(magic in data for magic, _ in [
-                        (b'\x00\x63\x33\x53\x42\x00', ''),
-                        (b'\x63\x33\x53\x42', ''),
-                        (b'c3SB', '')
-                    ])
+                    has_magic = signatures.search(data) is not None
                     
                     has_japanese = False
                     try:
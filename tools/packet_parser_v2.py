@@ -13,6 +13,7 @@ from datetime import datetime
 from typing import List, Dict, Optional
 import json
 import os
+from functools import partial
 
 # 警告を抑制
 warnings.filterwarnings('ignore', category=DeprecationWarning)
@@ -20,12 +21,19 @@ warnings.filterwarnings('ignore', message='.*TripleDES.*')
 logging.getLogger('scapy.runtime').setLevel(logging.ERROR)
 logging.getLogger('scapy').setLevel(logging.ERROR)
 
-try:
-    from scapy.all import rdpcap, Raw
-    SCAPY_AVAILABLE = True
-except ImportError:
-    SCAPY_AVAILABLE = False
-    print("Warning: scapy not available")
+# src パッケージを参照できるようにする
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.packet_decoder.pcap_reader import iter_pcap
+from src.packet_decoder.parallel import PcapShard, iter_shard, run_sharded
+from src.packet_decoder.signatures import signatures
+from src.packet_decoder.protobuf import (
+    WIRE_FIXED64,
+    WIRE_LENGTH_DELIMITED,
+    WIRE_VARINT,
+    scan_fields,
+)
+from src.packet_decoder.schema import DEFAULT_LISTING_SCHEMA, ListingSchema, SchemaDecoder
 
 # ロギング設定
 logging.basicConfig(
@@ -36,7 +44,12 @@ logger = logging.getLogger(__name__)
 
 
 class ProtobufParser:
-    """Protobuf形式のパケットをパース"""
+    """
+    Protobuf形式のパケットをパース
+    
+    単発のフィールド読み出し用。バッファ全体の解析には
+    src.packet_decoder.protobuf.scan_fields を使用してください。
+    """
     
     @staticmethod
     def parse_varint(data: bytes, offset: int) -> tuple:
@@ -95,14 +108,24 @@ class ProtobufParser:
 class GamePacketParserV2:
     """ゲームパケットパーサー V2"""
     
-    MAGIC_BYTES = bytes([0x00, 0x63, 0x33, 0x53, 0x42, 0x00])
-    MAGIC_BYTES_SHORT = b'c3SB'
+    MAGIC_BYTES = signatures.marker("trading_center")
+    MAGIC_BYTES_SHORT = signatures.marker("trading_center_short")
+    # マジックバイトの優先順位（長いマーカーを優先）
+    SIGNATURE_PREFERENCE = ("trading_center", "trading_center_short")
     
-    def __init__(self, pcap_file: str, auto_enrich: bool = True):
+    def __init__(
+        self,
+        pcap_file: str,
+        auto_enrich: bool = True,
+        schema: ListingSchema = DEFAULT_LISTING_SCHEMA
+    ):
         self.pcap_file = Path(pcap_file)
         self.items = []
         self.auto_enrich = auto_enrich
         self.item_master = self._load_item_master() if auto_enrich else {}
+        # スキーマでデコードできないエントリだけをヒューリスティックで解析する
+        self.schema_decoder = SchemaDecoder(schema)
+        self.decode_stats = {"schema": 0, "heuristic": 0}
     
     def _load_item_master(self) -> dict:
         """アイテムマスターデータを読み込み"""
@@ -173,12 +196,13 @@ class GamePacketParserV2:
         
         return item
     
-    def parse(self) -> List[Dict]:
-        """PCAPファイルをパース"""
-        if not SCAPY_AVAILABLE:
-            logger.error("scapy is required. Install it with: pip install scapy")
-            return []
+    def parse(self, workers: int = 1) -> List[Dict]:
+        """
+        PCAPファイルをパース
         
+        Args:
+            workers: 並列パースのプロセス数（2以上でマルチプロセス）
+        """
         if not self.pcap_file.exists():
             logger.error(f"File not found: {self.pcap_file}")
             return []
@@ -186,23 +210,23 @@ class GamePacketParserV2:
         logger.info(f"Parsing {self.pcap_file}")
         
         try:
-            packets = rdpcap(str(self.pcap_file))
-            logger.info(f"Total packets: {len(packets)}")
+            if workers > 1:
+                # スループット (MB/s) は run_sharded がログ出力する
+                items, _stats = run_sharded(
+                    str(self.pcap_file),
+                    partial(_parse_shard, schema=self.schema_decoder.schema),
+                    workers
+                )
+            else:
+                items = [item for _timestamp, item in self._parse_records(iter_pcap(str(self.pcap_file)))]
             
-            for i, packet in enumerate(packets):
-                if Raw in packet:
-                    data = bytes(packet[Raw].load)
-                    
-                    # マジックバイトを探す
-                    if self.MAGIC_BYTES in data or self.MAGIC_BYTES_SHORT in data:
-                        items = self._parse_packet(data)
-                        if items:
-                            # 自動エンリッチメント
-                            items = [self._enrich_item(item) for item in items]
-                            logger.info(f"Packet #{i+1}: Found {len(items)} items")
-                            self.items.extend(items)
+            # 自動エンリッチメント
+            self.items.extend(self._enrich_item(item) for item in items)
             
             logger.info(f"Total items extracted: {len(self.items)}")
+            if workers <= 1:
+                logger.info(f"Decoded by schema: {self.decode_stats['schema']}, "
+                            f"by heuristic fallback: {self.decode_stats['heuristic']}")
             return self.items
         
         except Exception as e:
@@ -211,37 +235,70 @@ class GamePacketParserV2:
             traceback.print_exc()
             return []
     
+    def _parse_records(self, records) -> List[tuple]:
+        """PcapRecordの列をパースし、(timestamp, item) のリストを返す"""
+        results = []
+        total_packets = 0
+        
+        for i, record in enumerate(records):
+            data = record.payload
+            if not data:
+                # FIN/RSTだけのセグメント
+                continue
+            total_packets += 1
+            
+            # マジックバイトの検索は _parse_packet 内で1回だけ行う
+            items = self._parse_packet(data)
+            if items:
+                logger.info(f"Packet #{i+1}: Found {len(items)} items")
+                results.extend((record.timestamp, item) for item in items)
+        
+        logger.info(f"Total packets: {total_packets}")
+        return results
+    
     def _parse_packet(self, data: bytes) -> List[Dict]:
         """パケットからアイテム情報を抽出"""
         items = []
         
         try:
-            # マジックバイトの位置を探す
-            magic_pos = data.find(self.MAGIC_BYTES)
-            if magic_pos == -1:
-                magic_pos = data.find(self.MAGIC_BYTES_SHORT)
-                if magic_pos == -1:
-                    return items
-                offset = magic_pos + len(self.MAGIC_BYTES_SHORT)
-            else:
-                offset = magic_pos + len(self.MAGIC_BYTES)
+            # マジックバイトの位置を探す（全シグネチャを1パスで走査）
+            match = signatures.search_preferred(data, self.SIGNATURE_PREFERENCE)
+            if match is None:
+                return items
+            offset = match.end
             
-            # Protobufデータをパース
-            parser = ProtobufParser()
+            # Protobufデータを1パスでトークン化
+            view = memoryview(data)
+            fields = scan_fields(view, offset)
+            entry_field = self.schema_decoder.schema.entry_field
             
-            while offset < len(data) - 10:
-                field, new_offset = parser.parse_field(data, offset)
-                
-                if field is None or new_offset == offset:
-                    break
+            for number, wire_type, value_offset, length, _value in fields.iter_fields():
+                # Length-delimited フィールド (アイテムデータの可能性)
+                if wire_type != WIRE_LENGTH_DELIMITED:
+                    continue
+                if entry_field is not None and number != entry_field:
+                    continue
                 
-                field_number, wire_type, value = field
-                offset = new_offset
+                # 宣言したスキーマでデコード
+                values = self.schema_decoder.decode_entry(view, value_offset, value_offset + length)
+                if values is not None:
+                    self.decode_stats["schema"] += 1
+                    items.append(self._build_item(
+                        item_id=values["item_id"],
+                        quantity=values["quantity"],
+                        price=values["price"],
+                        listing_id=values.get("listing_id", 0),
+                        guid=values.get("guid", ""),
+                        timestamp=values.get("notice_time", 0),
+                        bind_flag=values.get("bind_flag", False),
+                    ))
+                    continue
                 
-                # Length-delimited フィールド (アイテムデータの可能性)
-                if wire_type == 2 and isinstance(value, bytes) and len(value) > 20:
-                    item = self._parse_item_data(value)
+                # スキーマに合わない場合のみヒューリスティックにフォールバック
+                if length > 20:
+                    item = self._parse_item_data(view[value_offset:value_offset + length])
                     if item:
+                        self.decode_stats["heuristic"] += 1
                         items.append(item)
         
         except Exception as e:
@@ -249,14 +306,14 @@ class GamePacketParserV2:
         
         return items
     
-    def _parse_item_data(self, data: bytes) -> Optional[Dict]:
-        """アイテムデータをパース (詳細フォーマット)"""
+    def _parse_item_data(self, data) -> Optional[Dict]:
+        """
+        アイテムデータをヒューリスティックでパース (詳細フォーマット)
+        
+        値の範囲からフィールドを推測するため、誤って割り当てる可能性があります。
+        スキーマでデコードできなかったエントリのフォールバックとしてのみ使用します。
+        """
         try:
-            parser = ProtobufParser()
-            offset = 0
-            
-            # 収集した全データ
-            raw_fields = {}
             listing_id = 0
             item_id = 0
             quantity = 0
@@ -265,24 +322,14 @@ class GamePacketParserV2:
             guid = ""
             bind_flag = False
             
-            # Protobufフィールドを解析
-            while offset < len(data) - 4:
-                field, new_offset = parser.parse_field(data, offset)
-                
-                if field is None or new_offset == offset:
-                    break
-                
-                field_number, wire_type, value = field
-                offset = new_offset
-                
-                # フィールド情報を保存
-                raw_fields[f"field_{field_number}"] = {
-                    "wire_type": wire_type,
-                    "value": value if not isinstance(value, bytes) else value.hex() if len(value) < 50 else f"{value[:50].hex()}..."
-                }
-                
+            # Protobufフィールドを一括でトークン化し、配列の上でヒューリスティックを適用
+            fields = scan_fields(data)
+            
+            for wire_type, value_offset, length, value in zip(
+                fields.wire_types, fields.offsets, fields.lengths, fields.values
+            ):
                 # フィールド番号に基づいて値を割り当て
-                if wire_type == 0:  # Varint (IDや数量)
+                if wire_type == WIRE_VARINT:  # Varint (IDや数量)
                     if 10 <= value <= 999999:  # アイテムIDの範囲
                         if item_id == 0:
                             item_id = value
@@ -300,64 +347,76 @@ class GamePacketParserV2:
                         if timestamp == 0:
                             timestamp = value
                 
-                elif wire_type == 1:  # 64-bit (価格やタイムスタンプ)
+                elif wire_type == WIRE_FIXED64:  # 64-bit (価格やタイムスタンプ)
                     if 1000 <= value <= 999999999:
                         if price == 0:
                             price = value
                 
-                elif wire_type == 2:  # Length-delimited (文字列やGUID)
-                    if isinstance(value, bytes):
-                        # GUIDパターン (UUID)
-                        if len(value) == 36 or (16 <= len(value) <= 40):
-                            try:
-                                text = value.decode('utf-8', errors='strict')
-                                if '-' in text and len(text) >= 32:
-                                    guid = text
-                            except:
-                                pass
+                elif wire_type == WIRE_LENGTH_DELIMITED:  # Length-delimited (文字列やGUID)
+                    # GUIDパターン (UUID)
+                    if 16 <= length <= 40:
+                        try:
+                            text = str(data[value_offset:value_offset + length], 'utf-8')
+                            if '-' in text and len(text) >= 32:
+                                guid = text
+                        except UnicodeDecodeError:
+                            pass
             
             # 妥当性チェック
             if item_id > 0 and quantity > 0 and price > 0:
-                unit_price = price // quantity
-                estimated_tax = int(price * 0.05)  # 5% tax (推定)
-                
-                # 詳細フォーマットで返す（新旧両対応）
-                return {
-                    "price_luno": price,
-                    "quantity": quantity,
-                    "item_id": item_id,
-                    "item_name": "",  # エンリッチメント時に追加（旧形式互換）
-                    "listing_id": listing_id if listing_id > 0 else 0,
-                    "price": price,
-                    "unit_price": unit_price,
-                    "metadata": {
-                        "frame_offset": 0,  # パケット内のオフセット (後で設定可能)
-                        "server_sequence": listing_id if listing_id > 0 else None,
-                        "raw_entry": {
-                            "price": price,
-                            "num": quantity,
-                            "itemInfo": {
-                                "configId": item_id,
-                                "count": quantity,
-                                "bindFlag": bind_flag
-                            },
-                            "guid": guid if guid else None,
-                            "noticeTime": timestamp if timestamp > 0 else None
-                        }
-                    },
-                    "analysis": {
-                        "item_name": "",  # エンリッチメント時に追加
-                        "unit_price_luno": unit_price,
-                        "estimated_tax": estimated_tax,
-                        "source": "packet_parser_v2"
-                    }
-                }
+                return self._build_item(item_id, quantity, price, listing_id, guid, timestamp, bind_flag)
         
         except Exception as e:
             logger.debug(f"Error parsing item data: {e}")
         
         return None
     
+    @staticmethod
+    def _build_item(
+        item_id: int,
+        quantity: int,
+        price: int,
+        listing_id: int = 0,
+        guid: str = "",
+        timestamp: int = 0,
+        bind_flag: bool = False
+    ) -> Dict:
+        """デコードした値から詳細フォーマットのアイテムを生成"""
+        unit_price = price // quantity
+        estimated_tax = int(price * 0.05)  # 5% tax (推定)
+        
+        # 詳細フォーマットで返す（新旧両対応）
+        return {
+            "price_luno": price,
+            "quantity": quantity,
+            "item_id": item_id,
+            "item_name": "",  # エンリッチメント時に追加（旧形式互換）
+            "listing_id": listing_id if listing_id > 0 else 0,
+            "price": price,
+            "unit_price": unit_price,
+            "metadata": {
+                "frame_offset": 0,  # パケット内のオフセット (後で設定可能)
+                "server_sequence": listing_id if listing_id > 0 else None,
+                "raw_entry": {
+                    "price": price,
+                    "num": quantity,
+                    "itemInfo": {
+                        "configId": item_id,
+                        "count": quantity,
+                        "bindFlag": bind_flag
+                    },
+                    "guid": guid if guid else None,
+                    "noticeTime": timestamp if timestamp > 0 else None
+                }
+            },
+            "analysis": {
+                "item_name": "",  # エンリッチメント時に追加
+                "unit_price_luno": unit_price,
+                "estimated_tax": estimated_tax,
+                "source": "packet_parser_v2"
+            }
+        }
+    
     def save_results(self, output_file: str = None):
         """結果をJSONファイルに保存"""
         if not self.items:
@@ -423,15 +482,33 @@ class GamePacketParserV2:
                     print(f"  ... and {len(unknown_ids) - 10} more")
 
 
+def _parse_shard(
+    pcap_file: str,
+    shard: PcapShard,
+    schema: ListingSchema = DEFAULT_LISTING_SCHEMA
+) -> List[tuple]:
+    """並列パース用ワーカー（子プロセスで実行、エンリッチメントは親で行う）"""
+    parser = GamePacketParserV2(pcap_file, auto_enrich=False, schema=schema)
+    return parser._parse_records(iter_shard(pcap_file, shard))
+
+
 def main():
     if len(sys.argv) < 2:
-        print("Usage: python packet_parser_v2.py <pcap_file> [--no-enrich]")
+        print("Usage: python packet_parser_v2.py <pcap_file> [--no-enrich] [--workers N] [--schema FILE]")
         print("\nOptions:")
         print("  --no-enrich    Skip automatic item name enrichment")
+        print("  --workers N    Decode with N processes in parallel")
+        print("  --schema FILE  Listing schema file generated by infer_schema.py")
         sys.exit(1)
     
     pcap_file = sys.argv[1]
     auto_enrich = '--no-enrich' not in sys.argv
+    workers = 1
+    if '--workers' in sys.argv:
+        workers = int(sys.argv[sys.argv.index('--workers') + 1])
+    schema = DEFAULT_LISTING_SCHEMA
+    if '--schema' in sys.argv:
+        schema = ListingSchema.load(sys.argv[sys.argv.index('--schema') + 1])
     
     if auto_enrich:
         print("Auto-enrichment: Enabled")
@@ -440,8 +517,8 @@ def main():
         print("Auto-enrichment: Disabled")
     print()
     
-    parser = GamePacketParserV2(pcap_file, auto_enrich=auto_enrich)
-    items = parser.parse()
+    parser = GamePacketParserV2(pcap_file, auto_enrich=auto_enrich, schema=schema)
+    items = parser.parse(workers=workers)
     
     if items:
         parser.print_summary()
@@ -0,0 +1,181 @@
+"""
+Archive Re-decode
+アーカイブの一括再デコード
+
+PayloadArchive に保存した取引所フレームを、現在のデコーダー（とスキーマ）で読み直し、
+結果をデータベースにupsertします。ブロック単位でプロセスに分配するため、
+デコードの並列度を上げれば処理時間はディスクの読み込み速度で決まります。
+"""
+import sys
+import time
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from functools import partial
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+# src パッケージを参照できるようにする
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.packet_decoder.archive import ArchiveBlock, list_blocks, read_block
+from src.packet_decoder.decoder import TradingCenterDecoder
+from src.packet_decoder.schema import ListingSchema
+from src.database.ingest import listing_rows, upsert_listings
+
+# ロギング設定
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# このブロック数ごとにコミットする
+COMMIT_EVERY_BLOCKS = 16
+
+
+def decode_block(block: ArchiveBlock, schema: Optional[ListingSchema] = None) -> Tuple[int, int, List[Dict]]:
+    """
+    ブロックを読み込んでデコード（子プロセスで実行）
+
+    Args:
+        block: アーカイブのブロック
+        schema: リスティングのスキーマ
+
+    Returns:
+        (フレーム数, 圧縮前のバイト数, listings テーブルの行)
+    """
+    decoder = TradingCenterDecoder(schema=schema)
+    records = read_block(block)
+    listings = []
+    raw_bytes = 0
+    for record in records:
+        raw_bytes += len(record.payload)
+        if decoder.is_trading_packet(record.payload):
+            packet = decoder.decode_trading_packet(record.payload, datetime.fromtimestamp(record.timestamp))
+            if packet.listings:
+                listings.extend(packet.listings)
+    return len(records), raw_bytes, listing_rows(listings)
+
+
+def redecode(
+    directory: str,
+    workers: int = 1,
+    schema: Optional[ListingSchema] = None,
+    start: Optional[float] = None,
+    end: Optional[float] = None,
+    session=None
+) -> Dict:
+    """
+    アーカイブを再デコードしてupsert
+
+    Args:
+        directory: アーカイブのディレクトリ
+        workers: デコードのプロセス数
+        schema: リスティングのスキーマ
+        start: 開始時刻（UNIX秒）
+        end: 終了時刻（UNIX秒）
+        session: upsert先のセッション（Noneの場合は書き込まない）
+
+    Returns:
+        統計情報
+    """
+    blocks = list_blocks(directory, start, end)
+    stats = {
+        "blocks": len(blocks),
+        "frames": 0,
+        "listings": 0,
+        "stored_bytes": sum(block.length for block in blocks),
+        "raw_bytes": 0,
+        "inserted": 0,
+        "updated": 0,
+    }
+    logger.info(f"Re-decoding {len(blocks)} blocks ({stats['stored_bytes']:,} bytes) with {workers} workers")
+
+    started_at = time.perf_counter()
+    worker = partial(decode_block, schema=schema)
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        results = executor.map(worker, blocks) if executor else map(worker, blocks)
+        pending = 0
+        for frames, raw_bytes, rows in results:
+            stats["frames"] += frames
+            stats["raw_bytes"] += raw_bytes
+            stats["listings"] += len(rows)
+            if session is not None and rows:
+                counts = upsert_listings(session, rows)
+                stats["inserted"] += counts["inserted"]
+                stats["updated"] += counts["updated"]
+                pending += 1
+                if pending >= COMMIT_EVERY_BLOCKS:
+                    session.commit()
+                    pending = 0
+        if session is not None:
+            session.commit()
+    finally:
+        if executor:
+            executor.shutdown()
+
+    elapsed = time.perf_counter() - started_at
+    stats["seconds"] = elapsed
+    stats["stored_mb_per_second"] = stats["stored_bytes"] / elapsed / 1e6 if elapsed > 0 else 0.0
+    stats["raw_mb_per_second"] = stats["raw_bytes"] / elapsed / 1e6 if elapsed > 0 else 0.0
+    return stats
+
+
+def _parse_time(value: str) -> float:
+    return datetime.fromisoformat(value).timestamp()
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: python redecode_archive.py <archive_dir> [--workers N] [--schema FILE] "
+              "[--since ISO] [--until ISO] [--dry-run]")
+        print("\nOptions:")
+        print("  --workers N    Number of decode processes (default: 1)")
+        print("  --schema FILE  Listing schema file (see infer_schema.py)")
+        print("  --since ISO    Only frames captured at or after this time (e.g. 2026-01-28T12:00)")
+        print("  --until ISO    Only frames captured at or before this time")
+        print("  --dry-run      Decode without writing to the database")
+        sys.exit(1)
+
+    directory = sys.argv[1]
+    workers = 1
+    if '--workers' in sys.argv:
+        workers = int(sys.argv[sys.argv.index('--workers') + 1])
+    schema = None
+    if '--schema' in sys.argv:
+        schema = ListingSchema.load(sys.argv[sys.argv.index('--schema') + 1])
+    start = end = None
+    if '--since' in sys.argv:
+        start = _parse_time(sys.argv[sys.argv.index('--since') + 1])
+    if '--until' in sys.argv:
+        end = _parse_time(sys.argv[sys.argv.index('--until') + 1])
+
+    session = None
+    if '--dry-run' not in sys.argv:
+        from src.database import SessionLocal
+        session = SessionLocal()
+
+    try:
+        stats = redecode(directory, workers, schema, start, end, session)
+    finally:
+        if session is not None:
+            session.close()
+
+    print(f"\n{'='*60}")
+    print("RE-DECODE REPORT")
+    print(f"{'='*60}")
+    print(f"Blocks: {stats['blocks']:,}")
+    print(f"Frames: {stats['frames']:,}")
+    print(f"Listings: {stats['listings']:,}")
+    print(f"Archive size: {stats['stored_bytes']:,} bytes ({stats['raw_bytes']:,} bytes uncompressed)")
+    print(f"Throughput: {stats['stored_mb_per_second']:.1f} MB/s read, "
+          f"{stats['raw_mb_per_second']:.1f} MB/s decoded")
+    if session is not None:
+        print(f"Upserted: {stats['inserted']:,} inserted, {stats['updated']:,} updated")
+    print(f"Time: {stats['seconds']:.2f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+"""
+Capture Replay Load Test
+キャプチャ再生による負荷試験
+
+記録済みのPCAPをリアルタイムキャプチャと同じ経路（キャプチャ → キュー → デコード → コールバック）に
+流し、ゲームクライアントなしでパイプライン全体のスループット上限を測定します。
+"""
+import sys
+import time
+import logging
+from pathlib import Path
+
+# src パッケージを参照できるようにする
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.packet_decoder.capture_backends import PcapReplayBackend
+from src.packet_decoder.decode_pool import WORKER_MODES, WORKER_THREAD
+from src.packet_decoder.packet_queue import DROP_NEWEST, POLICIES
+from src.packet_decoder.realtime_capture import RealtimePacketCapture, RealtimeCaptureCallback
+
+logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+
+def replay(
+    pcap_file: str,
+    speed=1.0,
+    policy: str = DROP_NEWEST,
+    dedupe: bool = True,
+    workers: int = 1,
+    worker_mode: str = WORKER_THREAD
+) -> dict:
+    """
+    キャプチャファイルを再生して統計情報を返す
+
+    Args:
+        pcap_file: PCAP/PCAPNGファイルのパス
+        speed: 再生速度（None で待ち時間なし）
+        policy: パケットキューの破棄ポリシー
+        dedupe: 同じページの再送をデコードせずにスキップするか
+        workers: デコードのワーカー数
+        worker_mode: ワーカーの種類（"thread" / "process"）
+
+    Returns:
+        RealtimePacketCapture.get_stats() に処理全体の時間を加えたもの
+    """
+    capture = RealtimePacketCapture(
+        callback=RealtimeCaptureCallback(),
+        backend=PcapReplayBackend(pcap_file, speed=speed),
+        queue_policy=policy,
+        dedupe_size=4096 if dedupe else 0,
+        decode_workers=workers,
+        worker_mode=worker_mode
+    )
+
+    start_time = time.perf_counter()
+    capture.start()
+    capture.wait()
+    # キューに残ったフレームを処理し終えるまで待つ
+    capture.stop()
+    elapsed = time.perf_counter() - start_time
+
+    stats = capture.get_stats()
+    stats["decode_workers"] = f"{workers} ({worker_mode})" if workers > 1 else "1 (inline)"
+    stats["pipeline_seconds"] = elapsed
+    stats["pipeline_packets_per_second"] = stats["total_packets"] / elapsed if elapsed > 0 else 0.0
+    return stats
+
+
+def print_report(stats: dict):
+    """負荷試験の結果を表示"""
+    backend = stats["backend"]
+    latency = stats["latency"]["listing"]
+
+    print("\n" + "=" * 60)
+    print("REPLAY REPORT")
+    print("=" * 60)
+    print(f"File: {backend['path']}")
+    print(f"Speed: {backend['speed'] or 'max'}")
+    print(f"Decode workers: {stats['decode_workers']}")
+    print(f"Packets replayed: {backend['packets']:,} ({backend['bytes']:,} bytes)")
+    print(f"Capture rate: {backend['packets_per_second']:,.0f} packets/s")
+    print(f"Sustained pipeline rate: {stats['pipeline_packets_per_second']:,.0f} packets/s")
+    print(f"Trading packets: {stats['trading_packets']:,}")
+    print(f"Listings found: {stats['listings_found']:,}")
+    queue = stats["queue"]
+    print(f"Queue high-water mark: {queue['high_water_items']:,} frames, "
+          f"{queue['high_water_bytes']:,} bytes")
+    print(f"Queue drops ({queue['policy']}): {queue['dropped']}")
+    print(f"Filtered before queue: {stats['filtered']}")
+    if "dedupe" in stats:
+        print(f"Dedupe hit rate: {stats['dedupe']['hit_rate']:.1%} ({stats['dedupe']['hits']:,} pages skipped)")
+    if latency["count"]:
+        print(f"Listing latency: p50={latency['p50_ms']:.2f}ms p99={latency['p99_ms']:.2f}ms "
+              f"max={latency['max_ms']:.2f}ms")
+    print(f"Errors: {stats['errors']}")
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: python replay_capture.py <pcap_file> [--speed N | --max] [--policy P] [--no-dedupe] [--workers N [--worker-mode M]]")
+        print("\nOptions:")
+        print("  --speed N    Replay at N times the recorded speed (default: 1)")
+        print("  --max        Replay as fast as possible")
+        print(f"  --policy P   Queue drop policy: {', '.join(POLICIES)}")
+        print("  --no-dedupe  Decode repeated pages instead of skipping them")
+        print("  --workers N  Number of decode workers (default: 1)")
+        print(f"  --worker-mode M  Decode worker type: {', '.join(WORKER_MODES)} (default: {WORKER_THREAD})")
+        sys.exit(1)
+
+    pcap_file = sys.argv[1]
+    speed = 1.0
+    if '--speed' in sys.argv:
+        speed = float(sys.argv[sys.argv.index('--speed') + 1])
+    if '--max' in sys.argv:
+        speed = None
+    policy = DROP_NEWEST
+    if '--policy' in sys.argv:
+        policy = sys.argv[sys.argv.index('--policy') + 1]
+
+    workers = 1
+    if '--workers' in sys.argv:
+        workers = int(sys.argv[sys.argv.index('--workers') + 1])
+    worker_mode = WORKER_THREAD
+    if '--worker-mode' in sys.argv:
+        worker_mode = sys.argv[sys.argv.index('--worker-mode') + 1]
+
+    print_report(replay(pcap_file, speed, policy, '--no-dedupe' not in sys.argv, workers, worker_mode))
+
+
+if __name__ == '__main__':
+    main()